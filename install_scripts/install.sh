@@ -14,7 +14,7 @@ AWS_CONFIGURE_INTERACTIVE="${AWS_CONFIGURE_INTERACTIVE:-auto}"
 
 sudo apt-get update
 sudo DEBIAN_FRONTEND=noninteractive apt-get install -y \
-    ca-certificates curl unzip python3 python3-pip
+    ca-certificates curl unzip python3 python3-pip python3-boto3 python3-indexed-gzip
 
 case "$(uname -m)" in
     x86_64) awscli_arch=x86_64 ;;
@@ -22,7 +22,7 @@ if [[ "$INSTALL_DEPENDENCIES" == "1" ]]; then
     sudo apt-get update -qq
     sudo apt-get install -y -qq \
         build-essential cmake git ninja-build \
-        libcurl4-gnutls-dev libssl-dev zlib1g-dev uuid-dev
+        libcurl4-gnutls-dev libssl-dev zlib1g-dev libzstd-dev uuid-dev
 fi
 
 if [[ ! -f "$SDK_PREFIX/lib/cmake/AWSSDK/AWSSDKConfig.cmake" && \
@@ -1,32 +1,119 @@
 import os
+import sys
 import argparse
+import json
 import re
 import boto3
+import tempfile
 import time
+import threading
 import multiprocessing
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from boto3.s3.transfer import TransferConfig
 import subprocess
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+import completion_tracker
+import plan_shards
+import shard_cache
+from fastq_shard_engine import DEFAULT_SPLIT_LINES, ShardPublisher, TimingLog, format_shard_schedule
+from lambda_dispatch import (
+    DEFAULT_MAX_IN_FLIGHT, LambdaDispatcher, PacedDispatcher, audit_key, effective_concurrency,
+    inline_manifest_event
+)
+from s3_upload_service import S3_CONFIG, UploadService
 
 # Constants
 NUM_THREADS = 20
-S3_CONFIG = TransferConfig(multipart_threshold=5 * 1024**2, max_concurrency=32)
-DEFAULT_SPLIT_THRESHOLD_GB = 7
+SHARD_PLAN_FILE = os.getenv("SHARD_PLAN_FILE", "shard_plan.tsv")
+# Optional cross-run shard cache root, e.g. s3://my-cache/shard-cache.
+SHARD_CACHE_URI = os.getenv("SHARD_CACHE_URI", "")
+# Optional mapper function to invoke directly, with each manifest inline in the
+# event, instead of through the input bucket's EventBridge rule.
+ASYNC_LAMBDA_FUNCTION = os.getenv("ASYNC_LAMBDA_FUNCTION", "")
+LAMBDA_INVOKE_LOG_DIR = os.getenv("LAMBDA_INVOKE_LOG_DIR", "lambda-invocations")
+LAMBDA_MAX_IN_FLIGHT = int(os.getenv("LAMBDA_MAX_IN_FLIGHT", str(DEFAULT_MAX_IN_FLIGHT)))
+# Direct invocations are paced to the function's concurrency unless this is
+# "unrestricted"; a positive value caps the limit read from Lambda.
+LAMBDA_CONCURRENCY = os.getenv("LAMBDA_CONCURRENCY", "")
+# A queued shard's slot is given back after this long without its marker.
+LAMBDA_SLOT_TIMEOUT_SECONDS = float(os.getenv("LAMBDA_SLOT_TIMEOUT_SECONDS", "3600"))
+# Push channel the mapper publishes completions to (see scripts/completion_tracker.py).
+COMPLETION_CHANNEL = os.getenv("COMPLETION_CHANNEL", "")
+
+_upload_service = None
+_upload_service_lock = threading.Lock()
+_dispatcher = None
+_pacer = None
+
+
+def get_upload_service():
+    """Return the process-wide uploader so every upload reuses one connection pool."""
+    global _upload_service
+    with _upload_service_lock:
+        if _upload_service is None:
+            _upload_service = UploadService("us-east-2", config=S3_CONFIG)
+        return _upload_service
+
+
+def get_dispatcher():
+    """Return the process-wide Lambda dispatcher, or None without ASYNC_LAMBDA_FUNCTION."""
+    global _dispatcher
+    if not ASYNC_LAMBDA_FUNCTION:
+        return None
+    with _upload_service_lock:
+        if _dispatcher is None:
+            _dispatcher = LambdaDispatcher(
+                ASYNC_LAMBDA_FUNCTION, region, LAMBDA_MAX_IN_FLIGHT, LAMBDA_INVOKE_LOG_DIR
+            )
+        return _dispatcher
+
+
+def completion_marker_exists(s3_client, bucket, folder):
+    try:
+        s3_client.head_object(Bucket=bucket, Key=f"piscem_output/{folder}/output.txt")
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
 
 
-def get_split_threshold_gb():
+def start_pacer(plan_parameters):
     """
-    Use 0 GB threshold (force split) when Lambda memory is capped at 3008 MB.
-    Otherwise keep default 7 GB threshold.
+    Starts pacing direct invocations to the function's effective concurrency.
+    Returns None when invocations are not direct or the limit is unknown.
     """
+    global _pacer
+    dispatcher = get_dispatcher()
+    if dispatcher is None or LAMBDA_CONCURRENCY == "unrestricted":
+        return None
     try:
-        lambda_memory_mb = int(os.getenv("LAMBDA_MEMORY_MB", "0"))
-    except ValueError:
-        lambda_memory_mb = 0
-    if 0 < lambda_memory_mb <= 3008:
-        return 0
-    return DEFAULT_SPLIT_THRESHOLD_GB
+        limit = effective_concurrency(dispatcher.client, ASYNC_LAMBDA_FUNCTION)
+    except Exception as e:
+        print(f"WARNING: could not read the concurrency of {ASYNC_LAMBDA_FUNCTION}: {e}")
+        limit = 0
+    if LAMBDA_CONCURRENCY.isdigit() and int(LAMBDA_CONCURRENCY) > 0:
+        limit = min(limit, int(LAMBDA_CONCURRENCY)) if limit else int(LAMBDA_CONCURRENCY)
+    if limit <= 0:
+        print(f"Lambda concurrency unknown; invoking {ASYNC_LAMBDA_FUNCTION} without pacing")
+        return None
+
+    s3_client = boto3.client('s3', region_name=region)
+    spool_dir = os.getenv("LAMBDA_DISPATCH_SPOOL") or tempfile.mkdtemp(prefix="lambda-dispatch-")
+    _pacer = PacedDispatcher(
+        dispatcher,
+        limit,
+        lambda folder: completion_marker_exists(s3_client, output_bucket_name, folder),
+        lambda read_pairs: plan_shards.batch_seconds(read_pairs, plan_parameters),
+        spool_dir=spool_dir,
+        slot_timeout_seconds=LAMBDA_SLOT_TIMEOUT_SECONDS,
+        # Slots free up on pushed completions; the marker HEAD is a backstop.
+        channel=completion_tracker.open_channel(COMPLETION_CHANNEL, region),
+    )
+    print(f"Pacing {ASYNC_LAMBDA_FUNCTION} to {limit} running shard(s); split lanes spool to {spool_dir}")
+    return _pacer
 
 
 # Download File from S3
@@ -43,10 +130,10 @@ def download_file(bucket_name, s3_key, local_path):
 
 def upload_file_to_s3(bucket_name, file_path, s3_key):
     try:
-        print("creating S3 Client")
-        s3_client = boto3.client('s3', region_name="us-east-2")
+        service = get_upload_service()
+        s3_client = service.client
         print(f"uploading file at {s3_key}")
-        s3_client.upload_file(file_path, bucket_name, s3_key, Config=S3_CONFIG)
+        service.upload_file(file_path, bucket_name, s3_key).result()
 
         # Verify if the upload succeeded
         response = s3_client.head_object(Bucket=bucket_name, Key=s3_key)
@@ -59,9 +146,38 @@ def upload_file_to_s3(bucket_name, file_path, s3_key):
         print(f"Failed to upload {file_path}: {e}")
 
 
-def split_and_upload(bucket_name, r1_file, r2_file, basename_with_lane, input_txt_bucket_name):
+def replay_cached_shards(bucket_name, r1_file, r2_file, basename_with_lane, input_txt_bucket_name, shard_schedule=""):
+    """
+    Republishes a lane's input.txt manifests from the shard cache.
+    Returns (parts, cache_key); parts is None on a cache miss.
+    """
+    service = get_upload_service()
+    key = shard_cache.cache_key(
+        shard_cache.source_fingerprint(f"s3://{bucket_name}/{r1_file}", service.client),
+        shard_cache.source_fingerprint(f"s3://{bucket_name}/{r2_file}", service.client),
+        int(os.getenv("SPLIT_LINES") or DEFAULT_SPLIT_LINES),
+        shard_schedule,
+        os.getenv("SHARD_CODEC", "none"),
+    )
+    cache = shard_cache.ShardCache(service.client, SHARD_CACHE_URI)
+    pairs = cache.load(key)
+    if pairs is None:
+        return None, key
+    dispatcher = get_dispatcher()
+    publisher = ShardPublisher(
+        service, cache.bucket, basename_with_lane, input_txt_bucket_name, TimingLog(None),
+        lambda_client=dispatcher.client if dispatcher else None,
+        async_function=ASYNC_LAMBDA_FUNCTION,
+        invoke_log_dir=LAMBDA_INVOKE_LOG_DIR,
+        dispatch_spool=_pacer.spool_dir if _pacer else "",
+    )
+    return shard_cache.replay(pairs, publisher), key
+
+
+def split_and_upload(bucket_name, r1_file, r2_file, basename_with_lane, input_txt_bucket_name, shard_schedule=""):
     """
     Calls the `split_and_upload.sh` shell script and returns the number of parts.
+    `shard_schedule` is the lane's SHARD_SCHEDULE from the shard plan.
     """
     print(f"Running split_and_upload for {r1_file} and {r2_file}")
     print(f"R1 File: {r1_file}")
@@ -69,13 +185,35 @@ def split_and_upload(bucket_name, r1_file, r2_file, basename_with_lane, input_tx
     print(f"Bucket Name: {bucket_name}")
     print(f"Basename with Lane: {basename_with_lane}")
     print(f"Input txt bucket Name: {input_txt_bucket_name}")
+    print(f"Shard schedule: {shard_schedule or 'SPLIT_LINES'}")
     start_time = datetime.now()
 
+    env = dict(os.environ, SHARD_SCHEDULE=shard_schedule)
+    if _pacer is not None:
+        # The python engine spools its invocations for the pacer.
+        env["LAMBDA_DISPATCH_SPOOL"] = _pacer.spool_dir
+    elif ASYNC_LAMBDA_FUNCTION:
+        # The python engine invokes the mapper for every shard it publishes.
+        env["LAMBDA_INVOKE_LOG_DIR"] = LAMBDA_INVOKE_LOG_DIR
+    if SHARD_CACHE_URI:
+        try:
+            num_parts, env["SHARD_CACHE_KEY"] = replay_cached_shards(
+                bucket_name, r1_file, r2_file, basename_with_lane, input_txt_bucket_name, shard_schedule
+            )
+        except Exception as e:
+            print(f"WARNING: shard cache lookup failed for {basename_with_lane}: {e}")
+            env.pop("SHARD_CACHE_URI", None)
+            num_parts = None
+        if num_parts is not None:
+            print(f"Shard cache hit for {basename_with_lane}: republished {num_parts} input.txt file(s)")
+            return num_parts
+
     try:
         # Call the Bash script and capture output
         result = subprocess.run(
             ["bash", "split_and_upload.sh", bucket_name, r1_file, r2_file, basename_with_lane, input_txt_bucket_name],
-            capture_output=True, text=True, check=True
+            capture_output=True, text=True, check=True,
+            env=env,
         )
 
         # Extract the last line from the output (PAIR_COUNT)
@@ -98,48 +236,65 @@ def split_and_upload(bucket_name, r1_file, r2_file, basename_with_lane, input_tx
 def upload_input_files(file_pairs, input_folders):
     # Print each pair found and write to input file
     s3_client = boto3.client('s3', region_name=region)
-    split_threshold_gb = get_split_threshold_gb()
-    print(f"SPLIT_THRESHOLD_GB={split_threshold_gb} (LAMBDA_MEMORY_MB={os.getenv('LAMBDA_MEMORY_MB', '')})")
+    lanes = []
+    for base_name_with_lane, files in file_pairs.items():
+        if 'R1' in files and 'R2' in files:
+            r1_file = files['R1']
+            r2_file = files['R2']
+            print(f"Pair found in {base_name_with_lane}:\n  R1: {r1_file}\n  R2: {r2_file}\n")
+            combined_bytes = get_s3_file_size(s3_client, r1_file) + get_s3_file_size(s3_client, r2_file)
+            print(f"combined size of file pairs in GB: {combined_bytes / 1024 ** 3:.2f}")
+            lanes.append(plan_shards.Lane(base_name_with_lane, combined_bytes, r1_file, r2_file))
+
+    # Direct vs split and the shard sizes come from the makespan planner.
+    plan_parameters = plan_shards.parameters_from_env()
+    plan = plan_shards.plan_lanes(lanes, plan_parameters)
+    plan_shards.save_plan(plan, plan_parameters, SHARD_PLAN_FILE)
+    print(
+        f"Shard plan written to {SHARD_PLAN_FILE}: predicted makespan {plan.makespan_seconds:.1f} s, "
+        f"{plan.invocations} invocations (LAMBDA_MEMORY_MB={os.getenv('LAMBDA_MEMORY_MB', '')})"
+    )
+    start_pacer(plan_parameters)
 
     future_to_file = {}
     with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-        for base_name_with_lane, files in file_pairs.items():
-            if 'R1' in files and 'R2' in files:
-
-                # Split base_name_with_lane into folder path and lane identifier
-                base_folder, lane_identifier = os.path.split(base_name_with_lane)
-
-                # If no '/' in base_name_with_lane, set lane_identifier as base_name_with_lane
-                if not base_folder:
-                    lane_identifier = base_name_with_lane
-
-                r1_file = files['R1']
-                r2_file = files['R2']
-                print(f"Pair found in {base_name_with_lane}:\n  R1: {r1_file}\n  R2: {r2_file}\n")
-
-                # Full S3 path to each file
-                bucket_path_r1 = f"s3://{bucket_name}/{r1_file}"
-                bucket_path_r2 = f"s3://{bucket_name}/{r2_file}"
-                print(f"R1 file path is: {bucket_path_r1}")
-                print(f"R2 file path is: {bucket_path_r2}")
-
-                r1_file_size = get_s3_file_size_in_gb(s3_client, r1_file)
-                r2_file_size = get_s3_file_size_in_gb(s3_client, r2_file)
-                combined_size = r1_file_size + r2_file_size
-                print(f"combined size of file pairs in GB: {combined_size:.2f}")
-
-                if combined_size < split_threshold_gb:
-                    # Create input.txt file in memory
-                    print(f"File pairs size < {split_threshold_gb}GB → Uploading directly")
+        for lane_plan in plan.lanes:
+            base_name_with_lane = lane_plan.lane.name
+
+            # Split base_name_with_lane into folder path and lane identifier
+            base_folder, lane_identifier = os.path.split(base_name_with_lane)
+
+            # If no '/' in base_name_with_lane, set lane_identifier as base_name_with_lane
+            if not base_folder:
+                lane_identifier = base_name_with_lane
+
+            r1_file = lane_plan.lane.r1
+            r2_file = lane_plan.lane.r2
+
+            # Full S3 path to each file
+            bucket_path_r1 = f"s3://{bucket_name}/{r1_file}"
+            bucket_path_r2 = f"s3://{bucket_name}/{r2_file}"
+            print(f"R1 file path is: {bucket_path_r1}")
+            print(f"R2 file path is: {bucket_path_r2}")
+
+            if lane_plan.mode == "direct":
+                # Create input.txt file in memory
+                print(f"Plan passes {lane_identifier} directly → Uploading input.txt")
+                if not ASYNC_LAMBDA_FUNCTION:
                     time.sleep(3)
-                    create_and_upload_input_file(lane_identifier, bucket_path_r1, bucket_path_r2, base_folder, input_folders)
-                else:
-                    print(f"Queuing split_and_upload for {r1_file} and {r2_file}")
-                    # Submit to ThreadPoolExecutor
-                    future = executor.submit(
-                        split_and_upload, bucket_name, r1_file, r2_file, base_name_with_lane, input_txt_bucket_name
-                    )
-                    future_to_file[future] = lane_identifier
+                create_and_upload_input_file(
+                    lane_identifier, bucket_path_r1, bucket_path_r2, base_folder, input_folders,
+                    plan_shards.estimate_read_pairs(lane_plan.lane, plan_parameters)
+                )
+            else:
+                shard_schedule = format_shard_schedule(lane_plan.schedule)
+                print(f"Queuing split_and_upload for {r1_file} and {r2_file} ({shard_schedule})")
+                # Submit to ThreadPoolExecutor
+                future = executor.submit(
+                    split_and_upload, bucket_name, r1_file, r2_file, base_name_with_lane,
+                    input_txt_bucket_name, shard_schedule
+                )
+                future_to_file[future] = lane_identifier
 
     # Process completed futures
     for future in as_completed(future_to_file):
@@ -160,10 +315,18 @@ def upload_input_files(file_pairs, input_folders):
 
         except Exception as e:
             print(f"ERROR processing {lane_identifier}: {str(e)}")
+    dispatcher = get_dispatcher()
+    if _pacer is not None:
+        print(f"LAMBDA_PACING {json.dumps(_pacer.close(), sort_keys=True)}")
+    elif dispatcher is not None:
+        dispatcher.close()
+    if dispatcher is not None:
+        print(f"All {len(dispatcher.futures)} direct Lambda invocation(s) accepted by {ASYNC_LAMBDA_FUNCTION}")
     print("All input files processed. Starting polling for outputs.")
 
 
-def create_and_upload_input_file(lane_identifier, bucket_path_r1, bucket_path_r2, base_folder, input_folders):
+def create_and_upload_input_file(lane_identifier, bucket_path_r1, bucket_path_r2, base_folder, input_folders,
+                                 read_pairs=0):
     input_file_path = f"{lane_identifier}_p0_input.txt"
 
     print(f"writing to input file {input_file_path}")
@@ -177,7 +340,17 @@ def create_and_upload_input_file(lane_identifier, bucket_path_r1, bucket_path_r2
     # Upload R1, R2, and input.txt files to S3
     output_path = os.path.join(base_folder,input_file_path)
     print(f"output path is {output_path}")
-    upload_file_to_s3(input_txt_bucket_name, input_file_path, output_path)
+    dispatcher = get_dispatcher()
+    folder = f"{lane_identifier}_p0"
+    # Invoke with the manifest inline; the uploaded copy is the audit record,
+    # stored where the EventBridge rule does not match it.
+    event = inline_manifest_event(input_txt_bucket_name, output_path, [bucket_path_r1, bucket_path_r2])
+    if _pacer is not None:
+        _pacer.queue(event, folder, [folder], [read_pairs])
+    elif dispatcher is not None:
+        dispatcher.submit_event(event, folder)
+    upload_file_to_s3(input_txt_bucket_name, input_file_path,
+                      audit_key(output_path) if dispatcher is not None else output_path)
     os.remove(input_file_path)
     input_folders.add(f"{lane_identifier}_p0")
     print(f"added {len(input_folders)} input files to S3 in bucket {input_txt_bucket_name}")
@@ -214,61 +387,35 @@ def find_pairs_from_s3():
     return file_pairs
 
 
-def get_s3_file_size_in_gb(s3_client, s3_key):
+def get_s3_file_size(s3_client, s3_key):
     response = s3_client.head_object(Bucket=bucket_name, Key=s3_key)
-    file_size_bytes = response['ContentLength']
-    # Convert bytes to GB
-    file_size_gb = file_size_bytes / (1024 ** 3)
-    return file_size_gb
+    return response['ContentLength']
 
 
 def poll_output_bucket(output_bucket_name, output_dir, polling_interval, start_time):
     s3 = boto3.client('s3', region_name=region)
-    output_folders = set()
     input_folder_count = len(input_folders)
     print(f"input folder count is: {input_folder_count}")
 
-    while len(output_folders) < input_folder_count:
-        print(f"Polling bucket {output_bucket_name} for output folders...")
-
-        continuation_token = None
-
-        # Loop to handle paginated S3 responses
-        while True:
-            list_kwargs = {
-                'Bucket': output_bucket_name,
-                'Prefix': "piscem_output/",
-                'MaxKeys': 1000
-            }
-            if continuation_token:
-                list_kwargs['ContinuationToken'] = continuation_token
-                print(f"Using continuation token: {continuation_token}")
-
-            response = s3.list_objects_v2(**list_kwargs)
-
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    key_parts = obj['Key'].split('/')
-
-                    # Ensure the key format matches "piscem_output/{folder_name}/output.txt"
-                    if len(key_parts) >= 3:
-                        folder_name = key_parts[1]
-                        file_name = key_parts[2]
-                        # Check if folder_name is in input_folders and file is output.txt
-                        if folder_name in input_folders and file_name == 'output.txt':
-                            output_folders.add(folder_name)
-
-            print(f"Found output for {len(output_folders)} out of {input_folder_count} input folders.")
-
-            # Check if more results need to be fetched (pagination)
-            if response.get('IsTruncated'):
-                continuation_token = response['NextContinuationToken']
-            else:
-                break
-
-        if len(output_folders) < input_folder_count:
-            print(f"Retrying in {polling_interval} seconds...")
-            time.sleep(polling_interval)
+    # Pushed completions arrive as they happen; the listing sweep only covers
+    # the span of still-pending folders and backs up a lost event.
+    channel = completion_tracker.open_channel(COMPLETION_CHANNEL, region)
+    tracker = completion_tracker.CompletionTracker(
+        set(input_folders),
+        channel=channel,
+        fallback=completion_tracker.ListingFallback(s3, output_bucket_name),
+        fallback_seconds=polling_interval,
+    )
+    if _pacer is not None:
+        # An SQS message the pacer received is gone from the queue.
+        tracker.record(_pacer.completed_folders)
+    if channel is not None:
+        print(f"Waiting for completion events on {COMPLETION_CHANNEL} (listing every {polling_interval}s)")
+    while not tracker.complete:
+        if tracker.step(timeout=polling_interval):
+            print(f"Found output for {len(tracker.ready)} out of {input_folder_count} input folders.")
+    output_folders = set(tracker.ready)
+    print(f"COMPLETION_TRACKER {json.dumps(tracker.stats(), sort_keys=True)}")
 
     print(f"All {len(output_folders)} output folders are generated")
 
@@ -332,6 +479,7 @@ if __name__ == '__main__':
     time.sleep(30)
     bucket_name = args.bucket_name
     input_txt_bucket_name = args.s3_input_files_bucket_name
+    output_bucket_name = args.output_bucket_name
     region = args.aws_region
     s3_file_pairs = find_pairs_from_s3()
     input_folders = set()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Count the S3 requests and latency the Lambda claim protocol adds per shard.
+
+Runs the claim calls ``process_shard`` makes in ``scrna-pipeline/map.py``
+against the ``FakeS3`` stand-in from ``tests/test_lambda_claims.py``, with a
+fixed delay per request to model S3 round trips. ``lean`` is the current
+protocol; ``legacy`` replays the previous sequence: HEAD the marker, create the
+claim, renew it every heartbeat and again before upload, write an empty
+``output.txt`` and rewrite the claim as completed.
+
+Mapping is a sleep. Lease and heartbeat default to 6 s and 1 s, the 180 s and
+30 s production values scaled down 30 times, so ``--shard-seconds 2,8``
+stands for 60 s and 240 s shards.
+
+    benchmark_claim_protocol.py --latency-ms 20 --repeats 3
+
+Results are written as TSV to stdout.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import importlib.util
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+
+CLAIM_TESTS_PATH = Path(__file__).parents[1] / "tests" / "test_lambda_claims.py"
+SCENARIOS = ("fresh", "duplicate", "busy", "takeover")
+OPERATIONS = ("HeadObject", "GetObject", "PutObject", "DeleteObject")
+
+
+def load_claim_tests():
+    spec = importlib.util.spec_from_file_location("lambda_claim_tests", CLAIM_TESTS_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def latent_s3(fake_s3_class, latency_seconds: float):
+    class LatentS3(fake_s3_class):
+        """FakeS3 whose every request takes ``latency_seconds``."""
+
+        lock = threading.Lock()
+
+        def call(self, method, *args, **kwargs):
+            time.sleep(latency_seconds)
+            with self.lock:
+                return method(self, *args, **kwargs)
+
+        def head_object(self, *args, **kwargs):
+            return self.call(fake_s3_class.head_object, *args, **kwargs)
+
+        def get_object(self, *args, **kwargs):
+            return self.call(fake_s3_class.get_object, *args, **kwargs)
+
+        def put_object(self, *args, **kwargs):
+            return self.call(fake_s3_class.put_object, *args, **kwargs)
+
+        def delete_object(self, *args, **kwargs):
+            return self.call(fake_s3_class.delete_object, *args, **kwargs)
+
+    return LatentS3
+
+
+def lean_invocation(lambda_map, folder: str, owner: str, shard_seconds: float) -> str:
+    context = type("Context", (), {"aws_request_id": owner})()
+    try:
+        claim = lambda_map.acquire_processing_claim(folder, f"{folder}_input.txt", context)
+    except lambda_map.ClaimBusyError:
+        return "busy"
+    if claim["status"] == "already_complete":
+        return "already_complete"
+    lambda_map.start_claim_heartbeat(claim)
+    try:
+        time.sleep(shard_seconds)
+        lambda_map.refresh_processing_claim(claim, only_if_due=True)
+        lambda_map.publish_completion(
+            claim, lambda_map.completion_marker_key(folder), {"timings": {"total_seconds": shard_seconds}}
+        )
+    finally:
+        lambda_map.stop_claim_heartbeat(claim)
+    return "completed"
+
+
+def legacy_invocation(lambda_map, folder: str, owner: str, shard_seconds: float) -> str:
+    s3 = lambda_map.s3_client
+    bucket = lambda_map.S3_OUTPUT_BUCKET_NAME
+    marker = lambda_map.completion_marker_key(folder)
+    key = lambda_map.claim_object_key(folder)
+    if lambda_map.completion_marker_exists(folder):
+        return "already_complete"
+    now_epoch = int(time.time())
+    document = lambda_map.claim_document(owner, folder, f"{folder}_input.txt", "processing", now_epoch)
+    try:
+        etag = lambda_map.put_claim_document(key, document, IfNoneMatch="*")
+    except lambda_map.ClientError:
+        if lambda_map.completion_marker_exists(folder):
+            return "already_complete"
+        existing, existing_etag, _ = lambda_map.read_claim_document(key)
+        if now_epoch < int(existing.get("lease_expires_epoch", 0)):
+            return "busy"
+        etag = lambda_map.put_claim_document(key, document, IfMatch=existing_etag)
+    state = {"etag": etag}
+    mutex = threading.Lock()
+    stop = threading.Event()
+
+    def renew():
+        with mutex:
+            state["etag"] = lambda_map.put_claim_document(key, document, IfMatch=state["etag"])
+
+    def heartbeat():
+        while not stop.wait(lambda_map.CLAIM_HEARTBEAT_SECONDS):
+            renew()
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        time.sleep(shard_seconds)
+        renew()
+        s3.put_object(Bucket=bucket, Key=marker, Body=b"")
+    finally:
+        stop.set()
+        thread.join()
+    completed = dict(document, state="completed")
+    lambda_map.put_claim_document(key, completed, IfMatch=state["etag"])
+    return "completed"
+
+
+def prepare(lambda_map, s3, scenario: str, folder: str) -> None:
+    """Leave the state a duplicate, busy or takeover invocation finds."""
+    if scenario == "fresh":
+        return
+    if scenario == "duplicate":
+        # The completing invocation leaves its claim object behind.
+        s3.objects[lambda_map.completion_marker_key(folder)] = {
+            "Body": b"", "ETag": '"marker"', "LastModified": None,
+        }
+    expires = int(time.time()) + (3600 if scenario == "busy" else -1)
+    document = lambda_map.claim_document("earlier", folder, f"{folder}_input.txt", "processing", 0)
+    document["lease_expires_epoch"] = expires
+    s3.objects[lambda_map.claim_object_key(folder)] = {
+        "Body": json.dumps(document).encode(), "ETag": '"earlier"', "LastModified": None,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="delay added to every request")
+    parser.add_argument("--shard-seconds", default="2,8", help="comma-separated mapping durations")
+    parser.add_argument("--lease-seconds", type=int, default=6)
+    parser.add_argument("--heartbeat-seconds", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args(argv)
+    try:
+        durations = [float(value) for value in args.shard_seconds.split(",") if value]
+    except ValueError:
+        parser.error("--shard-seconds must be comma-separated numbers")
+    if not durations or min(durations) < 0 or args.latency_ms < 0 or args.repeats <= 0:
+        parser.error("--shard-seconds, --latency-ms and --repeats must be non-negative")
+    if not 0 < args.heartbeat_seconds < args.lease_seconds:
+        parser.error("--heartbeat-seconds must be positive and below --lease-seconds")
+
+    # map.py prints its configuration at import; keep stdout for the TSV.
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        claim_tests = load_claim_tests()
+    finally:
+        sys.stdout = stdout
+    lambda_map = claim_tests.lambda_map
+    lambda_map.S3_OUTPUT_BUCKET_NAME = "output"
+    lambda_map.CLAIM_LEASE_SECONDS = args.lease_seconds
+    lambda_map.CLAIM_HEARTBEAT_SECONDS = args.heartbeat_seconds
+    fake_class = latent_s3(claim_tests.FakeS3, args.latency_ms / 1000)
+    invocations = {"lean": lean_invocation, "legacy": legacy_invocation}
+
+    writer = csv.DictWriter(
+        sys.stdout,
+        fieldnames=["protocol", "scenario", "shard_seconds", "repeat", "outcome", "requests",
+                    *OPERATIONS, "claim_seconds"],
+        delimiter="\t",
+    )
+    writer.writeheader()
+    for shard_seconds in durations:
+        for scenario in SCENARIOS:
+            for repeat in range(args.repeats):
+                for protocol, invocation in invocations.items():
+                    s3 = fake_class()
+                    lambda_map.s3_client = s3
+                    folder = f"lane_p{repeat}"
+                    prepare(lambda_map, s3, scenario, folder)
+                    stdout, sys.stdout = sys.stdout, sys.stderr
+                    started = time.perf_counter()
+                    try:
+                        outcome = invocation(lambda_map, folder, "benchmark", shard_seconds)
+                    finally:
+                        sys.stdout = stdout
+                    elapsed = time.perf_counter() - started
+                    mapped = shard_seconds if outcome == "completed" else 0.0
+                    counts = Counter(operation for operation, _ in s3.requests)
+                    writer.writerow({
+                        "protocol": protocol,
+                        "scenario": scenario,
+                        "shard_seconds": shard_seconds,
+                        "repeat": repeat,
+                        "outcome": outcome,
+                        "requests": len(s3.requests),
+                        **{operation: counts[operation] for operation in OPERATIONS},
+                        "claim_seconds": round(elapsed - mapped, 3),
+                    })
+                    sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
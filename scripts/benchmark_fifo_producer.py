@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Measure the Lambda FIFO producer's CPU seconds per GB of S3 input.
+
+Runs ``write_s3_object_to_fifo`` from ``scrna-pipeline/map.py`` into a real
+FIFO drained by ``cat``, once with the reused-buffer ``readinto`` reader
+(``ring``) and once with a reader that allocates a new ``bytes`` per range
+as the producer did before (``bytes``). Only the producer's own CPU time is
+counted; the drain and the local server run in child processes.
+
+Without ``--s3-uri`` the object is a generated payload served by a local
+S3-compatible HTTP endpoint on 127.0.0.1, so the run needs no AWS access but
+still reads through botocore, urllib3 and a socket. With ``--s3-uri`` the
+real object is read; run it on a host in the bucket's region.
+
+    benchmark_fifo_producer.py --megabytes 1024 --concurrency 1,4
+    benchmark_fifo_producer.py --s3-uri s3://bucket/ko/lane_R2_001_p0.fastq
+
+Results are written as TSV to stdout.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import importlib.util
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import boto3
+from botocore.config import Config
+
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+MAP_PATH = Path(__file__).parents[1] / "scrna-pipeline" / "map.py"
+BUCKET = "benchmark"
+KEY = "lane_R2_001_p0.fastq"
+
+
+def load_map():
+    spec = importlib.util.spec_from_file_location("lambda_map_benchmark", MAP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def serve(path: str) -> int:
+    """Answer GET and ranged GET requests for one file, like S3 does."""
+    payload = Path(path).read_bytes()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            first, last = 0, len(payload) - 1
+            match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+            if match:
+                first, last = int(match.group(1)), min(int(match.group(2)), len(payload) - 1)
+            if first >= len(payload) and payload:
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = memoryview(payload)[first:last + 1]
+            self.send_response(206 if match else 200)
+            self.send_header("Content-Length", str(len(body)))
+            if match:
+                self.send_header("Content-Range", f"bytes {first}-{last}/{len(payload)}")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+    return 0
+
+
+def allocating_reader(lambda_map):
+    class AllocatingRangeReader(lambda_map.OrderedRangeReader):
+        """The producer before reused buffers: a new ``bytes`` per read."""
+
+        def fetch(self, first):
+            self.free_buffers.clear()
+            last = first + self.range_bytes - 1
+            response = lambda_map.s3_client.get_object(
+                Bucket=self.bucket, Key=self.key, Range=f"bytes={first}-{last}"
+            )
+            body = response["Body"]
+            try:
+                data = body.read()
+            finally:
+                body.close()
+            return response, data, len(data)
+
+        def stream_chunks(self):
+            waited = time.perf_counter()
+            response = lambda_map.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+            self.requests += 1
+            self.size = int(response["ContentLength"])
+            body = response["Body"]
+            try:
+                while chunk := body.read(self.range_bytes):
+                    self.starved_seconds += time.perf_counter() - waited
+                    yield chunk
+                    waited = time.perf_counter()
+            finally:
+                body.close()
+
+    return AllocatingRangeReader
+
+
+def producer_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(lambda_map, bucket: str, key: str, fifo_dir: str) -> dict:
+    fifo_path = os.path.join(fifo_dir, "r2_0000.fastq")
+    os.mkfifo(fifo_path, 0o600)
+    drain = subprocess.Popen(["cat", fifo_path], stdout=subprocess.DEVNULL)
+    spec = {
+        "uri": f"s3://{bucket}/{key}",
+        "bucket": bucket,
+        "key": key,
+        "read": "R2",
+        "compression": "none",
+        "fifo_path": fifo_path,
+    }
+    try:
+        cpu = producer_cpu_seconds()
+        result = lambda_map.write_s3_object_to_fifo(spec)
+        result["cpu_seconds"] = producer_cpu_seconds() - cpu
+    finally:
+        drain.wait()
+        os.unlink(fifo_path)
+    return result
+
+
+def main(argv: list[str] | None = None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["serve"]:
+        return serve(argv[1])
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--s3-uri", default="", help="read this object instead of a local payload")
+    parser.add_argument("--megabytes", type=int, default=512, help="local payload size")
+    parser.add_argument("--concurrency", default="1,4", help="comma-separated FIFO_RANGE_CONCURRENCY values")
+    parser.add_argument("--range-mib", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+    try:
+        concurrencies = [int(value) for value in args.concurrency.split(",") if value]
+    except ValueError:
+        parser.error("--concurrency must be comma-separated integers")
+    if not concurrencies or min(concurrencies) <= 0 or args.range_mib <= 0 or args.repeats <= 0:
+        parser.error("--concurrency, --range-mib and --repeats must be positive")
+    if args.s3_uri and not args.s3_uri.startswith("s3://"):
+        parser.error("--s3-uri must be an s3:// URI")
+
+    # Printed by map.py at import; keep stdout for the TSV.
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        lambda_map = load_map()
+    finally:
+        sys.stdout = stdout
+    config = Config(max_pool_connections=max(10, max(concurrencies) + 2))
+    server = None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.s3_uri:
+            bucket, _, key = args.s3_uri[len("s3://"):].partition("/")
+            lambda_map.s3_client = boto3.client("s3", config=config)
+        else:
+            bucket, key = BUCKET, KEY
+            payload_path = os.path.join(temp_dir, KEY)
+            with open(payload_path, "wb") as payload:
+                record = b"@read 2:N:0\n" + b"ACGT" * 22 + b"\n+\n" + b"F" * 88 + b"\n"
+                block = record * (1024 * 1024 // len(record) + 1)
+                for _ in range(args.megabytes):
+                    payload.write(block[:1024 * 1024])
+            server = subprocess.Popen(
+                [sys.executable, __file__, "serve", payload_path], stdout=subprocess.PIPE, text=True
+            )
+            port = int(server.stdout.readline())
+            lambda_map.s3_client = boto3.client(
+                "s3",
+                endpoint_url=f"http://127.0.0.1:{port}",
+                aws_access_key_id="benchmark",
+                aws_secret_access_key="benchmark",
+                config=config.merge(Config(s3={"addressing_style": "path"})),
+            )
+        readers = {"bytes": allocating_reader(lambda_map), "ring": lambda_map.OrderedRangeReader}
+        writer = csv.DictWriter(
+            sys.stdout,
+            fieldnames=[
+                "reader", "concurrency", "repeat", "bytes", "seconds", "cpu_seconds",
+                "cpu_seconds_per_gb", "starved_seconds", "blocked_seconds",
+            ],
+            delimiter="\t",
+        )
+        writer.writeheader()
+        original = lambda_map.OrderedRangeReader
+        lambda_map.FIFO_RANGE_BYTES = args.range_mib * 1024 * 1024
+        try:
+            for concurrency in concurrencies:
+                lambda_map.FIFO_RANGE_CONCURRENCY = concurrency
+                for repeat in range(args.repeats):
+                    for name, reader in readers.items():
+                        lambda_map.OrderedRangeReader = reader
+                        stdout, sys.stdout = sys.stdout, sys.stderr
+                        try:
+                            result = measure(lambda_map, bucket, key, temp_dir)
+                        finally:
+                            sys.stdout = stdout
+                        writer.writerow({
+                            "reader": name,
+                            "concurrency": concurrency,
+                            "repeat": repeat,
+                            "bytes": result["bytes"],
+                            "seconds": result["seconds"],
+                            "cpu_seconds": round(result["cpu_seconds"], 3),
+                            "cpu_seconds_per_gb": round(result["cpu_seconds"] / max(result["bytes"] / 1e9, 1e-9), 3),
+                            "starved_seconds": result["starved_seconds"],
+                            "blocked_seconds": result["blocked_seconds"],
+                        })
+                        sys.stdout.flush()
+        finally:
+            lambda_map.OrderedRangeReader = original
+            if server is not None:
+                server.terminate()
+                server.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
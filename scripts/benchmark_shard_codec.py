@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Measure whether gzip-compressed shards shorten split+upload for one lane.
+
+Run on the driver against the largest PBMC 10K lane and a KO lane. The offline
+pass decompresses and cuts the pair exactly as ``fastq_shard_engine.py`` does,
+then reports the gzip ratio, the compression and Lambda-side inflate rates,
+and the modelled per-lane upload seconds at each ``--uplink-gbps`` value.
+
+With ``--fastq-bucket`` and ``--input-txt-bucket`` it also runs the engine
+once per codec against those buckets and reports the measured
+``lane_streaming_total``. Use an input-manifest bucket without event
+notifications so no Lambda starts.
+
+Results are written as TSV to stdout.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fastq_shard_engine as engine
+
+
+ENGINE = Path(__file__).with_name("fastq_shard_engine.py")
+
+
+def inflate_rate(compressed: bytes) -> float:
+    """Single-thread bytes/second for the Lambda FIFO writer's inflate loop."""
+    start = time.perf_counter()
+    produced = 0
+    decompressor = zlib.decompressobj(31)
+    while compressed:
+        produced += len(decompressor.decompress(compressed))
+        compressed = decompressor.unused_data
+        decompressor = zlib.decompressobj(31)
+    return produced / max(time.perf_counter() - start, 1e-9)
+
+
+def offline_rows(args: argparse.Namespace) -> list[dict]:
+    raw_bytes = gzip_bytes = 0
+    compress_seconds = 0.0
+    inflate_rates = []
+    r1 = engine.Decompressor(args.r1_gz, args.decompressor, args.threads, "")
+    r2 = engine.Decompressor(args.r2_gz, args.decompressor, args.threads, "")
+    cut_start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.compress_threads) as pool:
+            for pair in engine.iter_shard_pairs(r1, r2, args.split_lines):
+                for shard in (pair.r1, pair.r2):
+                    start = time.perf_counter()
+                    body = engine.gzip_members(shard.payload, pool)
+                    compress_seconds += time.perf_counter() - start
+                    raw_bytes += len(shard.payload)
+                    gzip_bytes += len(body)
+                    if len(inflate_rates) < 2:
+                        inflate_rates.append(inflate_rate(body))
+                if args.max_pairs and pair.index + 1 >= args.max_pairs:
+                    break
+    finally:
+        r1.close()
+        r2.close()
+    wall = time.perf_counter() - cut_start
+    cut_seconds = wall - compress_seconds
+
+    rows = []
+    for gbps in args.uplink_gbps:
+        network = gbps * 1e9 / 8
+        raw_upload = raw_bytes / network
+        gzip_upload = gzip_bytes / network
+        for codec, upload, compress in (
+            ("none", raw_upload, 0.0),
+            ("gzip", gzip_upload, compress_seconds),
+        ):
+            rows.append(
+                {
+                    "mode": "model",
+                    "codec": codec,
+                    "uplink_gbps": gbps,
+                    "raw_bytes": raw_bytes,
+                    "uploaded_bytes": gzip_bytes if codec == "gzip" else raw_bytes,
+                    "decompress_cut_seconds": round(cut_seconds, 3),
+                    "compress_seconds": round(compress, 3),
+                    "upload_seconds": round(upload, 3),
+                    # Cutting, compression and upload overlap in the engine.
+                    "split_upload_seconds": round(max(cut_seconds, compress, upload), 3),
+                    "lambda_inflate_mb_per_second": (
+                        round(min(inflate_rates) / 1e6, 1) if codec == "gzip" and inflate_rates else ""
+                    ),
+                }
+            )
+    return rows
+
+
+def measured_row(args: argparse.Namespace, codec: str, prefix: str) -> dict:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        timings = Path(temp_dir) / "timings.csv"
+        env = dict(os.environ, SPLIT_TIMINGS_FILE=str(timings))
+        env.pop("ASYNC_LAMBDA_FUNCTION", None)
+        command = [
+            sys.executable, str(ENGINE),
+            args.fastq_bucket, args.r1_gz, args.r2_gz,
+            f"{prefix}/{codec}/{Path(args.r1_gz).name.split('_R1_')[0]}",
+            args.input_txt_bucket, str(args.split_lines),
+            "--decompressor", args.decompressor,
+            "--threads", str(args.threads),
+            "--shard-codec", codec,
+            "--compress-threads", str(args.compress_threads),
+        ]
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        with timings.open() as handle:
+            stages = {row["stage"]: float(row["seconds"]) for row in csv.DictReader(handle)}
+    return {
+        "mode": "measured",
+        "codec": codec,
+        "decompress_cut_seconds": stages.get("decompress_and_split_fastq", ""),
+        "compress_seconds": round(
+            sum(value for stage, value in stages.items() if stage.endswith("_compress")), 3
+        ),
+        "upload_seconds": stages.get("fastq_upload_window", ""),
+        "split_upload_seconds": stages.get("lane_streaming_total", ""),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("r1_gz")
+    parser.add_argument("r2_gz")
+    parser.add_argument("--split-lines", type=int, default=engine.DEFAULT_SPLIT_LINES)
+    parser.add_argument("--decompressor", default="rapidgzip", choices=engine.DECOMPRESSORS)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--compress-threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--uplink-gbps", type=float, nargs="+", default=[engine.detect_uplink_gbps()]
+    )
+    parser.add_argument("--max-pairs", type=int, default=0, help="stop the offline pass early")
+    parser.add_argument("--fastq-bucket", default="")
+    parser.add_argument("--input-txt-bucket", default="")
+    parser.add_argument("--s3-prefix", default="shard-codec-benchmark")
+    args = parser.parse_args(argv)
+
+    if bool(args.fastq_bucket) != bool(args.input_txt_bucket):
+        parser.error("--fastq-bucket and --input-txt-bucket go together")
+    for path in (args.r1_gz, args.r2_gz):
+        if not os.path.isfile(path):
+            parser.error(f"gzip not found: {path}")
+
+    rows = offline_rows(args)
+    if args.fastq_bucket:
+        prefix = f"{args.s3_prefix}/{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}"
+        rows.extend(measured_row(args, codec, prefix) for codec in ("none", "gzip"))
+
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+    writer = csv.DictWriter(sys.stdout, fieldnames=fields, delimiter="\t", restval="")
+    writer.writeheader()
+    writer.writerows(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""Track Lambda shard completions from a push channel, with a listing fallback.
+
+The mapper writes ``piscem_output/<folder>/output.txt`` as its completion
+marker. Finding markers by listing the whole prefix costs a pass over every
+object of the run on every poll. With ``COMPLETION_CHANNEL`` set on the
+function, the mapper also pushes one event per completed shard
+(``notify_completion`` in ``scrna-pipeline/map.py``) to:
+
+* an SQS queue URL (``https://sqs.<region>.amazonaws.com/<account>/<queue>``);
+  an on-success Lambda Destination pointing at the same queue also works,
+  because the handler's response lists the completed ``folders``;
+* ``file:///path/events.jsonl``, an append-only local file, for tests and
+  single-host runs.
+
+``CompletionTracker`` reads those events as they arrive and still lists S3
+every ``fallback_seconds``, so a lost event only delays readiness. The
+fallback listing starts after the first pending folder (``StartAfter``) and
+stops past the last one, so it shrinks as the run completes instead of
+growing with it. The marker stays the authority: a pushed event only names a
+folder whose marker has already been written.
+
+    completion_tracker.py follow --output-bucket BUCKET \\
+        --expected-folders expected_rad_folders.txt \\
+        --channel "$COMPLETION_CHANNEL" --inventory completion-inventory.tsv
+
+``follow`` keeps ``--inventory`` up to date in the ``Key<TAB>LastModified``
+form of an S3 listing, with a ``map.rad`` and an ``output.txt`` line per ready
+folder, so the shell drivers can read it in place of their listing, and exits
+once every expected folder is ready. ``--stats`` receives the request counts.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable
+
+
+RAD_PREFIX = "piscem_output"
+MARKER_FILE = "output.txt"
+RAD_FILE = "map.rad"
+
+
+def completion_folders(body: str) -> list[str]:
+    """Folders a channel message reports complete; [] for anything else."""
+    try:
+        message = json.loads(body)
+    except ValueError:
+        return []
+    if not isinstance(message, dict):
+        return []
+    if "responsePayload" in message:
+        # An on-success Lambda Destination record wraps the handler's response.
+        payload = message.get("responsePayload") or {}
+        folders = payload.get("folders", []) if isinstance(payload, dict) else []
+        return [folder for folder in folders if isinstance(folder, str)]
+    if message.get("type") == "shard_complete" and isinstance(message.get("folder"), str):
+        return [message["folder"]]
+    return []
+
+
+class FileChannel:
+    """Append-only JSON-lines file; every reader tails it from the start."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.offset = 0
+        self.partial = b""
+        self.received = 0
+
+    def publish(self, event: dict) -> None:
+        line = (json.dumps(event, sort_keys=True) + "\n").encode("utf-8")
+        # One O_APPEND write per event keeps concurrent writers' lines whole.
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(descriptor, line)
+        finally:
+            os.close(descriptor)
+
+    def poll(self, timeout: float) -> list[str]:
+        deadline = time.monotonic() + timeout
+        while True:
+            folders = self.read()
+            if folders or time.monotonic() >= deadline:
+                return folders
+            time.sleep(min(0.01, max(0.0, deadline - time.monotonic())))
+
+    def read(self) -> list[str]:
+        try:
+            with open(self.path, "rb") as stream:
+                stream.seek(self.offset)
+                data = stream.read()
+        except FileNotFoundError:
+            return []
+        self.offset += len(data)
+        data = self.partial + data
+        lines = data.split(b"\n")
+        self.partial = lines.pop()
+        folders = []
+        for line in lines:
+            if line.strip():
+                self.received += 1
+                folders.extend(completion_folders(line.decode("utf-8", "replace")))
+        return folders
+
+
+class SqsChannel:
+    """An SQS queue; messages are deleted once their folders are recorded."""
+
+    def __init__(self, queue_url: str, client=None, region: str | None = None):
+        if client is None:
+            import boto3
+
+            client = boto3.client("sqs", region_name=region or None)
+        self.queue_url = queue_url
+        self.client = client
+        self.received = 0
+        self.requests = 0
+
+    def publish(self, event: dict) -> None:
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(event, sort_keys=True))
+
+    def poll(self, timeout: float) -> list[str]:
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=max(0, min(20, math.ceil(timeout))),
+        )
+        self.requests += 1
+        messages = response.get("Messages", [])
+        folders = []
+        for message in messages:
+            folders.extend(completion_folders(message.get("Body", "")))
+        self.received += len(messages)
+        if messages:
+            self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(index), "ReceiptHandle": message["ReceiptHandle"]}
+                    for index, message in enumerate(messages)
+                ],
+            )
+            self.requests += 1
+        return folders
+
+
+def open_channel(uri: str, region: str | None = None):
+    """The channel named by a ``COMPLETION_CHANNEL`` value, or None if empty."""
+    if not uri:
+        return None
+    if uri.startswith("file://"):
+        return FileChannel(uri[len("file://"):])
+    if uri.startswith("https://sqs.") or uri.startswith("https://queue.amazonaws.com"):
+        return SqsChannel(uri, region=region)
+    raise ValueError(f"unsupported completion channel: {uri}")
+
+
+class ListingFallback:
+    """Find markers of pending folders by listing only the span they cover."""
+
+    def __init__(self, client, bucket: str, prefix: str = RAD_PREFIX, not_before: datetime | None = None):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.not_before = not_before
+        self.requests = 0
+
+    def sweep(self, pending: Iterable[str]) -> dict[str, datetime]:
+        """Pending folders whose marker exists, with the marker's LastModified."""
+        pending = set(pending)
+        if not pending:
+            return {}
+        # S3 orders keys, so folders sort as "<folder>/": "S1-1/" before "S1/".
+        first = min(pending, key=lambda folder: folder + "/")
+        last_folder = f"{self.prefix}/{max(folder + '/' for folder in pending)}"
+        kwargs = {
+            "Bucket": self.bucket,
+            "Prefix": f"{self.prefix}/",
+            # Keys of every folder sorting before the first pending one are skipped.
+            "StartAfter": f"{self.prefix}/{first}",
+        }
+        found = {}
+        while True:
+            response = self.client.list_objects_v2(**kwargs)
+            self.requests += 1
+            for item in response.get("Contents", []):
+                key = item["Key"]
+                if key > last_folder and not key.startswith(last_folder):
+                    return found
+                folder, _, name = key[len(self.prefix) + 1:].partition("/")
+                if name != MARKER_FILE or folder not in pending:
+                    continue
+                modified = item.get("LastModified")
+                if self.not_before is not None and modified is not None and modified < self.not_before:
+                    continue
+                found[folder] = modified
+            if not response.get("IsTruncated"):
+                return found
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+@dataclass
+class CompletionTracker:
+    """The set of expected folders whose completion has been seen."""
+
+    expected: set[str]
+    channel: object | None = None
+    fallback: ListingFallback | None = None
+    fallback_seconds: float = 30.0
+    ready: dict[str, datetime] = field(default_factory=dict)
+    pushed: int = 0
+    listed: int = 0
+    last_sweep: float = field(default=float("-inf"), repr=False)
+
+    @property
+    def pending(self) -> set[str]:
+        return self.expected - self.ready.keys()
+
+    @property
+    def complete(self) -> bool:
+        return not self.pending
+
+    def record(self, folders: Iterable[str], modified: datetime | None = None) -> list[str]:
+        new = []
+        for folder in folders:
+            if folder in self.expected and folder not in self.ready:
+                self.ready[folder] = modified or datetime.now(timezone.utc)
+                new.append(folder)
+        return new
+
+    def step(self, timeout: float = 1.0) -> list[str]:
+        """Wait up to ``timeout`` for completions; return the newly ready folders."""
+        new = []
+        now = time.monotonic()
+        if self.fallback is not None and now - self.last_sweep >= self.fallback_seconds:
+            self.last_sweep = now
+            for folder, modified in self.fallback.sweep(self.pending).items():
+                if self.record([folder], modified):
+                    new.append(folder)
+                    self.listed += 1
+        if self.complete:
+            return new
+        if self.channel is not None:
+            wait = timeout
+            if self.fallback is not None:
+                wait = min(wait, max(0.0, self.last_sweep + self.fallback_seconds - time.monotonic()))
+            pushed = self.record(self.channel.poll(wait))
+            self.pushed += len(pushed)
+            new.extend(pushed)
+        elif not new:
+            time.sleep(max(0.0, min(timeout, self.last_sweep + self.fallback_seconds - time.monotonic())))
+        return new
+
+    def wait(self, timeout: float, on_ready=None) -> bool:
+        """Step until every folder is ready or ``timeout`` seconds pass."""
+        deadline = time.monotonic() + timeout
+        while not self.complete and time.monotonic() < deadline:
+            new = self.step(min(1.0, max(0.0, deadline - time.monotonic())))
+            if new and on_ready is not None:
+                on_ready(new)
+        return self.complete
+
+    def stats(self) -> dict:
+        return {
+            "expected": len(self.expected),
+            "ready": len(self.ready),
+            "pushed": self.pushed,
+            "listed": self.listed,
+            "list_calls": self.fallback.requests if self.fallback is not None else 0,
+            "channel_requests": getattr(self.channel, "requests", 0),
+        }
+
+
+def write_inventory(path: Path, prefix: str, ready: dict[str, datetime]) -> None:
+    """Write ``ready`` as a ``Key<TAB>LastModified`` listing, atomically."""
+    partial = path.with_name(f"{path.name}.partial.{os.getpid()}")
+    with open(partial, "w") as inventory:
+        for folder in sorted(ready):
+            modified = ready[folder].astimezone(timezone.utc).isoformat()
+            inventory.write(f"{prefix}/{folder}/{RAD_FILE}\t{modified}\n")
+            inventory.write(f"{prefix}/{folder}/{MARKER_FILE}\t{modified}\n")
+    os.replace(partial, path)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    follow = commands.add_parser("follow", help="track the expected folders until all are ready")
+    follow.add_argument("--output-bucket", required=True)
+    follow.add_argument("--expected-folders", type=Path, required=True)
+    follow.add_argument("--inventory", type=Path, required=True)
+    follow.add_argument("--stats", type=Path)
+    follow.add_argument("--channel", default=os.getenv("COMPLETION_CHANNEL", ""))
+    follow.add_argument("--rad-prefix", default=RAD_PREFIX)
+    follow.add_argument("--region", default="")
+    follow.add_argument("--not-before", default="", help="ignore markers older than this UTC time")
+    follow.add_argument("--fallback-seconds", type=float, default=30.0,
+                        help="seconds between listing sweeps (used alone without --channel)")
+    follow.add_argument("--timeout-seconds", type=float, default=43200.0)
+    args = parser.parse_args(argv)
+    if args.fallback_seconds <= 0 or args.timeout_seconds <= 0:
+        parser.error("--fallback-seconds and --timeout-seconds must be positive")
+
+    import boto3
+
+    expected = {line.strip() for line in args.expected_folders.read_text().splitlines() if line.strip()}
+    if not expected:
+        parser.error(f"no expected folders in {args.expected_folders}")
+    not_before = None
+    if args.not_before:
+        not_before = datetime.fromisoformat(args.not_before.replace("Z", "+00:00"))
+        if not_before.tzinfo is None:
+            not_before = not_before.replace(tzinfo=timezone.utc)
+    try:
+        channel = open_channel(args.channel, args.region)
+    except ValueError as error:
+        parser.error(str(error))
+    prefix = args.rad_prefix.strip("/")
+    tracker = CompletionTracker(
+        expected,
+        channel=channel,
+        fallback=ListingFallback(
+            boto3.client("s3", region_name=args.region or None), args.output_bucket, prefix, not_before
+        ),
+        fallback_seconds=args.fallback_seconds,
+    )
+
+    def publish(_new=None) -> None:
+        write_inventory(args.inventory, prefix, tracker.ready)
+        if args.stats is not None:
+            args.stats.write_text(json.dumps(tracker.stats(), sort_keys=True) + "\n")
+
+    publish()
+    complete = tracker.wait(args.timeout_seconds, on_ready=publish)
+    publish()
+    json.dump(tracker.stats(), sys.stderr, sort_keys=True)
+    sys.stderr.write("\n")
+    return 0 if complete else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
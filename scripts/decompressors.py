@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Gzip decompressor backends for the split path, with per-host calibration.
+
+Every backend is a child process that inflates one gzip (or stdin) to stdout,
+so ``fastq_shard_engine.Decompressor`` treats them alike:
+
+- ``rapidgzip``: parallel inflate, ``-P`` threads.
+- ``rapidgzip-python``: the rapidgzip Python module in a child interpreter,
+  for hosts that have the wheel but not the CLI.
+- ``igzip``: ISA-L, single-threaded but several times GNU gzip.
+- ``libdeflate``: ``libdeflate-gunzip``; single-threaded and fast, but it
+  buffers its whole input, so it never reads a prefetching stream.
+- ``pigz``: single inflate thread plus read, write and check threads.
+- ``gzip``: GNU gzip, always available.
+
+``calibrate`` times each available backend and thread count on a real input
+for a few seconds each and caches the decompressed MB/s per instance type.
+``choose_backend`` then picks the fastest backend for the cores a stream is
+given; ``split_scheduler.py`` calls it per stream. Without a calibration the
+choice is rapidgzip for more than one core and the fastest single-threaded
+inflater on the host otherwise.
+
+    decompressors.py calibrate /mnt/nvme/lane_L001_R2_001.fastq.gz
+    decompressors.py choose --cores 1
+
+``resolve`` prints what ``resolve_backend`` makes of a requested backend, and
+``inflate`` runs it on a gzip, or on stdin without one, so the coreutils split
+path in ``split_and_upload.sh`` substitutes backends the way the Python engine
+does.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Sequence
+
+
+DEFAULT_CALIBRATION_DIR = Path.home() / ".cache" / "scrna-serverless"
+DEFAULT_CALIBRATION_SECONDS = 3.0
+DEFAULT_THREAD_COUNTS = (1, 2, 4, 8, 16)
+READ_BYTES = 4 * 1024 * 1024
+# Fastest first on one core; `calibrate` measures the actual order on a host.
+SINGLE_THREAD_PREFERENCE = ("igzip", "libdeflate", "pigz", "gzip")
+
+RAPIDGZIP_PYTHON = (
+    "import rapidgzip, shutil, sys\n"
+    "source = sys.argv[1]\n"
+    "with rapidgzip.open(source, parallelization=int(sys.argv[2])) as stream:\n"
+    "    shutil.copyfileobj(stream, sys.stdout.buffer, 4 << 20)\n"
+)
+
+
+@dataclass(frozen=True)
+class Backend:
+    name: str
+    executable: str
+    multithreaded: bool = False
+    reads_stdin: bool = True
+
+    def available(self) -> bool:
+        if self.name == "rapidgzip-python":
+            return importlib.util.find_spec("rapidgzip") is not None
+        return shutil.which(self.executable) is not None
+
+    def command(self, path: str | None, threads: int) -> list[str]:
+        """argv that inflates ``path`` to stdout; with no ``path`` it reads stdin."""
+        if self.name == "rapidgzip":
+            command = ["rapidgzip", "-d", "-c", "-P", str(threads)]
+        elif self.name == "rapidgzip-python":
+            return [sys.executable, "-c", RAPIDGZIP_PYTHON, path or "/dev/stdin", str(threads)]
+        elif self.name == "pigz":
+            command = ["pigz", "-dc", "-p", str(threads)]
+        elif self.name == "igzip":
+            command = ["igzip", "-dc"]
+        elif self.name == "libdeflate":
+            command = ["libdeflate-gunzip", "-c"]
+        else:
+            command = ["gzip", "-dc", "--"]
+        return command + ([path] if path else [])
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (
+        Backend("rapidgzip", "rapidgzip", multithreaded=True),
+        Backend("rapidgzip-python", sys.executable, multithreaded=True, reads_stdin=False),
+        Backend("igzip", "igzip"),
+        Backend("libdeflate", "libdeflate-gunzip", reads_stdin=False),
+        Backend("pigz", "pigz", multithreaded=True),
+        Backend("gzip", "gzip"),
+    )
+}
+
+
+def available_backends(names: Sequence[str] | None = None, streaming: bool = False) -> list[str]:
+    """Installed backends among ``names`` (default all); ``streaming`` needs stdin."""
+    return [
+        name
+        for name in (names or BACKENDS)
+        if name in BACKENDS
+        and BACKENDS[name].available()
+        and (BACKENDS[name].reads_stdin or not streaming)
+    ]
+
+
+def choose_backend(
+    cores: int,
+    calibration: Sequence[dict] | None = None,
+    candidates: Sequence[str] | None = None,
+    streaming: bool = False,
+) -> tuple[str, int]:
+    """Return the fastest (backend, threads) for a stream given ``cores`` cores."""
+    installed = available_backends(candidates, streaming) or ["gzip"]
+    measured = [
+        row for row in calibration or ()
+        if row["backend"] in installed and row["threads"] <= max(cores, 1)
+    ]
+    if measured:
+        best = max(measured, key=lambda row: row["mb_per_second"])
+        return best["backend"], int(best["threads"])
+    if cores > 1 and "rapidgzip" in installed:
+        return "rapidgzip", cores
+    for name in SINGLE_THREAD_PREFERENCE:
+        if name in installed:
+            return name, 1
+    return installed[0], 1
+
+
+def resolve_backend(name: str, threads: int, streaming: bool = False) -> tuple[str, int]:
+    """Map ``auto`` or an unusable backend to the best usable one for ``threads`` cores.
+
+    Single-threaded backends ignore ``threads``; it is returned unchanged so a
+    stream still hands back its whole core allotment when it finishes.
+    """
+    backend = BACKENDS.get(name)
+    if backend is not None and backend.available() and (backend.reads_stdin or not streaming):
+        return name, threads
+    choice, _ = choose_backend(threads, load_calibration(), streaming=streaming)
+    if name != "auto":
+        reason = "cannot read a stream" if backend is not None and backend.available() else "is not available"
+        print(f"WARNING: {name} {reason}; using {choice}", file=sys.stderr)
+    return choice, threads
+
+
+def instance_type() -> str:
+    """EC2 instance type from DMI (Nitro hosts), else a CPU-count label."""
+    try:
+        name = Path("/sys/devices/virtual/dmi/id/product_name").read_text().strip()
+    except OSError:
+        name = ""
+    if name and "." in name:
+        return name
+    return f"{os.cpu_count() or 1}cpu"
+
+
+def calibration_path(directory: str | Path = "") -> Path:
+    directory = Path(directory or os.getenv("DECOMP_CALIBRATION_DIR") or DEFAULT_CALIBRATION_DIR)
+    return directory / f"decompressors-{instance_type()}.json"
+
+
+def load_calibration(path: str | Path | None = None) -> list[dict] | None:
+    try:
+        document = json.loads(Path(path or calibration_path()).read_text())
+    except (OSError, ValueError):
+        return None
+    return document.get("results") or None
+
+
+def measure(backend: Backend, path: str, threads: int, seconds: float) -> float:
+    """Decompressed MB/s of ``backend`` on ``path`` over at most ``seconds``."""
+    process = subprocess.Popen(
+        backend.command(path, threads), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    produced = [0]
+
+    def drain() -> None:
+        while block := process.stdout.read(READ_BYTES):
+            produced[0] += len(block)
+
+    reader = threading.Thread(target=drain, daemon=True)
+    start = time.monotonic()
+    reader.start()
+    reader.join(seconds)
+    elapsed = time.monotonic() - start
+    finished = not reader.is_alive()
+    if not finished:
+        process.kill()
+    process.wait()
+    reader.join()
+    if finished and process.returncode != 0:
+        return 0.0
+    return produced[0] / 1e6 / max(elapsed, 1e-6)
+
+
+def calibrate(
+    path: str,
+    thread_counts: Sequence[int] = DEFAULT_THREAD_COUNTS,
+    seconds: float = DEFAULT_CALIBRATION_SECONDS,
+    names: Sequence[str] | None = None,
+) -> list[dict]:
+    cores = os.cpu_count() or 1
+    results = []
+    for name in available_backends(names):
+        backend = BACKENDS[name]
+        counts = [count for count in thread_counts if count <= cores] if backend.multithreaded else [1]
+        for threads in counts or [1]:
+            rate = measure(backend, path, threads, seconds)
+            results.append({"backend": name, "threads": threads, "mb_per_second": round(rate, 1)})
+            print(f"{name:17} {threads:3} thread(s) {rate:9.1f} MB/s", flush=True)
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    calibrate_parser = commands.add_parser("calibrate", help="time every backend on a real gzip")
+    calibrate_parser.add_argument("sample", help="a representative input gzip, e.g. an R2")
+    calibrate_parser.add_argument(
+        "--threads", default=",".join(map(str, DEFAULT_THREAD_COUNTS)),
+        help="comma-separated thread counts for multithreaded backends",
+    )
+    calibrate_parser.add_argument("--seconds", type=float, default=DEFAULT_CALIBRATION_SECONDS)
+    calibrate_parser.add_argument("--backends", default="", help="comma-separated subset")
+    calibrate_parser.add_argument("--output", default="", help="default: the per-instance-type cache")
+    choose_parser = commands.add_parser("choose", help="print the backend and threads for a stream")
+    choose_parser.add_argument("--cores", type=int, required=True)
+    choose_parser.add_argument("--backends", default="", help="comma-separated subset")
+    choose_parser.add_argument("--streaming", action="store_true", help="input arrives on stdin")
+    choose_parser.add_argument("--calibration", default="", help="default: the per-instance-type cache")
+    resolve_parser = commands.add_parser("resolve", help="print the usable backend and threads for a request")
+    resolve_parser.add_argument("backend", choices=(*BACKENDS, "auto"))
+    resolve_parser.add_argument("--threads", type=int, default=1)
+    resolve_parser.add_argument("--streaming", action="store_true", help="input arrives on stdin")
+    inflate_parser = commands.add_parser("inflate", help="inflate a gzip, or stdin, to stdout")
+    inflate_parser.add_argument("backend", choices=(*BACKENDS, "auto"))
+    inflate_parser.add_argument("path", nargs="?", help="default: stdin")
+    inflate_parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args(argv)
+    if args.command in ("resolve", "inflate"):
+        if args.threads <= 0:
+            parser.error("--threads must be positive")
+        streaming = args.streaming if args.command == "resolve" else args.path is None
+        backend, threads = resolve_backend(args.backend, args.threads, streaming)
+        if args.command == "resolve":
+            print(backend, threads)
+            return 0
+        command = BACKENDS[backend].command(args.path, threads)
+        os.execvp(command[0], command)
+
+    names = [name for name in args.backends.split(",") if name] or None
+    if names and any(name not in BACKENDS for name in names):
+        parser.error(f"backends must be among {', '.join(BACKENDS)}")
+
+    if args.command == "choose":
+        if args.cores <= 0:
+            parser.error("--cores must be positive")
+        backend, threads = choose_backend(
+            args.cores, load_calibration(args.calibration or None), names, args.streaming
+        )
+        print(backend, threads)
+        return 0
+
+    try:
+        thread_counts = sorted({int(count) for count in args.threads.split(",") if count})
+    except ValueError:
+        parser.error("--threads must be comma-separated integers")
+    if not thread_counts or thread_counts[0] <= 0 or args.seconds <= 0:
+        parser.error("--threads and --seconds must be positive")
+    if not os.path.isfile(args.sample):
+        print(f"ERROR: sample gzip not found: {args.sample}", file=sys.stderr)
+        return 1
+    results = calibrate(args.sample, thread_counts, args.seconds, names)
+    output = Path(args.output) if args.output else calibration_path()
+    output.parent.mkdir(parents=True, exist_ok=True)
+    document = {
+        "instance_type": instance_type(),
+        "cores": os.cpu_count(),
+        "sample": os.path.abspath(args.sample),
+        "seconds": args.seconds,
+        "results": results,
+    }
+    output.write_text(json.dumps(document, indent=1) + "\n")
+    best = max(results, key=lambda row: row["mb_per_second"])
+    print(f"Fastest: {best['backend']} with {best['threads']} thread(s); saved {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
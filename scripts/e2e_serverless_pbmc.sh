@@ -59,13 +59,67 @@
 #   TERMINATE_DRIVER_ON_EXIT  Terminate EC2 instance on exit (default: 1)
 #   DOWNLOAD_TO_LOCAL      Download results from EC2 to local machine (default: 1). Alias for DOWNLOAD_RESULTS.
 #   RUN_QC                 Run QC analysis on outputs (default: 1). ONLY step requiring python.
-#   READ_PAIRS_PER_SHARD   Target read pairs per Lambda shard (default: 4000000;
+#   READ_PAIRS_PER_SHARD   Largest Lambda shard in read pairs (default: 4000000;
 #                          8000000 on accounts limited to <=25 concurrent Lambdas).
 #   SPLIT_LINES            Legacy override; must equal read pairs per shard * 4.
-#   DIRECT_GZIP_MAX_BYTES  Pass a compressed R1/R2 pair directly to Lambda when
-#                          its combined size is below this value (default: 1 GiB).
+#   SHARD_PLANNER          1 (default) chooses direct vs split and tapered shard
+#                          sizes per lane with scripts/plan_shards.py and keeps
+#                          the plan as shard_plan.tsv in the run directory; 0
+#                          uses DIRECT_GZIP_MAX_BYTES and fixed-size shards.
+#   SHARD_CACHE_URI        Optional s3:// root of a cross-run shard cache. Split
+#                          lanes whose gzips and split parameters match an
+#                          earlier run only republish their input.txt manifests
+#                          (scripts/shard_cache.py). Empty (default) disables it.
+#   DIRECT_GZIP_MAX_BYTES  With SHARD_PLANNER=0, pass a compressed R1/R2 pair
+#                          directly to Lambda when its combined size is below
+#                          this value (default: 1 GiB).
 #   USE_RAPIDGZIP          auto/1 enables CPU-aware rapidgzip selection (default:
 #                          auto); 0 forces single-threaded gzip workers.
+#   SHARD_BATCH_SHARDS     Most split shards one Lambda invocation maps back to
+#                          back from a batch manifest (default: 1, no batching);
+#                          batches are also capped to fit the 900 s timeout.
+#                          Python engine only.
+#   LAMBDA_SPLITTER        1 cuts S3-resident split lanes inside the map Lambda
+#                          from a <lane>_split.txt manifest instead of on this
+#                          driver (default: 0). NVMe input still splits here.
+#                          The Lambda caps pairs per shard to its memory, so
+#                          the 3008 MB fallback cuts smaller shards.
+#   DECOMP_CALIBRATION     auto (default) lets split_scheduler.py use this
+#                          instance type's cached decompressors.py calibration
+#                          when one exists; 1 re-times every installed backend
+#                          on the largest split R2 first (local FASTQ mode);
+#                          0 ignores calibration.
+#   SHARD_ENGINE           python (default) cuts and uploads shard pairs in memory
+#                          with scripts/fastq_shard_engine.py; split keeps the
+#                          coreutils split path. python falls back to split when
+#                          boto3 is not importable on the driver. index is
+#                          zero-split: Lambdas map byte ranges of the original
+#                          gzips through a seek-point index (needs indexed_gzip).
+#   SHARD_CODEC            none (default) uploads .fastq shards; gzip uploads
+#                          member-compressed .fastq.gz shards; auto chooses per
+#                          lane from idle cores and uplink share (python engine).
+#   FASTQ_GZIP_INFLATE     Lambda-side handling of .fastq.gz inputs: parallel
+#                          (default) inflates each stream with rapidgzip on a
+#                          share of the vCPUs taken from Piscem; writer inflates
+#                          in the FIFO writer threads; piscem hands Piscem the
+#                          gzip itself.
+#   FIFO_RANGE_CONCURRENCY Ranged S3 GETs each Lambda FIFO producer keeps in
+#                          flight (default: 4); 1 streams one GET per object.
+#   FIFO_RANGE_MIB         Size of each of those ranged GETs (default: 8).
+#   RAD_UPLOAD_PART_MIB    Part size for uploading map.rad while Piscem writes
+#                          it (default: 8, minimum 5); 0 uploads it afterwards.
+#   RAD_FRAME_CODEC        none, zstd or deflate; compresses map.rad into
+#                          chunk-aligned frames before upload (default: none).
+#   RAD_FRAME_MIB          Uncompressed size of each of those frames (default: 8).
+#   BARCODE_HISTOGRAM      1 makes each Lambda upload per-barcode read counts,
+#                          merged into a frequency table and knee estimate
+#                          while map.rad is materialized (default: 0).
+#   COMPLETION_CHANNEL     SQS queue URL each Lambda pushes shard completions to.
+#                          The driver follows it with completion_tracker.py and
+#                          lists the map bucket only as a fallback (default: none).
+#   RESOURCE_SAMPLE_SECONDS Interval at which each Lambda samples CPU, memory,
+#                          network and /tmp from /proc (default: 1; 0 disables).
+#   RESOURCE_TIMESERIES    1 adds every sample to PIPELINE_TIMING (default: 0).
 #   MATERIALIZER_THREADS   Concurrent S3 RAD materializer workers (default: 32).
 #   EXECUTION_MODE         synchronous (default) or async-submit. The latter
 #                          exits after publishing all immediate shard triggers.
@@ -333,10 +387,27 @@ RUN_ID="${RUN_ID:-}"
 READ_PAIRS_PER_SHARD="${READ_PAIRS_PER_SHARD:-}"
 SPLIT_LINES="${SPLIT_LINES:-}"
 DIRECT_GZIP_MAX_BYTES="${DIRECT_GZIP_MAX_BYTES:-1073741824}"
+SHARD_PLANNER="${SHARD_PLANNER:-1}"
+DECOMP_CALIBRATION="${DECOMP_CALIBRATION:-auto}"
+SHARD_BATCH_SHARDS="${SHARD_BATCH_SHARDS:-1}"
+LAMBDA_SPLITTER="${LAMBDA_SPLITTER:-0}"
+SHARD_CACHE_URI="${SHARD_CACHE_URI:-}"
 PROCESS_FASTQ_TIMEOUT_SEC="${PROCESS_FASTQ_TIMEOUT_SEC:-43200}"
 POLL_INTERVAL_SECONDS="${POLL_INTERVAL_SECONDS:-10}"
 POST_UPLOAD_PROPAGATION_WAIT_SECONDS="${POST_UPLOAD_PROPAGATION_WAIT_SECONDS:-0}"
 USE_RAPIDGZIP="${USE_RAPIDGZIP:-auto}"
+SHARD_ENGINE="${SHARD_ENGINE:-python}"
+SHARD_CODEC="${SHARD_CODEC:-none}"
+FASTQ_GZIP_INFLATE="${FASTQ_GZIP_INFLATE:-parallel}"
+FIFO_RANGE_CONCURRENCY="${FIFO_RANGE_CONCURRENCY:-4}"
+FIFO_RANGE_MIB="${FIFO_RANGE_MIB:-8}"
+RAD_UPLOAD_PART_MIB="${RAD_UPLOAD_PART_MIB:-8}"
+RAD_FRAME_CODEC="${RAD_FRAME_CODEC:-none}"
+RAD_FRAME_MIB="${RAD_FRAME_MIB:-8}"
+BARCODE_HISTOGRAM="${BARCODE_HISTOGRAM:-0}"
+COMPLETION_CHANNEL="${COMPLETION_CHANNEL:-}"
+RESOURCE_SAMPLE_SECONDS="${RESOURCE_SAMPLE_SECONDS:-1}"
+RESOURCE_TIMESERIES="${RESOURCE_TIMESERIES:-0}"
 EXECUTION_MODE="${EXECUTION_MODE:-synchronous}"
 
 # Derived values (will be set later)
@@ -723,6 +794,16 @@ create_lambda_function_from_image() {
         --arg claims "$S3_CLAIM_PREFIX" \
         --arg lease "$CLAIM_LEASE_SECONDS" \
         --arg heartbeat "$CLAIM_HEARTBEAT_SECONDS" \
+        --arg inflate "$FASTQ_GZIP_INFLATE" \
+        --arg range_concurrency "$FIFO_RANGE_CONCURRENCY" \
+        --arg range_mib "$FIFO_RANGE_MIB" \
+        --arg rad_part_mib "$RAD_UPLOAD_PART_MIB" \
+        --arg frame_codec "$RAD_FRAME_CODEC" \
+        --arg frame_mib "$RAD_FRAME_MIB" \
+        --arg histogram "$BARCODE_HISTOGRAM" \
+        --arg completion_channel "$COMPLETION_CHANNEL" \
+        --arg sample_seconds "$RESOURCE_SAMPLE_SECONDS" \
+        --arg timeseries "$RESOURCE_TIMESERIES" \
         '{Variables:{
             S3_OUTPUT_BUCKET_NAME:$out,
             S3_INPUT_BUCKET_NAME:$inp,
@@ -730,7 +811,17 @@ create_lambda_function_from_image() {
             LAMBDA_MEMORY_MB:$mem,
             S3_CLAIM_PREFIX:$claims,
             CLAIM_LEASE_SECONDS:$lease,
-            CLAIM_HEARTBEAT_SECONDS:$heartbeat
+            CLAIM_HEARTBEAT_SECONDS:$heartbeat,
+            FASTQ_GZIP_INFLATE:$inflate,
+            FIFO_RANGE_CONCURRENCY:$range_concurrency,
+            FIFO_RANGE_MIB:$range_mib,
+            RAD_UPLOAD_PART_MIB:$rad_part_mib,
+            RAD_FRAME_CODEC:$frame_codec,
+            RAD_FRAME_MIB:$frame_mib,
+            BARCODE_HISTOGRAM:$histogram,
+            COMPLETION_CHANNEL:$completion_channel,
+            RESOURCE_SAMPLE_SECONDS:$sample_seconds,
+            RESOURCE_TIMESERIES:$timeseries
         }}')
 
     # Check if function already exists
@@ -789,8 +880,11 @@ create_eventbridge_rule_for_lambda() {
 
     # Create EventBridge rule
     local event_pattern
+    # Only shard and split manifests start the mapper; direct invocations
+    # leave their manifest copies as *.audit objects, which must not match.
     event_pattern=$(jq -n --arg b "$bucket_name" \
-        '{source:["aws.s3"],"detail-type":["Object Created"],detail:{bucket:{name:[$b]}}}')
+        '{source:["aws.s3"],"detail-type":["Object Created"],
+          detail:{bucket:{name:[$b]},object:{key:[{suffix:"_input.txt"},{suffix:"_split.txt"}]}}}')
 
     local rule_arn
     rule_arn=$(aws events put-rule \
@@ -945,17 +1039,36 @@ fetch_ko_fastqs() {
     log_info "Lanes found: ${#LANE_BASENAMES[@]}"
 }
 
+S3_UPLOAD_SERVICE=/home/ubuntu/scrna-repo/scripts/s3_upload_service.py
+
+# Upload every "LOCAL_PATH S3_URI" line of a job list through one pooled
+# s3_upload_service.py process. Returns nonzero if any upload failed.
+s3_upload_batch() {
+    local job_list="$1"
+    AWS_REGION="$AWS_REGION" python3 "$S3_UPLOAD_SERVICE" < "$job_list" | { ! grep '^ERROR' >&2; }
+    return "${PIPESTATUS[0]}"
+}
+
+s3_upload_service_available() {
+    [[ -f "$S3_UPLOAD_SERVICE" ]] && python3 -c 'import boto3' >/dev/null 2>&1
+}
+
+input_txt_s3_key() {
+    local lane_id="$1" base_folder="$2"
+    if [[ -n "$base_folder" && "$base_folder" != "." ]]; then
+        echo "${base_folder}/${lane_id}_p0_input.txt"
+    else
+        echo "${lane_id}_p0_input.txt"
+    fi
+}
+
 create_and_upload_input_txt() {
     local lane_id="$1" r1_s3_path="$2" r2_s3_path="$3" base_folder="$4"
     local input_file="/tmp/${lane_id}_p0_input.txt"
     printf '%s\n%s\n' "$r1_s3_path" "$r2_s3_path" > "$input_file"
 
     local s3_key
-    if [[ -n "$base_folder" && "$base_folder" != "." ]]; then
-        s3_key="${base_folder}/${lane_id}_p0_input.txt"
-    else
-        s3_key="${lane_id}_p0_input.txt"
-    fi
+    s3_key=$(input_txt_s3_key "$lane_id" "$base_folder")
 
     aws s3 cp "$input_file" "s3://${INPUT_TXT_BUCKET}/${s3_key}" \
         --region "$AWS_REGION" --only-show-errors
@@ -1041,7 +1154,7 @@ process_fastq_bash() {
     local -a ORDERED_BASES=()
     local -a SPLIT_LANES=() SPLIT_R1=() SPLIT_R2=() SPLIT_BASE=()
     local -a DIRECT_LANES=() DIRECT_R1=() DIRECT_R2=() DIRECT_BASE=()
-    local -A PF_PAIR_BYTES=()
+    local -A PF_PAIR_BYTES=() PF_R1_BYTES=() PF_R2_BYTES=()
     local base r1_key r2_key r1_bytes r2_bytes combined_bytes
 
     TOTAL_INPUT_BYTES=0
@@ -1062,6 +1175,8 @@ process_fastq_bash() {
             die "Could not determine compressed size for $base"
         combined_bytes=$((r1_bytes + r2_bytes))
         PF_PAIR_BYTES["$base"]="$combined_bytes"
+        PF_R1_BYTES["$base"]="$r1_bytes"
+        PF_R2_BYTES["$base"]="$r2_bytes"
         TOTAL_INPUT_BYTES=$((TOTAL_INPUT_BYTES + combined_bytes))
     done
 
@@ -1071,6 +1186,51 @@ process_fastq_bash() {
         done | LC_ALL=C sort -t $'\t' -k1,1nr -k2,2 | cut -f2-
     )
 
+    # The makespan planner decides direct vs split and each split lane's
+    # shard schedule from the size inventory, Lambda concurrency, and cores.
+    # Without it, fall back to the fixed cutoff and fixed-size shards.
+    local -A PF_PLAN_MODE=() PF_PLAN_SCHEDULE=()
+    local -a SPLIT_SCHEDULE=()
+    local shard_plan_file="$RUN_DIR/shard_plan.tsv"
+    if [[ "$SHARD_PLANNER" == "1" ]]; then
+        local _inventory_file="$RUN_DIR/shard_inventory.tsv"
+        local -a _plan_args=(--output "$shard_plan_file" --cores "$(nproc 2>/dev/null || echo 4)")
+        {
+            printf 'lane\tcombined_bytes\n'
+            for base in "${ORDERED_BASES[@]}"; do
+                printf '%s\t%s\n' "$base" "${PF_PAIR_BYTES[$base]}"
+            done
+        } > "$_inventory_file"
+        if [[ "$LAMBDA_CONCURRENCY" == "unrestricted" ]]; then
+            _plan_args+=(--lambda-concurrency 0)
+        else
+            _plan_args+=(--lambda-concurrency "$LAMBDA_CONCURRENCY")
+        fi
+        _plan_args+=(--max-read-pairs "$READ_PAIRS_PER_SHARD")
+        [[ $LAMBDA_MEMORY_MB -le 3008 ]] && _plan_args+=(--no-direct)
+        (( local_fastq_mode == 1 )) && _plan_args+=(--local-input)
+        # The coreutils split engine, also the workers' fallback without boto3,
+        # ignores SHARD_SCHEDULE and cuts READ_PAIRS_PER_SHARD shards.
+        if [[ "$SHARD_ENGINE" == "split" ]] || ! python3 -c 'import boto3' >/dev/null 2>&1; then
+            _plan_args+=(--fixed-shard-size)
+        fi
+        if [[ "$USE_RAPIDGZIP" == "0" ]] || ! command -v rapidgzip >/dev/null 2>&1; then
+            _plan_args+=(--max-threads-per-file 1)
+        fi
+        if python3 /home/ubuntu/scrna-repo/scripts/plan_shards.py "$_inventory_file" \
+               "${_plan_args[@]}"; then
+            local _order _lane _mode _schedule
+            while IFS=$'\t' read -r _order _lane _mode _ _ _ _schedule _; do
+                [[ "$_order" =~ ^[0-9]+$ ]] || continue
+                PF_PLAN_MODE["$_lane"]="$_mode"
+                PF_PLAN_SCHEDULE["$_lane"]="$_schedule"
+            done < "$shard_plan_file"
+            log_info "Shard plan: $(head -1 "$shard_plan_file" | sed 's/^# //') ($shard_plan_file)"
+        else
+            log_warn "Shard planner failed; using DIRECT_GZIP_MAX_BYTES and fixed-size shards"
+        fi
+    fi
+
     local lane_id direct_threshold_bytes
     if [[ $LAMBDA_MEMORY_MB -le 3008 ]]; then
         direct_threshold_bytes=0
@@ -1082,9 +1242,17 @@ process_fastq_bash() {
         r2_key="${PF_R2_KEYS[$base]}"
         combined_bytes="${PF_PAIR_BYTES[$base]}"
         lane_id=$(basename "$base")
-        log_info "Pair $lane_id: combined compressed size $combined_bytes bytes; direct-pass cutoff $direct_threshold_bytes bytes"
+        local _lane_mode="${PF_PLAN_MODE[$base]:-}"
+        if [[ -z "$_lane_mode" ]]; then
+            _lane_mode=split
+            (( direct_threshold_bytes > 0 && combined_bytes < direct_threshold_bytes )) && \
+                _lane_mode=direct
+            log_info "Pair $lane_id: combined compressed size $combined_bytes bytes; direct-pass cutoff $direct_threshold_bytes bytes"
+        else
+            log_info "Pair $lane_id: combined compressed size $combined_bytes bytes; planned $_lane_mode ${PF_PLAN_SCHEDULE[$base]}"
+        fi
 
-        if (( direct_threshold_bytes > 0 && combined_bytes < direct_threshold_bytes )); then
+        if [[ "$_lane_mode" == "direct" ]]; then
             DIRECT_LANES+=("$lane_id")
             DIRECT_R1+=("$r1_key")
             DIRECT_R2+=("$r2_key")
@@ -1095,12 +1263,56 @@ process_fastq_bash() {
             SPLIT_R1+=("$r1_key")
             SPLIT_R2+=("$r2_key")
             SPLIT_BASE+=("$base")
+            SPLIT_SCHEDULE+=("${PF_PLAN_SCHEDULE[$base]:-}")
         fi
     done
 
+    publish_direct_pairs_pooled() {
+        # Same publication order as below: every FASTQ object lands before
+        # any manifest that names it, but all uploads share one connection pool.
+        local i lane base_path base_folder direct_r1 direct_r2 r1_s3 r2_s3
+        local fastq_jobs manifest_jobs input_file rc=0
+        fastq_jobs=$(mktemp /tmp/direct_fastq_jobs.XXXXXX)
+        manifest_jobs=$(mktemp /tmp/direct_manifest_jobs.XXXXXX)
+        for i in "${!DIRECT_LANES[@]}"; do
+            lane="${DIRECT_LANES[$i]}"
+            base_path="${DIRECT_BASE[$i]}"
+            base_folder=$(dirname "$base_path")
+            [[ "$base_folder" == "." ]] && base_folder=""
+            direct_r1="${DIRECT_R1[$i]}"
+            direct_r2="${DIRECT_R2[$i]}"
+            if (( local_fastq_mode == 1 )); then
+                r1_s3="s3://${INPUT_FASTQ_BUCKET}/${base_path}_R1_001.fastq.gz"
+                r2_s3="s3://${INPUT_FASTQ_BUCKET}/${base_path}_R2_001.fastq.gz"
+                printf '%s\t%s\n%s\t%s\n' "$direct_r1" "$r1_s3" "$direct_r2" "$r2_s3" >> "$fastq_jobs"
+            else
+                r1_s3="s3://${INPUT_FASTQ_BUCKET}/${direct_r1}"
+                r2_s3="s3://${INPUT_FASTQ_BUCKET}/${direct_r2}"
+            fi
+            input_file="/tmp/${lane}_p0_input.txt"
+            printf '%s\n%s\n' "$r1_s3" "$r2_s3" > "$input_file"
+            printf '%s\ts3://%s/%s\n' "$input_file" "$INPUT_TXT_BUCKET" \
+                "$(input_txt_s3_key "$lane" "$base_folder")" >> "$manifest_jobs"
+        done
+        if [[ -s "$fastq_jobs" ]] && ! s3_upload_batch "$fastq_jobs"; then
+            rc=1
+        elif ! s3_upload_batch "$manifest_jobs"; then
+            rc=1
+        else
+            log_info "Uploaded input.txt for ${#DIRECT_LANES[@]} direct pair(s)"
+        fi
+        cut -f1 "$manifest_jobs" | xargs -r rm -f
+        rm -f "$fastq_jobs" "$manifest_jobs"
+        return "$rc"
+    }
+
     publish_direct_pairs() {
         local i lane base_path base_folder direct_r1 direct_r2 r1_s3 r2_s3
         local r1_object r2_object r1_upload_pid r2_upload_pid
+        if s3_upload_service_available; then
+            publish_direct_pairs_pooled
+            return
+        fi
         for i in "${!DIRECT_LANES[@]}"; do
             lane="${DIRECT_LANES[$i]}"
             base_path="${DIRECT_BASE[$i]}"
@@ -1131,129 +1343,123 @@ process_fastq_bash() {
 
     local DIRECT_PUBLISH_PID=""
 
-    if [[ ${#SPLIT_LANES[@]} -gt 0 ]]; then
-        # Apportion CPUs across the compressed files that actually require
-        # splitting. More files than cores means one gzip worker per file.
-        # Otherwise divide CPUs evenly and cap rapidgzip at its measured sweet
-        # spot of eight threads per file.
-        local _cores _split_file_count
-        _cores=$(nproc 2>/dev/null || echo 4)
-        _split_file_count=$(( ${#SPLIT_LANES[@]} * 2 ))
-        DECOMP_THREADS=1
-        FASTQ_DECOMPRESSOR=gzip
-        if [[ "$USE_RAPIDGZIP" != "0" ]] && (( _split_file_count < _cores )); then
-            DECOMP_THREADS=$(( _cores / _split_file_count ))
-            (( DECOMP_THREADS > 8 )) && DECOMP_THREADS=8
-            if (( DECOMP_THREADS > 1 )) && command -v rapidgzip >/dev/null 2>&1; then
-                FASTQ_DECOMPRESSOR=rapidgzip
-            else
-                DECOMP_THREADS=1
-            fi
+    if [[ ${#SPLIT_LANES[@]} -gt 0 && "$LAMBDA_SPLITTER" == "1" ]] && (( local_fastq_mode == 0 )); then
+        # Each lane becomes a <base>_split.txt manifest; map.py inflates the
+        # pair inside a Lambda, uploads the shards and publishes their
+        # <lane>_p<N>_input.txt manifests, so the driver only waits for the
+        # <lane>_split.done.json documents (and their continuations), or a
+        # <lane>_split.failed.json one.
+        local i _split_manifest
+        for i in "${!SPLIT_LANES[@]}"; do
+            _split_manifest="$RUN_DIR/${SPLIT_LANES[$i]}_split.txt"
+            printf '# split pairs=%s\ns3://%s/%s\ns3://%s/%s\n' "$READ_PAIRS_PER_SHARD" \
+                "$INPUT_FASTQ_BUCKET" "${SPLIT_R1[$i]}" "$INPUT_FASTQ_BUCKET" "${SPLIT_R2[$i]}" \
+                > "$_split_manifest"
+            aws s3 cp "$_split_manifest" "s3://${INPUT_TXT_BUCKET}/${SPLIT_BASE[$i]}_split.txt" \
+                --region "$AWS_REGION" --only-show-errors || die "Failed to publish ${SPLIT_LANES[$i]}_split.txt"
+        done
+        log_info "Published ${#SPLIT_LANES[@]} split manifest(s) for the Lambda splitter"
+        if [[ ${#DIRECT_LANES[@]} -gt 0 ]]; then
+            publish_direct_pairs &
+            DIRECT_PUBLISH_PID=$!
         fi
-        export DECOMP_THREADS FASTQ_DECOMPRESSOR
-        local _max_lanes=$(( _cores / (DECOMP_THREADS * 2) ))
-        (( _max_lanes < 1 )) && _max_lanes=1
 
-        local _decompressor_description="$FASTQ_DECOMPRESSOR"
-        [[ "$FASTQ_DECOMPRESSOR" == "rapidgzip" ]] && \
-            _decompressor_description="rapidgzip -P $DECOMP_THREADS"
-        if (( local_fastq_mode == 1 )); then
-            log_info "Splitting ${#SPLIT_LANES[@]} lane pair(s), ${_max_lanes} at a time from NVMe with $_decompressor_description per file"
-        else
-            log_info "Splitting ${#SPLIT_LANES[@]} lane pair(s), ${_max_lanes} at a time after S3 download with $_decompressor_description per file"
+        local _split_folder _split_doc _split_started=$SECONDS
+        for i in "${!SPLIT_LANES[@]}"; do
+            _split_folder="${SPLIT_LANES[$i]}_split"
+            while true; do
+                if _split_doc=$(aws s3 cp "s3://${OUTPUT_MAP_BUCKET}/${S3_CLAIM_PREFIX}/${_split_folder}.done.json" - \
+                        --region "$AWS_REGION" 2>/dev/null); then
+                    mapfile -t -O "${#INPUT_FOLDERS[@]}" INPUT_FOLDERS < <(jq -r '.folders[]' <<< "$_split_doc")
+                    log_info "  $_split_folder: $(jq -r '.shards' <<< "$_split_doc") shard pair(s)"
+                    [[ "$(jq -r '.complete' <<< "$_split_doc")" == "true" ]] && break
+                    _split_folder=$(basename "$(jq -r '.continued_by' <<< "$_split_doc")" .txt)
+                    continue
+                fi
+                # A retryable failure may still be retried by Lambda (two async
+                # retries, minutes apart); give up once none can be running.
+                if _split_doc=$(aws s3 cp "s3://${OUTPUT_MAP_BUCKET}/${S3_CLAIM_PREFIX}/${_split_folder}.failed.json" - \
+                        --region "$AWS_REGION" 2>/dev/null); then
+                    if [[ "$(jq -r '.retryable' <<< "$_split_doc")" != "true" ]] || \
+                            (( $(date +%s) - $(jq -r '.failed_epoch' <<< "$_split_doc") > LAMBDA_TIMEOUT_SEC + 300 )); then
+                        die "Lambda splitter failed on ${SPLIT_LANES[$i]} ($_split_folder): $(jq -r '.error' <<< "$_split_doc")"
+                    fi
+                fi
+                (( SECONDS - _split_started <= PROCESS_FASTQ_TIMEOUT_SEC )) || \
+                    die "Timeout waiting for the Lambda splitter on ${SPLIT_LANES[$i]} ($_split_folder)"
+                sleep "$POLL_INTERVAL_SECONDS"
+            done
+        done
+    elif [[ ${#SPLIT_LANES[@]} -gt 0 ]]; then
+        # split_scheduler.py admits lanes against the driver's cores, NVMe
+        # staging bytes and uplink, sizes each gzip's threads by its share of
+        # the lane's bytes, and hands an R1 stream's cores to its R2 sibling
+        # when R1 drains first. Each stream gets the fastest installed
+        # decompressor for its cores (decompressors.py); hosts without a
+        # parallel inflater get one core per file.
+        local _cores
+        _cores=$(nproc 2>/dev/null || echo 4)
+        FASTQ_DECOMPRESSOR=auto
+        local -a _scheduler_args=(--cores "$_cores" --max-threads-per-file 1)
+        if [[ "$USE_RAPIDGZIP" == "0" ]]; then
+            FASTQ_DECOMPRESSOR=gzip
+            _scheduler_args+=(--decompressors gzip)
+        elif command -v rapidgzip >/dev/null 2>&1; then
+            _scheduler_args=(--cores "$_cores")
+        fi
+        if [[ "$DECOMP_CALIBRATION" == "0" ]]; then
+            _scheduler_args+=(--calibration /dev/null)
+        elif [[ "$DECOMP_CALIBRATION" == "1" && "$USE_RAPIDGZIP" != "0" ]] && (( local_fastq_mode == 1 )); then
+            local _sample="" _sample_bytes=0 _base
+            for i in "${!SPLIT_LANES[@]}"; do
+                _base="${SPLIT_BASE[$i]}"
+                if (( ${PF_R2_BYTES[$_base]:-0} > _sample_bytes )); then
+                    _sample="${SPLIT_R2[$i]}"; _sample_bytes=${PF_R2_BYTES[$_base]}
+                fi
+            done
+            log_info "Calibrating decompressors on $(basename "$_sample")"
+            python3 /home/ubuntu/scrna-repo/scripts/decompressors.py calibrate "$_sample" \
+                || log_warn "Decompressor calibration failed; using the built-in preference"
         fi
+        export FASTQ_DECOMPRESSOR SHARD_ENGINE SHARD_CODEC
 
         local parts_dir="$RUN_DIR/split_parts"
         rm -rf "$parts_dir"; mkdir -p "$parts_dir"
         local split_timings_dir="$RUN_DIR/split_timings"
         mkdir -p "$split_timings_dir"
-
-        local -a split_pids=()
-        local i _rc=0 _finished_pid _pid
-        local _core_release_dir="" _core_release_fifo="" _core_release_fd=""
-        local _available_cores="$_cores" _pair_core_cost=$((DECOMP_THREADS * 2))
-        reap_one_split_pair() {
-            local _wait_rc=0
-            local -a _remaining=()
-            _finished_pid=""
-            wait -n -p _finished_pid "${split_pids[@]}" || _wait_rc=$?
-            (( _wait_rc == 0 )) || _rc=1
-            [[ -n "$_finished_pid" ]] || die "Could not identify completed split-pair worker"
-            for _pid in "${split_pids[@]}"; do
-                [[ "$_pid" == "$_finished_pid" ]] || _remaining+=("$_pid")
+        local split_jobs_file="$RUN_DIR/split_jobs.tsv"
+        local i _rc=0 _split_base
+        {
+            printf 'lane\tbase\tr1\tr2\tr1_bytes\tr2_bytes\tschedule\n'
+            for i in "${!SPLIT_LANES[@]}"; do
+                _split_base="${SPLIT_BASE[$i]}"
+                printf '%s\t%s\t%s\t%s\t%s\t%s\t%s\n' "${SPLIT_LANES[$i]}" "$_split_base" \
+                    "${SPLIT_R1[$i]}" "${SPLIT_R2[$i]}" "${PF_R1_BYTES[$_split_base]}" \
+                    "${PF_R2_BYTES[$_split_base]}" "${SPLIT_SCHEDULE[$i]}"
             done
-            split_pids=("${_remaining[@]}")
-        }
-
-        # NVMe workers can return the R1 and R2 allocations independently.
-        # The next pair starts as soon as any two complete streams have freed
-        # enough cores; the streams need not belong to the same prior pair.
-        if (( local_fastq_mode == 1 )); then
-            _core_release_dir=$(mktemp -d "$RUN_DIR/core_release.XXXXXX")
-            _core_release_fifo="$_core_release_dir/releases.fifo"
-            mkfifo "$_core_release_fifo"
-            exec {_core_release_fd}<>"$_core_release_fifo"
-        fi
+        } > "$split_jobs_file"
 
-        for i in "${!SPLIT_LANES[@]}"; do
-            if (( local_fastq_mode == 1 )); then
-                while (( _available_cores < _pair_core_cost )); do
-                    local _released_cores
-                    IFS= read -r _released_cores <&"$_core_release_fd" || \
-                        die "Core-release scheduler pipe closed unexpectedly"
-                    [[ "$_released_cores" =~ ^[1-9][0-9]*$ ]] || \
-                        die "Invalid core-release notification: $_released_cores"
-                    _available_cores=$((_available_cores + _released_cores))
-                done
-                _available_cores=$((_available_cores - _pair_core_cost))
-            else
-                while (( ${#split_pids[@]} >= _max_lanes )); do
-                    reap_one_split_pair
-                done
-            fi
-            (
-                if (( local_fastq_mode == 1 )); then
-                    CORE_RELEASE_FIFO="$_core_release_fifo" \
-                    SPLIT_TIMINGS_FILE="$split_timings_dir/${SPLIT_LANES[$i]}.csv" \
-                    bash /home/ubuntu/scrna-repo/scripts/split_upload_trigger_local.sh \
-                        "$INPUT_FASTQ_BUCKET" "${SPLIT_R1[$i]}" "${SPLIT_R2[$i]}" \
-                        "${SPLIT_BASE[$i]}" "$INPUT_TXT_BUCKET" "$SPLIT_LINES" \
-                        > "$parts_dir/${SPLIT_LANES[$i]}.log" 2>&1
-                else
-                    SPLIT_TIMINGS_FILE="$split_timings_dir/${SPLIT_LANES[$i]}.csv" \
-                    bash /home/ubuntu/scrna-repo/split_and_upload.sh \
-                        "$INPUT_FASTQ_BUCKET" "${SPLIT_R1[$i]}" "${SPLIT_R2[$i]}" \
-                        "${SPLIT_BASE[$i]}" "$INPUT_TXT_BUCKET" \
-                        > "$parts_dir/${SPLIT_LANES[$i]}.log" 2>&1
-                fi
-                _split_rc=$?
-                tail -1 "$parts_dir/${SPLIT_LANES[$i]}.log" \
-                    > "$parts_dir/${SPLIT_LANES[$i]}.parts"
-                exit "$_split_rc"
-            ) &
-            split_pids+=("$!")
-            # Start direct-pass pairs only after the first full batch of the
-            # largest split jobs has claimed the decompression cores. Direct
-            # pairs use Lambda/S3 capacity and can overlap without displacing
-            # those larger local jobs.
-            if [[ -z "$DIRECT_PUBLISH_PID" && ${#DIRECT_LANES[@]} -gt 0 ]] && \
-               (( ${#split_pids[@]} >= _max_lanes || i == ${#SPLIT_LANES[@]} - 1 )); then
-                publish_direct_pairs &
-                DIRECT_PUBLISH_PID=$!
-            fi
-        done
+        local -a _worker=()
         if (( local_fastq_mode == 1 )); then
-            for _pid in "${split_pids[@]}"; do
-                wait "$_pid" || _rc=1
-            done
-            exec {_core_release_fd}>&-
-            rm -f -- "$_core_release_fifo"
-            rmdir -- "$_core_release_dir"
+            _worker=(bash /home/ubuntu/scrna-repo/scripts/split_upload_trigger_local.sh)
+            log_info "Scheduling ${#SPLIT_LANES[@]} split lane pair(s) from NVMe with $FASTQ_DECOMPRESSOR"
         else
-            while (( ${#split_pids[@]} > 0 )); do
-                reap_one_split_pair
-            done
-        fi
+            _worker=(bash /home/ubuntu/scrna-repo/split_and_upload.sh)
+            _scheduler_args+=(--staged-input)
+            log_info "Scheduling ${#SPLIT_LANES[@]} split lane pair(s) after S3 download with $FASTQ_DECOMPRESSOR"
+        fi
+        python3 /home/ubuntu/scrna-repo/scripts/split_scheduler.py "$split_jobs_file" \
+            --parts-dir "$parts_dir" --timings-dir "$split_timings_dir" \
+            "${_scheduler_args[@]}" -- "${_worker[@]}" \
+            "$INPUT_FASTQ_BUCKET" "{r1}" "{r2}" "{base}" "$INPUT_TXT_BUCKET" "$SPLIT_LINES" &
+        local _scheduler_pid=$!
+        # Direct pairs use Lambda/S3 capacity rather than driver cores, so
+        # they are published while the scheduler runs the split lanes.
+        if [[ ${#DIRECT_LANES[@]} -gt 0 ]]; then
+            publish_direct_pairs &
+            DIRECT_PUBLISH_PID=$!
+        fi
+        wait "$_scheduler_pid" || _rc=1
         [[ $_rc -eq 0 ]] || die "split_and_upload.sh failed for one or more lanes"
 
         for i in "${!SPLIT_LANES[@]}"; do
@@ -1312,6 +1518,24 @@ process_fastq_bash() {
     last_progress_ts="$poll_start"
     stall_limit=$(( LAMBDA_TIMEOUT_SEC + 180 ))
 
+    # With a completion channel the tracker keeps an inventory of finished
+    # shards up to date; the loop reads it instead of listing the bucket.
+    local tracker_inventory="" tracker_pid="" poll_sleep="$POLL_INTERVAL_SECONDS"
+    if [[ -n "$COMPLETION_CHANNEL" ]]; then
+        tracker_inventory="$RUN_DIR/completion-inventory.tsv"
+        rm -f -- "$tracker_inventory"
+        python3 /home/ubuntu/scrna-repo/scripts/completion_tracker.py follow \
+            --output-bucket "$OUTPUT_MAP_BUCKET" --expected-folders "$expected_folders_file" \
+            --inventory "$tracker_inventory" --stats "$RUN_DIR/completion-tracker.json" \
+            --channel "$COMPLETION_CHANNEL" --region "$AWS_REGION" --not-before "$MAP_POLL_SINCE" \
+            --fallback-seconds "$((POLL_INTERVAL_SECONDS * 6))" \
+            --timeout-seconds "$PROCESS_FASTQ_TIMEOUT_SEC" \
+            2> "$RUN_DIR/completion-tracker.log" &
+        tracker_pid=$!
+        poll_sleep=0.2
+        log_info "Following shard completions on $COMPLETION_CHANNEL"
+    fi
+
     while true; do
         local completed=0
         local -a _have=()
@@ -1319,10 +1543,22 @@ process_fastq_bash() {
         # Filter on age in the shell rather than in JMESPath: comparing a
         # timestamp against a string literal there needs nested quoting that
         # does not survive being shipped through SSM.
-        _keys=$(aws s3api list-objects-v2 --bucket "$OUTPUT_MAP_BUCKET" --prefix "piscem_output/" \
-                    --query "Contents[?ends_with(Key,'/output.txt')].[Key,to_string(LastModified)]" \
-                    --output text --region "$AWS_REGION" 2>/dev/null \
-                | awk -v since="$MAP_POLL_SINCE" '$2 >= since {print $1}' || echo "")
+        if [[ -n "$tracker_pid" ]] && ! kill -0 "$tracker_pid" 2>/dev/null; then
+            if ! wait "$tracker_pid"; then
+                log_warn "Completion tracker failed (see $RUN_DIR/completion-tracker.log); listing the bucket instead"
+                tracker_inventory=""
+                poll_sleep="$POLL_INTERVAL_SECONDS"
+            fi
+            tracker_pid=""
+        fi
+        if [[ -n "$tracker_inventory" ]]; then
+            _keys=$(awk -F '\t' '$1 ~ /\/output\.txt$/ {print $1}' "$tracker_inventory" 2>/dev/null || echo "")
+        else
+            _keys=$(aws s3api list-objects-v2 --bucket "$OUTPUT_MAP_BUCKET" --prefix "piscem_output/" \
+                        --query "Contents[?ends_with(Key,'/output.txt')].[Key,to_string(LastModified)]" \
+                        --output text --region "$AWS_REGION" 2>/dev/null \
+                    | awk -v since="$MAP_POLL_SINCE" '$2 >= since {print $1}' || echo "")
+        fi
 
         if [[ -n "$_keys" && "$_keys" != "None" ]]; then
             local _k
@@ -1340,7 +1576,8 @@ process_fastq_bash() {
             done
         fi
 
-        log_info "Output progress: $completed / $input_count"
+        [[ -n "$tracker_inventory" && $completed -eq $last_completed && $completed -lt $input_count ]] || \
+            log_info "Output progress: $completed / $input_count"
 
         if [[ $completed -gt $last_completed ]]; then
             last_completed=$completed
@@ -1391,8 +1628,12 @@ process_fastq_bash() {
                 die "No Lambda outputs after $((elapsed/60))m (2x timeout). Lambda processing appears to have failed."
             fi
         fi
-        sleep "$POLL_INTERVAL_SECONDS"
+        sleep "$poll_sleep"
     done
+    if [[ -n "$tracker_pid" ]]; then
+        kill "$tracker_pid" 2>/dev/null || true
+        wait "$tracker_pid" 2>/dev/null || true
+    fi
 
     phase_end
 
@@ -1515,7 +1756,15 @@ ssm_run_pipeline() {
         --arg read_pairs_per_shard "$READ_PAIRS_PER_SHARD" \
         --arg split_lines "$SPLIT_LINES" \
         --arg direct_gzip_max_bytes "$DIRECT_GZIP_MAX_BYTES" \
+        --arg shard_planner "$SHARD_PLANNER" \
+        --arg shard_cache_uri "$SHARD_CACHE_URI" \
+        --arg decomp_calibration "$DECOMP_CALIBRATION" \
+        --arg shard_batch_shards "$SHARD_BATCH_SHARDS" \
+        --arg lambda_splitter "$LAMBDA_SPLITTER" \
         --arg use_rapidgzip "${USE_RAPIDGZIP:-auto}" \
+        --arg shard_engine "$SHARD_ENGINE" \
+        --arg shard_codec "$SHARD_CODEC" \
+        --arg gzip_inflate "$FASTQ_GZIP_INFLATE" \
         --arg execution_mode "$EXECUTION_MODE" \
         --arg concurrency "${LAMBDA_CONCURRENCY:-0}" \
         --arg ko_cache "${KO_FASTQ_CACHE_BUCKET:-}" \
@@ -1547,7 +1796,15 @@ ssm_run_pipeline() {
             ("export READ_PAIRS_PER_SHARD=" + $read_pairs_per_shard),
             ("export SPLIT_LINES=" + $split_lines),
             ("export DIRECT_GZIP_MAX_BYTES=" + $direct_gzip_max_bytes),
+            ("export SHARD_PLANNER=" + $shard_planner),
+            ("export SHARD_CACHE_URI=" + $shard_cache_uri),
+            ("export DECOMP_CALIBRATION=" + $decomp_calibration),
+            ("export SHARD_BATCH_SHARDS=" + $shard_batch_shards),
+            ("export LAMBDA_SPLITTER=" + $lambda_splitter),
             ("export USE_RAPIDGZIP=" + $use_rapidgzip),
+            ("export SHARD_ENGINE=" + $shard_engine),
+            ("export SHARD_CODEC=" + $shard_codec),
+            ("export FASTQ_GZIP_INFLATE=" + $gzip_inflate),
             ("export EXECUTION_MODE=" + $execution_mode),
             ("export KO_FASTQ_CACHE_BUCKET=" + $ko_cache),
             ("cd /home/" + $user + "/scrna-repo"),
@@ -1661,8 +1918,29 @@ fi
     die "CLAIM_HEARTBEAT_SECONDS must be less than CLAIM_LEASE_SECONDS"
 [[ "$USE_RAPIDGZIP" == "auto" || "$USE_RAPIDGZIP" == "0" || "$USE_RAPIDGZIP" == "1" ]] || \
     die "USE_RAPIDGZIP must be auto, 0, or 1"
+[[ "$SHARD_CODEC" == "none" || "$SHARD_CODEC" == "gzip" || "$SHARD_CODEC" == "auto" ]] || \
+    die "SHARD_CODEC must be none, gzip, or auto"
+[[ "$FASTQ_GZIP_INFLATE" =~ ^(piscem|writer|parallel)$ ]] || \
+    die "FASTQ_GZIP_INFLATE must be piscem, writer, or parallel"
+[[ "$FIFO_RANGE_CONCURRENCY" =~ ^[1-9][0-9]*$ && "$FIFO_RANGE_MIB" =~ ^[1-9][0-9]*$ ]] || \
+    die "FIFO_RANGE_CONCURRENCY and FIFO_RANGE_MIB must be positive integers"
+[[ "$RAD_UPLOAD_PART_MIB" =~ ^[0-9]+$ ]] || die "RAD_UPLOAD_PART_MIB must be a non-negative integer"
+[[ "$RAD_FRAME_CODEC" =~ ^(none|zstd|deflate)$ ]] || die "RAD_FRAME_CODEC must be none, zstd, or deflate"
+[[ "$RAD_FRAME_MIB" =~ ^[1-9][0-9]*$ ]] || die "RAD_FRAME_MIB must be a positive integer"
+[[ "$BARCODE_HISTOGRAM" == "0" || "$BARCODE_HISTOGRAM" == "1" ]] || die "BARCODE_HISTOGRAM must be 0 or 1"
+[[ -z "$COMPLETION_CHANNEL" || "$COMPLETION_CHANNEL" =~ ^https://sqs\.[a-z0-9-]+\.amazonaws\.com/[0-9]+/.+ ]] || \
+    die "COMPLETION_CHANNEL must be an SQS queue URL"
+[[ "$RESOURCE_SAMPLE_SECONDS" =~ ^[0-9]+([.][0-9]+)?$ ]] || \
+    die "RESOURCE_SAMPLE_SECONDS must be a non-negative number"
+[[ "$RESOURCE_TIMESERIES" == "0" || "$RESOURCE_TIMESERIES" == "1" ]] || die "RESOURCE_TIMESERIES must be 0 or 1"
 [[ "$DIRECT_GZIP_MAX_BYTES" =~ ^[1-9][0-9]*$ ]] || \
     die "DIRECT_GZIP_MAX_BYTES must be a positive integer"
+[[ "$SHARD_PLANNER" == "0" || "$SHARD_PLANNER" == "1" ]] || die "SHARD_PLANNER must be 0 or 1"
+[[ -z "$SHARD_CACHE_URI" || "$SHARD_CACHE_URI" == s3://?* ]] || \
+    die "SHARD_CACHE_URI must be an s3:// URI"
+[[ "$DECOMP_CALIBRATION" =~ ^(auto|0|1)$ ]] || die "DECOMP_CALIBRATION must be auto, 0, or 1"
+[[ "$SHARD_BATCH_SHARDS" =~ ^[1-9][0-9]*$ ]] || die "SHARD_BATCH_SHARDS must be a positive integer"
+[[ "$LAMBDA_SPLITTER" == "0" || "$LAMBDA_SPLITTER" == "1" ]] || die "LAMBDA_SPLITTER must be 0 or 1"
 if [[ -n "$READ_PAIRS_PER_SHARD" ]]; then
     [[ "$READ_PAIRS_PER_SHARD" =~ ^[1-9][0-9]*$ ]] || \
         die "READ_PAIRS_PER_SHARD must be a positive integer"
@@ -2626,7 +2904,15 @@ export RUN_QC=$RUN_QC
 export READ_PAIRS_PER_SHARD=$READ_PAIRS_PER_SHARD
 export SPLIT_LINES=$SPLIT_LINES
 export DIRECT_GZIP_MAX_BYTES=$DIRECT_GZIP_MAX_BYTES
+export SHARD_PLANNER=$SHARD_PLANNER
+export SHARD_CACHE_URI=$SHARD_CACHE_URI
+export DECOMP_CALIBRATION=$DECOMP_CALIBRATION
+export SHARD_BATCH_SHARDS=$SHARD_BATCH_SHARDS
+export LAMBDA_SPLITTER=$LAMBDA_SPLITTER
 export USE_RAPIDGZIP=${USE_RAPIDGZIP:-auto}
+export SHARD_ENGINE=$SHARD_ENGINE
+export SHARD_CODEC=$SHARD_CODEC
+export FASTQ_GZIP_INFLATE=$FASTQ_GZIP_INFLATE
 export EXECUTION_MODE=$EXECUTION_MODE
 export KO_FASTQ_CACHE_BUCKET=${KO_FASTQ_CACHE_BUCKET:-}
 
@@ -3172,6 +3458,18 @@ log_info "Steps 5-6b complete"
 
 # 6c: Create Lambda execution role
 LAMBDA_ROLE_ARN=$(create_lambda_execution_role "$LAMBDA_EXECUTION_ROLE_NAME")
+if [[ -n "$COMPLETION_CHANNEL" ]]; then
+    # https://sqs.REGION.amazonaws.com/ACCOUNT/NAME -> arn:aws:sqs:REGION:ACCOUNT:NAME
+    _queue_path="${COMPLETION_CHANNEL#https://sqs.}"
+    _queue_region="${_queue_path%%.*}"
+    _queue_path="${_queue_path#*/}"
+    _queue_arn="arn:aws:sqs:${_queue_region}:${_queue_path%%/*}:${_queue_path#*/}"
+    aws iam put-role-policy --role-name "$LAMBDA_EXECUTION_ROLE_NAME" \
+        --policy-name completion-channel \
+        --policy-document "{\"Version\":\"2012-10-17\",\"Statement\":[{\"Effect\":\"Allow\",\"Action\":\"sqs:SendMessage\",\"Resource\":\"${_queue_arn}\"}]}" \
+        || die "Could not allow $LAMBDA_EXECUTION_ROLE_NAME to send to $_queue_arn"
+    log_info "Lambda role may send completion events to $_queue_arn"
+fi
 
 # Wait for IAM role propagation (IAM is eventually consistent)
 log_info "Waiting 15s for IAM role propagation..."
@@ -3311,6 +3609,11 @@ S3_CLAIM_PREFIX=$S3_CLAIM_PREFIX
 READ_PAIRS_PER_SHARD=$READ_PAIRS_PER_SHARD
 SPLIT_LINES=$SPLIT_LINES
 DIRECT_GZIP_MAX_BYTES=$DIRECT_GZIP_MAX_BYTES
+SHARD_PLANNER=$SHARD_PLANNER
+SHARD_CACHE_URI=$SHARD_CACHE_URI
+DECOMP_CALIBRATION=$DECOMP_CALIBRATION
+SHARD_BATCH_SHARDS=$SHARD_BATCH_SHARDS
+LAMBDA_SPLITTER=$LAMBDA_SPLITTER
 EXPECTED_FOLDERS_FILE=$EXPECTED_RAD_FOLDERS
 NOT_BEFORE=$(<"${EXPECTED_RAD_FOLDERS}.not-before")
 SUBMITTED_AT=$ASYNC_SUBMITTED_AT
@@ -3356,6 +3659,17 @@ log_info "Running combine scripts..."
 COMBINED_DIR="$RUN_DIR/combined"
 mkdir -p "$COMBINED_DIR"
 
+BARCODE_MERGE_PID=""
+if [[ "$BARCODE_HISTOGRAM" == "1" ]]; then
+    # Only the small per-shard sidecars are read, so the barcode frequency
+    # table and knee are ready while the materializer assembles map.rad.
+    python3 /home/ubuntu/scrna-repo/scripts/merge_barcode_histograms.py "$OUTPUT_DIR/piscem_output" \
+        --expected-folders "$EXPECTED_RAD_FOLDERS" \
+        --output-dir "$RUN_DIR/barcode_histogram" \
+        > "$RUN_DIR/barcode_histogram.log" 2>&1 &
+    BARCODE_MERGE_PID=$!
+fi
+
 phase_begin "Parallel S3 .rad materializer [on-server]" 7
 bash /home/ubuntu/scrna-repo/scripts/synchronous_s3_rad_materialize.sh \
     --output-bucket "$OUTPUT_MAP_BUCKET" \
@@ -3368,6 +3682,14 @@ bash /home/ubuntu/scrna-repo/scripts/synchronous_s3_rad_materialize.sh \
     --timings-file "$RUN_DIR/rad_materializer_timings.csv"
 phase_end
 
+if [[ -n "$BARCODE_MERGE_PID" ]]; then
+    if wait "$BARCODE_MERGE_PID"; then
+        log_info "Barcode histogram: $(tail -n 1 "$RUN_DIR/barcode_histogram.log")"
+    else
+        log_warn "Barcode histogram merge failed; see $RUN_DIR/barcode_histogram.log"
+    fi
+fi
+
 phase_begin "Concatenate unmapped_bc_count.bin [on-server]" 7
 bash /home/ubuntu/scrna-repo/combine_unmapped_bc_count_bin.sh "$OUTPUT_DIR" "$COMBINED_DIR"
 phase_end
@@ -3503,6 +3825,11 @@ CLAIM_HEARTBEAT_SECONDS=$CLAIM_HEARTBEAT_SECONDS
 READ_PAIRS_PER_SHARD=$READ_PAIRS_PER_SHARD
 SPLIT_LINES=$SPLIT_LINES
 DIRECT_GZIP_MAX_BYTES=$DIRECT_GZIP_MAX_BYTES
+SHARD_PLANNER=$SHARD_PLANNER
+SHARD_CACHE_URI=$SHARD_CACHE_URI
+DECOMP_CALIBRATION=$DECOMP_CALIBRATION
+SHARD_BATCH_SHARDS=$SHARD_BATCH_SHARDS
+LAMBDA_SPLITTER=$LAMBDA_SPLITTER
 ALLOW_DESTRUCTIVE_CLEANUP=$ALLOW_DESTRUCTIVE_CLEANUP
 ALLOW_S3_DELETE=$ALLOW_S3_DELETE
 CLEANUP_AWS=$CLEANUP_AWS
@@ -0,0 +1,1049 @@
+#!/usr/bin/env python3
+"""Stream one R1/R2 gzip pair into record-aligned FASTQ shards and publish them.
+
+Both mates are decompressed by child processes and cut in lockstep on FASTQ
+record boundaries. Each completed shard pair stays in memory and is handed to
+the uploader through a bounded queue, so nothing is written to NVMe and no
+filesystem polling decides when a pair is complete. A pair's ``_input.txt``
+manifest is published only after both of its FASTQ objects exist in S3.
+
+Shards can optionally be recompressed as concatenated gzip members, each
+member compressed independently on a thread pool. ``--shard-codec auto`` makes
+that choice once per lane from the idle cores measured while the first pair
+was cut and from the lane's share of the uplink.
+
+``--shard-schedule`` (``SHARD_SCHEDULE``) gives read pairs per shard by shard
+index, as written by ``plan_shards.py``; shards past its end repeat its last
+size. Without it every shard has ``split_lines`` lines.
+
+With ``SHARD_CACHE_URI`` the shards go to the cross-run cache described in
+``shard_cache.py``, and its index is written once every pair has landed.
+
+With ``SHARD_BATCH_SHARDS`` above 1, landed pairs are collected into batch
+manifests (``<lane>_b<first index>_input.txt``) that one Lambda invocation
+maps back to back. Each shard keeps its own output folder. A batch is
+published when it is full or when ``plan_shards.batch_fits`` predicts that one
+more shard would overrun the Lambda timeout. The rest are published when the
+lane ends.
+
+The command line mirrors ``split_upload_trigger_local.sh`` and prints the shard
+pair count as the final stdout line.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import BinaryIO, Iterator, Sequence
+
+import boto3
+
+from decompressors import BACKENDS, resolve_backend
+from lambda_dispatch import audit_key, inline_manifest_event, invoke_async, spool_invocation
+from s3_upload_service import UploadService
+from shard_cache import CachedPair, ShardCache, cache_key, source_fingerprint
+from shard_sizing import (
+    DEFAULT_QUEUE_DEPTH,
+    DEFAULT_SPLIT_LINES,
+    DEFAULT_UPLOAD_WINDOW_MAX,
+    MEMORY_BUDGET_FRACTION,
+    available_memory_bytes,
+    detect_uplink_gbps,
+    fit_memory,
+    format_shard_schedule,
+    lane_memory_bytes,
+    parse_shard_schedule,
+    schedule_lines,
+    shard_pair_bytes,
+)
+
+
+READ_BLOCK_BYTES = 8 * 1024 * 1024
+DECOMPRESSORS = (*BACKENDS, "auto")
+SHARD_CODECS = ("none", "gzip", "auto")
+GZIP_MEMBER_BYTES = 4 * 1024 * 1024
+GZIP_LEVEL = 1
+CODEC_PROBE_BYTES = 8 * 1024 * 1024
+
+
+class ShardPairingError(ValueError):
+    """R1 and R2 streams disagree on record count or mate identity."""
+
+
+@dataclass(frozen=True)
+class FastqShard:
+    payload: bytes
+    records: int
+    first_name: bytes
+    last_name: bytes
+
+
+@dataclass(frozen=True)
+class ShardPair:
+    index: int
+    r1: FastqShard
+    r2: FastqShard
+
+    @property
+    def records(self) -> int:
+        return self.r1.records
+
+
+def mate_name(header: bytes) -> bytes:
+    """Return the read identifier shared by both mates of a FASTQ header."""
+    if not header.startswith(b"@"):
+        raise ValueError(f"FASTQ header does not start with '@': {header[:80]!r}")
+    fields = header[1:].split(None, 1)
+    name = fields[0] if fields else b""
+    if name.endswith((b"/1", b"/2")):
+        name = name[:-2]
+    return name
+
+
+def last_record_header(payload: bytes) -> bytes:
+    """Return the header of the final four-line record in a shard payload."""
+    # Terminators of the quality, plus, sequence, and header lines, from the end.
+    ends = [len(payload) - 1]
+    for _ in range(3):
+        ends.append(payload.rfind(b"\n", 0, ends[-1]))
+    if payload[ends[2] + 1:ends[2] + 2] != b"+":
+        raise ValueError("FASTQ shard does not end on a four-line record boundary")
+    start = payload.rfind(b"\n", 0, ends[3]) + 1
+    return payload[start:ends[3]]
+
+
+class FastqShardReader:
+    """Cut one decompressed FASTQ byte stream into fixed-line shards."""
+
+    def __init__(self, stream: BinaryIO, lines_per_shard: int, label: str):
+        if lines_per_shard <= 0 or lines_per_shard % 4:
+            raise ValueError("lines_per_shard must be positive and divisible by four")
+        self.stream = stream
+        self.lines_per_shard = lines_per_shard
+        self.label = label
+        self.pending = b""
+        self.eof = False
+
+    def next_shard(self, lines_per_shard: int | None = None) -> FastqShard | None:
+        lines_per_shard = lines_per_shard or self.lines_per_shard
+        lines_needed = lines_per_shard
+        pieces: list[bytes] = []
+        while lines_needed:
+            block = self.pending
+            self.pending = b""
+            if not block:
+                if self.eof:
+                    break
+                block = self.stream.read(READ_BLOCK_BYTES)
+                if not block:
+                    self.eof = True
+                    break
+            newlines = block.count(b"\n")
+            if newlines < lines_needed:
+                pieces.append(block)
+                lines_needed -= newlines
+                continue
+            cut = -1
+            for _ in range(lines_needed):
+                cut = block.index(b"\n", cut + 1)
+            pieces.append(block[:cut + 1])
+            self.pending = block[cut + 1:]
+            lines_needed = 0
+
+        payload = b"".join(pieces)
+        if not payload:
+            return None
+        lines = lines_per_shard - lines_needed
+        if not payload.endswith(b"\n"):
+            payload += b"\n"
+            lines += 1
+        if lines % 4:
+            raise ValueError(
+                f"{self.label} ended inside a FASTQ record ({lines} lines in final shard)"
+            )
+        first_header = payload[:payload.index(b"\n")]
+        return FastqShard(
+            payload=payload,
+            records=lines // 4,
+            first_name=mate_name(first_header),
+            last_name=mate_name(last_record_header(payload)),
+        )
+
+
+def iter_shard_pairs(
+    r1_stream: BinaryIO,
+    r2_stream: BinaryIO,
+    lines_per_shard: int,
+    schedule: Sequence[int] = (),
+) -> Iterator[ShardPair]:
+    """Yield R1/R2 shards cut in lockstep and checked at both record boundaries."""
+    r1_reader = FastqShardReader(r1_stream, lines_per_shard, "R1")
+    r2_reader = FastqShardReader(r2_stream, lines_per_shard, "R2")
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="fastq-cut") as pool:
+        index = 0
+        while True:
+            lines = schedule_lines(schedule, index, lines_per_shard)
+            r1_future = pool.submit(r1_reader.next_shard, lines)
+            r2_future = pool.submit(r2_reader.next_shard, lines)
+            r1, r2 = r1_future.result(), r2_future.result()
+            if r1 is None and r2 is None:
+                return
+            if r1 is None or r2 is None or r1.records != r2.records:
+                raise ShardPairingError(
+                    f"R1/R2 record-count mismatch at p{index}: "
+                    f"R1={r1.records if r1 else 0} R2={r2.records if r2 else 0}"
+                )
+            if r1.first_name != r2.first_name or r1.last_name != r2.last_name:
+                raise ShardPairingError(
+                    f"R1/R2 mate names disagree at p{index}: "
+                    f"{r1.first_name!r}..{r1.last_name!r} vs "
+                    f"{r2.first_name!r}..{r2.last_name!r}"
+                )
+            yield ShardPair(index=index, r1=r1, r2=r2)
+            index += 1
+
+
+def decompressor_command(path: str | None, decompressor: str, threads: int) -> list[str]:
+    """Return the decompressor argv; with no ``path`` it reads stdin."""
+    return BACKENDS[decompressor].command(path, threads)
+
+
+def gzip_member(block: bytes, level: int = GZIP_LEVEL) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+
+def gzip_members(
+    payload: bytes,
+    pool: ThreadPoolExecutor | None = None,
+    level: int = GZIP_LEVEL,
+    member_bytes: int | None = None,
+) -> bytes:
+    """Gzip ``payload`` as independent members, compressed in parallel on ``pool``.
+
+    Concatenated members are one valid gzip stream to gzip, zlib and Piscem.
+    """
+    member_bytes = member_bytes or GZIP_MEMBER_BYTES
+    blocks = [payload[start:start + member_bytes] for start in range(0, len(payload), member_bytes)]
+    if pool is None:
+        return b"".join(gzip_member(block, level) for block in blocks)
+    return b"".join(pool.map(lambda block: gzip_member(block, level), blocks))
+
+
+def cpu_times() -> tuple[int, int] | None:
+    """Return cumulative (idle, total) jiffies from /proc/stat."""
+    try:
+        with open("/proc/stat") as stat:
+            fields = [int(value) for value in stat.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # idle + iowait count as headroom.
+    return fields[3] + fields[4], sum(fields)
+
+
+def idle_cores(before: tuple[int, int] | None, after: tuple[int, int] | None, cpus: int) -> float:
+    if before is None or after is None or after[1] <= before[1]:
+        return float(cpus)
+    return cpus * (after[0] - before[0]) / (after[1] - before[1])
+
+
+def choose_shard_codec(
+    ratio: float, core_bytes_per_second: float, cores: float, lane_gbps: float
+) -> str:
+    """Pick gzip when compressing, then sending fewer bytes, beats sending raw bytes.
+
+    Compression and upload overlap across pairs, so the slower of the two sets
+    the per-byte cost of the gzip path.
+    """
+    if lane_gbps <= 0 or core_bytes_per_second <= 0 or cores <= 0:
+        return "none"
+    network_bytes_per_second = lane_gbps * 1e9 / 8
+    raw_seconds = 1 / network_bytes_per_second
+    gzip_seconds = max(1 / (core_bytes_per_second * cores), ratio / network_bytes_per_second)
+    return "gzip" if gzip_seconds < raw_seconds else "none"
+
+
+def probe_gzip(sample: bytes, level: int = GZIP_LEVEL) -> tuple[float, float]:
+    """Return (compressed/raw ratio, single-core bytes per second) for ``sample``."""
+    start = time.perf_counter()
+    compressed = gzip_member(sample, level)
+    seconds = max(time.perf_counter() - start, 1e-9)
+    return len(compressed) / max(len(sample), 1), len(sample) / seconds
+
+
+class TimingLog:
+    """Append ``stage,seconds`` rows in the split scripts' CSV format."""
+
+    def __init__(self, path: str | None):
+        self.path = Path(path) if path else None
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, start_ns: int, end_ns: int) -> None:
+        seconds = f"{(end_ns - start_ns) / 1_000_000_000:.6f}"
+        print(f"TIMING {stage}={seconds}s", flush=True)
+        if self.path is None:
+            return
+        with self.lock:
+            if not self.path.is_file():
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.path.write_text("stage,seconds\n")
+            with self.path.open("a") as handle:
+                handle.write(f"{stage},{seconds}\n")
+
+
+class UploadWindow:
+    """Bound the shard pairs one lane has in flight to its share of the uplink.
+
+    After each pair lands, the limit becomes the number of pairs at the measured
+    per-pair throughput needed to fill ``lane_gbps``. While the link is not yet
+    saturated, each pair sees high throughput and the window stays small; once
+    pairs contend for the link the window settles where it is just full.
+    """
+
+    def __init__(self, lane_gbps: float, maximum: int, initial: int = 2):
+        if maximum <= 0:
+            raise ValueError("upload window maximum must be positive")
+        self.lane_gbps = lane_gbps
+        self.maximum = maximum
+        self.limit = max(1, min(initial, maximum))
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, payload_bytes: int = 0, seconds: float = 0.0) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            if self.lane_gbps > 0 and payload_bytes and seconds > 0:
+                pair_gbps = payload_bytes * 8 / seconds / 1e9
+                self.limit = max(
+                    1, min(self.maximum, math.ceil(self.lane_gbps / pair_gbps))
+                )
+            self.condition.notify_all()
+
+
+class ShardPublisher:
+    """Upload queued shard pairs, then publish each pair's Lambda manifest.
+
+    Several pairs may upload at once, bounded by ``window``. Each manifest is
+    still written only after both FASTQ objects of its own pair have landed.
+    With ``batch_shards`` above 1, landed pairs wait in ``batch`` until a batch
+    manifest is published for them (``flush_batch`` publishes the remainder).
+    """
+
+    def __init__(
+        self,
+        uploader,
+        fastq_bucket: str,
+        s3_base: str,
+        input_txt_bucket: str,
+        timings: TimingLog,
+        lambda_client=None,
+        async_function: str = "",
+        invoke_log_dir: str = "",
+        dispatch_spool: str = "",
+        window: UploadWindow | None = None,
+        codec: str = "none",
+        compress_pool: ThreadPoolExecutor | None = None,
+        shard_bucket: str = "",
+        shard_prefix: str = "",
+        batch_shards: int = 1,
+    ):
+        self.uploader = uploader
+        self.fastq_bucket = fastq_bucket
+        self.s3_base = s3_base
+        # A shard cache stores the FASTQ objects under its own prefix.
+        self.shard_bucket = shard_bucket or fastq_bucket
+        self.shard_prefix = shard_prefix
+        self.input_txt_bucket = input_txt_bucket
+        self.lane = os.path.basename(s3_base)
+        self.timings = timings
+        self.lambda_client = lambda_client
+        self.async_function = async_function
+        self.invoke_log_dir = invoke_log_dir
+        self.dispatch_spool = dispatch_spool
+        self.window = window or UploadWindow(lane_gbps=0, maximum=1)
+        self.codec = codec
+        self.compress_pool = compress_pool
+        self.lock = threading.Lock()
+        self.published = 0
+        self.shards: list[CachedPair] = []
+        self.batch_shards = batch_shards
+        self.batch: list[CachedPair] = []
+        self.batch_params = None
+        if batch_shards > 1:
+            from plan_shards import parameters_from_env
+
+            self.batch_params = replace(parameters_from_env(), batch_shards=batch_shards)
+        self.error: Exception | None = None
+        self.first_fastq_ns: int | None = None
+        self.last_fastq_ns: int | None = None
+        self.first_manifest_ns: int | None = None
+        self.last_manifest_ns: int | None = None
+
+    def shard_key(self, read: str, index: int) -> str:
+        suffix = ".fastq.gz" if self.codec == "gzip" else ".fastq"
+        if self.shard_prefix:
+            # The mapper classifies a FASTQ by the _R1_/_R2_ in its basename.
+            return f"{self.shard_prefix}/{self.lane}_{read}_001_p{index}{suffix}"
+        return f"{self.s3_base}_{read}_001_p{index}{suffix}"
+
+    def manifest_key(self, index: int) -> str:
+        return f"{self.s3_base}_p{index}_input.txt"
+
+    def batch_manifest_key(self, first_index: int) -> str:
+        return f"{self.s3_base}_b{first_index}_input.txt"
+
+    def queue_manifest(self, pair: CachedPair) -> None:
+        """Publish ``pair``'s manifest now, or add it to the open batch."""
+        if self.batch_shards <= 1:
+            self.publish_manifest([pair])
+            return
+        from plan_shards import batch_fits
+
+        ready = []
+        with self.lock:
+            sizes = [item.read_pairs for item in self.batch]
+            if self.batch and not batch_fits([*sizes, pair.read_pairs], self.batch_params):
+                ready.append(self.batch)
+                self.batch, sizes = [], []
+            self.batch.append(pair)
+            sizes.append(pair.read_pairs)
+            # Close the batch when another shard of this size would not fit.
+            if not batch_fits([*sizes, pair.read_pairs], self.batch_params):
+                ready.append(self.batch)
+                self.batch = []
+        for batch in ready:
+            self.publish_manifest(batch)
+
+    def flush_batch(self) -> None:
+        with self.lock:
+            batch, self.batch = self.batch, []
+        if batch:
+            self.publish_manifest(batch)
+
+    def publish_manifest(self, pairs: Sequence[CachedPair]) -> None:
+        """Write one manifest for ``pairs`` and start its Lambda invocation."""
+        pairs = sorted(pairs, key=lambda pair: pair.index)
+        if len(pairs) == 1:
+            pair = pairs[0]
+            manifest_key = self.manifest_key(pair.index)
+            output_folder = f"{self.lane}_p{pair.index}"
+            manifest = f"{pair.r1}\n{pair.r2}\n"
+        else:
+            manifest_key = self.batch_manifest_key(pairs[0].index)
+            output_folder = f"{self.lane}_b{pairs[0].index}"
+            manifest = "".join(
+                f"# shard {self.lane}_p{pair.index}\n{pair.r1}\n{pair.r2}\n" for pair in pairs
+            )
+        # A directly invoked manifest is only an audit copy; at its own key the
+        # EventBridge rule would invoke the mapper a second time.
+        stored_key = audit_key(manifest_key) if self.async_function or self.dispatch_spool else manifest_key
+        manifest_start_ns = time.time_ns()
+        self.uploader.put_bytes(manifest.encode("utf-8"), self.input_txt_bucket, stored_key)
+        manifest_end_ns = time.time_ns()
+        self.record_window(
+            "first_manifest_ns", "last_manifest_ns", manifest_start_ns, manifest_end_ns
+        )
+        self.invoke_lambda_async(manifest_key, output_folder, manifest.splitlines(), pairs)
+        for pair in pairs:
+            self.timings.record(
+                f"shard_p{pair.index}_manifest_publish", manifest_start_ns, manifest_end_ns
+            )
+        if len(pairs) > 1:
+            print(
+                f"Published batch {output_folder} with {len(pairs)} shard pair(s) "
+                f"({sum(pair.read_pairs for pair in pairs)} read pairs); Lambda may start now",
+                flush=True,
+            )
+
+    def invoke_lambda_async(
+        self, manifest_key: str, output_folder: str, lines: Sequence[str], pairs: Sequence[CachedPair]
+    ) -> None:
+        # The manifest rides in the event, so the mapper skips its GET.
+        event = inline_manifest_event(self.input_txt_bucket, manifest_key, lines)
+        if self.dispatch_spool:
+            # The driver's pacer invokes it once a concurrency slot is free.
+            spool_invocation(
+                self.dispatch_spool,
+                event,
+                output_folder,
+                [f"{self.lane}_p{pair.index}" for pair in pairs],
+                [pair.read_pairs for pair in pairs],
+            )
+            return
+        if not self.async_function:
+            return
+        status = invoke_async(self.lambda_client, self.async_function, event)
+        log_path = Path(self.invoke_log_dir) / f"{output_folder}.json"
+        log_path.write_text(json.dumps({"StatusCode": status}) + "\n")
+
+    def record_window(self, first: str, last: str, start_ns: int, end_ns: int) -> None:
+        with self.lock:
+            if getattr(self, first) is None or start_ns < getattr(self, first):
+                setattr(self, first, start_ns)
+            if getattr(self, last) is None or end_ns > getattr(self, last):
+                setattr(self, last, end_ns)
+
+    def encode(self, pair: ShardPair) -> tuple[bytes, bytes]:
+        if self.codec != "gzip":
+            return pair.r1.payload, pair.r2.payload
+        start_ns = time.time_ns()
+        r1_body = gzip_members(pair.r1.payload, self.compress_pool)
+        r2_body = gzip_members(pair.r2.payload, self.compress_pool)
+        self.timings.record(f"shard_p{pair.index}_compress", start_ns, time.time_ns())
+        return r1_body, r2_body
+
+    def publish(self, pair: ShardPair) -> tuple[int, float]:
+        """Publish one pair and return its uploaded FASTQ bytes and seconds."""
+        r1_key = self.shard_key("R1", pair.index)
+        r2_key = self.shard_key("R2", pair.index)
+        r1_body, r2_body = self.encode(pair)
+        fastq_start_ns = time.time_ns()
+        uploads = [
+            self.uploader.upload_bytes(r1_body, self.shard_bucket, r1_key),
+            self.uploader.upload_bytes(r2_body, self.shard_bucket, r2_key),
+        ]
+        for upload in uploads:
+            upload.result()
+        fastq_end_ns = time.time_ns()
+        self.record_window("first_fastq_ns", "last_fastq_ns", fastq_start_ns, fastq_end_ns)
+
+        self.timings.record(
+            f"shard_p{pair.index}_fastq_upload", fastq_start_ns, fastq_end_ns
+        )
+        cached = CachedPair(
+            pair.index, f"s3://{self.shard_bucket}/{r1_key}", f"s3://{self.shard_bucket}/{r2_key}",
+            pair.records,
+        )
+        self.queue_manifest(cached)
+        if self.batch_shards <= 1:
+            print(
+                f"Published {self.lane}_p{pair.index} ({pair.records} read pairs); "
+                "Lambda may start now",
+                flush=True,
+            )
+        with self.lock:
+            self.published += 1
+            self.shards.append(cached)
+        return len(r1_body) + len(r2_body), (fastq_end_ns - fastq_start_ns) / 1_000_000_000
+
+    def publish_in_window(self, pair: ShardPair, failed: threading.Event) -> None:
+        uploaded_bytes, seconds = 0, 0.0
+        try:
+            if not failed.is_set():
+                uploaded_bytes, seconds = self.publish(pair)
+        except Exception as error:
+            with self.lock:
+                self.error = self.error or error
+            failed.set()
+        finally:
+            self.window.release(uploaded_bytes, seconds)
+
+    def run(self, pairs: "queue.Queue[ShardPair | None]", failed: threading.Event) -> None:
+        # Keep draining after a failure so the producer never blocks on put().
+        with ThreadPoolExecutor(
+            max_workers=self.window.maximum, thread_name_prefix="shard-pair"
+        ) as pool:
+            while True:
+                pair = pairs.get()
+                if pair is None:
+                    break
+                if failed.is_set():
+                    continue
+                self.window.acquire()
+                pool.submit(self.publish_in_window, pair, failed)
+        if failed.is_set():
+            return
+        try:
+            self.flush_batch()
+        except Exception as error:
+            self.error = self.error or error
+            failed.set()
+
+
+def release_decompressor_cores(core_release_fifo: str, threads: int) -> None:
+    if not core_release_fifo:
+        return
+    # One short write is atomic for a FIFO; the driver adds these cores back.
+    with open(core_release_fifo, "w") as fifo:
+        fifo.write(f"{threads}\n")
+
+
+def record_pipeline_start(path: str, start_ns: int) -> None:
+    if not path:
+        return
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # The first lane to create the shared sentinel is its sole writer.
+        with open(path, "x") as handle:
+            handle.write(f"{start_ns}\n")
+    except FileExistsError:
+        pass
+
+
+class Decompressor:
+    """Own one decompressor child and report when its stream is drained.
+
+    With ``follow_prefetch`` the gzip is still being written by
+    ``s3_range_prefetcher.py fetch``; a feeder thread pipes its finished
+    prefix into the decompressor as the watermark advances.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        decompressor: str,
+        threads: int,
+        core_release_fifo: str,
+        follow_prefetch: bool = False,
+        cpus: Sequence[int] = (),
+        scheduler_fifo: str = "",
+        lane: str = "",
+        stream: str = "",
+    ):
+        self.threads = threads
+        self.core_release_fifo = core_release_fifo
+        self.scheduler_fifo = scheduler_fifo
+        self.lane = lane
+        self.stream = stream
+        self.process = subprocess.Popen(
+            decompressor_command(None if follow_prefetch else path, decompressor, threads),
+            stdin=subprocess.PIPE if follow_prefetch else None,
+            stdout=subprocess.PIPE,
+            # Threads the decompressor starts inherit its stream's cores.
+            preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None,
+        )
+        self.report("start", self.process.pid)
+        self.stdout = self.process.stdout
+        self.finished_ns: int | None = None
+        self.feeder_error: BaseException | None = None
+        self.feeder: threading.Thread | None = None
+        if follow_prefetch:
+            self.feeder = threading.Thread(
+                target=self.feed, args=(path,), name="prefetch-follow", daemon=True
+            )
+            self.feeder.start()
+
+    def feed(self, path: str) -> None:
+        from s3_range_prefetcher import follow
+
+        try:
+            follow(path, self.process.stdin)
+        except BaseException as error:
+            self.feeder_error = error
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def finish(self) -> int:
+        returncode = self.process.wait()
+        if self.finished_ns is None:
+            self.finished_ns = time.time_ns()
+            # R1 and R2 return their allocation independently, as in the bash path.
+            release_decompressor_cores(self.core_release_fifo, self.threads)
+            self.report("end")
+        return returncode
+
+    def report(self, event: str, pid: int = 0) -> None:
+        if not self.scheduler_fifo:
+            return
+        from split_scheduler import report_stream_event
+
+        report_stream_event(self.scheduler_fifo, self.lane, self.stream, event, pid)
+
+    def read(self, size: int) -> bytes:
+        block = self.stdout.read(size)
+        if not block and self.finished_ns is None:
+            returncode = self.finish()
+            if self.feeder is not None:
+                self.feeder.join()
+            if self.feeder_error is not None:
+                raise RuntimeError(f"prefetch feed failed: {self.feeder_error}")
+            if returncode != 0:
+                raise RuntimeError(
+                    f"{self.process.args[0]} exited with status {returncode}"
+                )
+        return block
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            self.process.kill()
+        self.finish()
+        self.stdout.close()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("fastq_bucket")
+    parser.add_argument("r1_gz")
+    parser.add_argument("r2_gz")
+    parser.add_argument("s3_base")
+    parser.add_argument("input_txt_bucket")
+    parser.add_argument(
+        "split_lines",
+        nargs="?",
+        type=int,
+        default=int(os.getenv("SPLIT_LINES") or DEFAULT_SPLIT_LINES),
+    )
+    parser.add_argument(
+        "--decompressor", default=os.getenv("FASTQ_DECOMPRESSOR", "rapidgzip"),
+        choices=DECOMPRESSORS,
+    )
+    parser.add_argument(
+        "--threads", type=int, default=int(os.getenv("DECOMP_THREADS", "8"))
+    )
+    parser.add_argument(
+        "--region",
+        default=os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "us-east-2",
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=int(os.getenv("SHARD_QUEUE_DEPTH", str(DEFAULT_QUEUE_DEPTH))),
+        help="completed shard pairs held in memory ahead of the uploader",
+    )
+    parser.add_argument(
+        "--upload-window-max",
+        type=int,
+        default=int(os.getenv("SHARD_UPLOAD_WINDOW_MAX", str(DEFAULT_UPLOAD_WINDOW_MAX))),
+        help="most shard pairs this lane uploads concurrently",
+    )
+    parser.add_argument(
+        "--memory-bytes",
+        type=int,
+        default=int(os.getenv("SPLIT_MEMORY_BYTES") or 0),
+        help="shard pairs this lane may hold in memory; default: a share of MemAvailable",
+    )
+    parser.add_argument(
+        "--concurrent-lanes",
+        type=int,
+        default=int(os.getenv("SPLIT_CONCURRENT_LANES", "1")),
+        help="lanes sharing the uplink; each gets an equal share of it",
+    )
+    parser.add_argument(
+        "--shard-codec",
+        default=os.getenv("SHARD_CODEC", "none"),
+        choices=SHARD_CODECS,
+        help="none uploads .fastq, gzip uploads .fastq.gz, auto decides from the first pair",
+    )
+    parser.add_argument(
+        "--compress-threads",
+        type=int,
+        default=int(os.getenv("SHARD_COMPRESS_THREADS", "0")),
+        help="gzip worker threads; 0 uses the idle cores measured on the first pair",
+    )
+    parser.add_argument(
+        "--follow-prefetch",
+        action="store_true",
+        help="the gzips are still being written by s3_range_prefetcher.py fetch",
+    )
+    parser.add_argument(
+        "--shard-schedule",
+        default=os.getenv("SHARD_SCHEDULE", ""),
+        help="read pairs per shard by index, e.g. 4000000*12,2000000,1000000",
+    )
+    parser.add_argument("--timings-file", default=os.getenv("SPLIT_TIMINGS_FILE", ""))
+    parser.add_argument("--pipeline-start-file", default=os.getenv("PIPELINE_START_FILE", ""))
+    parser.add_argument("--core-release-fifo", default=os.getenv("CORE_RELEASE_FIFO", ""))
+    parser.add_argument(
+        "--cache-uri",
+        default=os.getenv("SHARD_CACHE_URI", ""),
+        help="s3:// root of the cross-run shard cache (shard_cache.py)",
+    )
+    parser.add_argument(
+        "--cache-key",
+        default=os.getenv("SHARD_CACHE_KEY", ""),
+        help="key printed by shard_cache.py replay; default: fingerprint the local gzips",
+    )
+    parser.add_argument(
+        "--scheduler-fifo",
+        default=os.getenv("SPLIT_SCHEDULER_FIFO", ""),
+        help="report decompressor start and end events to split_scheduler.py",
+    )
+    parser.add_argument("--scheduler-lane", default=os.getenv("SPLIT_SCHEDULER_LANE", ""))
+    parser.add_argument(
+        "--r1-decompressor", default=os.getenv("SPLIT_R1_DECOMPRESSOR", ""), choices=("", *DECOMPRESSORS),
+        help="per-stream override of --decompressor, chosen by split_scheduler.py",
+    )
+    parser.add_argument(
+        "--r2-decompressor", default=os.getenv("SPLIT_R2_DECOMPRESSOR", ""), choices=("", *DECOMPRESSORS),
+    )
+    parser.add_argument("--r1-threads", type=int, default=int(os.getenv("SPLIT_R1_THREADS") or 0))
+    parser.add_argument("--r2-threads", type=int, default=int(os.getenv("SPLIT_R2_THREADS") or 0))
+    parser.add_argument("--r1-cpus", default=os.getenv("SPLIT_R1_CPUS", ""), help="e.g. 0-3")
+    parser.add_argument("--r2-cpus", default=os.getenv("SPLIT_R2_CPUS", ""), help="e.g. 4-11")
+    parser.add_argument(
+        "--lane-gbps",
+        type=float,
+        default=float(os.getenv("SPLIT_LANE_GBPS") or 0),
+        help="this lane's uplink share; default: the uplink over --concurrent-lanes",
+    )
+    parser.add_argument(
+        "--batch-shards",
+        type=int,
+        default=int(os.getenv("SHARD_BATCH_SHARDS") or 1),
+        help="most shard pairs per Lambda invocation; 1 publishes one manifest per pair",
+    )
+    parser.add_argument("--async-lambda-function", default=os.getenv("ASYNC_LAMBDA_FUNCTION", ""))
+    parser.add_argument("--invoke-log-dir", default=os.getenv("LAMBDA_INVOKE_LOG_DIR", ""))
+    parser.add_argument(
+        "--dispatch-spool",
+        default=os.getenv("LAMBDA_DISPATCH_SPOOL", ""),
+        help="hand invocations to the driver's pacer through this directory instead of invoking",
+    )
+    args = parser.parse_args(argv)
+
+    if args.split_lines <= 0 or args.split_lines % 4:
+        parser.error("SPLIT_LINES must be positive and divisible by 4")
+    if args.threads <= 0:
+        parser.error("DECOMP_THREADS must be positive")
+    if args.r1_threads < 0 or args.r2_threads < 0:
+        parser.error("SPLIT_R1_THREADS and SPLIT_R2_THREADS must not be negative")
+    args.streams = {
+        read: resolve_backend(
+            decompressor or args.decompressor, threads or args.threads, args.follow_prefetch
+        )
+        for read, decompressor, threads in (
+            ("R1", args.r1_decompressor, args.r1_threads),
+            ("R2", args.r2_decompressor, args.r2_threads),
+        )
+    }
+    if args.queue_depth <= 0:
+        parser.error("--queue-depth must be positive")
+    if args.upload_window_max <= 0 or args.concurrent_lanes <= 0:
+        parser.error("--upload-window-max and --concurrent-lanes must be positive")
+    if args.memory_bytes < 0:
+        parser.error("--memory-bytes must not be negative")
+    if args.compress_threads < 0:
+        parser.error("--compress-threads must not be negative")
+    try:
+        args.schedule = parse_shard_schedule(args.shard_schedule)
+    except ValueError as error:
+        parser.error(f"SHARD_SCHEDULE: {error}")
+    for path in (args.r1_gz, args.r2_gz):
+        if not args.follow_prefetch and not os.path.isfile(path):
+            parser.error(f"gzip not found: {path}")
+    if args.core_release_fifo and not Path(args.core_release_fifo).is_fifo():
+        parser.error(f"CORE_RELEASE_FIFO is not a named pipe: {args.core_release_fifo}")
+    if args.scheduler_fifo and not Path(args.scheduler_fifo).is_fifo():
+        parser.error(f"SPLIT_SCHEDULER_FIFO is not a named pipe: {args.scheduler_fifo}")
+    if args.cache_uri and not args.cache_uri.startswith("s3://"):
+        parser.error("SHARD_CACHE_URI must be an s3:// URI")
+    if args.lane_gbps < 0:
+        parser.error("--lane-gbps must not be negative")
+    if args.batch_shards <= 0:
+        parser.error("SHARD_BATCH_SHARDS must be positive")
+    from split_scheduler import parse_cpu_list
+
+    try:
+        args.r1_cpu_list = parse_cpu_list(args.r1_cpus)
+        args.r2_cpu_list = parse_cpu_list(args.r2_cpus)
+    except ValueError as error:
+        parser.error(f"SPLIT_R1_CPUS/SPLIT_R2_CPUS: {error}")
+    if args.dispatch_spool and not os.path.isdir(args.dispatch_spool):
+        parser.error(f"LAMBDA_DISPATCH_SPOOL is not a directory: {args.dispatch_spool}")
+    if args.async_lambda_function and not args.invoke_log_dir and not args.dispatch_spool:
+        parser.error("LAMBDA_INVOKE_LOG_DIR is required with ASYNC_LAMBDA_FUNCTION")
+    return args
+
+
+def select_codec(
+    args: argparse.Namespace,
+    publisher: ShardPublisher,
+    pair: ShardPair,
+    cpu_before: tuple[int, int] | None,
+    lane_gbps: float,
+) -> None:
+    """Fix this lane's shard codec and gzip pool before its first pair is queued."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    # Idle cores while both decompressors ran, split evenly between lanes.
+    headroom = idle_cores(cpu_before, cpu_times(), cpus) / args.concurrent_lanes
+    workers = args.compress_threads or max(1, int(headroom))
+    codec = args.shard_codec
+    if codec == "auto":
+        ratio, core_rate = probe_gzip(pair.r1.payload[:CODEC_PROBE_BYTES])
+        codec = choose_shard_codec(ratio, core_rate, workers, lane_gbps)
+        print(
+            "SHARD_CODEC "
+            + json.dumps(
+                {
+                    "codec": codec,
+                    "compress_threads": workers,
+                    "core_mb_per_second": round(core_rate / 1e6, 1),
+                    "gzip_ratio": round(ratio, 4),
+                    "idle_cores": round(headroom, 2),
+                    "lane_gbps": round(lane_gbps, 3),
+                    "lane": publisher.lane,
+                },
+                sort_keys=True,
+            ),
+            flush=True,
+        )
+    publisher.codec = codec
+    if codec == "gzip":
+        publisher.compress_pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="shard-gzip"
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    uploader = UploadService(args.region)
+    lambda_client = None
+    if args.async_lambda_function and not args.dispatch_spool:
+        Path(args.invoke_log_dir).mkdir(parents=True, exist_ok=True)
+        lambda_client = boto3.client("lambda", region_name=args.region)
+
+    cache = None
+    cache_key_value = args.cache_key
+    if args.cache_uri:
+        cache = ShardCache(boto3.client("s3", region_name=args.region), args.cache_uri)
+        if not cache_key_value and args.follow_prefetch:
+            # The tail of a prefetching gzip is not on disk yet.
+            print("WARNING: no SHARD_CACHE_KEY for a prefetching lane; not caching it", file=sys.stderr)
+            cache = None
+        elif not cache_key_value:
+            cache_key_value = cache_key(
+                source_fingerprint(args.r1_gz),
+                source_fingerprint(args.r2_gz),
+                args.split_lines,
+                args.shard_schedule,
+                args.shard_codec,
+            )
+
+    timings = TimingLog(args.timings_file)
+    lane_gbps = args.lane_gbps or detect_uplink_gbps() / args.concurrent_lanes
+    memory_budget = args.memory_bytes or int(
+        available_memory_bytes() * MEMORY_BUDGET_FRACTION / args.concurrent_lanes
+    )
+    pair_bytes = shard_pair_bytes(args.split_lines, args.schedule)
+    queue_depth, window_max = fit_memory(memory_budget, pair_bytes, args.queue_depth, args.upload_window_max)
+    if memory_budget and lane_memory_bytes(pair_bytes, queue_depth, window_max) > memory_budget:
+        print(
+            f"WARNING: {memory_budget / 1e9:.1f} GB memory budget is below one queued and one "
+            f"uploading {pair_bytes / 1e9:.2f} GB shard pair; holding that many anyway",
+            file=sys.stderr,
+        )
+    window = UploadWindow(lane_gbps, window_max)
+    publisher = ShardPublisher(
+        uploader,
+        args.fastq_bucket,
+        args.s3_base,
+        args.input_txt_bucket,
+        timings,
+        lambda_client=lambda_client,
+        async_function=args.async_lambda_function,
+        invoke_log_dir=args.invoke_log_dir,
+        dispatch_spool=args.dispatch_spool,
+        window=window,
+        shard_bucket=cache.bucket if cache else "",
+        shard_prefix=cache.shard_prefix(cache_key_value) if cache else "",
+        batch_shards=args.batch_shards,
+    )
+    pairs: "queue.Queue[ShardPair | None]" = queue.Queue(maxsize=queue_depth)
+    failed = threading.Event()
+
+    total_start_ns = time.time_ns()
+    cpu_before = cpu_times()
+    record_pipeline_start(args.pipeline_start_file, total_start_ns)
+    sizing = (
+        f"shard schedule {args.shard_schedule}" if args.schedule
+        else f"{args.split_lines} lines per shard"
+    )
+    print(
+        f"Starting {publisher.lane} with "
+        + " and ".join(
+            f"{read} on {name}" + (f" -P {threads}" if BACKENDS[name].multithreaded else "")
+            for read, (name, threads) in args.streams.items()
+        )
+        + f", {sizing}, "
+        f"up to {window.maximum} shard pair uploads in flight for {lane_gbps:.1f} Gbit/s, "
+        f"{queue_depth} queued, "
+        f"{lane_memory_bytes(pair_bytes, queue_depth, window.maximum) / 1e9:.1f} GB of shard pairs at most",
+        flush=True,
+    )
+    publisher_thread = threading.Thread(
+        target=publisher.run, args=(pairs, failed), name="shard-publisher"
+    )
+    publisher_thread.start()
+    lane = args.scheduler_lane or publisher.lane
+    r1 = Decompressor(
+        args.r1_gz, *args.streams["R1"], args.core_release_fifo, args.follow_prefetch,
+        args.r1_cpu_list, args.scheduler_fifo, lane, "R1",
+    )
+    r2 = Decompressor(
+        args.r2_gz, *args.streams["R2"], args.core_release_fifo, args.follow_prefetch,
+        args.r2_cpu_list, args.scheduler_fifo, lane, "R2",
+    )
+    status = 0
+    try:
+        for pair in iter_shard_pairs(r1, r2, args.split_lines, args.schedule):
+            if failed.is_set():
+                break
+            if pair.index == 0:
+                select_codec(args, publisher, pair, cpu_before, lane_gbps)
+            pairs.put(pair)
+    except (OSError, RuntimeError, ValueError) as error:
+        print(f"ERROR: {error}", file=sys.stderr)
+        failed.set()
+        status = 1
+    finally:
+        pairs.put(None)
+        publisher_thread.join()
+        if publisher.compress_pool is not None:
+            publisher.compress_pool.shutdown()
+        uploader.close()
+        r1.close()
+        r2.close()
+
+    if publisher.error is not None:
+        print(f"ERROR: shard publication failed: {publisher.error}", file=sys.stderr)
+        return 1
+    if status:
+        return status
+    if publisher.published == 0:
+        print("ERROR: no FASTQ shard pairs produced", file=sys.stderr)
+        return 1
+
+    decompress_end_ns = max(r1.finished_ns or 0, r2.finished_ns or 0)
+    timings.record("decompress_and_split_fastq", total_start_ns, decompress_end_ns)
+    timings.record("fastq_upload_window", publisher.first_fastq_ns, publisher.last_fastq_ns)
+    timings.record(
+        "lambda_manifest_publish_window",
+        publisher.first_manifest_ns,
+        publisher.last_manifest_ns,
+    )
+    timings.record("nvme_to_last_lambda_trigger", total_start_ns, publisher.last_manifest_ns)
+    timings.record("lane_streaming_total", total_start_ns, time.time_ns())
+    if cache is not None:
+        try:
+            cache.store(cache_key_value, publisher.shards)
+            print(f"Cached {publisher.published} shard pair(s) under {publisher.shard_prefix}", flush=True)
+        except Exception as error:
+            # The run already has its shards; only later runs miss the cache.
+            print(f"WARNING: shard cache index not written: {error}", file=sys.stderr)
+    # Keep the part count as the last line; the drivers consume it.
+    print(publisher.published)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
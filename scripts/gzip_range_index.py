@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""Publish Lambda manifests that map byte ranges of the original R1/R2 gzips.
+
+Zero-split mode. Instead of decompressing, cutting, and re-uploading every
+shard, the driver inflates each original ``.fastq.gz`` once with
+``indexed_gzip``. That pass records a seek point, with its 32 KiB window,
+every ``--spacing`` uncompressed bytes, and cuts the stream in R1/R2 lockstep
+on record boundaries, just as ``fastq_shard_engine.py`` would. Only the seek
+point index (``<gzip key>.gzidx``) is uploaded. Each shard's manifest line
+points at the original object, with a fragment giving its uncompressed
+range, the seek point it starts from, the compressed bytes to fetch, and its
+read numbers:
+
+    s3://bucket/lane_R1_001.fastq.gz#index=s3://...gzidx&offset=U&length=L
+        &seek=S&compressed=X-Y&reads=N-M
+
+Pass ``--r1-uri``/``--r2-uri`` when the gzips are already in S3. Otherwise the
+local files are uploaded once, compressed, while they are being indexed.
+
+``--shard-schedule`` sizes shards by index exactly as in the shard engine.
+
+Manifests are published once both indexes and both gzip objects exist. The
+shard pair count is the final stdout line, as with the other split engines.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Sequence
+from urllib.parse import urlencode
+
+from fastq_shard_engine import (
+    DEFAULT_SPLIT_LINES,
+    READ_BLOCK_BYTES,
+    ShardPairingError,
+    TimingLog,
+    last_record_header,
+    mate_name,
+    parse_shard_schedule,
+    record_pipeline_start,
+    schedule_lines,
+)
+from s3_upload_service import UploadService, parse_s3_uri
+
+
+DEFAULT_SEEK_SPACING = 32 * 1024 * 1024
+INDEX_SUFFIX = ".gzidx"
+# Enough trailing bytes to hold the last four lines of any Illumina record.
+RECORD_TAIL_BYTES = 64 * 1024
+
+
+@dataclass(frozen=True)
+class ShardRange:
+    offset: int
+    length: int
+    first_read: int
+    records: int
+    first_name: bytes
+    last_name: bytes
+
+
+class RecordRangeScanner:
+    """Find fixed-line shard boundaries in an uncompressed FASTQ stream."""
+
+    def __init__(self, stream: BinaryIO, lines_per_shard: int, label: str):
+        if lines_per_shard <= 0 or lines_per_shard % 4:
+            raise ValueError("lines_per_shard must be positive and divisible by four")
+        self.stream = stream
+        self.lines_per_shard = lines_per_shard
+        self.label = label
+        self.pending = b""
+        self.eof = False
+        self.offset = 0
+        self.reads = 0
+
+    def next_range(self, lines_per_shard: int | None = None) -> ShardRange | None:
+        lines_per_shard = lines_per_shard or self.lines_per_shard
+        lines_needed = lines_per_shard
+        start = self.offset
+        first_header = b""
+        header_done = False
+        tail = b""
+        while lines_needed:
+            block = self.pending
+            self.pending = b""
+            if not block:
+                if self.eof:
+                    break
+                block = self.stream.read(READ_BLOCK_BYTES)
+                if not block:
+                    self.eof = True
+                    break
+            if not header_done:
+                newline = block.find(b"\n")
+                first_header += block if newline < 0 else block[:newline]
+                header_done = newline >= 0
+            newlines = block.count(b"\n")
+            if newlines >= lines_needed:
+                cut = -1
+                for _ in range(lines_needed):
+                    cut = block.index(b"\n", cut + 1)
+                self.pending = block[cut + 1:]
+                block = block[:cut + 1]
+                newlines = lines_needed
+            tail = (tail + block)[-RECORD_TAIL_BYTES:]
+            self.offset += len(block)
+            lines_needed -= newlines
+
+        length = self.offset - start
+        if not length:
+            return None
+        lines = lines_per_shard - lines_needed
+        if not tail.endswith(b"\n"):
+            # A final record without a trailing newline still counts as a line.
+            tail += b"\n"
+            lines += 1
+        if lines % 4:
+            raise ValueError(
+                f"{self.label} ended inside a FASTQ record ({lines} lines in final shard)"
+            )
+        shard = ShardRange(
+            offset=start,
+            length=length,
+            first_read=self.reads,
+            records=lines // 4,
+            first_name=mate_name(first_header),
+            last_name=mate_name(last_record_header(tail)),
+        )
+        self.reads += shard.records
+        return shard
+
+
+def iter_range_pairs(
+    r1_stream: BinaryIO,
+    r2_stream: BinaryIO,
+    lines_per_shard: int,
+    schedule: Sequence[int] = (),
+) -> Iterator[tuple[int, ShardRange, ShardRange]]:
+    """Yield R1/R2 shard ranges found in lockstep and checked like shard pairs."""
+    r1_scanner = RecordRangeScanner(r1_stream, lines_per_shard, "R1")
+    r2_scanner = RecordRangeScanner(r2_stream, lines_per_shard, "R2")
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="gzip-index") as pool:
+        index = 0
+        while True:
+            lines = schedule_lines(schedule, index, lines_per_shard)
+            r1_future = pool.submit(r1_scanner.next_range, lines)
+            r2_future = pool.submit(r2_scanner.next_range, lines)
+            r1, r2 = r1_future.result(), r2_future.result()
+            if r1 is None and r2 is None:
+                return
+            if r1 is None or r2 is None or r1.records != r2.records:
+                raise ShardPairingError(
+                    f"R1/R2 record-count mismatch at p{index}: "
+                    f"R1={r1.records if r1 else 0} R2={r2.records if r2 else 0}"
+                )
+            if r1.first_name != r2.first_name or r1.last_name != r2.last_name:
+                raise ShardPairingError(
+                    f"R1/R2 mate names disagree at p{index}: "
+                    f"{r1.first_name!r}..{r1.last_name!r} vs "
+                    f"{r2.first_name!r}..{r2.last_name!r}"
+                )
+            yield index, r1, r2
+            index += 1
+
+
+def compressed_span(
+    seek_points: list[tuple[int, int]], offset: int, length: int, compressed_size: int
+) -> tuple[int, int, int]:
+    """Return (seek point, first, last compressed byte) covering a range.
+
+    ``seek_points`` are ``(uncompressed, compressed)`` offsets in order. The
+    first byte is one before the seek point because a deflate block boundary
+    may start mid-byte.
+    """
+    seek = 0
+    for position, (uncompressed, _compressed) in enumerate(seek_points):
+        if uncompressed > offset:
+            break
+        seek = position
+    first = max(0, seek_points[seek][1] - 1)
+    last = compressed_size - 1
+    for uncompressed, compressed in seek_points[seek + 1:]:
+        if uncompressed >= offset + length:
+            last = min(last, compressed)
+            break
+    return seek, first, last
+
+
+def range_uri(
+    object_uri: str, index_uri: str, shard: ShardRange, seek: int, first: int, last: int
+) -> str:
+    fragment = urlencode(
+        {
+            "index": index_uri,
+            "offset": shard.offset,
+            "length": shard.length,
+            "seek": seek,
+            "compressed": f"{first}-{last}",
+            "reads": f"{shard.first_read}-{shard.first_read + shard.records - 1}",
+        },
+        safe=":/",
+    )
+    return f"{object_uri}#{fragment}"
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("fastq_bucket")
+    parser.add_argument("r1_gz")
+    parser.add_argument("r2_gz")
+    parser.add_argument("s3_base")
+    parser.add_argument("input_txt_bucket")
+    parser.add_argument(
+        "split_lines",
+        nargs="?",
+        type=int,
+        default=int(os.getenv("SPLIT_LINES") or DEFAULT_SPLIT_LINES),
+    )
+    parser.add_argument(
+        "--shard-schedule",
+        default=os.getenv("SHARD_SCHEDULE", ""),
+        help="read pairs per shard by index, e.g. 4000000*12,2000000,1000000",
+    )
+    parser.add_argument("--r1-uri", default="", help="existing S3 copy of r1_gz")
+    parser.add_argument("--r2-uri", default="", help="existing S3 copy of r2_gz")
+    parser.add_argument(
+        "--spacing",
+        type=int,
+        default=int(os.getenv("GZIP_SEEK_SPACING", str(DEFAULT_SEEK_SPACING))),
+        help="uncompressed bytes between seek points",
+    )
+    parser.add_argument(
+        "--region",
+        default=os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "us-east-2",
+    )
+    parser.add_argument("--timings-file", default=os.getenv("SPLIT_TIMINGS_FILE", ""))
+    parser.add_argument("--pipeline-start-file", default=os.getenv("PIPELINE_START_FILE", ""))
+    args = parser.parse_args(argv)
+
+    if args.split_lines <= 0 or args.split_lines % 4:
+        parser.error("SPLIT_LINES must be positive and divisible by 4")
+    if args.spacing <= 0:
+        parser.error("--spacing must be positive")
+    try:
+        args.schedule = parse_shard_schedule(args.shard_schedule)
+    except ValueError as error:
+        parser.error(f"SHARD_SCHEDULE: {error}")
+    if bool(args.r1_uri) != bool(args.r2_uri):
+        parser.error("--r1-uri and --r2-uri go together")
+    for path in (args.r1_gz, args.r2_gz):
+        if not os.path.isfile(path):
+            parser.error(f"gzip not found: {path}")
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    try:
+        import indexed_gzip
+    except ImportError:
+        print("ERROR: zero-split mode needs the indexed_gzip package", file=sys.stderr)
+        return 1
+
+    timings = TimingLog(args.timings_file)
+    lane = os.path.basename(args.s3_base)
+    start_ns = time.time_ns()
+    record_pipeline_start(args.pipeline_start_file, start_ns)
+    uploader = UploadService(args.region)
+    uploads = []
+    object_uris = [args.r1_uri, args.r2_uri]
+    if not args.r1_uri:
+        # Upload the compressed originals while they are being indexed.
+        for position, (read, path) in enumerate((("R1", args.r1_gz), ("R2", args.r2_gz))):
+            key = f"{args.s3_base}_{read}_001.fastq.gz"
+            uploads.append(uploader.upload_file(path, args.fastq_bucket, key))
+            object_uris[position] = f"s3://{args.fastq_bucket}/{key}"
+    index_uris = [
+        f"s3://{args.fastq_bucket}/{args.s3_base}_{read}_001.fastq.gz{INDEX_SUFFIX}"
+        for read in ("R1", "R2")
+    ]
+    print(
+        f"Indexing {lane} every {args.spacing} uncompressed bytes, "
+        f"{args.split_lines} lines per shard; no shard uploads",
+        flush=True,
+    )
+
+    streams = [
+        indexed_gzip.IndexedGzipFile(path, spacing=args.spacing)
+        for path in (args.r1_gz, args.r2_gz)
+    ]
+    status = 0
+    try:
+        pairs = list(iter_range_pairs(streams[0], streams[1], args.split_lines, args.schedule))
+        index_end_ns = time.time_ns()
+        for stream in streams:
+            # Normally a no-op: reading already placed every seek point.
+            stream.build_full_index()
+        seek_points = [list(stream.seek_points()) for stream in streams]
+        index_uploads = []
+        for stream, index_uri in zip(streams, index_uris):
+            local_index = f"/tmp/{lane}_{os.getpid()}_{os.path.basename(index_uri)}"
+            stream.export_index(local_index)
+            bucket, key = parse_s3_uri(index_uri)
+            index_uploads.append((local_index, uploader.upload_file(local_index, bucket, key)))
+        for local_index, upload in index_uploads:
+            upload.result()
+            os.remove(local_index)
+        for upload in uploads:
+            upload.result()
+        upload_end_ns = time.time_ns()
+
+        sizes = [os.path.getsize(path) for path in (args.r1_gz, args.r2_gz)]
+        lock = threading.Lock()
+        manifests_start_ns = time.time_ns()
+
+        def publish(entry: tuple[int, ShardRange, ShardRange]) -> None:
+            index, r1, r2 = entry
+            lines = []
+            for read, shard in enumerate((r1, r2)):
+                seek, first, last = compressed_span(
+                    seek_points[read], shard.offset, shard.length, sizes[read]
+                )
+                lines.append(range_uri(object_uris[read], index_uris[read], shard, seek, first, last))
+            uploader.put_bytes(
+                ("\n".join(lines) + "\n").encode("utf-8"),
+                args.input_txt_bucket,
+                f"{args.s3_base}_p{index}_input.txt",
+            )
+            with lock:
+                print(
+                    f"Published {lane}_p{index} (reads {r1.first_read}..{r1.first_read + r1.records - 1}); "
+                    "Lambda may start now",
+                    flush=True,
+                )
+
+        with ThreadPoolExecutor(max_workers=16, thread_name_prefix="range-manifest") as pool:
+            list(pool.map(publish, pairs))
+        manifests_end_ns = time.time_ns()
+    except (OSError, RuntimeError, ValueError) as error:
+        print(f"ERROR: {error}", file=sys.stderr)
+        status = 1
+    finally:
+        for stream in streams:
+            stream.close()
+        uploader.close()
+    if status:
+        return status
+    if not pairs:
+        print("ERROR: no FASTQ shard ranges produced", file=sys.stderr)
+        return 1
+
+    timings.record("index_and_scan_fastq", start_ns, index_end_ns)
+    timings.record("gzip_and_index_upload", start_ns, upload_end_ns)
+    timings.record("lambda_manifest_publish_window", manifests_start_ns, manifests_end_ns)
+    timings.record("nvme_to_last_lambda_trigger", start_ns, manifests_end_ns)
+    # Keep the part count as the last line; the drivers consume it.
+    print(len(pairs))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
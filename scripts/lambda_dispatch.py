@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""Invoke the mapper Lambda directly, with the shard manifest in the event.
+
+The EventBridge path costs a manifest PUT, the rule's delivery and the
+mapper's GET of the manifest before a shard can start. An inline event has
+the same shape as the EventBridge ``Object Created`` event, so the handler
+keeps one code path, plus ``detail.manifest`` with the manifest lines, which
+the handler then uses instead of reading the object. The manifest is still
+written as the run's audit record, under ``audit_key`` rather than the
+``_input.txt`` key itself: the input bucket's EventBridge rule only matches
+``_input.txt`` and ``_split.txt`` keys, so the copy does not invoke the
+mapper a second time.
+
+``LambdaDispatcher`` shares one pooled Lambda client between its submit
+threads and keeps at most ``max_in_flight`` invocations outstanding;
+``submit`` blocks while that many are in flight.
+
+An asynchronous invoke is accepted whatever the function's concurrency, and
+Lambda then retries throttled events with its own backoff. ``PacedDispatcher``
+therefore keeps at most the function's effective concurrency of shards
+running: it queues the rest locally, longest predicted first, and releases
+one as soon as the completion channel (``completion_tracker.py``) reports a
+running shard done, or its completion marker is found. Split lanes run in
+separate engine processes; with ``LAMBDA_DISPATCH_SPOOL`` set they write their
+events to that directory (``spool_invocation``) for the driver's pacer to pick
+up rather than invoking.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Sequence
+
+import boto3
+from botocore.config import Config
+
+
+DEFAULT_MAX_IN_FLIGHT = 16
+SPOOL_SUFFIX = ".event.json"
+AUDIT_SUFFIX = ".audit"
+# A running shard is first checked for its marker after this fraction of its
+# predicted seconds, then on every poll, or every MARKER_CHECK_SECONDS when a
+# completion channel reports completions as they happen.
+COMPLETION_CHECK_FRACTION = 0.5
+MARKER_CHECK_SECONDS = 30.0
+MARKER_CHECK_WORKERS = 16
+
+
+def inline_manifest_event(bucket: str, key: str, lines: Sequence[str]) -> dict:
+    """An EventBridge-shaped S3 event for ``key`` that also carries its lines."""
+    return {
+        "version": "0",
+        "id": "direct-async",
+        "detail-type": "Object Created",
+        "source": "aws.s3",
+        "detail": {
+            "bucket": {"name": bucket},
+            "object": {"key": key},
+            "manifest": [line for line in lines if line.strip()],
+        },
+    }
+
+
+def audit_key(manifest_key: str) -> str:
+    """Where a directly invoked shard's manifest copy is written."""
+    return f"{manifest_key}{AUDIT_SUFFIX}"
+
+
+def invoke_async(client, function_name: str, event: dict) -> int:
+    """Queue one asynchronous invocation; raise unless Lambda accepted it."""
+    response = client.invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps(event).encode("utf-8"),
+    )
+    status = response.get("StatusCode")
+    if status != 202:
+        key = event["detail"]["object"]["key"]
+        raise RuntimeError(f"Lambda rejected async invocation for {key}: status={status}")
+    return status
+
+
+def effective_concurrency(client, function_name: str) -> int:
+    """The function's reserved concurrency, else the account's unreserved pool."""
+    reserved = client.get_function_concurrency(FunctionName=function_name).get(
+        "ReservedConcurrentExecutions"
+    )
+    if reserved:
+        return int(reserved)
+    return int(client.get_account_settings()["AccountLimit"]["UnreservedConcurrentExecutions"])
+
+
+def spool_invocation(
+    spool_dir: str, event: dict, output_folder: str, folders: Sequence[str], read_pairs: Sequence[int]
+) -> Path:
+    """Leave one invocation in ``spool_dir`` for the driver's ``PacedDispatcher``."""
+    record = {
+        "event": event,
+        "output_folder": output_folder,
+        "folders": list(folders),
+        "read_pairs": list(read_pairs),
+    }
+    path = Path(spool_dir) / f"{output_folder}{SPOOL_SUFFIX}"
+    partial = path.with_name(path.name + ".tmp")
+    partial.write_text(json.dumps(record))
+    os.replace(partial, path)
+    return path
+
+
+class LambdaDispatcher:
+    """Submit inline-manifest invocations from a bounded pool of threads."""
+
+    def __init__(
+        self,
+        function_name: str,
+        region: str | None = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        invoke_log_dir: str = "",
+        client=None,
+    ):
+        self.function_name = function_name
+        self.client = client or boto3.client(
+            "lambda",
+            region_name=region,
+            config=Config(
+                max_pool_connections=max_in_flight + 2,
+                retries={"max_attempts": 10, "mode": "adaptive"},
+            ),
+        )
+        self.invoke_log_dir = invoke_log_dir
+        if invoke_log_dir:
+            Path(invoke_log_dir).mkdir(parents=True, exist_ok=True)
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="lambda-invoke")
+        self.futures: list[Future] = []
+
+    def submit(self, bucket: str, key: str, lines: Sequence[str], output_folder: str) -> Future:
+        return self.submit_event(inline_manifest_event(bucket, key, lines), output_folder)
+
+    def submit_event(self, event: dict, output_folder: str) -> Future:
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self.invoke, event, output_folder)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        return future
+
+    def invoke(self, event: dict, output_folder: str) -> int:
+        status = invoke_async(self.client, self.function_name, event)
+        if self.invoke_log_dir:
+            log_path = Path(self.invoke_log_dir) / f"{output_folder}.json"
+            log_path.write_text(json.dumps({"StatusCode": status}) + "\n")
+        return status
+
+    def close(self) -> None:
+        """Wait for every submitted invocation; raise the first failure."""
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+
+    def __enter__(self) -> "LambdaDispatcher":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+@dataclass
+class RunningShard:
+    output_folder: str
+    remaining: set[str]
+    started: float
+    check_after: float
+
+
+@dataclass
+class PacingStats:
+    limit: int
+    dispatched: int = 0
+    completed: int = 0
+    reclaimed: int = 0
+    max_running: int = 0
+    max_queued: int = 0
+    max_queue_seconds: float = 0.0
+    queue_seconds: list[float] = field(default_factory=list, repr=False)
+
+    def summary(self) -> dict:
+        waits = self.queue_seconds
+        return {
+            "limit": self.limit,
+            "dispatched": self.dispatched,
+            "completed": self.completed,
+            "reclaimed": self.reclaimed,
+            "max_running": self.max_running,
+            "max_queued": self.max_queued,
+            "mean_queue_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_queue_seconds": round(self.max_queue_seconds, 3),
+        }
+
+
+class PacedDispatcher:
+    """Keep at most ``limit`` shards running; queue the rest, longest first.
+
+    ``expected_seconds(read_pairs)`` predicts an invocation's runtime from the
+    read pairs of its shards. A shard's slot is given back when ``channel``
+    (a ``completion_tracker`` channel) reports all of its folders complete.
+    ``is_complete(folder)`` checks one completion marker: it is asked once a
+    shard has run ``COMPLETION_CHECK_FRACTION`` of its predicted seconds, then
+    every ``marker_check_seconds`` with a channel, in case an event was lost,
+    or on every poll without one. Those checks and the invocations run outside
+    the lock ``queue`` takes, so pacing never holds up the engines publishing
+    shards. A shard that has shown no marker after ``slot_timeout_seconds``
+    gives its slot back, so a shard that exhausted its retries cannot hold the
+    queue forever.
+    """
+
+    def __init__(
+        self,
+        dispatcher: LambdaDispatcher,
+        limit: int,
+        is_complete: Callable[[str], bool],
+        expected_seconds: Callable[[Sequence[int]], float],
+        spool_dir: str = "",
+        poll_seconds: float = 1.0,
+        slot_timeout_seconds: float = 3600.0,
+        channel=None,
+        marker_check_seconds: float = MARKER_CHECK_SECONDS,
+    ):
+        if limit <= 0:
+            raise ValueError("PacedDispatcher needs a positive concurrency limit")
+        self.dispatcher = dispatcher
+        self.is_complete = is_complete
+        self.expected_seconds = expected_seconds
+        self.spool_dir = spool_dir
+        if spool_dir:
+            Path(spool_dir).mkdir(parents=True, exist_ok=True)
+        self.poll_seconds = poll_seconds
+        self.slot_timeout_seconds = slot_timeout_seconds
+        self.channel = channel
+        self.marker_check_seconds = marker_check_seconds
+        self.stats = PacingStats(limit)
+        self.pending: list[tuple[float, int, float, dict]] = []
+        self.running: dict[str, RunningShard] = {}
+        # Every folder seen complete, for the caller's own completion tracking.
+        self.completed_folders: set[str] = set()
+        self.order = itertools.count()
+        self.wakeup = threading.Condition()
+        self.closing = False
+        self.error: BaseException | None = None
+        self.checker = ThreadPoolExecutor(
+            max_workers=MARKER_CHECK_WORKERS, thread_name_prefix="lambda-marker"
+        )
+        self.thread = threading.Thread(target=self.run, name="lambda-pacer", daemon=True)
+        self.thread.start()
+
+    def queue(self, event: dict, output_folder: str, folders: Sequence[str], read_pairs: Sequence[int]) -> None:
+        record = {
+            "event": event,
+            "output_folder": output_folder,
+            "folders": list(folders),
+            "read_pairs": list(read_pairs),
+        }
+        with self.wakeup:
+            self.push(record)
+            self.wakeup.notify()
+
+    def push(self, record: dict) -> None:
+        seconds = self.expected_seconds(record["read_pairs"])
+        heapq.heappush(self.pending, (-seconds, next(self.order), time.monotonic(), record))
+        self.stats.max_queued = max(self.stats.max_queued, len(self.pending))
+
+    def drain_spool(self) -> None:
+        if not self.spool_dir:
+            return
+        for path in sorted(Path(self.spool_dir).glob(f"*{SPOOL_SUFFIX}")):
+            record = json.loads(path.read_text())
+            path.unlink()
+            self.push(record)
+
+    def observe(self, folders: Sequence[str]) -> None:
+        """Free the slot of every running shard whose folders are all complete."""
+        if not folders:
+            return
+        self.completed_folders.update(folders)
+        for folder, shard in list(self.running.items()):
+            shard.remaining -= self.completed_folders
+            if not shard.remaining:
+                del self.running[folder]
+                self.stats.completed += 1
+
+    def due_checks(self, now: float) -> list[str]:
+        """Reclaim stale slots; return the folders whose markers are due a check."""
+        due = []
+        for folder, shard in list(self.running.items()):
+            if now - shard.started >= self.slot_timeout_seconds:
+                print(
+                    f"WARNING: no completion marker for {folder} after {now - shard.started:.0f}s; "
+                    "releasing its concurrency slot",
+                    file=sys.stderr,
+                )
+                del self.running[folder]
+                self.stats.reclaimed += 1
+                continue
+            if now < shard.check_after:
+                continue
+            due.extend(shard.remaining)
+            if self.channel is not None:
+                shard.check_after = now + self.marker_check_seconds
+        return due
+
+    def marker_exists(self, folder: str) -> bool:
+        try:
+            return self.is_complete(folder)
+        except Exception as error:
+            # One throttled or failed check only delays this shard's slot.
+            print(f"WARNING: completion check for {folder} failed: {error}", file=sys.stderr)
+            return False
+
+    def take_releasable(self, now: float) -> list[dict]:
+        """Move queued shards into free slots; return the records to invoke."""
+        released = []
+        while self.pending and len(self.running) < self.stats.limit:
+            negative_seconds, _, queued, record = heapq.heappop(self.pending)
+            folder = record["output_folder"]
+            self.running[folder] = RunningShard(
+                folder,
+                set(record["folders"]),
+                now,
+                now - negative_seconds * COMPLETION_CHECK_FRACTION,
+            )
+            self.stats.dispatched += 1
+            self.stats.queue_seconds.append(now - queued)
+            self.stats.max_queue_seconds = max(self.stats.max_queue_seconds, now - queued)
+            self.stats.max_running = max(self.stats.max_running, len(self.running))
+            released.append(record)
+        return released
+
+    def run(self) -> None:
+        try:
+            while True:
+                pushed = self.channel.poll(self.poll_seconds) if self.channel is not None else []
+                with self.wakeup:
+                    self.drain_spool()
+                    self.observe(pushed)
+                    due = self.due_checks(time.monotonic())
+                found = [
+                    folder for folder, done in zip(due, self.checker.map(self.marker_exists, due)) if done
+                ]
+                with self.wakeup:
+                    self.observe(found)
+                    released = self.take_releasable(time.monotonic())
+                # submit_event blocks while max_in_flight invocations are out.
+                for record in released:
+                    self.dispatcher.submit_event(record["event"], record["output_folder"])
+                with self.wakeup:
+                    if self.closing and not self.pending:
+                        return
+                    if self.channel is None and not released:
+                        self.wakeup.wait(self.poll_seconds)
+        except BaseException as error:  # surfaced by close()
+            self.error = error
+
+    def close(self) -> dict:
+        """Wait until every queued shard is dispatched; return the pacing stats.
+
+        Shards still running are left to the caller's completion polling.
+        """
+        with self.wakeup:
+            self.closing = True
+            self.wakeup.notify()
+        self.thread.join()
+        self.checker.shutdown(wait=True)
+        self.dispatcher.close()
+        if self.error is not None:
+            raise self.error
+        return self.stats.summary()
+
+    def __enter__(self) -> "PacedDispatcher":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
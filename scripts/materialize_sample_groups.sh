@@ -35,6 +35,11 @@ Options:
   --not-before TIME          Ignore output objects older than this time.
   --readiness-inventory FILE Use a previously captured complete global
                              readiness inventory instead of polling S3.
+  --completion-channel URI   Follow the completions Lambda pushes to this SQS
+                             queue URL or file://PATH (default:
+                             COMPLETION_CHANNEL) with completion_tracker.py;
+                             S3 is then listed only every 30 polls, from the
+                             first pending folder on.
   --materializer FILE        s3-rad-materialize executable override.
   --overwrite                Atomically replace existing local outputs.
   --rad-only                 Do not create SAMPLE/unmapped_bc_count.bin.
@@ -72,6 +77,7 @@ POLL_SECONDS="${POLL_INTERVAL_SECONDS:-1}"
 TIMEOUT_SECONDS="${PROCESS_FASTQ_TIMEOUT_SEC:-43200}"
 NOT_BEFORE=""
 READINESS_INVENTORY=""
+COMPLETION_CHANNEL_VALUE="${COMPLETION_CHANNEL:-}"
 MATERIALIZER="${MATERIALIZER:-s3-rad-materialize}"
 OVERWRITE=0
 RAD_ONLY=0
@@ -117,6 +123,9 @@ while [[ $# -gt 0 ]]; do
         --readiness-inventory)
             [[ $# -ge 2 ]] || die "$1 requires a value"
             READINESS_INVENTORY="$2"; shift 2 ;;
+        --completion-channel)
+            [[ $# -ge 2 ]] || die "$1 requires a value"
+            COMPLETION_CHANNEL_VALUE="$2"; shift 2 ;;
         --materializer)
             [[ $# -ge 2 ]] || die "$1 requires a value"
             MATERIALIZER="$2"; shift 2 ;;
@@ -151,13 +160,18 @@ command -v "$MATERIALIZER" >/dev/null 2>&1 || die "materializer not found: $MATE
 SCRIPT_DIR=$(cd "$(dirname "$0")" && pwd)
 CONTRACT_BUILDER="$SCRIPT_DIR/build_sample_rad_contract.py"
 SINGLE_MATERIALIZER="$SCRIPT_DIR/synchronous_s3_rad_materialize.sh"
+COMPLETION_TRACKER="$SCRIPT_DIR/completion_tracker.py"
 [[ -f "$CONTRACT_BUILDER" ]] || die "contract builder not found: $CONTRACT_BUILDER"
 [[ -f "$SINGLE_MATERIALIZER" ]] || die "RAD materializer wrapper not found: $SINGLE_MATERIALIZER"
 
 mkdir -p "$OUTPUT_DIR"
 CONTRACT_FILE=$(mktemp "$OUTPUT_DIR/.sample-contract.XXXXXX.tsv")
+TRACKER_PID=""
 cleanup_contract() {
     rm -f -- "$CONTRACT_FILE"
+    if [[ -n "$TRACKER_PID" ]]; then
+        kill "$TRACKER_PID" 2>/dev/null || true
+    fi
 }
 trap cleanup_contract EXIT
 
@@ -315,6 +329,32 @@ if [[ -n "$READINESS_INVENTORY" ]]; then
     log "Using supplied complete readiness inventory: $READINESS_INVENTORY"
 fi
 
+# The tracker rewrites its inventory as completions arrive; reading it is a
+# local file read, so readiness is refreshed on every loop iteration.
+TRACKER_INVENTORY=""
+TRACKER_STATS=""
+if [[ -n "$COMPLETION_CHANNEL_VALUE" ]] && (( SUPPLIED_INVENTORY == 0 )); then
+    TRACKER_INVENTORY="$OUTPUT_DIR/completion-inventory.tsv"
+    TRACKER_STATS="$OUTPUT_DIR/completion-tracker.json"
+    rm -f -- "$TRACKER_INVENTORY" "$TRACKER_STATS"
+    tracker_args=(
+        --output-bucket "$OUTPUT_BUCKET"
+        --expected-folders "$EXPECTED_FOLDERS_FILE"
+        --inventory "$TRACKER_INVENTORY"
+        --stats "$TRACKER_STATS"
+        --channel "$COMPLETION_CHANNEL_VALUE"
+        --rad-prefix "$RAD_PREFIX"
+        --region "$AWS_REGION_VALUE"
+        --fallback-seconds "$((POLL_SECONDS * 30))"
+        --timeout-seconds "$TIMEOUT_SECONDS"
+    )
+    [[ -n "$NOT_BEFORE" ]] && tracker_args+=(--not-before "$NOT_BEFORE")
+    [[ -n "$AWS_PROFILE_VALUE" ]] && export AWS_PROFILE="$AWS_PROFILE_VALUE"
+    python3 "$COMPLETION_TRACKER" follow "${tracker_args[@]}" 2> "$OUTPUT_DIR/completion-tracker.log" &
+    TRACKER_PID=$!
+    log "Following shard completions on $COMPLETION_CHANNEL_VALUE (tracker pid $TRACKER_PID)"
+fi
+
 printf 'sample\tshards\tready_ns\tstart_ns\tend_ns\tseconds\tthreads\tstatus\n' \
     > "$OUTPUT_DIR/sample-materialization-timings.tsv"
 
@@ -323,6 +363,9 @@ refresh_readiness() {
     local now_ns_value partial
     if (( SUPPLIED_INVENTORY == 1 )); then
         LISTING=$(<"$READINESS_INVENTORY")
+    elif [[ -n "$TRACKER_INVENTORY" ]]; then
+        [[ -f "$TRACKER_INVENTORY" ]] || return 1
+        LISTING=$(<"$TRACKER_INVENTORY")
     elif ! LISTING=$(aws s3api list-objects-v2 \
         --bucket "$OUTPUT_BUCKET" --prefix "${RAD_PREFIX}/" \
         --query 'Contents[].[Key,LastModified]' --output text \
@@ -385,7 +428,11 @@ refresh_readiness() {
         fi
     done
     if (( READY_SHARDS != LAST_READY_SHARDS )); then
-        log "Global Lambda output progress: $READY_SHARDS/${#EXPECTED[@]} (S3 listings=$LIST_CALLS)"
+        if [[ -n "$TRACKER_INVENTORY" ]]; then
+            log "Global Lambda output progress: $READY_SHARDS/${#EXPECTED[@]} (completion tracker)"
+        else
+            log "Global Lambda output progress: $READY_SHARDS/${#EXPECTED[@]} (S3 listings=$LIST_CALLS)"
+        fi
         LAST_READY_SHARDS=$READY_SHARDS
     fi
     if (( READY_SHARDS == ${#EXPECTED[@]} )); then
@@ -479,8 +526,17 @@ while (( COMPLETED < ${#SAMPLES[@]} )); do
     [[ -z "$FAILED_SAMPLE" ]] || break
 
     now_epoch=$(date +%s)
+    if [[ -n "$TRACKER_PID" ]] && ! kill -0 "$TRACKER_PID" 2>/dev/null; then
+        # A clean exit means its inventory is complete; otherwise list S3 again.
+        if ! wait "$TRACKER_PID"; then
+            log "Completion tracker failed (see $OUTPUT_DIR/completion-tracker.log); listing S3 instead"
+            TRACKER_INVENTORY=""
+        fi
+        TRACKER_PID=""
+    fi
     if (( ALL_SHARDS_READY == 0 )) && \
-       (( SUPPLIED_INVENTORY == 1 || LAST_LIST_EPOCH == 0 || now_epoch - LAST_LIST_EPOCH >= POLL_SECONDS )); then
+       { [[ -n "$TRACKER_INVENTORY" ]] || \
+         (( SUPPLIED_INVENTORY == 1 || LAST_LIST_EPOCH == 0 || now_epoch - LAST_LIST_EPOCH >= POLL_SECONDS )); }; then
         refresh_readiness || true
         LAST_LIST_EPOCH=$now_epoch
     fi
@@ -511,6 +567,10 @@ if [[ -n "$FAILED_SAMPLE" ]]; then
     die "sample-eager materialization failed: $FAILED_SAMPLE"
 fi
 
+if [[ -n "$TRACKER_STATS" && -f "$TRACKER_STATS" ]]; then
+    LIST_CALLS=$(python3 -c 'import json, sys; print(json.load(open(sys.argv[1]))["list_calls"])' \
+        "$TRACKER_STATS")
+fi
 COORDINATOR_END_NS=$(date +%s%N)
 COORDINATOR_END_UTC=$(date -u +%Y-%m-%dT%H:%M:%SZ)
 ALL_SHARDS_READY_UTC=$(date -u -d "@$((ALL_SHARDS_READY_NS / 1000000000))" +%Y-%m-%dT%H:%M:%SZ)
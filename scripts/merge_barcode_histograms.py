@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Merge the Lambda barcode histograms of a run into one frequency table.
+
+With ``BARCODE_HISTOGRAM=1`` each mapper uploads ``bc_read_counts.bin`` next
+to its ``map.rad``: the reads of every barcode in the shard, written by
+``write_barcode_histogram`` in ``scrna-pipeline/map.py``. This sums them over
+the shard folders, so the barcode frequencies and the knee are known without
+a pass over the combined ``map.rad`` and can be computed while it is still
+being materialized.
+
+The knee is the point of the log10 rank / log10 read curve farthest above the
+chord from its first to its last point. The search is repeated on the curve
+up to three times the previous knee until the knee stops moving. It is an
+early estimate in the manner of alevin-fry's ``--knee-distance``; the permit
+list alevin-fry writes stays authoritative for collate and quant.
+
+    merge_barcode_histograms.py output/piscem_output \\
+        --expected-folders expected_rad_folders.txt --output-dir combined/barcodes
+
+The output directory gets ``barcode_freq.tsv`` (barcode and reads, most reads
+first), ``permit_list.txt`` (the barcodes up to the knee) and ``knee.json``.
+Barcodes are written as sequences when the shards recorded their length.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import struct
+import sys
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+
+HISTOGRAM_FILE = "bc_read_counts.bin"
+HISTOGRAM_MAGIC = b"BCH1"
+BASES = "ACGT"
+
+
+def read_histogram(path: Path) -> tuple[dict[int, int], int]:
+    """Return the barcode read counts and barcode length of one sidecar."""
+    data = path.read_bytes()
+    if data[:4] != HISTOGRAM_MAGIC or len(data) < 16:
+        raise ValueError(f"{path} is not a barcode histogram")
+    barcode_length, entries = struct.unpack_from("<B3xQ", data, 4)
+    body = zlib.decompress(data[16:])
+    if len(body) != 16 * entries:
+        raise ValueError(f"{path} holds {len(body)} bytes for {entries} entries")
+    barcodes = struct.unpack_from(f"<{entries}Q", body)
+    counts = struct.unpack_from(f"<{entries}Q", body, 8 * entries)
+    return dict(zip(barcodes, counts)), barcode_length
+
+
+def merge_histograms(paths: list[Path]) -> tuple[Counter, int]:
+    merged: Counter = Counter()
+    lengths = set()
+    for path in paths:
+        counts, barcode_length = read_histogram(path)
+        merged.update(counts)
+        lengths.add(barcode_length)
+    if len(lengths) > 1:
+        raise ValueError(f"shards disagree on the barcode length: {sorted(lengths)}")
+    return merged, lengths.pop() if lengths else 0
+
+
+def decode_barcode(barcode: int, length: int) -> str:
+    """Spell a 2-bit encoded barcode, first base in the highest bits."""
+    if length <= 0:
+        return str(barcode)
+    return "".join(BASES[(barcode >> (2 * (length - 1 - index))) & 3] for index in range(length))
+
+
+def knee_rank(reads: list[int], max_iterations: int = 100) -> int:
+    """Number of barcodes up to the knee of ``reads``, sorted most first."""
+    if len(reads) < 3:
+        return len(reads)
+    xs = [math.log10(rank) for rank in range(1, len(reads) + 1)]
+    ys = [math.log10(count) for count in reads]
+    limit = len(reads)
+    knee = limit
+    for _ in range(max_iterations):
+        dx, dy = xs[limit - 1] - xs[0], ys[limit - 1] - ys[0]
+        best = max(range(limit), key=lambda index: dx * ys[index] - dy * xs[index])
+        knee = best + 1
+        next_limit = min(len(reads), 3 * knee)
+        if next_limit == limit or next_limit < 3:
+            break
+        limit = next_limit
+    return knee
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("input_dir", type=Path, help="directory holding one folder per shard")
+    parser.add_argument("--expected-folders", type=Path,
+                        help="shard folders that must all have a histogram, one per line")
+    parser.add_argument("--output-dir", type=Path, required=True)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.expected_folders is not None:
+        folders = [line.strip() for line in args.expected_folders.read_text().splitlines() if line.strip()]
+        paths = [args.input_dir / folder / HISTOGRAM_FILE for folder in folders]
+        missing = [str(path) for path in paths if not path.is_file()]
+        if missing:
+            parser.error(f"{len(missing)} shard histogram(s) missing, first: {missing[0]}")
+    else:
+        paths = sorted(args.input_dir.glob(f"*/{HISTOGRAM_FILE}"))
+    if not paths:
+        parser.error(f"no {HISTOGRAM_FILE} under {args.input_dir}")
+
+    merged, barcode_length = merge_histograms(paths)
+    ranked = sorted(merged.items(), key=lambda item: (-item[1], item[0]))
+    knee = knee_rank([count for _, count in ranked])
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    with open(args.output_dir / "barcode_freq.tsv", "w") as table:
+        for barcode, count in ranked:
+            table.write(f"{decode_barcode(barcode, barcode_length)}\t{count}\n")
+    with open(args.output_dir / "permit_list.txt", "w") as permit:
+        for barcode, _ in ranked[:knee]:
+            permit.write(decode_barcode(barcode, barcode_length) + "\n")
+    summary = {
+        "shards": len(paths),
+        "barcode_length": barcode_length,
+        "barcodes": len(ranked),
+        "reads": sum(merged.values()),
+        "knee_barcodes": knee,
+        "knee_reads": ranked[knee - 1][1] if ranked else 0,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    (args.output_dir / "knee.json").write_text(json.dumps(summary, indent=2, sort_keys=True) + "\n")
+    json.dump(summary, sys.stdout, sort_keys=True)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
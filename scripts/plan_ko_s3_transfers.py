@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
-"""Print, but never execute, the KO FASTQ-to-S3 transfer plan."""
+"""Print, but never execute, the KO FASTQ-to-S3 transfer plan.
+
+Direct vs split and each split pair's shard schedule come from
+``plan_shards.py``; the full shard plan is also written to ``--plan-output``.
+"""
 
 from __future__ import annotations
 
@@ -9,8 +13,8 @@ import shlex
 import sys
 from pathlib import Path
 
-
-GIB = 1024**3
+import plan_shards
+from shard_sizing import format_shard_schedule
 
 
 def shell_join(parts: list[str]) -> str:
@@ -51,17 +55,26 @@ def main() -> int:
     parser.add_argument("--s3-prefix", default="ko")
     parser.add_argument("--region", default="us-east-2")
     parser.add_argument("--cores", type=int, default=32)
-    parser.add_argument("--direct-gzip-max-bytes", type=int, default=GIB)
-    parser.add_argument("--split-lines", type=int, default=16_000_000)
+    parser.add_argument(
+        "--lambda-concurrency", type=int, default=plan_shards.DEFAULT_LAMBDA_CONCURRENCY
+    )
+    parser.add_argument("--uplink-gbps", type=float, default=10.0)
+    parser.add_argument(
+        "--read-pairs-per-shard", type=int, default=plan_shards.DEFAULT_MAX_READ_PAIRS,
+        help="largest shard the planner may choose",
+    )
+    parser.add_argument("--plan-output", type=Path, default=Path("ko_shard_plan.tsv"))
     parser.add_argument("--check-local", action="store_true")
     args = parser.parse_args()
 
     if args.cores <= 0:
         parser.error("--cores must be positive")
-    if args.direct_gzip_max_bytes <= 0:
-        parser.error("--direct-gzip-max-bytes must be positive")
-    if args.split_lines <= 0 or args.split_lines % 4:
-        parser.error("--split-lines must be positive and divisible by four")
+    if args.lambda_concurrency < 0:
+        parser.error("--lambda-concurrency must not be negative")
+    if args.uplink_gbps <= 0:
+        parser.error("--uplink-gbps must be positive")
+    if args.read_pairs_per_shard <= 0:
+        parser.error("--read-pairs-per-shard must be positive")
 
     try:
         rows = read_rows(args.manifest)
@@ -92,24 +105,38 @@ def main() -> int:
                 print(f"  ... and {len(errors) - 20} more", file=sys.stderr)
             return 1
 
-    direct = [row for row in rows if int(row["combined_bytes"]) < args.direct_gzip_max_bytes]
-    split = [row for row in rows if int(row["combined_bytes"]) >= args.direct_gzip_max_bytes]
+    params = plan_shards.PlanParameters(
+        lambda_concurrency=args.lambda_concurrency,
+        cores=args.cores,
+        uplink_gbps=args.uplink_gbps,
+        max_read_pairs=args.read_pairs_per_shard,
+        local_input=True,
+    )
+    lanes = [
+        plan_shards.Lane(row["pair_name"], int(row["combined_bytes"])) for row in rows
+    ]
+    plan = plan_shards.plan_lanes(lanes, params)
+    plan_shards.save_plan(plan, params, args.plan_output)
+    schedules = {
+        lane_plan.lane.name: format_shard_schedule(lane_plan.schedule)
+        for lane_plan in plan.lanes
+        if lane_plan.mode == "split"
+    }
+    # Both lists stay largest first, as in the manifest order.
+    direct = [row for row in rows if row["pair_name"] not in schedules]
+    split = [row for row in rows if row["pair_name"] in schedules]
     split_file_count = len(split) * 2
-    decompressor = "gzip"
-    decompressor_threads = 1
-    if split_file_count < args.cores:
-        decompressor_threads = min(8, args.cores // split_file_count)
-        if decompressor_threads > 1:
-            decompressor = "rapidgzip"
-        else:
-            decompressor_threads = 1
-    max_pair_workers = max(1, args.cores // (2 * decompressor_threads))
+    decompressor_threads = plan.threads_per_file
+    decompressor = "rapidgzip" if decompressor_threads > 1 else "gzip"
+    max_pair_workers = plan.concurrent_lanes
+    split_lines = args.read_pairs_per_shard * 4
 
     print("# DRY RUN ONLY: the planner executes no AWS, gzip, or rapidgzip command.")
     print(f"# pairs={len(rows)} direct={len(direct)} split={len(split)}")
     print(
-        f"# direct_cutoff_bytes={args.direct_gzip_max_bytes} "
-        f"split_lines={args.split_lines} reads_per_shard={args.split_lines // 4}"
+        f"# shard_plan={args.plan_output} "
+        f"predicted_makespan_seconds={plan.makespan_seconds:.1f} "
+        f"invocations={plan.invocations} max_reads_per_shard={args.read_pairs_per_shard}"
     )
     print(
         f"# split_files={split_file_count} cores={args.cores} "
@@ -126,6 +153,7 @@ def main() -> int:
             "env",
             f"FASTQ_DECOMPRESSOR={decompressor}",
             f"DECOMP_THREADS={decompressor_threads}",
+            f"SHARD_SCHEDULE={schedules[row['pair_name']]}",
             "bash",
             str(scripts_dir / "split_upload_trigger_local.sh"),
             args.fastq_bucket,
@@ -133,7 +161,7 @@ def main() -> int:
             str(args.fastq_dir / row["r2_filename"]),
             f"{args.s3_prefix}/{row['pair_name']}",
             args.input_txt_bucket,
-            str(args.split_lines),
+            str(split_lines),
         ]
         print(
             f"# queue_position={index + 1} priority={row['priority']} "
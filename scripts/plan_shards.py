@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""Choose direct-vs-split and shard sizes per lane to minimise predicted wall time.
+
+The planner replaces the fixed direct-pass cutoff and the fixed 4M-pair shard
+with a small makespan model of one run:
+
+- Split lanes are cut largest first on the driver, ``concurrent_lanes`` at a
+  time, with the same thread apportioning as ``process_fastq_bash``. A lane
+  produces read pairs at the lesser of its decompression rate and its share of
+  the uplink, and each shard is handed to Lambda as soon as it is cut.
+- A direct lane is one Lambda that maps the whole compressed pair.
+- Every invocation costs a fixed overhead plus its read pairs at the measured
+  mapping rate, and waits for a free slot when Lambda concurrency is capped.
+- With ``--batch-shards`` above 1, consecutive shards of a lane share one
+  invocation (``pack_batches``): it starts when its last shard is cut, and
+  each shard after the first costs only a warm overhead. A batch is closed
+  before it is predicted to run past the Lambda timeout margin.
+
+Within a lane, shards taper towards the end of its stream. Each earlier shard
+is larger by the pairs the driver cuts while later shards map, so all of a
+lane's shards are predicted to finish together instead of waiting on one full
+shard cut last. The planner tries every count of smallest eligible lanes sent
+direct and a few maximum shard sizes, and keeps the plan with the shortest
+predicted makespan (fewest invocations on ties). With ``--fixed-shard-size``
+(``SHARD_ENGINE=split``, which ignores ``SHARD_SCHEDULE``) every shard is
+``--max-read-pairs``, so the plan predicts the run that engine makes.
+
+The plan is a TSV, one row per lane in processing order, preceded by ``#``
+lines with the prediction and every model parameter so it can be reviewed
+before a run. ``shard_schedule`` is the ``SHARD_SCHEDULE`` value for
+``fastq_shard_engine.py`` and ``gzip_range_index.py``.
+
+    plan_shards.py inventory.tsv --output shard_plan.tsv
+
+The inventory is a TSV with ``lane`` and ``combined_bytes`` columns, plus
+optional ``r1`` and ``r2`` columns that are copied into the plan.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import heapq
+import math
+import os
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Sequence, TextIO
+
+from shard_sizing import detect_uplink_gbps, format_shard_schedule
+
+
+# Piscem on a plain-FASTQ shard (docs/PISCEM_SHARD_PROFILE.md).
+MAP_PAIRS_PER_SECOND = 561_000
+# Piscem reading a whole lane gzip: the slowest KO direct invocation mapped
+# about 95M pairs in 494 s (docs/KO_ASYNC_BENCHMARK_2026-08-20.md).
+DIRECT_PAIRS_PER_SECOND = 190_000
+# KO split invocations averaged 19.67 s for 4M pairs, 7.1 s of which mapped.
+INVOCATION_OVERHEAD_SECONDS = 12.5
+# PBMC 10K: 639M pairs cut and uploaded in 338 s on 32 vCPUs.
+DECOMPRESS_PAIRS_PER_CORE = 60_000
+# KO: 513 GB of R1+R2 gzip for 6.62G read pairs, 446 bytes per split pair.
+COMPRESSED_BYTES_PER_PAIR = 77.0
+FASTQ_BYTES_PER_PAIR = 446.0
+DEFAULT_MAX_READ_PAIRS = 4_000_000
+DEFAULT_MIN_READ_PAIRS = 500_000
+DEFAULT_LAMBDA_CONCURRENCY = 1000
+LAMBDA_TIMEOUT_SECONDS = 900.0
+# Direct lanes must be predicted to finish well inside the function timeout.
+DIRECT_TIMEOUT_FRACTION = 0.8
+SMALL_LAMBDA_MEMORY_MB = 3008
+MAX_THREADS_PER_FILE = 8
+SHARD_SIZE_STEPS = (1.0, 0.75, 0.5, 0.25)
+# A batched shard after the first skips the cold start and event delivery;
+# its claim, Piscem start-up and output upload remain.
+WARM_SHARD_OVERHEAD_SECONDS = 4.0
+
+PLAN_FIELDS = (
+    "order",
+    "lane",
+    "mode",
+    "combined_bytes",
+    "est_read_pairs",
+    "shards",
+    "shard_schedule",
+    "start_seconds",
+    "finish_seconds",
+    "r1",
+    "r2",
+)
+
+
+@dataclass(frozen=True)
+class Lane:
+    name: str
+    combined_bytes: int
+    r1: str = ""
+    r2: str = ""
+
+
+@dataclass(frozen=True)
+class PlanParameters:
+    lambda_concurrency: int = DEFAULT_LAMBDA_CONCURRENCY  # 0 is unrestricted
+    cores: int = 32
+    uplink_gbps: float = 10.0
+    max_read_pairs: int = DEFAULT_MAX_READ_PAIRS
+    min_read_pairs: int = DEFAULT_MIN_READ_PAIRS
+    max_threads_per_file: int = MAX_THREADS_PER_FILE
+    map_pairs_per_second: float = MAP_PAIRS_PER_SECOND
+    direct_pairs_per_second: float = DIRECT_PAIRS_PER_SECOND
+    invocation_overhead_seconds: float = INVOCATION_OVERHEAD_SECONDS
+    decompress_pairs_per_core: float = DECOMPRESS_PAIRS_PER_CORE
+    compressed_bytes_per_pair: float = COMPRESSED_BYTES_PER_PAIR
+    fastq_bytes_per_pair: float = FASTQ_BYTES_PER_PAIR
+    lambda_timeout_seconds: float = LAMBDA_TIMEOUT_SECONDS
+    allow_direct: bool = True
+    local_input: bool = False
+    taper: bool = True
+    # The coreutils split engine ignores SHARD_SCHEDULE and always cuts
+    # max_read_pairs shards, so only that size is planned.
+    fixed_shard_size: bool = False
+    batch_shards: int = 1
+
+
+@dataclass(frozen=True)
+class LanePlan:
+    lane: Lane
+    mode: str
+    read_pairs: int
+    schedule: tuple[int, ...]
+    # Split: when the driver starts cutting. Direct: when its manifest can go out.
+    start_seconds: float
+    finish_seconds: float
+
+
+@dataclass(frozen=True)
+class ShardPlan:
+    lanes: tuple[LanePlan, ...]
+    makespan_seconds: float
+    invocations: int
+    threads_per_file: int
+    concurrent_lanes: int
+
+
+def parameters_from_env() -> PlanParameters:
+    """Model parameters from the variables the drivers already export."""
+    concurrency = os.getenv("LAMBDA_CONCURRENCY", "")
+    memory_mb = os.getenv("LAMBDA_MEMORY_MB", "")
+    split_lines = os.getenv("SPLIT_LINES", "")
+    max_read_pairs = os.getenv("READ_PAIRS_PER_SHARD", "") or (
+        str(int(split_lines) // 4) if split_lines else ""
+    )
+    return PlanParameters(
+        lambda_concurrency=(
+            0 if concurrency == "unrestricted"
+            else int(concurrency or DEFAULT_LAMBDA_CONCURRENCY)
+        ),
+        cores=os.cpu_count() or 1,
+        uplink_gbps=detect_uplink_gbps(),
+        max_read_pairs=int(max_read_pairs or DEFAULT_MAX_READ_PAIRS),
+        min_read_pairs=int(os.getenv("SHARD_MIN_READ_PAIRS") or DEFAULT_MIN_READ_PAIRS),
+        map_pairs_per_second=float(os.getenv("MAP_PAIRS_PER_SECOND") or MAP_PAIRS_PER_SECOND),
+        direct_pairs_per_second=float(
+            os.getenv("DIRECT_PAIRS_PER_SECOND") or DIRECT_PAIRS_PER_SECOND
+        ),
+        allow_direct=not (0 < int(memory_mb or 0) <= SMALL_LAMBDA_MEMORY_MB),
+        local_input=bool(os.getenv("LOCAL_FASTQ_DIR")),
+        batch_shards=int(os.getenv("SHARD_BATCH_SHARDS") or 1),
+        fixed_shard_size=os.getenv("SHARD_ENGINE", "python") == "split",
+    )
+
+
+def estimate_read_pairs(lane: Lane, params: PlanParameters) -> int:
+    return max(1, round(lane.combined_bytes / params.compressed_bytes_per_pair))
+
+
+def driver_slots(split_lanes: int, params: PlanParameters) -> tuple[int, int]:
+    """Decompressor threads per file and lanes cut at once, as in process_fastq_bash."""
+    files = split_lanes * 2
+    threads = 1
+    if files and files < params.cores:
+        threads = min(params.max_threads_per_file, params.cores // files)
+    return threads, max(1, params.cores // (threads * 2))
+
+
+def lane_pair_rate(threads: int, concurrent_lanes: int, params: PlanParameters) -> float:
+    """Read pairs per second one split lane cuts and uploads."""
+    decompress = 2 * threads * params.decompress_pairs_per_core
+    uplink = params.uplink_gbps * 1e9 / 8 / concurrent_lanes / params.fastq_bytes_per_pair
+    return min(decompress, uplink)
+
+
+def uniform_schedule(read_pairs: int, max_pairs: int) -> tuple[int, ...]:
+    full, rest = divmod(read_pairs, max_pairs)
+    return tuple([max_pairs] * full + ([rest] if rest else []))
+
+
+def taper_schedule(
+    read_pairs: int, max_pairs: int, min_pairs: int, map_rate: float, cut_rate: float
+) -> tuple[int, ...]:
+    """Shard sizes that shrink towards the end of a lane.
+
+    Shard ``k`` is handed over ``later / cut_rate`` seconds before the last
+    one, where ``later`` is the pairs in the shards after it. Making it that
+    much longer to map, ``min_pairs + later * map_rate / cut_rate`` pairs,
+    predicts all of them finishing together.
+    """
+    min_pairs = min(min_pairs, max_pairs)
+    tail: list[int] = []
+    later = 0
+    size = min_pairs
+    while size < max_pairs and later + size < read_pairs:
+        tail.append(size)
+        later += size
+        size = min(max_pairs, math.ceil(min_pairs + later * map_rate / cut_rate))
+    head = list(reversed(uniform_schedule(read_pairs - later, max_pairs)))
+    return tuple(head + tail[::-1])
+
+
+def batch_seconds(read_pairs: Sequence[int], params: PlanParameters) -> float:
+    """Predicted seconds for one invocation mapping ``read_pairs`` shards back to back."""
+    return (
+        params.invocation_overhead_seconds
+        + WARM_SHARD_OVERHEAD_SECONDS * max(0, len(read_pairs) - 1)
+        + sum(read_pairs) / params.map_pairs_per_second
+    )
+
+
+def batch_fits(read_pairs: Sequence[int], params: PlanParameters) -> bool:
+    """True when one invocation may take all of ``read_pairs``."""
+    if len(read_pairs) > max(1, params.batch_shards):
+        return False
+    limit = params.lambda_timeout_seconds * DIRECT_TIMEOUT_FRACTION
+    return len(read_pairs) <= 1 or batch_seconds(read_pairs, params) <= limit
+
+
+def pack_batches(schedule: Sequence[int], params: PlanParameters) -> list[tuple[int, ...]]:
+    """Group a lane's consecutive shards into invocations that fit the timeout."""
+    batches: list[tuple[int, ...]] = []
+    current: list[int] = []
+    for size in schedule:
+        if current and not batch_fits([*current, size], params):
+            batches.append(tuple(current))
+            current = []
+        current.append(size)
+    if current:
+        batches.append(tuple(current))
+    return batches
+
+
+def finish_times(
+    jobs: Sequence[tuple[float, float]], concurrency: int
+) -> list[float]:
+    """Finish time of each ``(ready, duration)`` job on ``concurrency`` Lambda slots."""
+    if concurrency <= 0 or concurrency >= len(jobs):
+        return [ready + duration for ready, duration in jobs]
+    finishes = [0.0] * len(jobs)
+    slots = [0.0] * concurrency
+    for index in sorted(range(len(jobs)), key=lambda item: jobs[item][0]):
+        ready, duration = jobs[index]
+        finishes[index] = max(ready, heapq.heappop(slots)) + duration
+        heapq.heappush(slots, finishes[index])
+    return finishes
+
+
+def build_plan(
+    lanes: Sequence[Lane], direct: set[str], max_pairs: int, params: PlanParameters
+) -> ShardPlan:
+    """Predict one run with ``direct`` lanes passed whole and the rest split."""
+    split = [lane for lane in lanes if lane.name not in direct]
+    threads, concurrent_lanes = driver_slots(len(split), params)
+    cut_rate = lane_pair_rate(threads, concurrent_lanes, params)
+    overhead = params.invocation_overhead_seconds
+    jobs: list[tuple[float, float]] = []
+    owners: list[int] = []
+    entries: list[tuple[Lane, str, int, tuple[int, ...], float]] = []
+
+    driver = [0.0] * concurrent_lanes
+    for lane in split:
+        read_pairs = estimate_read_pairs(lane, params)
+        if params.taper and not params.fixed_shard_size:
+            schedule = taper_schedule(
+                read_pairs, max_pairs, params.min_read_pairs,
+                params.map_pairs_per_second, cut_rate,
+            )
+        else:
+            schedule = uniform_schedule(read_pairs, max_pairs)
+        start = clock = heapq.heappop(driver)
+        for batch in pack_batches(schedule, params):
+            # A batch is published once its last shard is cut.
+            clock += sum(batch) / cut_rate
+            jobs.append((clock, batch_seconds(batch, params)))
+            owners.append(len(entries))
+        heapq.heappush(driver, clock)
+        entries.append((lane, "split", read_pairs, schedule, start))
+
+    uplink_bytes_per_second = params.uplink_gbps * 1e9 / 8
+    upload_clock = 0.0
+    for lane in lanes:
+        if lane.name not in direct:
+            continue
+        read_pairs = estimate_read_pairs(lane, params)
+        if params.local_input:
+            upload_clock += lane.combined_bytes / uplink_bytes_per_second
+        jobs.append((upload_clock, overhead + read_pairs / params.direct_pairs_per_second))
+        owners.append(len(entries))
+        entries.append((lane, "direct", read_pairs, (read_pairs,), upload_clock))
+
+    lane_finish = [0.0] * len(entries)
+    for owner, finish in zip(owners, finish_times(jobs, params.lambda_concurrency)):
+        lane_finish[owner] = max(lane_finish[owner], finish)
+    plans = tuple(
+        LanePlan(lane, mode, read_pairs, schedule, start, lane_finish[index])
+        for index, (lane, mode, read_pairs, schedule, start) in enumerate(entries)
+    )
+    return ShardPlan(
+        lanes=plans,
+        makespan_seconds=max(lane_finish, default=0.0),
+        invocations=len(jobs),
+        threads_per_file=threads,
+        concurrent_lanes=concurrent_lanes,
+    )
+
+
+def direct_eligible(lane: Lane, params: PlanParameters) -> bool:
+    if not params.allow_direct:
+        return False
+    seconds = params.invocation_overhead_seconds + (
+        estimate_read_pairs(lane, params) / params.direct_pairs_per_second
+    )
+    return seconds <= params.lambda_timeout_seconds * DIRECT_TIMEOUT_FRACTION
+
+
+def plan_lanes(lanes: Sequence[Lane], params: PlanParameters) -> ShardPlan:
+    """Search direct-lane counts and maximum shard sizes for the shortest makespan."""
+    ordered = sorted(lanes, key=lambda lane: (-lane.combined_bytes, lane.name))
+    eligible = [lane.name for lane in reversed(ordered) if direct_eligible(lane, params)]
+    floor = min(params.min_read_pairs, params.max_read_pairs)
+    shard_sizes = sorted(
+        {max(floor, int(params.max_read_pairs * step)) for step in SHARD_SIZE_STEPS},
+        reverse=True,
+    )
+    if params.fixed_shard_size:
+        shard_sizes = [params.max_read_pairs]
+    best: ShardPlan | None = None
+    for count in range(len(eligible) + 1):
+        direct = set(eligible[:count])
+        for max_pairs in shard_sizes:
+            plan = build_plan(ordered, direct, max_pairs, params)
+            key = (round(plan.makespan_seconds, 1), plan.invocations)
+            if best is None or key < (round(best.makespan_seconds, 1), best.invocations):
+                best = plan
+            if count == len(ordered):
+                break  # Nothing left to split; shard size is irrelevant.
+    return best
+
+
+def read_inventory(path: Path) -> list[Lane]:
+    with path.open(newline="") as handle:
+        rows = list(csv.DictReader(handle, delimiter="\t"))
+    missing = {"lane", "combined_bytes"} - set(rows[0] if rows else ())
+    if missing:
+        raise ValueError(f"inventory is missing column(s): {', '.join(sorted(missing))}")
+    return [
+        Lane(row["lane"], int(row["combined_bytes"]), row.get("r1") or "", row.get("r2") or "")
+        for row in rows
+    ]
+
+
+def write_plan(plan: ShardPlan, params: PlanParameters, output: TextIO) -> None:
+    output.write(
+        f"# predicted_makespan_seconds={plan.makespan_seconds:.1f} "
+        f"invocations={plan.invocations} "
+        f"direct={sum(lane.mode == 'direct' for lane in plan.lanes)} "
+        f"split={sum(lane.mode == 'split' for lane in plan.lanes)}\n"
+    )
+    output.write(
+        f"# threads_per_file={plan.threads_per_file} concurrent_lanes={plan.concurrent_lanes}\n"
+    )
+    output.write(
+        "# " + " ".join(f"{name}={value}" for name, value in asdict(params).items()) + "\n"
+    )
+    writer = csv.writer(output, delimiter="\t", lineterminator="\n")
+    writer.writerow(PLAN_FIELDS)
+    for order, lane_plan in enumerate(plan.lanes):
+        writer.writerow(
+            [
+                order,
+                lane_plan.lane.name,
+                lane_plan.mode,
+                lane_plan.lane.combined_bytes,
+                lane_plan.read_pairs,
+                len(lane_plan.schedule),
+                format_shard_schedule(lane_plan.schedule) if lane_plan.mode == "split" else "",
+                f"{lane_plan.start_seconds:.1f}",
+                f"{lane_plan.finish_seconds:.1f}",
+                lane_plan.lane.r1,
+                lane_plan.lane.r2,
+            ]
+        )
+
+
+def save_plan(plan: ShardPlan, params: PlanParameters, path: str | Path) -> None:
+    with open(path, "w", newline="") as handle:
+        write_plan(plan, params, handle)
+
+
+def main(argv: list[str] | None = None) -> int:
+    defaults = parameters_from_env()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("inventory", type=Path)
+    parser.add_argument("--output", default="-", help="plan TSV path; - writes stdout")
+    parser.add_argument("--lambda-concurrency", type=int, default=defaults.lambda_concurrency)
+    parser.add_argument("--cores", type=int, default=defaults.cores)
+    parser.add_argument("--uplink-gbps", type=float, default=defaults.uplink_gbps)
+    parser.add_argument("--max-read-pairs", type=int, default=defaults.max_read_pairs)
+    parser.add_argument("--min-read-pairs", type=int, default=defaults.min_read_pairs)
+    parser.add_argument("--max-threads-per-file", type=int, default=defaults.max_threads_per_file)
+    parser.add_argument(
+        "--map-pairs-per-second", type=float, default=defaults.map_pairs_per_second
+    )
+    parser.add_argument(
+        "--direct-pairs-per-second", type=float, default=defaults.direct_pairs_per_second
+    )
+    parser.add_argument(
+        "--invocation-overhead-seconds",
+        type=float,
+        default=defaults.invocation_overhead_seconds,
+    )
+    parser.add_argument(
+        "--decompress-pairs-per-core", type=float, default=defaults.decompress_pairs_per_core
+    )
+    parser.add_argument(
+        "--compressed-bytes-per-pair", type=float, default=defaults.compressed_bytes_per_pair
+    )
+    parser.add_argument("--fastq-bytes-per-pair", type=float, default=defaults.fastq_bytes_per_pair)
+    parser.add_argument(
+        "--lambda-timeout-seconds", type=float, default=defaults.lambda_timeout_seconds
+    )
+    parser.add_argument(
+        "--no-direct",
+        dest="allow_direct",
+        action="store_false",
+        default=defaults.allow_direct,
+        help="split every lane (forced when LAMBDA_MEMORY_MB <= 3008)",
+    )
+    parser.add_argument(
+        "--local-input",
+        action="store_true",
+        default=defaults.local_input,
+        help="direct lanes must first be uploaded from the driver",
+    )
+    parser.add_argument("--no-taper", dest="taper", action="store_false")
+    parser.add_argument(
+        "--fixed-shard-size",
+        action="store_true",
+        default=defaults.fixed_shard_size,
+        help="plan only --max-read-pairs shards, as SHARD_ENGINE=split cuts",
+    )
+    parser.add_argument(
+        "--batch-shards",
+        type=int,
+        default=defaults.batch_shards,
+        help="most shards one invocation maps back to back (SHARD_BATCH_SHARDS)",
+    )
+    args = parser.parse_args(argv)
+
+    params = PlanParameters(
+        **{name: getattr(args, name) for name in asdict(defaults)}
+    )
+    if params.lambda_concurrency < 0:
+        parser.error("--lambda-concurrency must not be negative")
+    if min(params.cores, params.max_read_pairs, params.min_read_pairs,
+           params.max_threads_per_file, params.batch_shards) <= 0:
+        parser.error("core, thread, and read-pair counts must be positive")
+    if min(params.uplink_gbps, params.map_pairs_per_second, params.direct_pairs_per_second,
+           params.decompress_pairs_per_core, params.compressed_bytes_per_pair,
+           params.fastq_bytes_per_pair, params.lambda_timeout_seconds) <= 0:
+        parser.error("rates, sizes, and the Lambda timeout must be positive")
+
+    try:
+        lanes = read_inventory(args.inventory)
+    except (OSError, ValueError) as error:
+        print(f"ERROR: {error}", file=sys.stderr)
+        return 1
+    if not lanes:
+        print(f"ERROR: no lanes in {args.inventory}", file=sys.stderr)
+        return 1
+
+    plan = plan_lanes(lanes, params)
+    if args.output == "-":
+        write_plan(plan, params, sys.stdout)
+    else:
+        save_plan(plan, params, args.output)
+        print(
+            f"Wrote {args.output}: {len(plan.lanes)} lane(s), "
+            f"predicted makespan {plan.makespan_seconds:.1f} s",
+            file=sys.stderr,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
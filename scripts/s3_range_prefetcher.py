@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Download one S3 object with parallel ranged GETs while its prefix is consumed.
+
+``fetch`` preallocates the local file as a sparse file and fills it with
+``--workers`` concurrent ranged GETs, handing out ``--chunk-mib`` chunks in
+offset order. After every piece it publishes a watermark: every byte below it
+is on disk. The watermark lives in ``<path>.watermark`` as
+``<bytes> <size> <state>``, replaced atomically; state is ``fetching``,
+``done`` or ``failed``.
+
+``follow`` copies the file to stdout as the watermark advances, so a
+decompressor can read the finished prefix while the tail is still
+downloading. It exits nonzero if the fetch fails.
+
+    s3_range_prefetcher.py fetch s3://bucket/lane_R1_001.fastq.gz /mnt/nvme/r1.gz &
+    s3_range_prefetcher.py follow /mnt/nvme/r1.gz | rapidgzip -d -c -P 8 | ...
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import BinaryIO
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from fastq_shard_engine import TimingLog
+from s3_upload_service import parse_s3_uri
+
+
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+DEFAULT_WORKERS = 8
+PIECE_BYTES = 8 * 1024 * 1024
+CHUNK_ATTEMPTS = 3
+FOLLOW_POLL_SECONDS = 0.02
+WATERMARK_WAIT_SECONDS = 300.0
+
+
+class PrefetchError(RuntimeError):
+    """The prefetch of an object failed or its watermark never appeared."""
+
+
+def watermark_path(path: str) -> str:
+    return f"{path}.watermark"
+
+
+def write_watermark(path: str, watermark: int, size: int, state: str) -> None:
+    target = watermark_path(path)
+    temporary = f"{target}.{os.getpid()}.tmp"
+    with open(temporary, "w") as handle:
+        handle.write(f"{watermark} {size} {state}\n")
+    os.replace(temporary, target)
+
+
+def read_watermark(path: str) -> tuple[int, int, str] | None:
+    try:
+        with open(watermark_path(path)) as handle:
+            watermark, size, state = handle.read().split()
+    except (FileNotFoundError, ValueError):
+        return None
+    return int(watermark), int(size), state
+
+
+class RangePrefetcher:
+    """Fill a sparse local file from S3 with concurrent ranged GETs."""
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        key: str,
+        path: str,
+        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+        workers: int = DEFAULT_WORKERS,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.workers = workers
+        self.size = 0
+        self.filled: list[int] = []
+        self.next_chunk = 0
+        self.watermark = 0
+        self.lock = threading.Lock()
+        self.error: BaseException | None = None
+
+    def chunk_length(self, chunk: int) -> int:
+        return min(self.chunk_bytes, self.size - chunk * self.chunk_bytes)
+
+    def advance(self, chunk: int, length: int) -> None:
+        """Record ``length`` more contiguous bytes in ``chunk`` and move the watermark."""
+        with self.lock:
+            self.filled[chunk] += length
+            watermark = self.watermark
+            first = watermark // self.chunk_bytes
+            while first < len(self.filled):
+                start = first * self.chunk_bytes
+                watermark = start + self.filled[first]
+                if self.filled[first] < self.chunk_length(first):
+                    break
+                first += 1
+            if watermark != self.watermark:
+                self.watermark = watermark
+                write_watermark(self.path, watermark, self.size, "fetching")
+
+    def fetch_chunk(self, fd: int, chunk: int) -> None:
+        end = chunk * self.chunk_bytes + self.chunk_length(chunk) - 1
+        for attempt in range(1, CHUNK_ATTEMPTS + 1):
+            offset = chunk * self.chunk_bytes + self.filled[chunk]
+            if offset > end:
+                return
+            try:
+                response = self.client.get_object(
+                    Bucket=self.bucket, Key=self.key, Range=f"bytes={offset}-{end}"
+                )
+                body = response["Body"]
+                try:
+                    while True:
+                        piece = body.read(PIECE_BYTES)
+                        if not piece:
+                            break
+                        view = memoryview(piece)
+                        while view:
+                            written = os.pwrite(fd, view, offset)
+                            offset += written
+                            view = view[written:]
+                        self.advance(chunk, len(piece))
+                finally:
+                    body.close()
+                if offset > end:
+                    return
+                raise IOError(f"short ranged GET for s3://{self.bucket}/{self.key} at {offset}")
+            except Exception:
+                if attempt == CHUNK_ATTEMPTS:
+                    raise
+
+    def worker(self, fd: int) -> None:
+        try:
+            while True:
+                with self.lock:
+                    if self.error is not None or self.next_chunk >= len(self.filled):
+                        return
+                    chunk = self.next_chunk
+                    self.next_chunk += 1
+                self.fetch_chunk(fd, chunk)
+        except BaseException as error:
+            with self.lock:
+                self.error = self.error or error
+
+    def run(self) -> None:
+        self.size = int(
+            self.client.head_object(Bucket=self.bucket, Key=self.key)["ContentLength"]
+        )
+        self.filled = [0] * max(1, -(-self.size // self.chunk_bytes))
+        with open(self.path, "wb") as handle:
+            handle.truncate(self.size)
+        write_watermark(self.path, 0, self.size, "fetching")
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            threads = [
+                threading.Thread(target=self.worker, args=(fd,), name=f"prefetch-{index}")
+                for index in range(min(self.workers, len(self.filled)))
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            os.close(fd)
+        if self.error is not None:
+            write_watermark(self.path, self.watermark, self.size, "failed")
+            raise PrefetchError(f"prefetch of s3://{self.bucket}/{self.key} failed: {self.error}")
+        write_watermark(self.path, self.size, self.size, "done")
+
+
+def follow(path: str, output: BinaryIO, wait_seconds: float = WATERMARK_WAIT_SECONDS) -> int:
+    """Copy ``path`` to ``output`` as its watermark advances; return bytes copied."""
+    deadline = time.monotonic() + wait_seconds
+    while (state := read_watermark(path)) is None:
+        if time.monotonic() > deadline:
+            raise PrefetchError(f"no prefetch watermark for {path}")
+        time.sleep(FOLLOW_POLL_SECONDS)
+    position = 0
+    # Unbuffered: a buffered reader would cache not-yet-written sparse zeros.
+    with open(path, "rb", buffering=0) as source:
+        while True:
+            watermark, size, status = state
+            if status == "failed":
+                raise PrefetchError(f"prefetch for {path} failed at byte {watermark}")
+            while position < watermark:
+                block = source.read(min(PIECE_BYTES, watermark - position))
+                if not block:
+                    raise PrefetchError(f"{path} is shorter than its watermark {watermark}")
+                output.write(block)
+                position += len(block)
+            if status == "done" and position >= size:
+                output.flush()
+                return position
+            time.sleep(FOLLOW_POLL_SECONDS)
+            state = read_watermark(path) or state
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    fetch_parser = commands.add_parser("fetch", help="download an object into a sparse file")
+    fetch_parser.add_argument("s3_uri")
+    fetch_parser.add_argument("path")
+    fetch_parser.add_argument(
+        "--chunk-mib",
+        type=int,
+        default=int(os.getenv("S3_PREFETCH_CHUNK_MIB", str(DEFAULT_CHUNK_BYTES // 1024**2))),
+    )
+    fetch_parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("S3_PREFETCH_WORKERS", str(DEFAULT_WORKERS)))
+    )
+    fetch_parser.add_argument(
+        "--region",
+        default=os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "us-east-2",
+    )
+    fetch_parser.add_argument("--timing-stage", default="")
+    fetch_parser.add_argument("--timings-file", default=os.getenv("SPLIT_TIMINGS_FILE", ""))
+    follow_parser = commands.add_parser("follow", help="stream a prefetching file to stdout")
+    follow_parser.add_argument("path")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "follow":
+            follow(args.path, sys.stdout.buffer)
+            return 0
+        if args.chunk_mib <= 0 or args.workers <= 0:
+            parser.error("--chunk-mib and --workers must be positive")
+        bucket, key = parse_s3_uri(args.s3_uri)
+        client = boto3.client(
+            "s3",
+            region_name=args.region,
+            config=Config(max_pool_connections=max(10, args.workers)),
+        )
+        start_ns = time.time_ns()
+        RangePrefetcher(
+            client, bucket, key, args.path, args.chunk_mib * 1024**2, args.workers
+        ).run()
+        if args.timing_stage:
+            TimingLog(args.timings_file).record(args.timing_stage, start_ns, time.time_ns())
+    except BrokenPipeError:
+        print(f"ERROR: reader of {args.path} exited early", file=sys.stderr)
+        return 1
+    except (BotoCoreError, ClientError, OSError, ValueError, PrefetchError) as error:
+        if args.command == "fetch" and (read_watermark(args.path) or (0, 0, ""))[2] != "failed":
+            # Release any follower that is still waiting for bytes.
+            write_watermark(args.path, 0, 0, "failed")
+        print(f"ERROR: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Long-lived S3 upload service with one warm connection pool.
+
+Every upload submitted here shares a single S3 client and transfer manager, so
+jobs reuse pooled TLS connections and multipart workers instead of paying
+interpreter startup, credential resolution, and a new handshake per
+``aws s3 cp`` process.
+
+As a command, it reads tab-separated ``LOCAL_PATH<TAB>s3://bucket/key`` jobs
+from stdin and starts each immediately. Every completion is acknowledged on
+stdout as ``OK<TAB>uri`` or ``ERROR<TAB>uri<TAB>message``, in completion
+order, so a shell coprocess can wait for exactly the jobs it submitted. The
+exit status is nonzero if any job failed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import sys
+import threading
+from typing import Callable, TextIO
+
+import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
+from s3transfer.subscribers import BaseSubscriber
+
+
+# Shared by process_fastq.py and every split worker on the driver.
+S3_CONFIG = TransferConfig(multipart_threshold=5 * 1024**2, max_concurrency=32)
+# Multipart workers and small PUTs must not queue for a pooled connection.
+MAX_POOL_CONNECTIONS = 64
+
+
+def parse_s3_uri(uri: str) -> tuple[str, str]:
+    if not uri.startswith("s3://"):
+        raise ValueError(f"not an s3:// URI: {uri}")
+    bucket, _, key = uri[5:].partition("/")
+    if not bucket or not key:
+        raise ValueError(f"S3 URI needs a bucket and key: {uri}")
+    return bucket, key
+
+
+class _DoneSubscriber(BaseSubscriber):
+    def __init__(self, callback: Callable[[BaseException | None], None]):
+        self.callback = callback
+
+    def on_done(self, future, **kwargs):
+        try:
+            future.result()
+        except BaseException as error:
+            self.callback(error)
+        else:
+            self.callback(None)
+
+
+class UploadService:
+    """Submit uploads to one shared S3 client and transfer manager."""
+
+    def __init__(self, region: str | None = None, config: TransferConfig = S3_CONFIG, client=None):
+        self.client = client or boto3.client(
+            "s3",
+            region_name=region,
+            config=Config(max_pool_connections=MAX_POOL_CONNECTIONS),
+        )
+        self.manager = create_transfer_manager(self.client, config)
+
+    def upload_file(self, path: str, bucket: str, key: str, on_done=None):
+        subscribers = [_DoneSubscriber(on_done)] if on_done else None
+        return self.manager.upload(path, bucket, key, subscribers=subscribers)
+
+    def upload_bytes(self, payload: bytes, bucket: str, key: str, on_done=None):
+        subscribers = [_DoneSubscriber(on_done)] if on_done else None
+        return self.manager.upload(io.BytesIO(payload), bucket, key, subscribers=subscribers)
+
+    def put_bytes(self, payload: bytes, bucket: str, key: str) -> None:
+        """Write a small object, such as a manifest, with one PUT."""
+        self.client.put_object(Bucket=bucket, Key=key, Body=payload)
+
+    def close(self) -> None:
+        self.manager.shutdown()
+
+    def __enter__(self) -> "UploadService":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def serve(service: UploadService, jobs: TextIO, acks: TextIO) -> int:
+    """Run stdin jobs through ``service`` and acknowledge each on ``acks``."""
+    lock = threading.Lock()
+    pending: list = []
+    failures = 0
+
+    def acknowledge(uri: str, error: BaseException | None) -> None:
+        nonlocal failures
+        with lock:
+            if error is None:
+                acks.write(f"OK\t{uri}\n")
+            else:
+                failures += 1
+                message = " ".join(str(error).split())
+                acks.write(f"ERROR\t{uri}\t{type(error).__name__}: {message}\n")
+            acks.flush()
+
+    for line in jobs:
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        fields = line.split("\t")
+        if len(fields) != 2:
+            fields = line.split()
+        uri = fields[-1]
+        try:
+            if len(fields) != 2:
+                raise ValueError(f"expected LOCAL_PATH<TAB>S3_URI, got {line!r}")
+            path = fields[0]
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"local file not found: {path}")
+            bucket, key = parse_s3_uri(uri)
+            pending.append(
+                service.upload_file(
+                    path, bucket, key, on_done=lambda error, uri=uri: acknowledge(uri, error)
+                )
+            )
+        except (OSError, ValueError) as error:
+            acknowledge(uri, error)
+
+    for future in pending:
+        try:
+            future.result()
+        except Exception:
+            pass
+    return 1 if failures else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--region",
+        default=os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "us-east-2",
+    )
+    args = parser.parse_args(argv)
+    with UploadService(args.region) as service:
+        return serve(service, sys.stdin, sys.stdout)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
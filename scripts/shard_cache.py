@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""Content-addressed cross-run cache of split FASTQ shards in S3.
+
+With ``SHARD_CACHE_URI`` set (e.g. ``s3://my-cache/shard-cache``), the shards
+of a lane are uploaded under ``<cache>/<key>/`` instead of next to the run's
+lane base, and once every pair has landed an ``index.json`` beside them lists
+each pair's R1/R2 URIs and read count. The index is written last, so a partly
+uploaded lane is never a hit.
+
+The key is a SHA-256 over the split parameters (lines per shard, shard
+schedule, shard codec) and a fingerprint of each gzip: its size and the
+SHA-256 of its first and last MiB. The fingerprint reads the same bytes from
+an S3 object (two ranged GETs) as from its local NVMe copy, so a lane keyed
+before download matches the shards cut after it; S3 ETags cannot do that
+because local copies have none and multipart ETags depend on the part size.
+
+On a hit the workers only republish the lane's ``_input.txt`` manifests,
+pointing at the cached shards, and print the pair count as their last line
+like a normal split:
+
+    shard_cache.py replay s3://bucket/lane_R1_001.fastq.gz s3://bucket/lane_R2_001.fastq.gz \\
+        runs/ko/lane_L001 input-txt-bucket 16000000
+
+``replay`` exits 0 on a hit and 3 on a miss, printing the key as its last
+line so the worker can pass it on as ``SHARD_CACHE_KEY``. Lambda needs read
+access to the cache bucket.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from dataclasses import dataclass
+from typing import Sequence
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from s3_upload_service import UploadService, parse_s3_uri
+
+
+CACHE_FORMAT = 1
+FINGERPRINT_BYTES = 1024 * 1024
+INDEX_NAME = "index.json"
+MISS_EXIT_STATUS = 3
+
+
+@dataclass(frozen=True)
+class CachedPair:
+    index: int
+    r1: str
+    r2: str
+    read_pairs: int
+
+
+def fingerprint_parts(size: int, head: bytes, tail: bytes) -> str:
+    digest = hashlib.sha256(head)
+    digest.update(tail)
+    return f"{size}:{digest.hexdigest()}"
+
+
+def source_fingerprint(source: str, client=None) -> str:
+    """Fingerprint a local gzip or an ``s3://`` object from its size, head and tail."""
+    if source.startswith("s3://"):
+        bucket, key = parse_s3_uri(source)
+        size = int(client.head_object(Bucket=bucket, Key=key)["ContentLength"])
+
+        def read_range(first: int, last: int) -> bytes:
+            if last < first:
+                return b""
+            body = client.get_object(Bucket=bucket, Key=key, Range=f"bytes={first}-{last}")["Body"]
+            try:
+                return body.read()
+            finally:
+                body.close()
+
+        head = read_range(0, min(size, FINGERPRINT_BYTES) - 1)
+        tail = read_range(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES), size - 1)
+        return fingerprint_parts(size, head, tail)
+    size = os.path.getsize(source)
+    with open(source, "rb") as handle:
+        head = handle.read(FINGERPRINT_BYTES)
+        handle.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+        tail = handle.read()
+    return fingerprint_parts(size, head, tail)
+
+
+def cache_key(r1_fingerprint: str, r2_fingerprint: str, split_lines: int, schedule: str, codec: str) -> str:
+    document = {
+        "codec": codec,
+        "format": CACHE_FORMAT,
+        "r1": r1_fingerprint,
+        "r2": r2_fingerprint,
+        # A schedule fixes every shard size, so SPLIT_LINES only matters without one.
+        "schedule": schedule,
+        "split_lines": 0 if schedule else split_lines,
+    }
+    return hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()
+
+
+class ShardCache:
+    """The ``<cache>/<key>/`` prefixes of one cache root."""
+
+    def __init__(self, client, uri: str):
+        self.client = client
+        self.bucket, prefix = parse_s3_uri(uri.rstrip("/") + "/")
+        self.prefix = prefix.rstrip("/")
+
+    def shard_prefix(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def index_key(self, key: str) -> str:
+        return f"{self.shard_prefix(key)}/{INDEX_NAME}"
+
+    def load(self, key: str) -> list[CachedPair] | None:
+        """Return the cached pairs for ``key``, or None unless every shard is present."""
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.index_key(key))["Body"]
+            document = json.loads(body.read())
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+        if document.get("format") != CACHE_FORMAT:
+            return None
+        pairs = [CachedPair(**pair) for pair in document["pairs"]]
+        if not pairs or self.missing_shards(key, pairs):
+            return None
+        return sorted(pairs, key=lambda pair: pair.index)
+
+    def missing_shards(self, key: str, pairs: Sequence[CachedPair]) -> bool:
+        """True when a lifecycle rule or a manual cleanup removed any shard."""
+        present: set[str] = set()
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.shard_prefix(key) + "/"):
+            present.update(f"s3://{self.bucket}/{item['Key']}" for item in page.get("Contents", []))
+        return any(pair.r1 not in present or pair.r2 not in present for pair in pairs)
+
+    def store(self, key: str, pairs: Sequence[CachedPair]) -> None:
+        """Write the index; call only after every shard in ``pairs`` has landed."""
+        document = {
+            "format": CACHE_FORMAT,
+            "key": key,
+            "pairs": [pair.__dict__ for pair in sorted(pairs, key=lambda pair: pair.index)],
+        }
+        payload = json.dumps(document, indent=1, sort_keys=True).encode()
+        self.client.put_object(Bucket=self.bucket, Key=self.index_key(key), Body=payload)
+
+
+def replay(pairs: Sequence[CachedPair], publisher) -> int:
+    """Publish the cached pairs' manifests through ``publisher``; return the count.
+
+    The publisher batches them exactly as it would freshly cut pairs.
+    """
+    for pair in pairs:
+        publisher.queue_manifest(pair)
+    publisher.flush_batch()
+    return len(pairs)
+
+
+def main(argv: list[str] | None = None) -> int:
+    from fastq_shard_engine import DEFAULT_SPLIT_LINES, ShardPublisher, TimingLog
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="republish a cached lane's manifests")
+    replay_parser.add_argument("r1", help="local gzip path or s3:// URI")
+    replay_parser.add_argument("r2")
+    replay_parser.add_argument("s3_base")
+    replay_parser.add_argument("input_txt_bucket")
+    replay_parser.add_argument(
+        "split_lines", nargs="?", type=int,
+        default=int(os.getenv("SPLIT_LINES") or DEFAULT_SPLIT_LINES),
+    )
+    replay_parser.add_argument("--cache-uri", default=os.getenv("SHARD_CACHE_URI", ""))
+    replay_parser.add_argument("--shard-schedule", default=os.getenv("SHARD_SCHEDULE", ""))
+    replay_parser.add_argument("--shard-codec", default=os.getenv("SHARD_CODEC", "none"))
+    replay_parser.add_argument(
+        "--batch-shards", type=int, default=int(os.getenv("SHARD_BATCH_SHARDS") or 1)
+    )
+    replay_parser.add_argument("--async-lambda-function", default=os.getenv("ASYNC_LAMBDA_FUNCTION", ""))
+    replay_parser.add_argument("--invoke-log-dir", default=os.getenv("LAMBDA_INVOKE_LOG_DIR", ""))
+    replay_parser.add_argument(
+        "--region",
+        default=os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") or "us-east-2",
+    )
+    args = parser.parse_args(argv)
+
+    if not args.cache_uri.startswith("s3://"):
+        parser.error("SHARD_CACHE_URI must be an s3:// URI")
+    if args.batch_shards <= 0:
+        parser.error("SHARD_BATCH_SHARDS must be positive")
+    client = boto3.client("s3", region_name=args.region)
+    try:
+        key = cache_key(
+            source_fingerprint(args.r1, client),
+            source_fingerprint(args.r2, client),
+            args.split_lines,
+            args.shard_schedule,
+            args.shard_codec,
+        )
+        cache = ShardCache(client, args.cache_uri)
+        pairs = cache.load(key)
+        if pairs is None:
+            print(f"Shard cache miss for {os.path.basename(args.s3_base)}")
+            print(key)
+            return MISS_EXIT_STATUS
+        lambda_client = None
+        if args.async_lambda_function:
+            os.makedirs(args.invoke_log_dir, exist_ok=True)
+            lambda_client = boto3.client("lambda", region_name=args.region)
+        with UploadService(args.region) as uploader:
+            publisher = ShardPublisher(
+                uploader, cache.bucket, args.s3_base, args.input_txt_bucket, TimingLog(None),
+                lambda_client=lambda_client, async_function=args.async_lambda_function,
+                invoke_log_dir=args.invoke_log_dir, batch_shards=args.batch_shards,
+            )
+            count = replay(pairs, publisher)
+    except (BotoCoreError, ClientError, OSError, ValueError, KeyError, TypeError, RuntimeError) as error:
+        print(f"ERROR: {error}", file=sys.stderr)
+        return 1
+    print(
+        f"Shard cache hit for {publisher.lane}: republished {count} manifest(s) "
+        f"for {cache.shard_prefix(key)}",
+        flush=True,
+    )
+    # Keep the part count as the last line; the drivers consume it.
+    print(count)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Shard sizes and the driver resources they are fitted to.
+
+Shared by ``fastq_shard_engine.py``, ``plan_shards.py`` and
+``split_scheduler.py``. It needs only the standard library, so the planner and
+the scheduler run on a driver without boto3, where the workers fall back to
+``SHARD_ENGINE=split``.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Sequence
+
+
+DEFAULT_SPLIT_LINES = 16_000_000
+DEFAULT_QUEUE_DEPTH = 2
+DEFAULT_UPLOAD_WINDOW_MAX = 4
+# Shard pairs a lane holds outside its queue and upload window: the pair being
+# cut and the pair the publisher has dequeued while it waits for a slot.
+HELD_PAIRS = 2
+# Share of MemAvailable that the lanes may fill with shard pairs.
+MEMORY_BUDGET_FRACTION = 0.8
+
+
+def parse_shard_schedule(spec: str) -> list[int]:
+    """Parse ``4000000*12,2000000,1000000`` into read pairs per shard index."""
+    schedule: list[int] = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        size, _, count = item.partition("*")
+        count = count or "1"
+        if not (size.isdigit() and count.isdigit() and int(size) > 0 and int(count) > 0):
+            raise ValueError(f"invalid shard schedule entry: {item!r}")
+        schedule.extend([int(size)] * int(count))
+    return schedule
+
+
+def format_shard_schedule(schedule: Sequence[int]) -> str:
+    """Inverse of ``parse_shard_schedule``, with runs of equal sizes collapsed."""
+    items: list[str] = []
+    index = 0
+    while index < len(schedule):
+        run = 1
+        while index + run < len(schedule) and schedule[index + run] == schedule[index]:
+            run += 1
+        items.append(f"{schedule[index]}*{run}" if run > 1 else str(schedule[index]))
+        index += run
+    return ",".join(items)
+
+
+def schedule_lines(schedule: Sequence[int], index: int, default_lines: int) -> int:
+    """FASTQ lines in shard ``index``; past the schedule its last size repeats."""
+    if not schedule:
+        return default_lines
+    return 4 * schedule[min(index, len(schedule) - 1)]
+
+
+def available_memory_bytes() -> int:
+    """MemAvailable from /proc/meminfo, or 0 where it cannot be read."""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def shard_pair_bytes(split_lines: int, schedule: Sequence[int]) -> int:
+    """Uncompressed bytes of the largest shard pair a lane cuts."""
+    from plan_shards import FASTQ_BYTES_PER_PAIR
+
+    return int((max(schedule) if schedule else split_lines // 4) * FASTQ_BYTES_PER_PAIR)
+
+
+def lane_memory_bytes(pair_bytes: int, queue_depth: int, window: int) -> int:
+    """Peak bytes of shard pairs one lane holds in memory."""
+    return pair_bytes * (queue_depth + window + HELD_PAIRS)
+
+
+def fit_memory(budget: int, pair_bytes: int, queue_depth: int, window: int) -> tuple[int, int]:
+    """Shrink the queue, then the upload window, until a lane fits ``budget``.
+
+    Neither goes below one pair, so a budget under ``lane_memory_bytes(pair,
+    1, 1)`` is exceeded rather than stalling the lane. A budget of 0 leaves
+    both unchanged.
+    """
+    if budget <= 0 or pair_bytes <= 0:
+        return queue_depth, window
+    spare = budget // pair_bytes - HELD_PAIRS
+    window = max(1, min(window, spare - 1))
+    return max(1, min(queue_depth, spare - window)), window
+
+
+def detect_uplink_gbps(default: float = 10.0) -> float:
+    """Return UPLINK_GBPS, else the default-route NIC speed, else ``default``."""
+    configured = os.getenv("UPLINK_GBPS", "")
+    if configured:
+        return float(configured)
+    try:
+        with open("/proc/net/route") as routes:
+            next(routes)
+            for line in routes:
+                fields = line.split()
+                if len(fields) > 1 and fields[1] == "00000000":
+                    speed_mbps = int(Path(f"/sys/class/net/{fields[0]}/speed").read_text())
+                    if speed_mbps > 0:
+                        return speed_mbps / 1000
+                    break
+    except (OSError, StopIteration, ValueError):
+        pass
+    return default
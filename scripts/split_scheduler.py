@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""Run split lanes against the driver's CPU, NVMe and uplink budgets.
+
+``process_fastq_bash`` used to admit lane pairs with one static thread count
+per gzip and a FIFO of released core counts. This scheduler owns three
+budgets instead and launches the lane workers itself:
+
+- CPU: a lane is allotted ``2 * threads`` cores with the same apportioning as
+  ``plan_shards.driver_slots``, divided between R1 and R2 in proportion to
+  their compressed sizes. Each stream gets the fastest backend for its
+  cores from ``decompressors.choose_backend`` (calibrated per instance type
+  when ``decompressors.py calibrate`` has run). It is pinned to its stream's
+  cores; a multithreaded backend runs one thread per core of the whole lane.
+- NVMe: the bytes a lane stages on local disk, the downloaded gzips for S3
+  input plus the cut FASTQ for ``SHARD_ENGINE=split``, must fit in the free
+  space of ``--nvme-dir``.
+- Uplink: the lane's predicted shard upload rate must fit in what the running
+  lanes leave of the NIC. The lane is told its share through
+  ``SPLIT_LANE_GBPS``.
+- Memory: the python engine holds whole shard pairs in RAM, being cut,
+  queued and uploading. A lane needs room for one queued and one uploading
+  pair of its largest shard, and is granted up to its full queue and window
+  out of ``--memory-bytes`` (default: a share of MemAvailable). The grant goes
+  to the lane as ``SPLIT_MEMORY_BYTES``, and the engine shrinks its queue and
+  upload window to fit it.
+
+Lanes are admitted in inventory order as soon as all four budgets allow.
+The first lane is always admitted, so one oversized lane cannot stall a run.
+
+Workers report over a FIFO of JSON lines: ``start`` with the decompressor
+pid, and ``end`` once that stream is drained. When one stream of a lane ends,
+its cores widen the sibling decompressor's affinity, which already runs
+enough threads to use them; R1 is usually a fraction of R2 and used to leave
+its cores idle until R2 finished. Cores without a running sibling go back to
+the pool for the next lane.
+
+Each worker's output goes to ``<parts-dir>/<lane>.log`` and its last line to
+``<lane>.parts``, as the bash admission loop wrote them.
+
+    split_scheduler.py jobs.tsv --parts-dir split_parts -- \\
+        bash scripts/split_upload_trigger_local.sh BUCKET {r1} {r2} {base} TXT_BUCKET
+
+The jobs TSV has ``lane``, ``base``, ``r1``, ``r2``, ``r1_bytes``,
+``r2_bytes`` and ``schedule`` columns. ``{lane}``, ``{base}``, ``{r1}`` and
+``{r2}`` in the worker command are replaced per lane.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import select
+import subprocess
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Sequence
+
+from decompressors import BACKENDS, calibration_path, choose_backend, load_calibration
+from plan_shards import PlanParameters, driver_slots
+from shard_sizing import (
+    DEFAULT_QUEUE_DEPTH,
+    DEFAULT_SPLIT_LINES,
+    DEFAULT_UPLOAD_WINDOW_MAX,
+    MEMORY_BUDGET_FRACTION,
+    available_memory_bytes,
+    detect_uplink_gbps,
+    lane_memory_bytes,
+    parse_shard_schedule,
+    shard_pair_bytes,
+)
+
+
+DEFAULT_NVME_DIR = "/mnt/nvme"
+# Leave headroom on the staging disk for logs, indexes and filesystem overhead.
+NVME_RESERVE_FRACTION = 0.1
+POLL_SECONDS = 0.2
+STREAMS = ("R1", "R2")
+JOB_FIELDS = ("lane", "base", "r1", "r2", "r1_bytes", "r2_bytes", "schedule")
+
+
+@dataclass(frozen=True)
+class SplitJob:
+    lane: str
+    base: str
+    r1: str
+    r2: str
+    r1_bytes: int
+    r2_bytes: int
+    schedule: str = ""
+
+    @property
+    def combined_bytes(self) -> int:
+        return self.r1_bytes + self.r2_bytes
+
+
+@dataclass
+class Budgets:
+    cpus: set[int]
+    nvme_bytes: int
+    uplink_gbps: float
+    # None leaves memory unbudgeted.
+    memory_bytes: int | None = None
+
+
+@dataclass
+class RunningLane:
+    job: SplitJob
+    cpus: dict[str, list[int]]
+    backends: dict[str, str]
+    threads: dict[str, int]
+    nvme_bytes: int
+    uplink_gbps: float
+    memory_bytes: int = 0
+    pids: dict[str, int] = field(default_factory=dict)
+    ended: set[str] = field(default_factory=set)
+    process: subprocess.Popen | None = None
+
+
+def parse_cpu_list(spec: str) -> list[int]:
+    """Parse a kernel CPU list such as ``0-3,8`` into sorted CPU ids."""
+    cpus: set[int] = set()
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        first, _, last = item.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus: Sequence[int]) -> str:
+    ranges: list[str] = []
+    for cpu in sorted(cpus):
+        if ranges and int(ranges[-1].rpartition("-")[2]) == cpu - 1:
+            ranges[-1] = f"{ranges[-1].partition('-')[0]}-{cpu}"
+        else:
+            ranges.append(str(cpu))
+    return ",".join(ranges)
+
+
+def stream_threads(cores: int, r1_bytes: int, r2_bytes: int) -> tuple[int, int]:
+    """Divide a lane's cores between R1 and R2 by compressed size, one each at least."""
+    if cores < 2:
+        return 1, 1
+    total = r1_bytes + r2_bytes
+    r1 = round(cores * r1_bytes / total) if total > 0 else cores // 2
+    r1 = min(max(r1, 1), cores - 1)
+    return r1, cores - r1
+
+
+def nvme_cost(job: SplitJob, staged_input: bool, engine: str, params: PlanParameters) -> int:
+    """Bytes a lane holds on the staging disk while it runs."""
+    cost = job.combined_bytes if staged_input else 0
+    if engine == "split":
+        # The coreutils path writes every cut FASTQ shard before upload.
+        cost += int(job.combined_bytes * params.fastq_bytes_per_pair / params.compressed_bytes_per_pair)
+    return cost
+
+
+def memory_cost(job: SplitJob, engine: str, split_lines: int, queue_depth: int, window: int) -> tuple[int, int]:
+    """Shard-pair memory a lane needs at least, and with its full queue and window."""
+    if engine != "python":
+        # The coreutils path cuts shards to NVMe, not into memory.
+        return 0, 0
+    pair_bytes = shard_pair_bytes(split_lines, parse_shard_schedule(job.schedule))
+    return lane_memory_bytes(pair_bytes, 1, 1), lane_memory_bytes(pair_bytes, queue_depth, window)
+
+
+def uplink_demand_gbps(cores: int, params: PlanParameters) -> float:
+    """Shard upload rate of a lane decompressing on ``cores``."""
+    return cores * params.decompress_pairs_per_core * params.fastq_bytes_per_pair * 8 / 1e9
+
+
+def set_process_affinity(pid: int, cpus: Sequence[int]) -> None:
+    """Pin every thread of ``pid``; a thread that has already exited is skipped."""
+    try:
+        tasks = [int(task) for task in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        tasks = [pid]
+    for task in tasks:
+        try:
+            os.sched_setaffinity(task, cpus)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class SplitScheduler:
+    """Budget bookkeeping: admission, per-stream cores and sibling rebalancing."""
+
+    def __init__(
+        self,
+        budgets: Budgets,
+        lane_cores: int,
+        params: PlanParameters,
+        staged_input: bool = False,
+        engine: str = "python",
+        set_affinity: Callable[[int, Sequence[int]], None] = set_process_affinity,
+        calibration: Sequence[dict] | None = None,
+        decompressors: Sequence[str] | None = None,
+        split_lines: int = DEFAULT_SPLIT_LINES,
+        queue_depth: int = DEFAULT_QUEUE_DEPTH,
+        upload_window_max: int = DEFAULT_UPLOAD_WINDOW_MAX,
+    ):
+        self.budgets = budgets
+        self.lane_cores = lane_cores
+        self.params = params
+        self.staged_input = staged_input
+        self.engine = engine
+        self.set_affinity = set_affinity
+        self.calibration = calibration
+        self.decompressors = decompressors
+        self.split_lines = split_lines
+        self.queue_depth = queue_depth
+        self.upload_window_max = upload_window_max
+        self.running: dict[str, RunningLane] = {}
+
+    def memory_cost(self, job: SplitJob) -> tuple[int, int]:
+        return memory_cost(job, self.engine, self.split_lines, self.queue_depth, self.upload_window_max)
+
+    def admissible(self, job: SplitJob) -> bool:
+        if not self.running:
+            return True
+        return (
+            len(self.budgets.cpus) >= self.lane_cores
+            and nvme_cost(job, self.staged_input, self.engine, self.params) <= self.budgets.nvme_bytes
+            and uplink_demand_gbps(self.lane_cores, self.params) <= self.budgets.uplink_gbps + 1e-9
+            and (self.budgets.memory_bytes is None or self.memory_cost(job)[0] <= self.budgets.memory_bytes)
+        )
+
+    def admit(self, job: SplitJob) -> RunningLane:
+        """Take ``job``'s allotment out of the budgets; call only when admissible."""
+        cores = sorted(self.budgets.cpus)[:self.lane_cores]
+        r1_cores, _ = stream_threads(len(cores), job.r1_bytes, job.r2_bytes)
+        cpus = {"R1": cores[:r1_cores], "R2": cores[r1_cores:]}
+        self.budgets.cpus.difference_update(cores)
+        nvme_bytes = nvme_cost(job, self.staged_input, self.engine, self.params)
+        uplink = min(uplink_demand_gbps(len(cores), self.params), max(self.budgets.uplink_gbps, 0.0))
+        self.budgets.nvme_bytes -= nvme_bytes
+        self.budgets.uplink_gbps -= uplink
+        memory = 0
+        if self.budgets.memory_bytes is not None:
+            memory = max(0, min(self.memory_cost(job)[1], self.budgets.memory_bytes))
+            self.budgets.memory_bytes -= memory
+        backends: dict[str, str] = {}
+        threads: dict[str, int] = {}
+        for stream in STREAMS:
+            backends[stream], _ = choose_backend(
+                len(cpus[stream]), self.calibration, self.decompressors, streaming=self.staged_input
+            )
+            # A multithreaded backend runs a thread per core of the whole lane
+            # so it can absorb its sibling's cores.
+            threads[stream] = len(cores) if BACKENDS[backends[stream]].multithreaded else 1
+        lane = RunningLane(job, cpus, backends, threads, nvme_bytes, uplink, memory)
+        self.running[job.lane] = lane
+        return lane
+
+    def stream_started(self, lane_name: str, stream: str, pid: int) -> None:
+        lane = self.running.get(lane_name)
+        if lane is None or stream not in STREAMS:
+            return
+        lane.pids[stream] = pid
+        if stream in lane.ended:
+            return
+        self.set_affinity(pid, lane.cpus[stream])
+
+    def stream_finished(self, lane_name: str, stream: str) -> list[int]:
+        """Hand a drained stream's cores to its sibling; return cores freed to the pool."""
+        lane = self.running.get(lane_name)
+        if lane is None or stream not in STREAMS or stream in lane.ended:
+            return []
+        lane.ended.add(stream)
+        released = lane.cpus[stream]
+        lane.cpus[stream] = []
+        sibling = "R2" if stream == "R1" else "R1"
+        if sibling not in lane.ended and sibling in lane.pids:
+            widened = sorted(set(lane.cpus[sibling]) | set(released))
+            lane.cpus[sibling] = widened[:lane.threads[sibling]]
+            self.set_affinity(lane.pids[sibling], lane.cpus[sibling])
+            released = sorted(set(released) - set(lane.cpus[sibling]))
+        self.budgets.cpus.update(released)
+        return released
+
+    def lane_finished(self, lane_name: str) -> None:
+        lane = self.running.pop(lane_name, None)
+        if lane is None:
+            return
+        for cpus in lane.cpus.values():
+            self.budgets.cpus.update(cpus)
+        self.budgets.nvme_bytes += lane.nvme_bytes
+        self.budgets.uplink_gbps += lane.uplink_gbps
+        if self.budgets.memory_bytes is not None:
+            self.budgets.memory_bytes += lane.memory_bytes
+
+    def handle_event(self, line: str) -> None:
+        try:
+            event = json.loads(line)
+            lane, stream, kind = event["lane"], event["stream"], event["event"]
+        except (ValueError, KeyError, TypeError):
+            print(f"WARNING: ignoring scheduler event: {line.strip()}", file=sys.stderr)
+            return
+        if kind == "start":
+            self.stream_started(lane, stream, int(event.get("pid", 0)))
+        elif kind == "end":
+            self.stream_finished(lane, stream)
+
+
+def report_stream_event(fifo: str, lane: str, stream: str, event: str, pid: int = 0) -> None:
+    """Tell the scheduler behind ``fifo`` that a decompressor started or drained."""
+    if not fifo:
+        return
+    message = {"event": event, "lane": lane, "stream": stream}
+    if pid:
+        message["pid"] = pid
+    # One short write is atomic for a FIFO, so lanes never interleave events.
+    with open(fifo, "w") as handle:
+        handle.write(json.dumps(message, sort_keys=True) + "\n")
+
+
+def read_jobs(path: Path) -> list[SplitJob]:
+    with path.open(newline="") as handle:
+        rows = list(csv.DictReader(handle, delimiter="\t"))
+    missing = [name for name in JOB_FIELDS if rows and name not in rows[0]]
+    if missing:
+        raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+    return [
+        SplitJob(
+            lane=row["lane"],
+            base=row["base"],
+            r1=row["r1"],
+            r2=row["r2"],
+            r1_bytes=int(row["r1_bytes"] or 0),
+            r2_bytes=int(row["r2_bytes"] or 0),
+            schedule=row["schedule"] or "",
+        )
+        for row in rows
+    ]
+
+
+def free_nvme_bytes(path: str) -> int:
+    try:
+        stat = os.statvfs(path)
+    except OSError:
+        return 0
+    return int(stat.f_bavail * stat.f_frsize * (1 - NVME_RESERVE_FRACTION))
+
+
+def worker_env(scheduler: SplitScheduler, lane: RunningLane, fifo: str, timings_dir: str) -> dict[str, str]:
+    env = dict(
+        os.environ,
+        DECOMP_THREADS=str(max(lane.threads.values())),
+        SPLIT_R1_DECOMPRESSOR=lane.backends["R1"],
+        SPLIT_R2_DECOMPRESSOR=lane.backends["R2"],
+        SPLIT_R1_THREADS=str(lane.threads["R1"]),
+        SPLIT_R2_THREADS=str(lane.threads["R2"]),
+        SPLIT_R1_CPUS=format_cpu_list(lane.cpus["R1"]),
+        SPLIT_R2_CPUS=format_cpu_list(lane.cpus["R2"]),
+        SPLIT_LANE_GBPS=f"{lane.uplink_gbps:.3f}",
+        SPLIT_CONCURRENT_LANES=str(len(scheduler.running)),
+        SPLIT_SCHEDULER_FIFO=fifo,
+        SPLIT_SCHEDULER_LANE=lane.job.lane,
+        SHARD_SCHEDULE=lane.job.schedule,
+    )
+    if lane.memory_bytes:
+        env["SPLIT_MEMORY_BYTES"] = str(lane.memory_bytes)
+    if timings_dir:
+        env["SPLIT_TIMINGS_FILE"] = str(Path(timings_dir) / f"{lane.job.lane}.csv")
+    return env
+
+
+def worker_command(template: Sequence[str], job: SplitJob) -> list[str]:
+    values = {"lane": job.lane, "base": job.base, "r1": job.r1, "r2": job.r2}
+    return [part.format(**values) for part in template]
+
+
+def write_parts(log_path: Path, parts_path: Path) -> None:
+    lines = log_path.read_text(errors="replace").splitlines() if log_path.exists() else []
+    parts_path.write_text((lines[-1] if lines else "") + "\n")
+
+
+def run(
+    jobs: Sequence[SplitJob],
+    scheduler: SplitScheduler,
+    template: Sequence[str],
+    parts_dir: Path,
+    fifo: str,
+    timings_dir: str = "",
+) -> int:
+    """Run every job under ``scheduler``; return nonzero if any worker failed."""
+    pending = list(jobs)
+    status = 0
+    # Held open read-write so the FIFO never reports EOF between writers.
+    fifo_fd = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+    buffered = b""
+    try:
+        while pending or scheduler.running:
+            while pending and scheduler.admissible(pending[0]):
+                job = pending.pop(0)
+                lane = scheduler.admit(job)
+                with (parts_dir / f"{job.lane}.log").open("wb") as log:
+                    lane.process = subprocess.Popen(
+                        worker_command(template, job),
+                        env=worker_env(scheduler, lane, fifo, timings_dir),
+                        stdout=log,
+                        stderr=subprocess.STDOUT,
+                    )
+                print(
+                    f"Admitted {job.lane}: R1 {lane.backends['R1']} on CPUs "
+                    f"{format_cpu_list(lane.cpus['R1'])}, R2 {lane.backends['R2']} on CPUs "
+                    f"{format_cpu_list(lane.cpus['R2'])}, "
+                    f"{lane.nvme_bytes / 1e9:.1f} GB NVMe, {lane.uplink_gbps:.2f} Gbit/s uplink, "
+                    f"{lane.memory_bytes / 1e9:.1f} GB memory",
+                    flush=True,
+                )
+            readable, _, _ = select.select([fifo_fd], [], [], POLL_SECONDS)
+            if readable:
+                try:
+                    buffered += os.read(fifo_fd, 65536)
+                except BlockingIOError:
+                    pass
+                *lines, buffered = buffered.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        scheduler.handle_event(line.decode(errors="replace"))
+            for name, lane in list(scheduler.running.items()):
+                returncode = lane.process.poll() if lane.process else 0
+                if returncode is None:
+                    continue
+                if returncode != 0:
+                    print(f"ERROR: split worker for {name} exited with status {returncode}", file=sys.stderr)
+                    status = 1
+                write_parts(parts_dir / f"{name}.log", parts_dir / f"{name}.parts")
+                scheduler.lane_finished(name)
+    finally:
+        os.close(fifo_fd)
+        for lane in scheduler.running.values():
+            if lane.process is not None and lane.process.poll() is None:
+                lane.process.terminate()
+    return status
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("jobs", type=Path)
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="worker argv after --")
+    parser.add_argument("--parts-dir", type=Path, required=True)
+    parser.add_argument("--timings-dir", default="")
+    parser.add_argument("--cores", type=int, default=os.cpu_count() or 4)
+    parser.add_argument(
+        "--max-threads-per-file", type=int, default=PlanParameters.max_threads_per_file,
+        help="1 when only gzip is available",
+    )
+    parser.add_argument("--nvme-dir", default=DEFAULT_NVME_DIR)
+    parser.add_argument("--nvme-bytes", type=int, default=0, help="default: free space of --nvme-dir")
+    parser.add_argument("--uplink-gbps", type=float, default=0.0, help="default: UPLINK_GBPS or the NIC speed")
+    parser.add_argument(
+        "--memory-bytes", type=int, default=int(os.getenv("SPLIT_MEMORY_BYTES") or 0),
+        help="shard-pair memory shared by the lanes; default: a share of MemAvailable",
+    )
+    parser.add_argument(
+        "--staged-input", action="store_true", help="workers download the gzips to --nvme-dir first"
+    )
+    parser.add_argument("--engine", default=os.getenv("SHARD_ENGINE", "python"))
+    parser.add_argument(
+        "--decompressors", default="", help="comma-separated backends to choose from; default all"
+    )
+    parser.add_argument(
+        "--calibration", default="", help="decompressors.py calibrate output; default the host's cache"
+    )
+    args = parser.parse_args(argv)
+
+    decompressors = [name for name in args.decompressors.split(",") if name] or None
+    if decompressors and any(name not in BACKENDS for name in decompressors):
+        parser.error(f"--decompressors must be among {', '.join(BACKENDS)}")
+    template = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not template:
+        parser.error("a worker command is required after --")
+    if args.cores <= 0 or args.max_threads_per_file <= 0:
+        parser.error("--cores and --max-threads-per-file must be positive")
+    if args.memory_bytes < 0:
+        parser.error("--memory-bytes must not be negative")
+    try:
+        jobs = read_jobs(args.jobs)
+    except (OSError, ValueError) as error:
+        print(f"ERROR: {error}", file=sys.stderr)
+        return 1
+    if not jobs:
+        return 0
+
+    params = PlanParameters(cores=args.cores, max_threads_per_file=args.max_threads_per_file)
+    threads, _ = driver_slots(len(jobs), params)
+    cpus = sorted(os.sched_getaffinity(0))[:args.cores] if hasattr(os, "sched_getaffinity") else []
+    budgets = Budgets(
+        cpus=set(cpus or range(args.cores)),
+        nvme_bytes=args.nvme_bytes or free_nvme_bytes(args.nvme_dir),
+        uplink_gbps=args.uplink_gbps or detect_uplink_gbps(),
+        memory_bytes=args.memory_bytes or int(available_memory_bytes() * MEMORY_BUDGET_FRACTION),
+    )
+    calibration = load_calibration(args.calibration or calibration_path())
+    scheduler = SplitScheduler(
+        budgets,
+        2 * threads,
+        params,
+        staged_input=args.staged_input,
+        engine=args.engine,
+        calibration=calibration,
+        decompressors=decompressors,
+        split_lines=int(os.getenv("SPLIT_LINES") or DEFAULT_SPLIT_LINES),
+        queue_depth=int(os.getenv("SHARD_QUEUE_DEPTH") or DEFAULT_QUEUE_DEPTH),
+        upload_window_max=int(os.getenv("SHARD_UPLOAD_WINDOW_MAX") or DEFAULT_UPLOAD_WINDOW_MAX),
+    )
+    print(
+        f"Scheduling {len(jobs)} split lane(s) on {len(budgets.cpus)} cores "
+        f"({2 * threads} per lane), {budgets.nvme_bytes / 1e9:.1f} GB NVMe, "
+        f"{budgets.uplink_gbps:.1f} Gbit/s uplink, {budgets.memory_bytes / 1e9:.1f} GB memory, "
+        + ("calibrated decompressors" if calibration else "uncalibrated decompressors"),
+        flush=True,
+    )
+
+    args.parts_dir.mkdir(parents=True, exist_ok=True)
+    if args.timings_dir:
+        Path(args.timings_dir).mkdir(parents=True, exist_ok=True)
+    fifo = str(args.parts_dir / "scheduler.fifo")
+    if os.path.exists(fifo):
+        os.unlink(fifo)
+    os.mkfifo(fifo)
+    try:
+        return run(jobs, scheduler, template, args.parts_dir, fifo, args.timings_dir)
+    finally:
+        os.unlink(fifo)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
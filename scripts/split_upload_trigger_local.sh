@@ -28,25 +28,84 @@ PIPELINE_START_FILE="${PIPELINE_START_FILE:-}"
 # Optional driver-side core scheduler. Each R1/R2 producer returns its static
 # CPU allocation independently when decompression and split have finished.
 CORE_RELEASE_FIFO="${CORE_RELEASE_FIFO:-}"
+# Optional split_scheduler.py channel. The scheduler pins each stream to
+# SPLIT_R1_CPUS/SPLIT_R2_CPUS and is told when a stream has drained.
+SPLIT_SCHEDULER_FIFO="${SPLIT_SCHEDULER_FIFO:-}"
+SPLIT_SCHEDULER_LANE="${SPLIT_SCHEDULER_LANE:-}"
+SPLIT_R1_CPUS="${SPLIT_R1_CPUS:-}"
+SPLIT_R2_CPUS="${SPLIT_R2_CPUS:-}"
 # Optional direct asynchronous invocation.  This is useful when the caller does
 # not have EventBridge-management permission: publish the manifest first, then
 # enqueue the same EventBridge-shaped event directly with Lambda.
 ASYNC_LAMBDA_FUNCTION="${ASYNC_LAMBDA_FUNCTION:-}"
 LAMBDA_INVOKE_LOG_DIR="${LAMBDA_INVOKE_LOG_DIR:-}"
+# python: cut both decompressed streams in lockstep in memory and upload each
+# shard pair straight from fastq_shard_engine.py. split: the coreutils split
+# and NVMe polling path below, kept as the fallback when boto3 is unavailable.
+# index: zero-split; upload the original gzips once with a seek-point index and
+# publish byte-range manifests from gzip_range_index.py.
+SHARD_ENGINE="${SHARD_ENGINE:-python}"
+SCRIPT_DIR=$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd)
 
 [[ -f "$R1_GZ" ]] || { echo "ERROR: R1 gzip not found: $R1_GZ" >&2; exit 1; }
 [[ -f "$R2_GZ" ]] || { echo "ERROR: R2 gzip not found: $R2_GZ" >&2; exit 1; }
 [[ "$SPLIT_LINES" =~ ^[1-9][0-9]*$ ]] || { echo "ERROR: SPLIT_LINES must be positive" >&2; exit 1; }
 (( SPLIT_LINES % 4 == 0 )) || { echo "ERROR: SPLIT_LINES must be divisible by 4" >&2; exit 1; }
 [[ "$DECOMP_THREADS" =~ ^[1-9][0-9]*$ ]] || { echo "ERROR: DECOMP_THREADS must be positive" >&2; exit 1; }
-[[ "$FASTQ_DECOMPRESSOR" == "gzip" || "$FASTQ_DECOMPRESSOR" == "rapidgzip" ]] || {
-    echo "ERROR: FASTQ_DECOMPRESSOR must be gzip or rapidgzip" >&2
-    exit 1
-}
-command -v "$FASTQ_DECOMPRESSOR" >/dev/null 2>&1 || {
-    echo "ERROR: $FASTQ_DECOMPRESSOR not found" >&2
+# Backends of scripts/decompressors.py. The python engine resolves auto and
+# replaces a missing backend; the split path below runs the CLI backends.
+case "$FASTQ_DECOMPRESSOR" in
+    gzip|rapidgzip|rapidgzip-python|igzip|libdeflate|pigz|auto) ;;
+    *)
+        echo "ERROR: FASTQ_DECOMPRESSOR must be gzip, rapidgzip, rapidgzip-python, igzip, libdeflate, pigz, or auto" >&2
+        exit 1
+        ;;
+esac
+[[ "$SHARD_ENGINE" == "python" || "$SHARD_ENGINE" == "split" || "$SHARD_ENGINE" == "index" ]] || {
+    echo "ERROR: SHARD_ENGINE must be python, split, or index" >&2
     exit 1
 }
+if [[ "$SHARD_ENGINE" == "index" ]] && ! python3 -c 'import boto3, indexed_gzip' >/dev/null 2>&1; then
+    echo "WARNING: indexed_gzip not available; using SHARD_ENGINE=python" >&2
+    SHARD_ENGINE=python
+fi
+if [[ "$SHARD_ENGINE" == "python" ]] && ! python3 -c 'import boto3' >/dev/null 2>&1; then
+    echo "WARNING: python3 with boto3 not available; using SHARD_ENGINE=split" >&2
+    SHARD_ENGINE=split
+fi
+if [[ "$SHARD_ENGINE" == "split" && -n "${SHARD_SCHEDULE:-}" ]]; then
+    echo "WARNING: SHARD_ENGINE=split ignores SHARD_SCHEDULE=$SHARD_SCHEDULE; cutting $SPLIT_LINES-line shards" >&2
+fi
+if [[ "$SHARD_ENGINE" == "index" ]]; then
+    exec python3 "$SCRIPT_DIR/gzip_range_index.py" \
+        "$FASTQ_BUCKET" "$R1_GZ" "$R2_GZ" "$S3_BASE" "$INPUT_TXT_BUCKET" "$SPLIT_LINES" \
+        --region "$AWS_REGION_VALUE"
+fi
+if [[ -n "${SHARD_CACHE_URI:-}" && "$SHARD_ENGINE" == "python" ]]; then
+    # Cross-run shard cache: a hit republishes this lane's manifests against
+    # the cached shards (scripts/shard_cache.py); a miss falls through and the
+    # engine stores what it cuts.
+    CACHE_RC=0
+    CACHE_OUTPUT=$(python3 "$SCRIPT_DIR/shard_cache.py" replay \
+        "$R1_GZ" "$R2_GZ" "$S3_BASE" "$INPUT_TXT_BUCKET" "$SPLIT_LINES" \
+        --region "$AWS_REGION_VALUE") || CACHE_RC=$?
+    if (( CACHE_RC == 0 )); then
+        printf '%s\n' "$CACHE_OUTPUT"
+        exit 0
+    elif (( CACHE_RC == 3 )); then
+        printf '%s\n' "$CACHE_OUTPUT" | sed '$d'
+        export SHARD_CACHE_KEY="${CACHE_OUTPUT##*$'\n'}"
+    else
+        echo "WARNING: shard cache lookup failed; splitting without it" >&2
+        unset SHARD_CACHE_URI
+    fi
+fi
+if [[ "$SHARD_ENGINE" == "python" ]]; then
+    exec python3 "$SCRIPT_DIR/fastq_shard_engine.py" \
+        "$FASTQ_BUCKET" "$R1_GZ" "$R2_GZ" "$S3_BASE" "$INPUT_TXT_BUCKET" "$SPLIT_LINES" \
+        --decompressor "$FASTQ_DECOMPRESSOR" --threads "$DECOMP_THREADS" \
+        --region "$AWS_REGION_VALUE"
+fi
 command -v aws >/dev/null 2>&1 || { echo "ERROR: aws not found" >&2; exit 1; }
 if [[ -n "$ASYNC_LAMBDA_FUNCTION" ]]; then
     command -v jq >/dev/null 2>&1 || { echo "ERROR: jq not found" >&2; exit 1; }
@@ -60,12 +119,20 @@ fi
     echo "ERROR: CORE_RELEASE_FIFO is not a named pipe: $CORE_RELEASE_FIFO" >&2
     exit 1
 }
+[[ -z "$SPLIT_SCHEDULER_FIFO" || -p "$SPLIT_SCHEDULER_FIFO" ]] || {
+    echo "ERROR: SPLIT_SCHEDULER_FIFO is not a named pipe: $SPLIT_SCHEDULER_FIFO" >&2
+    exit 1
+}
 
 LANE=$(basename "$S3_BASE")
 WORK_DIR=$(mktemp -d "/mnt/nvme/${LANE}.stream.XXXXXX")
 SUCCESS=0
 
 cleanup() {
+    if [[ -n "${UPLOADER_PID:-}" ]]; then
+        exec {UPLOADER[1]}>&- 2>/dev/null || true
+        wait "$UPLOADER_PID" 2>/dev/null || true
+    fi
     if [[ -d "$WORK_DIR" ]]; then
         find "$WORK_DIR" -type f -delete 2>/dev/null || true
         rmdir "$WORK_DIR" 2>/dev/null || true
@@ -98,6 +165,40 @@ record_timing() {
     fi
 }
 
+# With boto3, every shard and manifest goes through one long-lived
+# s3_upload_service.py coprocess so uploads share a warm connection pool.
+if python3 -c 'import boto3' >/dev/null 2>&1; then
+    coproc UPLOADER { AWS_REGION="$AWS_REGION_VALUE" python3 "$SCRIPT_DIR/s3_upload_service.py"; }
+    UPLOADER_PID=$!
+fi
+
+# Upload LOCAL_PATH S3_URI pairs concurrently and wait for all of them.
+upload_files() {
+    local pids=() status=0 ack pid
+    if [[ -n "${UPLOADER_PID:-}" ]]; then
+        local pending=$(($# / 2))
+        while (( $# >= 2 )); do
+            printf '%s\t%s\n' "$1" "$2" >&"${UPLOADER[1]}"
+            shift 2
+        done
+        while (( pending > 0 )); do
+            IFS= read -r ack <&"${UPLOADER[0]}" || { echo "ERROR: S3 upload service exited" >&2; return 1; }
+            [[ "$ack" == OK$'\t'* ]] || { echo "ERROR: $ack" >&2; status=1; }
+            pending=$((pending - 1))
+        done
+        return "$status"
+    fi
+    while (( $# >= 2 )); do
+        aws s3 cp "$1" "$2" --region "$AWS_REGION_VALUE" --only-show-errors --no-progress &
+        pids+=("$!")
+        shift 2
+    done
+    for pid in "${pids[@]}"; do
+        wait "$pid" || status=1
+    done
+    return "$status"
+}
+
 invoke_lambda_async() {
     local manifest_key="$1" output_folder="$2" payload response response_file status
     [[ -n "$ASYNC_LAMBDA_FUNCTION" ]] || return 0
@@ -142,6 +243,23 @@ release_decompressor_cores() {
     printf '%s\n' "$DECOMP_THREADS" > "$CORE_RELEASE_FIFO"
 }
 
+report_stream_end() {
+    [[ -n "$SPLIT_SCHEDULER_FIFO" ]] || return 0
+    printf '{"event": "end", "lane": "%s", "stream": "%s"}\n' \
+        "${SPLIT_SCHEDULER_LANE:-$LANE}" "$1" > "$SPLIT_SCHEDULER_FIFO"
+}
+
+# Run a decompressor on the CPU list the scheduler gave its stream, if any.
+pinned() {
+    local cpus="$1"
+    shift
+    if [[ -n "$cpus" ]] && command -v taskset >/dev/null 2>&1; then
+        taskset -c "$cpus" "$@"
+    else
+        "$@"
+    fi
+}
+
 TOTAL_START_NS=$(now_ns)
 if [[ -n "$PIPELINE_START_FILE" ]]; then
     mkdir -p "$(dirname -- "$PIPELINE_START_FILE")"
@@ -156,36 +274,39 @@ R2_STATUS="$WORK_DIR/r2.status"
 R1_PREFIX="$WORK_DIR/r1_p"
 R2_PREFIX="$WORK_DIR/r2_p"
 
-if [[ "$FASTQ_DECOMPRESSOR" == "rapidgzip" ]]; then
-    echo "Starting $LANE from local NVMe with two rapidgzip -P $DECOMP_THREADS processes"
-else
-    echo "Starting $LANE from local NVMe with two single-threaded gzip processes"
-fi
+case "$FASTQ_DECOMPRESSOR" in
+    rapidgzip) DECOMPRESS_CMD=(rapidgzip -d -c -P "$DECOMP_THREADS") ;;
+    igzip) DECOMPRESS_CMD=(igzip -dc) ;;
+    libdeflate) DECOMPRESS_CMD=(libdeflate-gunzip -c) ;;
+    pigz) DECOMPRESS_CMD=(pigz -dc -p "$DECOMP_THREADS") ;;
+    *) DECOMPRESS_CMD=(gzip -dc --) ;;
+esac
+command -v "${DECOMPRESS_CMD[0]}" >/dev/null 2>&1 || {
+    echo "ERROR: ${DECOMPRESS_CMD[0]} not found" >&2
+    exit 1
+}
+echo "Starting $LANE from local NVMe with two ${DECOMPRESS_CMD[*]} processes"
 (
     set +e
     set -o pipefail
-    if [[ "$FASTQ_DECOMPRESSOR" == "rapidgzip" ]]; then
-        rapidgzip -d -c -P "$DECOMP_THREADS" "$R1_GZ"
-    else
-        gzip -dc -- "$R1_GZ"
-    fi | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "$R1_PREFIX"
+    pinned "$SPLIT_R1_CPUS" "${DECOMPRESS_CMD[@]}" "$R1_GZ" \
+        | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "$R1_PREFIX"
     rc=$?
     printf '%s %s\n' "$rc" "$(now_ns)" > "$R1_STATUS"
     release_decompressor_cores
+    report_stream_end R1
 ) &
 R1_PRODUCER_PID=$!
 
 (
     set +e
     set -o pipefail
-    if [[ "$FASTQ_DECOMPRESSOR" == "rapidgzip" ]]; then
-        rapidgzip -d -c -P "$DECOMP_THREADS" "$R2_GZ"
-    else
-        gzip -dc -- "$R2_GZ"
-    fi | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "$R2_PREFIX"
+    pinned "$SPLIT_R2_CPUS" "${DECOMPRESS_CMD[@]}" "$R2_GZ" \
+        | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "$R2_PREFIX"
     rc=$?
     printf '%s %s\n' "$rc" "$(now_ns)" > "$R2_STATUS"
     release_decompressor_cores
+    report_stream_end R2
 ) &
 R2_PRODUCER_PID=$!
 
@@ -210,14 +331,10 @@ while true; do
 
         R1_URI="s3://${FASTQ_BUCKET}/${S3_BASE}_R1_001_p${PAIR_INDEX}.fastq"
         R2_URI="s3://${FASTQ_BUCKET}/${S3_BASE}_R2_001_p${PAIR_INDEX}.fastq"
-        aws s3 cp "$R1_SHARD" "$R1_URI" --region "$AWS_REGION_VALUE" \
-            --only-show-errors --no-progress &
-        R1_UPLOAD_PID=$!
-        aws s3 cp "$R2_SHARD" "$R2_URI" --region "$AWS_REGION_VALUE" \
-            --only-show-errors --no-progress &
-        R2_UPLOAD_PID=$!
-        wait "$R1_UPLOAD_PID" || { echo "ERROR: R1 shard upload failed: $R1_URI" >&2; exit 1; }
-        wait "$R2_UPLOAD_PID" || { echo "ERROR: R2 shard upload failed: $R2_URI" >&2; exit 1; }
+        upload_files "$R1_SHARD" "$R1_URI" "$R2_SHARD" "$R2_URI" || {
+            echo "ERROR: shard pair upload failed: $R1_URI $R2_URI" >&2
+            exit 1
+        }
         LAST_FASTQ_UPLOAD_NS=$(now_ns)
 
         MANIFEST="$WORK_DIR/${LANE}_p${PAIR_INDEX}_input.txt"
@@ -225,9 +342,10 @@ while true; do
         MANIFEST_UPLOAD_START_NS=$(now_ns)
         [[ -n "$FIRST_MANIFEST_UPLOAD_NS" ]] || FIRST_MANIFEST_UPLOAD_NS="$MANIFEST_UPLOAD_START_NS"
         MANIFEST_KEY="${S3_BASE}_p${PAIR_INDEX}_input.txt"
-        aws s3 cp "$MANIFEST" \
-            "s3://${INPUT_TXT_BUCKET}/${MANIFEST_KEY}" \
-            --region "$AWS_REGION_VALUE" --only-show-errors --no-progress
+        upload_files "$MANIFEST" "s3://${INPUT_TXT_BUCKET}/${MANIFEST_KEY}" || {
+            echo "ERROR: manifest upload failed: $MANIFEST_KEY" >&2
+            exit 1
+        }
         LAST_MANIFEST_UPLOAD_NS=$(now_ns)
         invoke_lambda_async "$MANIFEST_KEY" "${LANE}_p${PAIR_INDEX}"
 
@@ -1,15 +1,25 @@
 import boto3
+import botocore
+import io
 import json
 import os
+import re
+import selectors
 import shutil
+import struct
 import subprocess
 import threading
 import time
+import urllib3
+import zlib
+from collections import Counter, deque
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from boto3.s3.transfer import S3Transfer
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from urllib.parse import urlparse
+from botocore.response import StreamingBody
+from urllib.parse import parse_qsl, urlparse
 
 # AWS S3 buckets
 
@@ -20,11 +30,91 @@ S3_PREFIX = "piscem_output"
 S3_CLAIM_PREFIX = os.getenv("S3_CLAIM_PREFIX", "piscem_claims").strip("/")
 CLAIM_LEASE_SECONDS = int(os.getenv("CLAIM_LEASE_SECONDS", "180"))
 CLAIM_HEARTBEAT_SECONDS = int(os.getenv("CLAIM_HEARTBEAT_SECONDS", "30"))
+# The heartbeat wakes every CLAIM_HEARTBEAT_SECONDS but renews only when less
+# than two intervals of lease are left. A shard's lease covers this many times
+# the slowest recent shard in the container, so most shards never renew.
+CLAIM_LEASE_MARGIN = 1.5
+# piscem: hand .fastq.gz FIFOs to Piscem. writer: inflate in each FIFO writer
+# thread so Piscem parses plain FASTQ and its threads stay on mapping.
+# parallel: inflate each stream with a block-parallel rapidgzip child given a
+# share of the vCPUs; without rapidgzip, or a vCPU to spare, it acts as writer.
+FASTQ_GZIP_INFLATE = os.getenv("FASTQ_GZIP_INFLATE", "parallel")
+RAPIDGZIP = shutil.which("rapidgzip")
+# Ranged GETs kept in flight per FIFO producer. One S3 connection rarely fills
+# a 10 GB Lambda's network; 1 streams each object through a single GET.
+FIFO_RANGE_CONCURRENCY = max(1, int(os.getenv("FIFO_RANGE_CONCURRENCY", "4")))
+FIFO_RANGE_BYTES = max(1, int(os.getenv("FIFO_RANGE_MIB", "8"))) * 1024 * 1024
+# Ranges are read through the http.client response under botocore's
+# StreamingBody and urllib3's HTTPResponse, which are private attributes; only
+# the major versions they were checked against take that path, and
+# FAST_BODY_READS=0 keeps every read on the public StreamingBody.readinto.
+FAST_BODY_VERSIONS = {"botocore": ("1",), "urllib3": ("1", "2")}
+FAST_BODY_READS = (
+    os.getenv("FAST_BODY_READS", "1") == "1"
+    and botocore.__version__.split(".")[0] in FAST_BODY_VERSIONS["botocore"]
+    and urllib3.__version__.split(".")[0] in FAST_BODY_VERSIONS["urllib3"]
+)
+# map.rad is uploaded in parts of this size while Piscem writes it; 0 uploads
+# it whole after Piscem exits. S3 needs at least 5 MiB for all but the last.
+RAD_UPLOAD_PART_BYTES = int(os.getenv("RAD_UPLOAD_PART_MIB", "8")) * 1024 * 1024
+if 0 < RAD_UPLOAD_PART_BYTES < 5 * 1024 * 1024:
+    RAD_UPLOAD_PART_BYTES = 5 * 1024 * 1024
+RAD_TAIL_POLL_SECONDS = 0.2
+# zstd or deflate: after Piscem exits, rewrite map.rad as independently
+# compressed frames of about RAD_FRAME_MIB, each ending on a RAD chunk
+# boundary, for s3-rad-materialize to inflate in parallel. none uploads RAD.
+RAD_FRAME_CODEC = os.getenv("RAD_FRAME_CODEC", "none")
+RAD_FRAME_BYTES = max(1, int(os.getenv("RAD_FRAME_MIB", "8"))) * 1024 * 1024
+RAD_FRAME_MAGIC = b"RADZ"
+RAD_FRAME_CODECS = {"deflate": 1, "zstd": 2}
+# 1 counts the reads of each barcode in map.rad after Piscem exits and uploads
+# them as bc_read_counts.bin, which the driver merges into the barcode
+# frequency table without another pass over the combined file.
+BARCODE_HISTOGRAM = os.getenv("BARCODE_HISTOGRAM", "0") == "1"
+BARCODE_HISTOGRAM_FILE = "bc_read_counts.bin"
+BARCODE_HISTOGRAM_MAGIC = b"BCH1"
+# /proc is sampled at this interval while a shard runs (0 disables), and the
+# summary is added to PIPELINE_TIMING; RESOURCE_TIMESERIES=1 adds every sample.
+RESOURCE_SAMPLE_SECONDS = float(os.getenv("RESOURCE_SAMPLE_SECONDS", "1"))
+RESOURCE_TIMESERIES = os.getenv("RESOURCE_TIMESERIES", "0") == "1"
+# A batch manifest starts each shard with this line and its output folder.
+BATCH_SHARD_MARKER = "# shard "
+# Another batched shard starts only if this many times the slowest shard so
+# far, plus the reserve, is left before the function timeout; otherwise the
+# rest of the batch is published as a "<batch>_r<position>_input.txt" manifest.
+BATCH_DEADLINE_MARGIN = 1.25
+BATCH_DEADLINE_RESERVE_SECONDS = 20
+# Splitter role: a "<lane>_split.txt" manifest names one R1/R2 pair that this
+# function inflates, cuts into shards and publishes mapper manifests for.
+SPLIT_MANIFEST_SUFFIX = "_split.txt"
+SPLIT_DEFAULT_READ_PAIRS = 4_000_000
+SPLIT_READ_BYTES = 4 * 1024 * 1024
+# The splitter holds the pair being cut, its joined copy and the previous pair
+# while it uploads. Pairs per shard are capped so that many pairs of
+# SPLIT_PAIR_BYTES (decompressed R1 + R2 record bytes) fit in this fraction of
+# the function's memory; the 3008 MB fallback cuts about 1.2M-pair shards.
+SPLIT_HELD_PAIRS = 3
+SPLIT_PAIR_BYTES = int(os.getenv("SPLIT_PAIR_BYTES", "512"))
+SPLIT_MEMORY_FRACTION = 0.6
+# A continuation seeks to its first shard through this seek-point index beside
+# a gzip (scripts/gzip_range_index.py writes it) instead of re-inflating.
+SPLIT_INDEX_SUFFIX = ".gzidx"
+# A failure that no Lambda retry can fix (a bad manifest, unpaired mates).
+SPLIT_PERMANENT_ERRORS = (ValueError,)
+# Optional push channel for shard completions, read by scripts/completion_tracker.py:
+# an SQS queue URL, or file:///path for an append-only local file.
+COMPLETION_CHANNEL = os.getenv("COMPLETION_CHANNEL", "")
 
 print(f"S3_OUTPUT_BUCKET_NAME : {S3_OUTPUT_BUCKET_NAME}")
 print(f"S3_INPUT_BUCKET_NAME : {S3_INPUT_BUCKET_NAME}")
 print(f"EXPECTED_INPUT_FILES_BUCKET : {EXPECTED_INPUT_FILES_BUCKET}")
-s3_client = boto3.client('s3')
+# Room for an R1 and an R2 producer's ranged GETs plus the claim requests.
+s3_client = boto3.client(
+    's3', config=Config(max_pool_connections=max(10, 2 * FIFO_RANGE_CONCURRENCY + 2))
+)
+# Durations of the last shards mapped by this warm container.
+recent_shard_seconds = deque(maxlen=4)
+sqs_client = None
 
 
 class ClaimBusyError(RuntimeError):
@@ -35,6 +125,10 @@ class ClaimLostError(RuntimeError):
     """This invocation no longer owns its conditional S3 claim."""
 
 
+class ShardPairingError(ValueError):
+    """R1 and R2 shards cut by the splitter do not hold the same reads."""
+
+
 def utc_now_iso():
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
@@ -52,11 +146,20 @@ def completion_marker_key(output_folder):
     return f"{S3_PREFIX}/{output_folder}/output.txt"
 
 
-def completion_marker_exists(output_folder):
+def split_marker_key(output_folder):
+    # Outside S3_PREFIX, where every output.txt is counted as a mapped shard.
+    return f"{S3_CLAIM_PREFIX}/{output_folder}.done.json"
+
+
+def split_failure_key(output_folder):
+    return f"{S3_CLAIM_PREFIX}/{output_folder}.failed.json"
+
+
+def completion_marker_exists(output_folder, marker_key=None):
     try:
         s3_client.head_object(
             Bucket=S3_OUTPUT_BUCKET_NAME,
-            Key=completion_marker_key(output_folder),
+            Key=marker_key or completion_marker_key(output_folder),
         )
         return True
     except ClientError as error:
@@ -69,7 +172,21 @@ def claim_object_key(output_folder):
     return f"{S3_CLAIM_PREFIX}/{output_folder}.json"
 
 
-def claim_document(owner, output_folder, input_file_key, state, now_epoch, **extra):
+def claim_lease_seconds(context, expected_seconds=None):
+    """Lease for a shard expected to take ``expected_seconds``, never below the default."""
+    if not expected_seconds:
+        return CLAIM_LEASE_SECONDS
+    lease = expected_seconds * CLAIM_LEASE_MARGIN
+    remaining_ms = getattr(context, "get_remaining_time_in_millis", None)
+    if remaining_ms is not None:
+        # Holding the claim past the invocation's own timeout protects nothing.
+        lease = min(lease, remaining_ms() / 1000 + CLAIM_HEARTBEAT_SECONDS)
+    return max(CLAIM_LEASE_SECONDS, int(lease + 0.999))
+
+
+def claim_document(owner, output_folder, input_file_key, state, now_epoch,
+                   lease_seconds=None, **extra):
+    lease_seconds = lease_seconds or CLAIM_LEASE_SECONDS
     document = {
         "version": 1,
         "owner": owner,
@@ -77,7 +194,8 @@ def claim_document(owner, output_folder, input_file_key, state, now_epoch, **ext
         "input_file_key": input_file_key,
         "state": state,
         "updated_at": utc_now_iso(),
-        "lease_expires_epoch": now_epoch + CLAIM_LEASE_SECONDS,
+        "lease_seconds": lease_seconds,
+        "lease_expires_epoch": now_epoch + lease_seconds,
     }
     document.update(extra)
     return document
@@ -110,12 +228,14 @@ def read_claim_document(key):
     return document, response["ETag"], response.get("LastModified")
 
 
-def acquire_processing_claim(output_folder, input_file_key, context):
-    """Atomically acquire or take over an expired per-manifest S3 lease."""
-    if completion_marker_exists(output_folder):
-        print(f"CLAIM already_complete folder={output_folder}", flush=True)
-        return {"status": "already_complete"}
+def acquire_processing_claim(output_folder, input_file_key, context, marker_key=None,
+                             expected_seconds=None):
+    """Atomically acquire or take over an expired per-manifest S3 lease.
 
+    The conditional claim PUT and the completion-marker HEAD are issued
+    together, so a fresh shard pays one round trip for both. A claim won for
+    a folder that turns out to be complete is conditionally deleted again.
+    """
     owner = getattr(context, "aws_request_id", None) or "unknown-request"
     key = claim_object_key(output_folder)
     now_epoch = int(time.time())
@@ -125,15 +245,31 @@ def acquire_processing_claim(output_folder, input_file_key, context):
         input_file_key,
         "processing",
         now_epoch,
+        lease_seconds=claim_lease_seconds(context, expected_seconds),
         acquired_at=utc_now_iso(),
     )
-    try:
-        etag = put_claim_document(key, document, IfNoneMatch="*")
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="claim-marker") as pool:
+        marker_future = pool.submit(completion_marker_exists, output_folder, marker_key)
+        try:
+            etag = put_claim_document(key, document, IfNoneMatch="*")
+            won = True
+        except ClientError as error:
+            if not is_s3_error(error, "409", "412", "ConditionalRequestConflict", "PreconditionFailed"):
+                raise
+            won = False
+        complete = marker_future.result()
+
+    if won:
+        if complete:
+            print(f"CLAIM already_complete folder={output_folder}", flush=True)
+            release_failed_claim(
+                {"key": key, "owner": owner, "etag": etag, "mutex": threading.Lock()},
+                "released_when_complete",
+            )
+            return {"status": "already_complete"}
         print(f"CLAIM acquired key={key} owner={owner} etag={etag}", flush=True)
-    except ClientError as error:
-        if not is_s3_error(error, "409", "412", "ConditionalRequestConflict", "PreconditionFailed"):
-            raise
-        if completion_marker_exists(output_folder):
+    else:
+        if complete:
             print(f"CLAIM duplicate_complete folder={output_folder}", flush=True)
             return {"status": "already_complete"}
 
@@ -190,14 +326,25 @@ def acquire_processing_claim(output_folder, input_file_key, context):
     return claim
 
 
-def refresh_processing_claim(claim):
+def refresh_processing_claim(claim, only_if_due=False):
+    """Renew the lease with an ETag-conditional PUT; return whether one was sent.
+
+    With ``only_if_due`` the PUT is skipped while at least two heartbeat
+    intervals of lease remain: no other invocation can take over before the
+    lease expires, so an unexpired lease already proves ownership.
+    """
     with claim["mutex"]:
         if claim["lost"].is_set():
             raise ClaimLostError(f"S3 claim lost: {claim['key']}")
-        document = dict(claim["document"])
         now_epoch = int(time.time())
+        remaining = claim["document"]["lease_expires_epoch"] - now_epoch
+        if only_if_due and remaining >= 2 * CLAIM_HEARTBEAT_SECONDS:
+            return False
+        document = dict(claim["document"])
         document["updated_at"] = utc_now_iso()
-        document["lease_expires_epoch"] = now_epoch + CLAIM_LEASE_SECONDS
+        document["lease_expires_epoch"] = now_epoch + document.get(
+            "lease_seconds", CLAIM_LEASE_SECONDS
+        )
         try:
             etag = put_claim_document(
                 claim["key"], document, IfMatch=claim["etag"]
@@ -215,23 +362,24 @@ def refresh_processing_claim(claim):
             raise
         claim["etag"] = etag
         claim["document"] = document
+        return True
 
 
 def start_claim_heartbeat(claim):
     def heartbeat():
         while not claim["stop"].wait(CLAIM_HEARTBEAT_SECONDS):
             try:
-                refresh_processing_claim(claim)
-                print(
-                    f"CLAIM heartbeat key={claim['key']} owner={claim['owner']}",
-                    flush=True,
-                )
+                if refresh_processing_claim(claim, only_if_due=True):
+                    print(
+                        f"CLAIM heartbeat key={claim['key']} owner={claim['owner']}",
+                        flush=True,
+                    )
             except ClaimLostError as error:
                 print(f"CLAIM heartbeat_lost error={error}", flush=True)
                 return
             except Exception as error:
                 # A transient heartbeat failure is not proof of lost ownership.
-                # The synchronous refresh before upload is authoritative.
+                # The next wake still has a heartbeat interval of lease left.
                 print(
                     f"CLAIM heartbeat_warning type={type(error).__name__} error={error}",
                     flush=True,
@@ -255,40 +403,94 @@ def stop_claim_heartbeat(claim):
         thread.join(timeout=max(1, CLAIM_HEARTBEAT_SECONDS + 1))
 
 
-def mark_claim_completed(claim, timings):
+def publish_completion(claim, marker_key, record):
+    """Write the completion marker once, with the claim's audit fields in ``record``.
+
+    This one ``If-None-Match`` PUT both publishes the shard and closes the
+    claim; the claim object keeps its last lease, and duplicates check the
+    marker. Returns False when another invocation already completed it.
+    """
     stop_claim_heartbeat(claim)
     with claim["mutex"]:
-        document = dict(claim["document"])
-        document.update(
-            state="completed",
+        if claim["lost"].is_set():
+            raise ClaimLostError(f"S3 claim lost: {claim['key']}")
+        document = dict(
+            record,
+            owner=claim["owner"],
+            claim_key=claim["key"],
+            claim_etag=claim["etag"],
+            acquired_at=claim["document"].get("acquired_at"),
             completed_at=utc_now_iso(),
-            timings=timings,
         )
-        document.pop("lease_expires_epoch", None)
+        if claim["document"].get("takeover_of"):
+            document["takeover_of"] = claim["document"]["takeover_of"]
         try:
-            etag = put_claim_document(
-                claim["key"], document, IfMatch=claim["etag"]
+            response = s3_client.put_object(
+                Bucket=S3_OUTPUT_BUCKET_NAME,
+                Key=marker_key,
+                Body=json.dumps(document, sort_keys=True).encode("utf-8"),
+                ContentType="application/json",
+                IfNoneMatch="*",
             )
         except ClientError as error:
-            if is_s3_error(
+            if not is_s3_error(
                 error,
                 "409",
                 "412",
                 "ConditionalRequestConflict",
                 "PreconditionFailed",
             ):
-                claim["lost"].set()
-                raise ClaimLostError(f"S3 claim lost: {claim['key']}") from error
-            raise
-        claim["etag"] = etag
-        claim["document"] = document
+                raise
+            print(
+                f"CLAIM duplicate_complete key={marker_key} owner={claim['owner']}",
+                flush=True,
+            )
+            return False
         print(
-            f"CLAIM completed key={claim['key']} owner={claim['owner']} etag={etag}",
+            f"CLAIM completed key={marker_key} owner={claim['owner']} "
+            f"etag={response.get('ETag')}",
             flush=True,
         )
+        return True
+
+
+def notify_completion(output_folder):
+    """Push a shard's completion to COMPLETION_CHANNEL once its marker is written.
+
+    The marker stays the contract and the tracker also lists S3, so a failed
+    push is only logged.
+    """
+    global sqs_client
+    if not COMPLETION_CHANNEL:
+        return
+    event = {
+        "type": "shard_complete",
+        "bucket": S3_OUTPUT_BUCKET_NAME,
+        "folder": output_folder,
+        "marker_key": completion_marker_key(output_folder),
+        "completed_at": utc_now_iso(),
+    }
+    body = json.dumps(event, sort_keys=True)
+    try:
+        if COMPLETION_CHANNEL.startswith("file://"):
+            # One O_APPEND write keeps lines from concurrent writers whole.
+            descriptor = os.open(
+                COMPLETION_CHANNEL[len("file://"):], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+            )
+            try:
+                os.write(descriptor, (body + "\n").encode("utf-8"))
+            finally:
+                os.close(descriptor)
+        else:
+            if sqs_client is None:
+                sqs_client = boto3.client("sqs")
+            sqs_client.send_message(QueueUrl=COMPLETION_CHANNEL, MessageBody=body)
+    except Exception as error:
+        print(f"COMPLETION_EVENT warning folder={output_folder} type={type(error).__name__} "
+              f"error={error}", flush=True)
 
 
-def release_failed_claim(claim):
+def release_failed_claim(claim, event="released_after_failure"):
     stop_claim_heartbeat(claim)
     with claim["mutex"]:
         try:
@@ -298,7 +500,7 @@ def release_failed_claim(claim):
                 IfMatch=claim["etag"],
             )
             print(
-                f"CLAIM released_after_failure key={claim['key']} owner={claim['owner']}",
+                f"CLAIM {event} key={claim['key']} owner={claim['owner']}",
                 flush=True,
             )
         except ClientError as error:
@@ -333,6 +535,40 @@ def read_input_manifest(bucket, input_file_key):
     return uris
 
 
+def inline_manifest_lines(input_file_key, lines):
+    """Validate the manifest lines a direct invocation carries in its event."""
+    if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+        raise ValueError(f"Inline manifest for {input_file_key} is not a list of strings")
+    uris = [line.strip() for line in lines if line.strip()]
+    if not uris:
+        raise ValueError(f"Inline manifest for {input_file_key} is empty")
+    return uris
+
+
+def manifest_shards(input_file_key, lines):
+    """Split manifest lines into ``(output_folder, s3_uris)`` per shard.
+
+    A plain manifest is one shard named after its key. A batch manifest lists
+    several independent shards, each introduced by ``# shard <folder>``.
+    """
+    if not lines[0].startswith(BATCH_SHARD_MARKER):
+        folder = os.path.basename(input_file_key.rsplit("_input.txt", 1)[0])
+        return [(folder, lines)]
+    shards = []
+    for line in lines:
+        if line.startswith(BATCH_SHARD_MARKER):
+            folder = line[len(BATCH_SHARD_MARKER):].strip()
+            if not folder or "/" in folder:
+                raise ValueError(f"Invalid batch shard folder in {input_file_key}: {line!r}")
+            shards.append((folder, []))
+        else:
+            shards[-1][1].append(line)
+    folders = [folder for folder, _ in shards]
+    if len(set(folders)) != len(folders) or any(not uris for _, uris in shards):
+        raise ValueError(f"Batch manifest {input_file_key} repeats a shard or lists one without inputs")
+    return shards
+
+
 def parse_fastq_uri(uri):
     parsed = urlparse(uri)
     if parsed.scheme != "s3" or not parsed.netloc or not parsed.path.lstrip("/"):
@@ -367,9 +603,33 @@ def parse_fastq_uri(uri):
         "read": read,
         "suffix": suffix,
         "compression": compression,
+        "range": parse_fastq_range(uri, parsed.fragment) if parsed.fragment else None,
     }
 
 
+def parse_fastq_range(uri, fragment):
+    """Parse a zero-split manifest fragment naming a range of a gzip object."""
+    fields = dict(parse_qsl(fragment, keep_blank_values=True))
+    try:
+        index = urlparse(fields["index"])
+        compressed_first, compressed_last = (int(value) for value in fields["compressed"].split("-"))
+        spec = {
+            "index_bucket": index.netloc,
+            "index_key": index.path.lstrip("/"),
+            "offset": int(fields["offset"]),
+            "length": int(fields["length"]),
+            "seek": int(fields["seek"]),
+            "compressed_first": compressed_first,
+            "compressed_last": compressed_last,
+            "reads": fields.get("reads", ""),
+        }
+    except (KeyError, ValueError) as error:
+        raise ValueError(f"Invalid zero-split range in {uri}: {error}") from error
+    if index.scheme != "s3" or not spec["index_key"] or spec["length"] <= 0:
+        raise ValueError(f"Invalid zero-split range in {uri}")
+    return spec
+
+
 def create_fastq_fifos(s3_uris, stream_dir):
     """Create format-preserving FIFO paths for a paired FASTQ manifest."""
     os.makedirs(stream_dir, exist_ok=True)
@@ -390,9 +650,17 @@ def create_fastq_fifos(s3_uris, stream_dir):
 
     for read_specs in (files_r1, files_r2):
         for index, spec in enumerate(read_specs):
+            spec["inflate"] = (
+                FASTQ_GZIP_INFLATE
+                if spec["compression"] == "gzip" and FASTQ_GZIP_INFLATE in ("writer", "parallel")
+                else None
+            )
+            # A zero-split range is always inflated before it reaches the FIFO.
+            plain = spec["inflate"] or spec.get("range") is not None
+            suffix = ".fastq" if plain else spec["suffix"]
             fifo_path = os.path.join(
                 stream_dir,
-                f"{spec['read'].lower()}_{index:04d}{spec['suffix']}",
+                f"{spec['read'].lower()}_{index:04d}{suffix}",
             )
             os.mkfifo(fifo_path, 0o600)
             spec["fifo_path"] = fifo_path
@@ -400,54 +668,809 @@ def create_fastq_fifos(s3_uris, stream_dir):
     return files_r1, files_r2
 
 
-def write_s3_object_to_fifo(spec):
-    """Copy one complete S3 object, in order, into a Piscem input FIFO."""
+class GzipMemberInflater:
+    """Inflate a gzip stream that may be several concatenated members."""
+
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(31)
+        self.in_member = False
+
+    def inflate(self, chunk):
+        pieces = []
+        while chunk:
+            self.in_member = True
+            pieces.append(self.decompressor.decompress(chunk))
+            if not self.decompressor.eof:
+                break
+            chunk = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(31)
+            self.in_member = False
+        return b"".join(pieces)
+
+    def finish(self, uri):
+        if self.in_member:
+            raise IOError(f"Truncated gzip member in {uri}")
+
+
+def start_parallel_inflate(spec, fifo):
+    """Start a rapidgzip child that inflates its stdin into ``fifo``."""
+    return subprocess.Popen(
+        [RAPIDGZIP, "-d", "-c", "-P", str(spec.get("inflate_threads", 1))],
+        stdin=subprocess.PIPE,
+        stdout=fifo,
+        stderr=subprocess.PIPE,
+        bufsize=0,
+    )
+
+
+def finish_parallel_inflate(decoder, uri):
+    decoder.stdin.close()
+    stderr = decoder.stderr.read()
+    if decoder.wait() != 0:
+        raise IOError(
+            f"rapidgzip exited with status {decoder.returncode} for {uri}: "
+            f"{stderr[-2000:].decode('utf-8', 'replace')}"
+        )
+
+
+class S3RangeFile:
+    """Seekable read-only view of an S3 object backed by streaming ranged GETs.
+
+    Reads continue one open GET for as long as they are sequential; a seek
+    elsewhere starts a new GET. ``last_hint`` is the last byte a caller expects
+    to need: one GET runs up to it, and reads past it fetch bounded slices.
+    """
+
+    SLICE_BYTES = 1024 * 1024
+
+    def __init__(self, bucket, key, last_hint=None):
+        self.bucket = bucket
+        self.key = key
+        self.last_hint = last_hint
+        self.position = 0
+        self.size = None
+        self.body = None
+        self.body_position = None
+        self.body_end = None
+        self.bytes_read = 0
+        self.requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def object_size(self):
+        if self.size is None:
+            self.size = int(
+                s3_client.head_object(Bucket=self.bucket, Key=self.key)["ContentLength"]
+            )
+        return self.size
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.object_size()
+        self.position = max(0, offset)
+        return self.position
+
+    def close_body(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+
+    def open_body(self):
+        self.close_body()
+        if self.last_hint is not None and self.position <= self.last_hint:
+            last = self.last_hint
+        else:
+            last = self.position + self.SLICE_BYTES - 1
+        response = s3_client.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f"bytes={self.position}-{last}"
+        )
+        self.requests += 1
+        self.body = response["Body"]
+        self.body_position = self.position
+        self.body_end = self.position + int(response["ContentLength"])
+
+    def read(self, size=-1):
+        if self.body is None or self.body_position != self.position or self.position >= self.body_end:
+            if self.size is not None and self.position >= self.size:
+                return b""
+            try:
+                self.open_body()
+            except ClientError as error:
+                if is_s3_error(error, "InvalidRange"):
+                    return b""
+                raise
+        remaining = self.body_end - self.position
+        data = self.body.read(remaining if size is None or size < 0 else min(size, remaining))
+        self.position += len(data)
+        self.body_position = self.position
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.close_body()
+
+
+def body_reader(body):
+    """Return the fastest ``readinto`` source for a botocore streaming body.
+
+    urllib3's ``readinto`` reads into a fresh ``bytes`` and copies it, so an
+    undecoded body is read through its ``http.client`` response instead,
+    whose ``readinto`` receives socket data straight into the caller's buffer.
+    The caller checks the byte count, which urllib3 would otherwise verify.
+    Anything else gets the body itself: a checksum-validating subclass, whose
+    ``read`` is where botocore checks the response, an encoded body, or a
+    botocore/urllib3 outside the versions the private attributes were
+    checked against.
+    """
+    if not FAST_BODY_READS or type(body) is not StreamingBody:
+        return body
+    raw = getattr(body, "_raw_stream", None)
+    fp = getattr(raw, "_fp", None)
+    headers = getattr(raw, "headers", None) or {}
+    if fp is None or not hasattr(fp, "readinto"):
+        return body
+    if headers.get("content-encoding", "identity").lower() != "identity":
+        return body
+    return fp
+
+
+def fill_buffer(body, view):
+    """``readinto`` ``view`` until it is full or the body ends; return the bytes read."""
+    source = body_reader(body)
+    filled = 0
+    while filled < len(view):
+        count = source.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+class OrderedRangeReader:
+    """Read one S3 object through parallel ranged GETs, returning ranges in order.
+
+    Up to ``concurrency`` ranges are requested ahead of the one being written,
+    so at most ``concurrency + 1`` ranges are held in memory. Each range is
+    read into a reused buffer from a small ring rather than a new ``bytes``,
+    and ``chunks`` yields memoryviews that stay valid until the next one is
+    requested. A completed range waits in its queue slot until every earlier
+    range has been handed out. ``starved_seconds`` is the time the caller
+    spent waiting on S3 for the next range. With ``concurrency`` 1 the object
+    is streamed through a single GET into one buffer instead.
+    """
+
+    def __init__(self, bucket, key, range_bytes=None, concurrency=None, first_range=None):
+        self.bucket = bucket
+        self.key = key
+        self.range_bytes = range_bytes or FIFO_RANGE_BYTES
+        self.concurrency = concurrency or FIFO_RANGE_CONCURRENCY
+        # A future for fetch(0) started while the previous batched shard mapped.
+        self.first_range = first_range
+        self.size = None
+        self.requests = 0
+        self.starved_seconds = 0.0
+        self.free_buffers = []
+
+    def take_buffer(self):
+        # list.pop and list.append are atomic, so fetch threads can share the ring.
+        try:
+            return self.free_buffers.pop()
+        except IndexError:
+            return bytearray(self.range_bytes)
+
+    def fetch(self, first):
+        last = first + self.range_bytes - 1
+        response = s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={first}-{last}")
+        body = response["Body"]
+        buffer = self.take_buffer()
+        try:
+            length = fill_buffer(body, memoryview(buffer))
+        finally:
+            body.close()
+        if self.size is not None:
+            expected = min(self.range_bytes, self.size - first)
+        else:
+            expected = int(response["ContentLength"])
+        if length != expected:
+            self.free_buffers.append(buffer)
+            raise IOError(
+                f"Short range for s3://{self.bucket}/{self.key} at {first}: "
+                f"got {length}, expected {expected} bytes"
+            )
+        return response, buffer, length
+
+    def stream_chunks(self):
+        waited = time.perf_counter()
+        response = s3_client.get_object(Bucket=self.bucket, Key=self.key)
+        self.requests += 1
+        self.size = int(response["ContentLength"])
+        body = response["Body"]
+        view = memoryview(self.take_buffer())
+        try:
+            while True:
+                length = fill_buffer(body, view)
+                self.starved_seconds += time.perf_counter() - waited
+                if not length:
+                    return
+                yield view[:length]
+                waited = time.perf_counter()
+        finally:
+            body.close()
+
+    def chunks(self):
+        if self.concurrency == 1:
+            yield from self.stream_chunks()
+            return
+        waited = time.perf_counter()
+        try:
+            # The first range also reports the object size.
+            if self.first_range is not None:
+                response, buffer, length = self.first_range.result()
+            else:
+                response, buffer, length = self.fetch(0)
+        except ClientError as error:
+            if is_s3_error(error, "InvalidRange"):
+                self.size = 0
+                return
+            raise
+        self.requests += 1
+        self.size = int(response["ContentRange"].rsplit("/", 1)[1])
+        self.starved_seconds += time.perf_counter() - waited
+        offsets = iter(range(length, self.size, self.range_bytes))
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="s3-range")
+        try:
+            def refill():
+                while len(pending) < self.concurrency:
+                    offset = next(offsets, None)
+                    if offset is None:
+                        return
+                    pending.append(executor.submit(self.fetch, offset))
+                    self.requests += 1
+
+            refill()
+            yield memoryview(buffer)[:length]
+            while pending:
+                waited = time.perf_counter()
+                _, next_buffer, length = pending.popleft().result()
+                self.starved_seconds += time.perf_counter() - waited
+                # The caller is done with the previous range; its buffer is
+                # reused by the next fetch.
+                self.free_buffers.append(buffer)
+                buffer = next_buffer
+                refill()
+                yield memoryview(buffer)[:length]
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def prefetch_first_ranges(s3_uris, executor):
+    """Start the first ranged GET of each whole-object input of a later shard."""
+    if FIFO_RANGE_CONCURRENCY == 1:
+        return {}
+    prefetched = {}
+    for uri in s3_uris:
+        spec = parse_fastq_uri(uri)
+        if spec["range"] is None:
+            reader = OrderedRangeReader(spec["bucket"], spec["key"])
+            prefetched[uri] = executor.submit(reader.fetch, 0)
+    return prefetched
+
+
+def write_indexed_range_to_fifo(spec):
+    """Inflate one zero-split range from its seek point into a Piscem FIFO."""
+    import indexed_gzip
+
     started = time.perf_counter()
-    response = None
-    body = None
+    fastq_range = spec["range"]
+    response = s3_client.get_object(
+        Bucket=fastq_range["index_bucket"], Key=fastq_range["index_key"]
+    )
+    index_body = response["Body"]
+    try:
+        index_bytes = index_body.read()
+    finally:
+        index_body.close()
+
+    source = S3RangeFile(spec["bucket"], spec["key"], fastq_range["compressed_last"])
+    remaining = fastq_range["length"]
     bytes_written = 0
     first_byte_seconds = None
     try:
-        # Opening first lets the FIFO apply backpressure before an S3 body is held.
         with open(spec["fifo_path"], "wb", buffering=0) as output:
-            response = s3_client.get_object(Bucket=spec["bucket"], Key=spec["key"])
-            expected_bytes = int(response["ContentLength"])
-            body = response["Body"]
-            while True:
-                chunk = body.read(8 * 1024 * 1024)
-                if not chunk:
-                    break
+            stream = indexed_gzip.IndexedGzipFile(
+                fileobj=source, auto_build=False, skip_crc_check=True
+            )
+            try:
+                stream.import_index(fileobj=io.BytesIO(index_bytes))
+                stream.seek(fastq_range["offset"])
+                while remaining:
+                    chunk = stream.read(min(8 * 1024 * 1024, remaining))
+                    if not chunk:
+                        break
+                    if first_byte_seconds is None:
+                        first_byte_seconds = time.perf_counter() - started
+                    remaining -= len(chunk)
+                    view = memoryview(chunk)
+                    while view:
+                        written = output.write(view)
+                        if not written:
+                            raise IOError(f"Zero-byte FIFO write for {spec['uri']}")
+                        bytes_written += written
+                        view = view[written:]
+            finally:
+                stream.close()
+    finally:
+        source.close()
+
+    if remaining:
+        raise IOError(
+            f"Truncated zero-split range for {spec['uri']}: "
+            f"wrote {bytes_written}, expected {fastq_range['length']} bytes"
+        )
+
+    result = {
+        "uri": spec["uri"].split("#", 1)[0],
+        "read": spec["read"],
+        "compression": "gzip-range",
+        "reads": fastq_range["reads"],
+        "seek": fastq_range["seek"],
+        "bytes": source.bytes_read,
+        "index_bytes": len(index_bytes),
+        "fifo_bytes": bytes_written,
+        "get_requests": source.requests,
+        "seconds": round(time.perf_counter() - started, 6),
+        "first_byte_seconds": round(first_byte_seconds or 0.0, 6),
+    }
+    print("S3_STREAM " + json.dumps(result, sort_keys=True), flush=True)
+    return result
+
+
+def write_s3_object_to_fifo(spec):
+    """Copy one complete S3 object, in order, into a Piscem input FIFO."""
+    if spec.get("range"):
+        return write_indexed_range_to_fifo(spec)
+    started = time.perf_counter()
+    source = OrderedRangeReader(spec["bucket"], spec["key"], first_range=spec.get("first_range"))
+    bytes_read = 0
+    bytes_written = 0
+    blocked_seconds = 0.0
+    first_byte_seconds = None
+    parallel = spec.get("inflate") == "parallel"
+    inflater = GzipMemberInflater() if spec.get("inflate") and not parallel else None
+    decoder = None
+    # Opening first lets the FIFO apply backpressure before any range is held.
+    with open(spec["fifo_path"], "wb", buffering=0) as fifo:
+        output = fifo
+        if parallel:
+            # The FIFO's backpressure now reaches S3 through rapidgzip's stdin.
+            decoder = start_parallel_inflate(spec, fifo)
+            output = decoder.stdin
+        chunks = source.chunks()
+        try:
+            for chunk in chunks:
                 if first_byte_seconds is None:
                     first_byte_seconds = time.perf_counter() - started
+                bytes_read += len(chunk)
+                if inflater is not None:
+                    chunk = inflater.inflate(chunk)
+                # chunk is a view of a reused range buffer; write it out in place.
                 remaining = memoryview(chunk)
+                # A full pipe blocks the write: Piscem is not keeping up.
+                write_started = time.perf_counter()
                 while remaining:
                     written = output.write(remaining)
                     if not written:
                         raise IOError(f"Zero-byte FIFO write for {spec['uri']}")
                     bytes_written += written
                     remaining = remaining[written:]
-    finally:
-        if body is not None:
-            body.close()
+                blocked_seconds += time.perf_counter() - write_started
+            if decoder is not None:
+                finish_parallel_inflate(decoder, spec["uri"])
+        except BrokenPipeError:
+            # rapidgzip stopped reading; report why rather than the broken pipe.
+            if decoder is not None and decoder.poll() is not None:
+                finish_parallel_inflate(decoder, spec["uri"])
+            raise
+        finally:
+            chunks.close()
+            if decoder is not None and decoder.poll() is None:
+                decoder.kill()
+                decoder.wait()
 
-    if bytes_written != expected_bytes:
+    if bytes_read != source.size:
         raise IOError(
             f"Truncated S3 stream for {spec['uri']}: "
-            f"wrote {bytes_written}, expected {expected_bytes} bytes"
+            f"read {bytes_read}, expected {source.size} bytes"
         )
+    if inflater is not None:
+        inflater.finish(spec["uri"])
 
     result = {
         "uri": spec["uri"],
         "read": spec["read"],
         "compression": spec["compression"],
-        "bytes": bytes_written,
+        "inflate": spec.get("inflate") or "none",
+        "bytes": bytes_read,
+        # Bytes handed to rapidgzip when it inflates into the FIFO.
+        "fifo_bytes": bytes_written,
+        "get_requests": source.requests,
+        "range_concurrency": source.concurrency,
         "seconds": round(time.perf_counter() - started, 6),
         "first_byte_seconds": round(first_byte_seconds or 0.0, 6),
+        # Starved: Piscem could take more but S3 had not delivered it.
+        # Blocked: S3 data was ready but Piscem had not drained the FIFO.
+        "starved_seconds": round(source.starved_seconds, 6),
+        "blocked_seconds": round(blocked_seconds, 6),
+        "limit": "s3" if source.starved_seconds > blocked_seconds else "piscem",
     }
+    if parallel:
+        result["inflate_threads"] = spec["inflate_threads"]
     print("S3_STREAM " + json.dumps(result, sort_keys=True), flush=True)
     return result
 
 
+def rad_chunk_count_end(header):
+    """End offset of the chunk count in a RAD header prefix, or None if it is cut short.
+
+    The header is ``is_paired`` (u8), the reference count (u64), each reference
+    name (u16 length and bytes) and then the u64 chunk count, which Piscem
+    rewrites in place once mapping ends.
+    """
+    if len(header) < 9:
+        return None
+    (ref_count,) = struct.unpack_from("<Q", header, 1)
+    offset = 9
+    for _ in range(ref_count):
+        if len(header) < offset + 2:
+            return None
+        (length,) = struct.unpack_from("<H", header, offset)
+        offset += 2 + length
+    return offset + 8 if len(header) >= offset + 8 else None
+
+
+RAD_TYPE_WIDTHS = {0: 1, 1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}
+
+
+def rad_prelude_layout(header):
+    """Parse the prelude of a RAD header prefix, or return None if it is cut short.
+
+    After the chunk count come the file-, read- and alignment-level tag
+    descriptions (u16 count, then a u16-length name and a type id each; arrays
+    add a length and an element type) and the file-level tag values. Returns
+    the payload offset, the read- and alignment-level tags as (name, type id)
+    pairs, and the integer file-level tag values by name.
+    """
+    offset = rad_chunk_count_end(header)
+    if offset is None:
+        return None
+    widths = RAD_TYPE_WIDTHS
+    sections = ([], [], [])
+    file_values = {}
+    try:
+        for tags in sections:
+            (count,) = struct.unpack_from("<H", header, offset)
+            offset += 2
+            for _ in range(count):
+                (length,) = struct.unpack_from("<H", header, offset)
+                name = bytes(header[offset + 2:offset + 2 + length]).decode("utf-8", "replace")
+                offset += 2 + length
+                kind = header[offset]
+                offset += 1
+                if kind == 7:
+                    tags.append((name, kind, header[offset], header[offset + 1]))
+                    offset += 2
+                else:
+                    tags.append((name, kind, 0, 0))
+        for name, kind, length_kind, element_kind in sections[0]:
+            if kind == 8:
+                (length,) = struct.unpack_from("<H", header, offset)
+                offset += 2 + length
+            elif kind != 7:
+                if kind <= 4 and offset + widths[kind] <= len(header):
+                    file_values[name] = int.from_bytes(header[offset:offset + widths[kind]], "little")
+                offset += widths[kind]
+            else:
+                width = widths[length_kind]
+                if offset + width > len(header):
+                    return None
+                count = int.from_bytes(header[offset:offset + width], "little")
+                offset += width
+                for _ in range(count if element_kind == 8 else 0):
+                    (length,) = struct.unpack_from("<H", header, offset)
+                    offset += 2 + length
+                if element_kind != 8:
+                    offset += count * widths[element_kind]
+    except (struct.error, IndexError):
+        return None
+    if offset > len(header):
+        return None
+    return {
+        "payload_offset": offset,
+        "read_tags": [(name, kind) for name, kind, _, _ in sections[1]],
+        "alignment_tags": [(name, kind) for name, kind, _, _ in sections[2]],
+        "file_tags": file_values,
+    }
+
+
+def rad_payload_offset(header):
+    """Offset of the first record chunk in a RAD header prefix, or None if it is cut short."""
+    layout = rad_prelude_layout(header)
+    return None if layout is None else layout["payload_offset"]
+
+
+def rad_barcode_histogram(path):
+    """Count the reads of each barcode in a finished RAD file.
+
+    A record is its alignment count (u32), the read-level tags, of which the
+    barcode is the first, and then the alignment-level tags once per
+    alignment. Returns the counts keyed by the 2-bit encoded barcode and the
+    barcode length from Piscem's ``cblen`` file tag (0 when absent), or None
+    when a tag is not a fixed-width integer.
+    """
+    with open(path, "rb") as source:
+        data = source.read()
+    layout = rad_prelude_layout(data)
+    if layout is None:
+        raise ValueError(f"{path} does not start with a complete RAD prelude")
+    read_kinds = [kind for _, kind in layout["read_tags"]]
+    alignment_kinds = [kind for _, kind in layout["alignment_tags"]]
+    if not read_kinds or any(kind > 4 for kind in read_kinds + alignment_kinds):
+        return None
+    barcode_code = {0: "B", 1: "B", 2: "H", 3: "I", 4: "Q"}[read_kinds[0]]
+    unpack = struct.Struct("<I" + barcode_code).unpack_from
+    read_bytes = 4 + sum(RAD_TYPE_WIDTHS[kind] for kind in read_kinds)
+    alignment_bytes = sum(RAD_TYPE_WIDTHS[kind] for kind in alignment_kinds)
+    counts = Counter()
+    position = layout["payload_offset"]
+    while position + 8 <= len(data):
+        chunk_bytes, records = struct.unpack_from("<II", data, position)
+        end = position + chunk_bytes
+        if chunk_bytes < 8 or end > len(data):
+            break
+        barcodes = []
+        append = barcodes.append
+        record = position + 8
+        for _ in range(records):
+            alignments, barcode = unpack(data, record)
+            append(barcode)
+            record += read_bytes + alignments * alignment_bytes
+        if record != end:
+            raise ValueError(f"RAD chunk at byte {position} of {path} does not hold {records} records")
+        counts.update(barcodes)
+        position = end
+    return counts, layout["file_tags"].get("cblen", 0)
+
+
+def write_barcode_histogram(path, counts, barcode_length):
+    """Write barcode read counts to ``path``; return its size.
+
+    The layout is ``BCH1``, the barcode length (u8), three reserved bytes and
+    the entry count (u64), then the zlib-compressed sorted barcodes (u64 each)
+    followed by their counts (u64 each).
+    """
+    barcodes = sorted(counts)
+    body = struct.pack(f"<{len(barcodes)}Q", *barcodes)
+    body += struct.pack(f"<{len(barcodes)}Q", *(counts[barcode] for barcode in barcodes))
+    with open(path, "wb") as target:
+        target.write(BARCODE_HISTOGRAM_MAGIC + struct.pack("<B3xQ", barcode_length, len(barcodes)))
+        target.write(zlib.compress(body, 6))
+    return os.path.getsize(path)
+
+
+def rad_frame_bounds(data, payload_offset, frame_bytes):
+    """Split the RAD payload into frames of about ``frame_bytes`` ending on chunk boundaries.
+
+    Each chunk starts with its total size (u32, header included) and record
+    count (u32). Bytes that do not parse as a chunk go into the last frame.
+    """
+    bounds = []
+    start = position = payload_offset
+    while position + 8 <= len(data):
+        (chunk_bytes,) = struct.unpack_from("<I", data, position)
+        if chunk_bytes < 8 or position + chunk_bytes > len(data):
+            break
+        position += chunk_bytes
+        if position - start >= frame_bytes:
+            bounds.append((start, position))
+            start = position
+    if start < len(data):
+        bounds.append((start, len(data)))
+    return bounds
+
+
+def encode_rad_frames(path, codec, frame_bytes=None, threads=None):
+    """Rewrite the RAD file at ``path`` in place as compressed frames; return sizes.
+
+    The layout is ``RADZ``, a version byte, the codec id, two reserved bytes,
+    the prelude size and frame count (u64 each), the uncompressed RAD prelude
+    (which keeps the chunk count), one (compressed, raw) u64 pair per frame,
+    and then the frames. Each frame decompresses on its own.
+    """
+    if codec == "zstd":
+        import zstandard
+
+        compress = zstandard.ZstdCompressor(level=3).compress
+    else:
+        def compress(frame):
+            return zlib.compress(frame, 1)
+    with open(path, "rb") as source:
+        data = memoryview(source.read())
+    payload_offset = rad_payload_offset(data)
+    if payload_offset is None:
+        raise ValueError(f"{path} does not start with a complete RAD prelude")
+    bounds = rad_frame_bounds(data, payload_offset, frame_bytes or RAD_FRAME_BYTES)
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 2) as pool:
+        frames = list(pool.map(lambda bound: compress(data[bound[0]:bound[1]]), bounds))
+    temporary = path + ".frames"
+    with open(temporary, "wb") as target:
+        target.write(RAD_FRAME_MAGIC + struct.pack(
+            "<BBHQQ", 1, RAD_FRAME_CODECS[codec], 0, payload_offset, len(frames)
+        ))
+        target.write(data[:payload_offset])
+        for frame, (start, end) in zip(frames, bounds):
+            target.write(struct.pack("<QQ", len(frame), end - start))
+        for frame in frames:
+            target.write(frame)
+    data.release()
+    os.replace(temporary, path)
+    return {"raw_bytes": payload_offset + sum(end - start for start, end in bounds),
+            "framed_bytes": os.path.getsize(path), "frames": len(frames)}
+
+
+class RadStreamUploader:
+    """Upload ``map.rad`` as an S3 multipart upload while Piscem appends to it.
+
+    A tail thread uploads each completed part as the file grows. Part 1 runs
+    from the start of the file through the chunk count and is held back,
+    because Piscem rewrites that count when it exits. ``stop`` ends tailing
+    once Piscem has exited. ``complete`` then uploads the remaining parts and
+    part 1, re-uploads any streamed part whose bytes changed, and completes
+    the upload. The object stays invisible until then, so the caller can
+    prove claim ownership first. ``complete`` returns False when nothing was
+    streamed or tailing failed; the caller then uploads the file whole.
+    """
+
+    def __init__(self, path, bucket, key, part_bytes=None):
+        self.path = path
+        self.bucket = bucket
+        self.key = key
+        self.part_bytes = part_bytes or RAD_UPLOAD_PART_BYTES
+        self.client = None
+        self.upload_id = None
+        self.first_part_end = None
+        self.next_part_end = None
+        # part number -> (first byte, end, crc32, ETag)
+        self.parts = {}
+        self.streamed_bytes = 0
+        self.error = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.tail, name="rad-upload", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def read_range(self, first, end):
+        with open(self.path, "rb") as handle:
+            handle.seek(first)
+            return handle.read(end - first)
+
+    def upload_part(self, number, first, end, data=None):
+        data = self.read_range(first, end) if data is None else data
+        if len(data) != end - first:
+            raise IOError(f"map.rad shrank below {end} bytes")
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=data,
+        )
+        self.parts[number] = (first, end, zlib.crc32(data), response["ETag"])
+
+    def tail(self):
+        try:
+            while not self.stopped.wait(RAD_TAIL_POLL_SECONDS):
+                try:
+                    size = os.path.getsize(self.path)
+                except FileNotFoundError:
+                    continue
+                if self.first_part_end is None:
+                    count_end = rad_chunk_count_end(self.read_range(0, min(size, 64 * 1024 * 1024)))
+                    if count_end is None:
+                        continue
+                    self.first_part_end = self.next_part_end = max(self.part_bytes, count_end)
+                # Stream a part only once the one after it has started, so the
+                # last part, which may be short, is always left for complete.
+                while size >= self.next_part_end + self.part_bytes + 1:
+                    if self.upload_id is None:
+                        self.client = self.client or boto3.client("s3")
+                        self.upload_id = self.client.create_multipart_upload(
+                            Bucket=self.bucket, Key=self.key
+                        )["UploadId"]
+                    end = self.next_part_end + self.part_bytes
+                    self.upload_part(len(self.parts) + 2, self.next_part_end, end)
+                    self.streamed_bytes += end - self.next_part_end
+                    self.next_part_end = end
+        except Exception as error:
+            # Tailing is an optimisation; complete falls back to a whole upload.
+            self.error = error
+            print(f"RAD_STREAM tail_failed type={type(error).__name__} error={error}", flush=True)
+
+    def complete(self):
+        if self.upload_id is None:
+            return False
+        if self.error is not None:
+            self.abort()
+            return False
+        size = os.path.getsize(self.path)
+        for number, (first, end, crc, _) in list(self.parts.items()):
+            data = self.read_range(first, end)
+            if zlib.crc32(data) != crc:
+                print(f"RAD_STREAM reupload part={number}", flush=True)
+                self.upload_part(number, first, end, data)
+        number = len(self.parts) + 2
+        first = self.next_part_end
+        while first < size:
+            end = min(size, first + self.part_bytes)
+            if size - end < self.part_bytes:
+                end = size
+            self.upload_part(number, first, end)
+            number += 1
+            first = end
+        self.upload_part(1, 0, self.first_part_end)
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": number, "ETag": self.parts[number][3]}
+                    for number in sorted(self.parts)
+                ]
+            },
+        )
+        print(
+            f"RAD_STREAM completed key={self.key} parts={len(self.parts)} "
+            f"streamed_bytes={self.streamed_bytes} bytes={size}",
+            flush=True,
+        )
+        self.close()
+        return True
+
+    def abort(self):
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+                )
+            except Exception as error:
+                # A lifecycle rule for incomplete uploads cleans up after this.
+                print(f"RAD_STREAM abort_warning type={type(error).__name__} error={error}", flush=True)
+            self.upload_id = None
+        self.close()
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
 def close_fds(fds):
     while fds:
         try:
@@ -467,7 +1490,361 @@ def close_fifo_keepers(keeper_fds):
     keeper_fds.clear()
 
 
-def run_piscem_streaming(files_r1, files_r2):
+def bottleneck_verdict(stream_results):
+    """Name the side that held the FIFOs up, from the producers' stall times.
+
+    A producer waiting on S3 (``starved_seconds``) leaves Piscem short of
+    input; one waiting on a full FIFO (``blocked_seconds``) is ahead of it.
+    """
+    starved = sum(item.get("starved_seconds", 0.0) for item in stream_results)
+    blocked = sum(item.get("blocked_seconds", 0.0) for item in stream_results)
+    return "network-bound" if starved > blocked else "mapper-bound"
+
+
+def fifo_opened_by(pid, fifo_path):
+    """Whether process ``pid`` holds ``fifo_path`` open; True where /proc is unavailable."""
+    fd_dir = f"/proc/{pid}/fd"
+    try:
+        names = os.listdir(fd_dir)
+    except OSError:
+        return True
+    target = os.path.realpath(fifo_path)
+    for name in names:
+        try:
+            if os.readlink(os.path.join(fd_dir, name)) == target:
+                return True
+        except OSError:
+            continue
+    return False
+
+
+class PiscemSupervisor:
+    """Wait on Piscem's output pipes and the FIFO producers in one selector loop.
+
+    A producer's done-callback writes to a wake pipe, so its FIFO keeper is
+    closed as soon as it finishes instead of on the next poll, and Piscem's
+    stdout and stderr are forwarded to the log line by line as they arrive.
+    ``run`` returns once Piscem has closed both pipes and exited; a failed
+    producer terminates Piscem and is returned as ``producer_failure``.
+
+    A producer can finish a small input before Piscem opens its FIFO; the
+    bytes then sit in the pipe buffer, and closing the keeper would discard
+    them. Such keepers stay open, re-checked every ``OPEN_POLL_SECONDS``,
+    until Piscem has the FIFO open.
+    """
+
+    STDERR_TAIL_BYTES = 4000
+    OPEN_POLL_SECONDS = 0.05
+
+    def __init__(self, process, future_specs, keeper_fds):
+        self.process = process
+        self.pending = dict(future_specs)
+        # Finished producers whose FIFO Piscem has not opened yet.
+        self.unopened = []
+        self.keeper_fds = keeper_fds
+        self.producer_failure = None
+        self.inputs_done_at = None
+        self.exited_at = None
+        self.stderr_tail = bytearray()
+        self.partial = {}
+        self.lock = threading.Lock()
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_read, False)
+
+    def notify(self, _future):
+        # Runs on the producer thread; the wake pipe may already be closed.
+        with self.lock:
+            if self.wake_write is not None:
+                try:
+                    os.write(self.wake_write, b"\0")
+                except BlockingIOError:
+                    pass
+
+    def forward(self, name, data):
+        if name == "stderr":
+            self.stderr_tail += data
+            del self.stderr_tail[:-self.STDERR_TAIL_BYTES]
+        lines = (self.partial.pop(name, b"") + data).split(b"\n")
+        if lines[-1]:
+            self.partial[name] = lines[-1]
+        for line in lines[:-1]:
+            print(line.decode("utf-8", "replace"), flush=True)
+
+    def reap_producers(self):
+        for future in [future for future in self.pending if future.done()]:
+            spec = self.pending.pop(future)
+            if future.exception() is not None and self.producer_failure is None:
+                self.producer_failure = future.exception()
+                close_fifo_keepers(self.keeper_fds)
+                self.process.terminate()
+            self.unopened.append(spec["fifo_path"])
+        # Deliver EOF independently for R1 and R2. Waiting for all producers
+        # before closing every keeper can deadlock a paired reader when one
+        # byte stream finishes first.
+        for fifo_path in list(self.unopened):
+            if fifo_opened_by(self.process.pid, fifo_path):
+                close_fifo_keeper(self.keeper_fds, fifo_path)
+                self.unopened.remove(fifo_path)
+        if not self.pending and self.inputs_done_at is None:
+            self.inputs_done_at = time.perf_counter()
+
+    def run(self):
+        selector = selectors.DefaultSelector()
+        try:
+            selector.register(self.wake_read, selectors.EVENT_READ, "wake")
+            selector.register(self.process.stdout, selectors.EVENT_READ, "stdout")
+            selector.register(self.process.stderr, selectors.EVENT_READ, "stderr")
+            for future in self.pending:
+                future.add_done_callback(self.notify)
+            self.reap_producers()
+            open_pipes = 2
+            while open_pipes:
+                events = selector.select(self.OPEN_POLL_SECONDS if self.unopened else None)
+                if not events:
+                    self.reap_producers()
+                for key, _ in events:
+                    if key.data == "wake":
+                        while True:
+                            try:
+                                if not os.read(self.wake_read, 4096):
+                                    break
+                            except BlockingIOError:
+                                break
+                        self.reap_producers()
+                        continue
+                    data = os.read(key.fd, 65536)
+                    if data:
+                        self.forward(key.data, data)
+                        continue
+                    selector.unregister(key.fileobj)
+                    open_pipes -= 1
+                    if key.data in self.partial:
+                        print(self.partial.pop(key.data).decode("utf-8", "replace"), flush=True)
+        finally:
+            selector.close()
+            with self.lock:
+                os.close(self.wake_write)
+                self.wake_write = None
+            os.close(self.wake_read)
+        # Piscem is gone; a producer still writing gets EPIPE instead of
+        # blocking on a FIFO only its keeper holds open.
+        close_fifo_keepers(self.keeper_fds)
+        self.process.wait(timeout=30)
+        self.exited_at = time.perf_counter()
+        self.reap_producers()
+        return self.producer_failure
+
+    def tail_seconds(self):
+        """How long Piscem kept mapping after the last input byte was written."""
+        if self.inputs_done_at is None or self.exited_at is None:
+            return 0.0
+        return round(max(0.0, self.exited_at - self.inputs_done_at), 6)
+
+
+def read_cpu_times():
+    """Per-core (busy, total) jiffies from /proc/stat."""
+    cores = []
+    with open("/proc/stat") as stat:
+        for line in stat:
+            name, *fields = line.split()
+            if name == "cpu":
+                continue
+            if not name.startswith("cpu"):
+                break
+            values = [int(value) for value in fields[:8]]
+            total = sum(values)
+            cores.append((total - values[3] - values[4], total))
+    return cores
+
+
+def read_network_bytes():
+    """Bytes received and sent on every interface but loopback."""
+    received = sent = 0
+    with open("/proc/net/dev") as dev:
+        for line in list(dev)[2:]:
+            name, _, counters = line.partition(":")
+            if name.strip() == "lo":
+                continue
+            values = counters.split()
+            received += int(values[0])
+            sent += int(values[8])
+    return received, sent
+
+
+def read_proc_kib(path, *fields):
+    """``fields`` (reported in kB) from a /proc status-style file, in bytes."""
+    values = {}
+    with open(path) as status:
+        for line in status:
+            name, _, value = line.partition(":")
+            if name in fields:
+                values[name] = int(value.split()[0]) * 1024
+    return values
+
+
+def tmp_used_bytes():
+    stats = os.statvfs("/tmp")
+    return (stats.f_blocks - stats.f_bfree) * stats.f_frsize
+
+
+class ResourceSampler:
+    """Sample CPU, memory, network and /tmp usage from /proc on a background thread.
+
+    ``watch`` names the Piscem process whose RSS is tracked. ``stop`` returns
+    a summary for ``PIPELINE_TIMING``: mean and peak CPU utilisation, the mean
+    per core, Piscem's and the sandbox's peak memory, network bytes and peak
+    rates, and /tmp growth. Metrics whose /proc files cannot be read are left
+    out, so the sampler is harmless off Linux.
+    """
+
+    def __init__(self, interval=None, timeseries=None):
+        self.interval = RESOURCE_SAMPLE_SECONDS if interval is None else interval
+        self.timeseries = RESOURCE_TIMESERIES if timeseries is None else timeseries
+        self.pid = None
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def watch(self, pid):
+        self.pid = pid
+
+    def start(self):
+        self.sample()
+        self.thread = threading.Thread(target=self.run, name="resource-sampler", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        readers = {
+            "cpu": read_cpu_times,
+            "net": read_network_bytes,
+            "tmp": tmp_used_bytes,
+            "memory": lambda: read_proc_kib("/proc/meminfo", "MemTotal", "MemAvailable"),
+        }
+        if self.pid is not None:
+            readers["piscem"] = lambda: read_proc_kib(f"/proc/{self.pid}/status", "VmRSS", "VmHWM")
+        sample = {"time": time.perf_counter()}
+        for name, reader in readers.items():
+            try:
+                sample[name] = reader()
+            except (OSError, ValueError, IndexError):
+                pass
+        self.samples.append(sample)
+
+    def stop(self):
+        if self.thread is None:
+            return None
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.sample()
+        return self.summary()
+
+    def summary(self):
+        first, last = self.samples[0], self.samples[-1]
+        summary = {
+            "interval_seconds": self.interval,
+            "samples": len(self.samples),
+        }
+        pairs = list(zip(self.samples, self.samples[1:]))
+        rows = [[round(later["time"] - first["time"], 2)] for _, later in pairs]
+
+        def share(before, after):
+            busy = sum(core[0] for core in after) - sum(core[0] for core in before)
+            total = sum(core[1] for core in after) - sum(core[1] for core in before)
+            return round(100.0 * busy / total, 1) if total > 0 else 0.0
+
+        if "cpu" in first and "cpu" in last and len(first["cpu"]) == len(last["cpu"]):
+            interval_shares = [
+                share(earlier["cpu"], later["cpu"]) if "cpu" in earlier and "cpu" in later else None
+                for earlier, later in pairs
+            ]
+            summary.update(
+                cpu_cores=len(last["cpu"]),
+                cpu_mean_percent=share(first["cpu"], last["cpu"]),
+                cpu_peak_percent=max((value for value in interval_shares if value is not None), default=0.0),
+                cpu_core_mean_percent=[
+                    share([before], [after]) for before, after in zip(first["cpu"], last["cpu"])
+                ],
+            )
+            for row, value in zip(rows, interval_shares):
+                row.append(value)
+
+        piscem = [sample["piscem"] for sample in self.samples if sample.get("piscem")]
+        if piscem:
+            summary["piscem_rss_peak_bytes"] = max(
+                max(values.get("VmRSS", 0), values.get("VmHWM", 0)) for values in piscem
+            )
+        memory = [
+            sample["memory"]["MemTotal"] - sample["memory"]["MemAvailable"]
+            for sample in self.samples
+            if len(sample.get("memory", {})) == 2
+        ]
+        if memory:
+            summary["memory_used_peak_bytes"] = max(memory)
+        for row, (_, later) in zip(rows, pairs):
+            values = later.get("piscem") or {}
+            row.append(round(values["VmRSS"] / 2**20) if "VmRSS" in values else None)
+
+        if "net" in first and "net" in last:
+            summary.update(
+                net_rx_bytes=last["net"][0] - first["net"][0],
+                net_tx_bytes=last["net"][1] - first["net"][1],
+            )
+            rates = []
+            for row, (earlier, later) in zip(rows, pairs):
+                if "net" in earlier and "net" in later:
+                    seconds = max(later["time"] - earlier["time"], 1e-6)
+                    rates.append(tuple(
+                        (after - before) * 8 / 1e6 / seconds
+                        for before, after in zip(earlier["net"], later["net"])
+                    ))
+                    row.extend(round(rate, 1) for rate in rates[-1])
+                else:
+                    row.extend((None, None))
+            summary.update(
+                net_rx_peak_mbps=round(max((rate[0] for rate in rates), default=0.0), 1),
+                net_tx_peak_mbps=round(max((rate[1] for rate in rates), default=0.0), 1),
+            )
+
+        tmp = [sample["tmp"] for sample in self.samples if "tmp" in sample]
+        if tmp:
+            summary.update(tmp_used_peak_bytes=max(tmp), tmp_written_bytes=max(0, max(tmp) - tmp[0]))
+        for row, (_, later) in zip(rows, pairs):
+            row.append(round(later["tmp"] / 2**20) if "tmp" in later else None)
+
+        if self.timeseries:
+            columns = ["seconds"]
+            if "cpu_mean_percent" in summary:
+                columns.append("cpu_percent")
+            columns.append("piscem_rss_mib")
+            if "net_rx_bytes" in summary:
+                columns.extend(("net_rx_mbps", "net_tx_mbps"))
+            columns.append("tmp_used_mib")
+            summary["timeseries"] = {"columns": columns, "rows": rows}
+        return summary
+
+
+def inflate_thread_budget(cpu_count, thread_cap, parallel_gzip):
+    """Split the vCPUs between Piscem and rapidgzip children.
+
+    Returns (Piscem threads, R1 inflate threads, R2 inflate threads). A third
+    of the vCPUs inflate when any stream is parallel-inflated; R2 carries
+    most of the compressed bytes, so it gets that whole share and R1 half of
+    it. Zero inflate threads means no vCPU is spare and streams inflate in
+    their writer threads instead.
+    """
+    inflate = cpu_count // 3 if parallel_gzip else 0
+    piscem = max(2, min(cpu_count - inflate, thread_cap))
+    if inflate == 0:
+        return piscem, 0, 0
+    return piscem, max(1, inflate // 2), inflate
+
+
+def run_piscem_streaming(files_r1, files_r2, rad_upload=None, sampler=None):
     home_dir = "/var/task"
     output_dir = "/tmp/output"
     os.makedirs(output_dir, exist_ok=True)
@@ -482,10 +1859,18 @@ def run_piscem_streaming(files_r1, files_r2):
     except ValueError:
         lambda_memory_mb = 0
     thread_cap = 2 if 0 < lambda_memory_mb <= 3008 else 6
-    num_threads = max(2, min(cpu_count, thread_cap))
+    parallel_specs = [spec for spec in files_r1 + files_r2 if spec.get("inflate") == "parallel"]
+    num_threads, r1_inflate, r2_inflate = inflate_thread_budget(
+        cpu_count, thread_cap, bool(parallel_specs) and RAPIDGZIP is not None
+    )
+    for spec in parallel_specs:
+        spec["inflate_threads"] = r1_inflate if spec["read"] == "R1" else r2_inflate
+        if not spec["inflate_threads"]:
+            spec["inflate"] = "writer"
     print(
         f"Thread selection: cpu_count={cpu_count}, "
-        f"LAMBDA_MEMORY_MB={lambda_memory_mb}, threads={num_threads}"
+        f"LAMBDA_MEMORY_MB={lambda_memory_mb}, threads={num_threads}, "
+        f"inflate_threads=R1:{r1_inflate},R2:{r2_inflate}"
     )
 
     command = [
@@ -525,38 +1910,22 @@ def run_piscem_streaming(files_r1, files_r2):
             command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
         )
+        if rad_upload is not None:
+            rad_upload.start()
+        if sampler is not None:
+            sampler.watch(process.pid)
 
-        producer_failure = None
-        while process.poll() is None:
-            for future, spec in future_specs.items():
-                if future.done():
-                    # Deliver EOF independently for R1 and R2. Waiting for all
-                    # producers before closing every keeper can deadlock a
-                    # paired reader when one byte stream finishes first.
-                    close_fifo_keeper(keeper_fds, spec["fifo_path"])
-                    if future.exception() is not None:
-                        producer_failure = future.exception()
-                        break
-            if producer_failure is not None or all(future.done() for future in futures):
-                break
-            time.sleep(0.05)
-
-        close_fifo_keepers(keeper_fds)
-        if producer_failure is not None:
-            process.terminate()
-
-        stdout, stderr = process.communicate(timeout=30)
-        if stdout:
-            print(stdout, end="")
-        if stderr:
-            print(stderr, end="")
+        supervisor = PiscemSupervisor(process, future_specs, keeper_fds)
+        supervisor.run()
+        if rad_upload is not None:
+            rad_upload.stop()
 
         stream_results = [future.result() for future in futures]
         if process.returncode != 0:
+            stderr = supervisor.stderr_tail.decode("utf-8", "replace")
             raise RuntimeError(
-                f"Piscem exited with status {process.returncode}: {stderr[-4000:]}"
+                f"Piscem exited with status {process.returncode}: {stderr}"
             )
 
         output_prefix = os.path.join(output_dir, "split_map_output_transcriptome")
@@ -571,8 +1940,17 @@ def run_piscem_streaming(files_r1, files_r2):
             "seconds": round(time.perf_counter() - started, 6),
             "threads": num_threads,
             "input_bytes": sum(item["bytes"] for item in stream_results),
+            "fifo_starved_seconds": round(
+                sum(item.get("starved_seconds", 0.0) for item in stream_results), 6
+            ),
+            "fifo_blocked_seconds": round(
+                sum(item.get("blocked_seconds", 0.0) for item in stream_results), 6
+            ),
             "inputs": stream_results,
+            "bottleneck": bottleneck_verdict(stream_results),
+            "piscem_tail_seconds": supervisor.tail_seconds(),
             "map_rad_bytes": os.path.getsize(map_rad),
+            "map_rad_streamed_bytes": rad_upload.streamed_bytes if rad_upload is not None else 0,
             "num_reads": map_info.get("num_reads"),
             "num_mapped": map_info.get("num_mapped"),
         }
@@ -593,7 +1971,7 @@ def run_piscem_streaming(files_r1, files_r2):
         executor.shutdown(wait=True, cancel_futures=True)
 
 
-def upload_files_with_completion_marker(output_dir, output_folder, s3_bucket_name, s3_prefix):
+def upload_output_files(output_dir, output_folder, s3_bucket_name, s3_prefix, rad_upload=None):
     # Do not reuse the streaming client's HTTP connection pool for uploads.
     # A warm invocation once inherited a malformed/reused S3 response and spent
     # 30 seconds recovering while uploading a tiny companion file. Closing both
@@ -601,10 +1979,14 @@ def upload_files_with_completion_marker(output_dir, output_folder, s3_bucket_nam
     # pool from surviving into the next warm invocation.
     upload_client = boto3.client("s3")
     try:
+        # map.rad's parts were streamed during mapping; publish them first.
+        streamed_path = rad_upload.path if rad_upload is not None and rad_upload.complete() else None
         with S3Transfer(upload_client) as transfer:
             for root, _, files in os.walk(output_dir):
                 for file in files:
                     local_path = os.path.join(root, file)
+                    if local_path == streamed_path:
+                        continue
                     output_s3_key = os.path.join(s3_prefix, output_folder, file)
                     print(f"s3 prefix is {s3_prefix}")
                     print(f"output folder is {output_folder}")
@@ -612,25 +1994,12 @@ def upload_files_with_completion_marker(output_dir, output_folder, s3_bucket_nam
                     print(f"output s3 key is {output_s3_key}")
                     transfer.upload_file(local_path, s3_bucket_name, output_s3_key)
                     print(f"Uploaded {local_path} to S3://{s3_bucket_name}/{output_s3_key}")
-
-            empty_file_path = os.path.join(output_dir, 'output.txt')
-            with open(empty_file_path, 'w') as empty_file:
-                empty_file.write('')
-            empty_s3_key = os.path.join(s3_prefix, output_folder, 'output.txt')
-            transfer.upload_file(empty_file_path, s3_bucket_name, empty_s3_key)
-            os.remove(empty_file_path)
     finally:
         upload_client.close()
 
 
-def handler(event, context):
-    """
-    AWS Lambda function to process S3 events received from EventBridge.
-    It proceeds only if the uploaded file is in the specified bucket and ends with "_input.txt".
-    """
-
-    # Ensure /tmp is clean for processing
-    tmp_dir = "/tmp"
+def clean_scratch(tmp_dir="/tmp"):
+    """Empty the Lambda's scratch directory left over by a warm container."""
     if os.path.exists(tmp_dir) and os.access(tmp_dir, os.W_OK):
         for item in os.listdir(tmp_dir):
             item_path = os.path.join(tmp_dir, item)
@@ -642,12 +2011,23 @@ def handler(event, context):
             except Exception as e:
                 print(f"Warning: Unable to delete {item_path} - {e}")
 
+
+def handler(event, context):
+    """
+    AWS Lambda function to process S3 events received from EventBridge.
+    It proceeds only if the uploaded file is in the specified bucket and ends with "_input.txt".
+    A batch manifest maps its shards back to back, each under its own claim.
+    """
+    clean_scratch()
+
     print("🔹 Received Event from EventBridge:", json.dumps(event, indent=4))  # Debugging log
 
     # Extract S3 event details from EventBridge
     try:
         bucket = event['detail']['bucket']['name']
         input_file_key = event['detail']['object']['key']
+        # A direct invocation carries the manifest lines inline.
+        inline_manifest = event['detail'].get('manifest')
     except KeyError as e:
         print(f"Missing expected key in event: {e}")
         return {'statusCode': 400, 'body': 'Invalid EventBridge event format'}
@@ -660,21 +2040,114 @@ def handler(event, context):
         print(f"Ignoring file: {input_file_key} (Uploaded to an unexpected bucket: {bucket})")
         return {'statusCode': 200, 'body': 'File is in a different bucket, skipping processing'}
 
+    if input_file_key.endswith(SPLIT_MANIFEST_SUFFIX):
+        return process_split(bucket, input_file_key, context)
+
     if not input_file_key.endswith("_input.txt"):
         print(f"Ignoring file: {input_file_key} (Does not match '_input.txt')")
         return {'statusCode': 200, 'body': 'File does not match required pattern, skipping processing'}
 
-    # Extracting final folder name from the input file key
-    final_folder_name = input_file_key.rsplit("_input.txt", 1)[0]
-    final_folder_name = os.path.basename(final_folder_name)
-
     print("Processing File:", input_file_key)
-    print("Extracted Folder Name:", final_folder_name)
+    manifest_started = time.perf_counter()
+    try:
+        if inline_manifest is not None:
+            s3_uris = inline_manifest_lines(input_file_key, inline_manifest)
+        else:
+            s3_uris = read_input_manifest(bucket, input_file_key)
+    except ClientError as error:
+        # A late duplicate event may arrive after its manifest was cleaned up.
+        folder = os.path.basename(input_file_key.rsplit("_input.txt", 1)[0])
+        if is_s3_error(error, "NoSuchKey", "404") and completion_marker_exists(folder):
+            print(f"CLAIM already_complete folder={folder}", flush=True)
+            return {
+                'statusCode': 200,
+                'body': 'Piscem output already complete; duplicate event ignored',
+                'idempotent': True,
+            }
+        raise
+    manifest_seconds = time.perf_counter() - manifest_started
+    shards = manifest_shards(input_file_key, s3_uris)
+    if len(shards) == 1:
+        final_folder_name, s3_uris = shards[0]
+        print("Extracted Folder Name:", final_folder_name)
+        return process_shard(final_folder_name, input_file_key, s3_uris, context, manifest_seconds)
+    return process_batch(bucket, shards, input_file_key, context, manifest_seconds)
+
 
+def process_batch(bucket, shards, input_file_key, context, manifest_seconds):
+    """Map each shard of a batch manifest, prefetching the next one's first ranges.
+
+    Shards that might not finish before the timeout are published as a new
+    batch manifest, so another invocation maps them without a Lambda retry.
+    """
+    print(f"Batch of {len(shards)} shard(s): {[folder for folder, _ in shards]}", flush=True)
+    results = []
+    busy = []
+    continuation = None
+    slowest_seconds = 0.0
+    prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="s3-prefetch")
+    try:
+        prefetched = {}
+        for position, (folder, s3_uris) in enumerate(shards):
+            remaining_ms = getattr(context, "get_remaining_time_in_millis", None)
+            needed = slowest_seconds * BATCH_DEADLINE_MARGIN + BATCH_DEADLINE_RESERVE_SECONDS
+            if results and remaining_ms is not None and remaining_ms() / 1000 < needed:
+                continuation = f"{input_file_key.rsplit('_input.txt', 1)[0]}_r{position}_input.txt"
+                print(
+                    f"BATCH continue key={continuation} left={remaining_ms() / 1000:.0f}s "
+                    f"needed={needed:.0f}s shards={len(shards) - position}",
+                    flush=True,
+                )
+                # A retried event finds the manifest and does not publish it twice.
+                put_split_manifest_once(bucket, continuation, "".join(
+                    f"{BATCH_SHARD_MARKER}{rest}\n" + "".join(f"{uri}\n" for uri in uris)
+                    for rest, uris in shards[position:]
+                ))
+                break
+            if position + 1 < len(shards):
+                upcoming = prefetch_first_ranges(shards[position + 1][1], prefetch_pool)
+            else:
+                upcoming = {}
+            started = time.perf_counter()
+            try:
+                result = process_shard(
+                    folder, input_file_key, s3_uris, context, manifest_seconds, prefetched, len(shards)
+                )
+            except ClaimBusyError as error:
+                busy.append(error)
+                result = None
+            prefetched = upcoming
+            # Only a shard that was actually mapped predicts the next one.
+            if result is not None and "timings" in result:
+                slowest_seconds = max(slowest_seconds, time.perf_counter() - started)
+                results.append(result["timings"])
+            manifest_seconds = 0.0
+    finally:
+        prefetch_pool.shutdown(wait=True, cancel_futures=True)
+    if busy:
+        # As for a single shard: fail so Lambda retries the shards owned elsewhere.
+        raise busy[0]
+    return {
+        'statusCode': 200,
+        'body': f'Piscem map is successful for {len(results)} of {len(shards)} shard(s)',
+        'timings': results,
+        'folders': [timing["folder"] for timing in results],
+        'continued_by': continuation,
+    }
+
+
+def process_shard(final_folder_name, input_file_key, s3_uris, context, manifest_seconds,
+                  prefetched=None, batch_shards=1):
+    """Claim, map and publish one shard; ``prefetched`` maps URIs to first-range futures."""
     claim = None
+    rad_upload = None
+    sampler = None
     total_started = time.perf_counter()
     try:
-        claim = acquire_processing_claim(final_folder_name, input_file_key, context)
+        claim = acquire_processing_claim(
+            final_folder_name, input_file_key, context,
+            expected_seconds=max(recent_shard_seconds, default=None),
+        )
         if claim["status"] == "already_complete":
             return {
                 'statusCode': 200,
@@ -682,28 +2155,72 @@ def handler(event, context):
                 'idempotent': True,
             }
         start_claim_heartbeat(claim)
-
-        manifest_started = time.perf_counter()
-        s3_uris = read_input_manifest(bucket, input_file_key)
-        manifest_seconds = time.perf_counter() - manifest_started
+        if RESOURCE_SAMPLE_SECONDS > 0:
+            sampler = ResourceSampler()
+            sampler.start()
 
         stream_dir = "/tmp/input_streams"
+        # A batched shard reuses the paths of the one before it.
+        for path in (stream_dir, "/tmp/output"):
+            shutil.rmtree(path, ignore_errors=True)
         files_r1, files_r2 = create_fastq_fifos(s3_uris, stream_dir)
+        for spec in files_r1 + files_r2:
+            spec["first_range"] = (prefetched or {}).get(spec["uri"])
         formats = sorted({spec["compression"] for spec in files_r1 + files_r2})
         print(
             f"Streaming {len(files_r1)} R1/R2 pair(s); formats={formats}",
             flush=True,
         )
 
-        piscem_result = run_piscem_streaming(files_r1, files_r2)
+        map_rad = "/tmp/output/split_map_output_transcriptome/map.rad"
+        framed = RAD_FRAME_CODEC in RAD_FRAME_CODECS
+        # Framing needs the finished file, so it replaces the streamed upload.
+        if RAD_UPLOAD_PART_BYTES > 0 and not framed:
+            rad_upload = RadStreamUploader(
+                map_rad,
+                S3_OUTPUT_BUCKET_NAME,
+                os.path.join(S3_PREFIX, final_folder_name, "map.rad"),
+            )
+        piscem_result = run_piscem_streaming(files_r1, files_r2, rad_upload, sampler)
+        histogram_seconds = 0.0
+        if BARCODE_HISTOGRAM:
+            # Before framing, which rewrites map.rad.
+            histogram_started = time.perf_counter()
+            histogram = rad_barcode_histogram(map_rad)
+            if histogram is None:
+                print("BARCODE_HISTOGRAM skipped: RAD tags are not fixed-width integers", flush=True)
+            else:
+                counts, barcode_length = histogram
+                sidecar_bytes = write_barcode_histogram(
+                    os.path.join(os.path.dirname(map_rad), BARCODE_HISTOGRAM_FILE), counts, barcode_length
+                )
+                print(
+                    f"BARCODE_HISTOGRAM barcodes={len(counts)} reads={sum(counts.values())} "
+                    f"bytes={sidecar_bytes}",
+                    flush=True,
+                )
+            histogram_seconds = time.perf_counter() - histogram_started
+        frame_seconds = 0.0
+        map_rad_uploaded_bytes = piscem_result["map_rad_bytes"]
+        if framed:
+            frame_started = time.perf_counter()
+            frames = encode_rad_frames(map_rad, RAD_FRAME_CODEC)
+            frame_seconds = time.perf_counter() - frame_started
+            map_rad_uploaded_bytes = frames["framed_bytes"]
+            print(
+                f"RAD_FRAMES codec={RAD_FRAME_CODEC} frames={frames['frames']} "
+                f"raw_bytes={frames['raw_bytes']} framed_bytes={frames['framed_bytes']}",
+                flush=True,
+            )
 
-        # Prove ownership immediately before publishing output. A stale owner
-        # must not race a takeover and write the same deterministic prefix.
-        refresh_processing_claim(claim)
+        # Prove ownership before publishing output. A stale owner must not race
+        # a takeover and write the same deterministic prefix; a lease with two
+        # heartbeats left is proof enough, otherwise this renews it.
+        refresh_processing_claim(claim, only_if_due=True)
         upload_started = time.perf_counter()
         print(f"uploading output files to folder {final_folder_name}")
-        upload_files_with_completion_marker(
-            "/tmp/output", final_folder_name, S3_OUTPUT_BUCKET_NAME, S3_PREFIX
+        upload_output_files(
+            "/tmp/output", final_folder_name, S3_OUTPUT_BUCKET_NAME, S3_PREFIX, rad_upload
         )
         upload_seconds = time.perf_counter() - upload_started
 
@@ -711,30 +2228,39 @@ def handler(event, context):
             "manifest_seconds": round(manifest_seconds, 6),
             "stream_and_piscem_seconds": piscem_result["seconds"],
             "upload_seconds": round(upload_seconds, 6),
-            "total_seconds": round(time.perf_counter() - total_started, 6),
+            "total_seconds": round(time.perf_counter() - total_started + manifest_seconds, 6),
             "formats": formats,
             "num_reads": piscem_result["num_reads"],
             "num_mapped": piscem_result["num_mapped"],
             "input_bytes": piscem_result["input_bytes"],
+            "bottleneck": piscem_result["bottleneck"],
             "map_rad_bytes": piscem_result["map_rad_bytes"],
+            "map_rad_streamed_bytes": piscem_result["map_rad_streamed_bytes"],
+            "map_rad_uploaded_bytes": map_rad_uploaded_bytes,
+            "rad_frame_codec": RAD_FRAME_CODEC if framed else "none",
+            "rad_frame_seconds": round(frame_seconds, 6),
+            "barcode_histogram_seconds": round(histogram_seconds, 6),
         }
+        if sampler is not None:
+            timings["resources"] = sampler.stop()
+        if batch_shards > 1:
+            timings.update(folder=final_folder_name, batch_shards=batch_shards)
         print("PIPELINE_TIMING " + json.dumps(timings, sort_keys=True), flush=True)
-        try:
-            mark_claim_completed(claim, timings)
-        except Exception as claim_error:
-            # output.txt is the durable completion contract. A claim-audit
-            # update must not turn a successfully published shard into a retry.
-            print(
-                f"CLAIM completion_warning type={type(claim_error).__name__} "
-                f"error={claim_error}",
-                flush=True,
-            )
+        # output.txt is the durable completion contract and the claim's audit record.
+        if publish_completion(claim, completion_marker_key(final_folder_name), {"timings": timings}):
+            notify_completion(final_folder_name)
+        recent_shard_seconds.append(timings["total_seconds"])
+        # "folders" lets an on-success Lambda Destination serve as the channel.
         return {
             'statusCode': 200,
             'body': 'Piscem map is successful',
             'timings': timings,
+            'folders': [final_folder_name],
         }
     except Exception as error:
+        if rad_upload is not None:
+            rad_upload.stop()
+            rad_upload.abort()
         if claim and claim.get("status") == "acquired":
             try:
                 if not completion_marker_exists(final_folder_name):
@@ -751,6 +2277,477 @@ def handler(event, context):
         # and applies the configured retry/dead-letter behavior.
         raise
     finally:
+        if sampler is not None:
+            sampler.stop()
+        stop_claim_heartbeat(claim)
+
+
+def mate_name(header):
+    """Return the read identifier shared by both mates of a FASTQ header."""
+    if not header.startswith(b"@"):
+        raise ShardPairingError(f"FASTQ header does not start with '@': {header[:80]!r}")
+    fields = header[1:].split(None, 1)
+    name = fields[0] if fields else b""
+    if name.endswith((b"/1", b"/2")):
+        name = name[:-2]
+    return name
+
+
+def last_record_header(payload):
+    """Return the header of the final four-line record in a shard payload."""
+    ends = [len(payload) - 1]
+    for _ in range(3):
+        ends.append(payload.rfind(b"\n", 0, ends[-1]))
+    if payload[ends[2] + 1:ends[2] + 2] != b"+":
+        raise ShardPairingError("FASTQ shard does not end on a four-line record boundary")
+    start = payload.rfind(b"\n", 0, ends[3]) + 1
+    return payload[start:ends[3]]
+
+
+class InflatedS3Stream:
+    """Decompressed blocks of one S3 FASTQ object, for the splitter.
+
+    Objects stream through ``OrderedRangeReader``. A gzip is inflated by a
+    rapidgzip child fed from a thread when ``threads`` is above one and
+    rapidgzip is installed, and by ``GzipMemberInflater`` otherwise. With an
+    ``offset``, a plain object is read from there and a gzip is inflated from
+    the seek point before it in ``index_bytes``.
+    """
+
+    def __init__(self, spec, threads=1, offset=0, index_bytes=None):
+        self.spec = spec
+        self.bytes_read = 0
+        self.inflater = None
+        self.decoder = None
+        self.feeder = None
+        self.feed_error = None
+        self.seeker = None
+        if offset:
+            self.source = S3RangeFile(spec["bucket"], spec["key"])
+            self.source.last_hint = self.source.object_size() - 1
+            if spec["compression"] == "gzip":
+                import indexed_gzip
+
+                self.seeker = indexed_gzip.IndexedGzipFile(
+                    fileobj=self.source, auto_build=False, skip_crc_check=True
+                )
+                self.seeker.import_index(fileobj=io.BytesIO(index_bytes))
+            else:
+                self.seeker = self.source
+            self.seeker.seek(offset)
+            return
+        self.source = OrderedRangeReader(spec["bucket"], spec["key"])
+        self.chunks = self.source.chunks()
+        if spec["compression"] == "gzip":
+            if RAPIDGZIP is not None and threads > 1:
+                self.decoder = subprocess.Popen(
+                    [RAPIDGZIP, "-d", "-c", "-P", str(threads)],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    bufsize=0,
+                )
+                self.feeder = threading.Thread(target=self.feed, name="split-feed", daemon=True)
+                self.feeder.start()
+            else:
+                self.inflater = GzipMemberInflater()
+
+    def feed(self):
+        try:
+            for chunk in self.chunks:
+                self.bytes_read += len(chunk)
+                remaining = memoryview(chunk)
+                while remaining:
+                    remaining = remaining[self.decoder.stdin.write(remaining):]
+        except Exception as error:
+            self.feed_error = error
+        finally:
+            self.decoder.stdin.close()
+
+    def read_block(self):
+        """Return the next block of FASTQ bytes, or b"" at the end of the object."""
+        if self.seeker is not None:
+            block = self.seeker.read(SPLIT_READ_BYTES)
+            self.bytes_read = self.source.bytes_read
+            return block
+        if self.decoder is not None:
+            return self.decoder.stdout.read(SPLIT_READ_BYTES)
+        for chunk in self.chunks:
+            self.bytes_read += len(chunk)
+            # Chunks are views of reused range buffers; keep a copy.
+            block = self.inflater.inflate(chunk) if self.inflater else bytes(chunk)
+            if block:
+                return block
+        return b""
+
+    def finish(self):
+        """Check that the whole object was read and inflated."""
+        if self.seeker is not None:
+            # indexed_gzip raises on a truncated member; a plain object must
+            # have been read to its last byte.
+            if self.seeker is self.source and self.source.position != self.source.object_size():
+                raise IOError(
+                    f"Truncated S3 stream for {self.spec['uri']}: "
+                    f"stopped at {self.source.position} of {self.source.object_size()} bytes"
+                )
+            return
+        if self.decoder is not None:
+            self.feeder.join()
+            stderr = self.decoder.stderr.read()
+            if self.feed_error is not None:
+                raise self.feed_error
+            if self.decoder.wait() != 0:
+                raise IOError(
+                    f"rapidgzip exited with status {self.decoder.returncode} for "
+                    f"{self.spec['uri']}: {stderr[-2000:].decode('utf-8', 'replace')}"
+                )
+        elif self.inflater is not None:
+            self.inflater.finish(self.spec["uri"])
+        if self.bytes_read != self.source.size:
+            raise IOError(
+                f"Truncated S3 stream for {self.spec['uri']}: "
+                f"read {self.bytes_read}, expected {self.source.size} bytes"
+            )
+
+    def close(self):
+        if self.seeker is not None:
+            self.seeker.close()
+            self.source.close()
+            return
+        if self.decoder is not None:
+            # The feeder owns the chunk generator until its writes fail.
+            if self.decoder.poll() is None:
+                self.decoder.kill()
+            self.decoder.wait()
+            self.feeder.join()
+        self.chunks.close()
+
+
+class FastqShardCutter:
+    """Cut one decompressed FASTQ stream into shards of whole four-line records."""
+
+    def __init__(self, stream, label):
+        self.stream = stream
+        self.label = label
+        self.pending = b""
+        self.eof = False
+
+    def next_shard(self, lines_per_shard):
+        """Return ``(payload, records, first_name, last_name)``, or None at the end."""
+        lines_needed = lines_per_shard
+        pieces = []
+        while lines_needed:
+            block, self.pending = self.pending, b""
+            if not block:
+                if self.eof:
+                    break
+                block = self.stream.read_block()
+                if not block:
+                    self.eof = True
+                    break
+            newlines = block.count(b"\n")
+            if newlines < lines_needed:
+                pieces.append(block)
+                lines_needed -= newlines
+                continue
+            cut = -1
+            for _ in range(lines_needed):
+                cut = block.index(b"\n", cut + 1)
+            pieces.append(block[:cut + 1])
+            self.pending = block[cut + 1:]
+            lines_needed = 0
+
+        payload = b"".join(pieces)
+        if not payload:
+            return None
+        lines = lines_per_shard - lines_needed
+        if not payload.endswith(b"\n"):
+            payload += b"\n"
+            lines += 1
+        if lines % 4:
+            raise ShardPairingError(
+                f"{self.label} ended inside a FASTQ record ({lines} lines in final shard)"
+            )
+        first_name = mate_name(payload[:payload.index(b"\n")])
+        return payload, lines // 4, first_name, mate_name(last_record_header(payload))
+
+
+def parse_split_manifest(input_file_key, lines):
+    """Return the options, R1 spec and R2 spec of a splitter manifest.
+
+    The manifest is an optional ``# split key=value ...`` line (``pairs`` per
+    shard, ``start``: the first shard this invocation publishes, and
+    ``r1_offset``/``r2_offset``: where that shard starts in each decompressed
+    object) followed by the R1 and R2 object URIs.
+    """
+    options = {"pairs": SPLIT_DEFAULT_READ_PAIRS, "start": 0, "r1_offset": 0, "r2_offset": 0}
+    if lines[0].startswith("#"):
+        for item in lines[0].lstrip("#").split()[1:]:
+            name, _, value = item.partition("=")
+            if name not in options or not value.isdigit():
+                raise ValueError(f"Invalid split option in {input_file_key}: {item!r}")
+            options[name] = int(value)
+        lines = lines[1:]
+    specs = [parse_fastq_uri(uri) for uri in lines]
+    reads = sorted(spec["read"] for spec in specs)
+    if reads != ["R1", "R2"] or any(spec["range"] is not None for spec in specs) or options["pairs"] <= 0:
+        raise ValueError(f"Split manifest {input_file_key} must name one whole R1 and one R2 object")
+    r1, r2 = sorted(specs, key=lambda spec: spec["read"])
+    return options, r1, r2
+
+
+def split_pair_limit(memory_mb):
+    """Most read pairs per shard the splitter can hold in ``memory_mb``."""
+    budget = memory_mb * 1024 * 1024 * SPLIT_MEMORY_FRACTION
+    return max(1, int(budget // (SPLIT_HELD_PAIRS * SPLIT_PAIR_BYTES)))
+
+
+def split_seek_index(spec):
+    """Return the seek-point index stored beside a gzip object, or None."""
+    try:
+        response = s3_client.get_object(
+            Bucket=spec["bucket"], Key=spec["key"] + SPLIT_INDEX_SUFFIX
+        )
+    except ClientError as error:
+        if is_s3_error(error, "404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    body = response["Body"]
+    try:
+        return body.read()
+    finally:
+        body.close()
+
+
+def record_split_failure(folder, input_file_key, context, error):
+    """Publish ``<folder>.failed.json`` so the driver stops waiting for the lane.
+
+    ``retryable`` is false for errors a Lambda retry would hit again; the
+    driver gives a retryable failure until the retries could have finished.
+    """
+    document = {
+        "folder": folder,
+        "input_key": input_file_key,
+        "owner": getattr(context, "aws_request_id", None),
+        "error": f"{type(error).__name__}: {error}",
+        "retryable": not isinstance(error, SPLIT_PERMANENT_ERRORS),
+        "failed_epoch": int(time.time()),
+    }
+    s3_client.put_object(
+        Bucket=S3_OUTPUT_BUCKET_NAME,
+        Key=split_failure_key(folder),
+        Body=json.dumps(document, sort_keys=True).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def put_split_manifest_once(bucket, key, body):
+    """Publish a manifest unless an earlier attempt already did.
+
+    Rewriting it would deliver another S3 event for the same shard.
+    """
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+        return False
+    except ClientError as error:
+        if not is_s3_error(error, "404", "NoSuchKey", "NotFound"):
+            raise
+    s3_client.put_object(Bucket=bucket, Key=key, Body=body.encode("utf-8"))
+    return True
+
+
+def upload_split_shard(upload_client, bucket, key, payload):
+    """Upload one shard object; a retry skips an object already of this size."""
+    try:
+        if upload_client.head_object(Bucket=bucket, Key=key)["ContentLength"] == len(payload):
+            return
+    except ClientError as error:
+        if not is_s3_error(error, "404", "NoSuchKey", "NotFound"):
+            raise
+    upload_client.upload_fileobj(io.BytesIO(payload), bucket, key)
+
+
+def process_split(bucket, input_file_key, context):
+    """Inflate one lane pair, upload its shards and publish their mapper manifests.
+
+    Shards and manifests use the driver's names (``<lane>_R1_001_p<N>.fastq``
+    beside the source objects and ``<lane>_p<N>_input.txt`` beside this
+    manifest), so mapping and materialization are unchanged. The invocation
+    runs under the usual S3 claim and checks its lease before every manifest.
+    When the next shard would not finish before the timeout, it publishes a
+    ``<lane>_s<N>_split.txt`` continuation that starts publishing at shard N.
+    The continuation records where shard N starts in each decompressed
+    object and seeks there through a ``.gzidx`` seek-point index beside each
+    gzip. Without one it re-inflates the lane from its first byte, so a lane
+    needing K invocations inflates its prefix K times. The result is written
+    to the claim prefix as ``<folder>.done.json``, listing the mapper folders
+    it published; a failure is written as ``<folder>.failed.json``.
+    """
+    folder = os.path.basename(input_file_key[:-len(".txt")])
+    base = re.sub(r"_s\d+$", "", input_file_key[:-len(SPLIT_MANIFEST_SUFFIX)])
+    lane = os.path.basename(base)
+    marker_key = split_marker_key(folder)
+    claim = None
+    streams = []
+    upload_client = None
+    started = time.perf_counter()
+    try:
+        options, r1_spec, r2_spec = parse_split_manifest(
+            input_file_key, read_input_manifest(bucket, input_file_key)
+        )
+        claim = acquire_processing_claim(folder, input_file_key, context, marker_key)
+        if claim["status"] == "already_complete":
+            return {
+                'statusCode': 200,
+                'body': 'Split already complete; duplicate event ignored',
+                'idempotent': True,
+            }
+        start_claim_heartbeat(claim)
+
+        offsets = [options["r1_offset"], options["r2_offset"]]
+        indexes = [None, None]
+        if options["start"] and all(offsets):
+            indexes = [
+                split_seek_index(spec) if spec["compression"] == "gzip" else b""
+                for spec in (r1_spec, r2_spec)
+            ]
+        if None in indexes:
+            offsets = [0, 0]
+        if options["start"]:
+            print(f"SPLIT resume start={options['start']} seek={offsets != [0, 0]}", flush=True)
+        pairs = options["pairs"]
+        memory_mb = os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "")
+        # A continuation that re-cuts from the first byte must cut the shards
+        # its predecessor did, so only a fresh lane or a seek is capped.
+        if (not options["start"] or offsets != [0, 0]) and memory_mb.isdigit():
+            pairs = min(pairs, split_pair_limit(int(memory_mb)))
+            if pairs != options["pairs"]:
+                print(f"SPLIT pairs_capped requested={options['pairs']} pairs={pairs} "
+                      f"memory_mb={memory_mb}", flush=True)
+
+        cpu_count = os.cpu_count() or 2
+        # R2 carries most of the compressed bytes.
+        streams = [
+            InflatedS3Stream(r1_spec, max(1, cpu_count // 3), offsets[0], indexes[0]),
+            InflatedS3Stream(r2_spec, max(1, cpu_count - cpu_count // 3), offsets[1], indexes[1]),
+        ]
+        cutters = [FastqShardCutter(stream, stream.spec["read"]) for stream in streams]
+        upload_client = boto3.client("s3")
+        published = []
+        continuation = None
+        slowest_seconds = 0.0
+        lines_per_shard = pairs * 4
+        index = options["start"] if offsets != [0, 0] else 0
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="split") as pool:
+            uploading = None
+
+            def shard_keys(shard_index):
+                return [f"{base}_{read}_001_p{shard_index}.fastq" for read in ("R1", "R2")]
+
+            def publish(upload):
+                shard_index, futures = upload
+                for future in futures:
+                    future.result()
+                refresh_processing_claim(claim, only_if_due=True)
+                manifest_key = f"{base}_p{shard_index}_input.txt"
+                body = "".join(f"s3://{spec['bucket']}/{key}\n" for spec, key in zip(
+                    (r1_spec, r2_spec), shard_keys(shard_index)
+                ))
+                if not put_split_manifest_once(bucket, manifest_key, body):
+                    print(f"SPLIT manifest_exists key={manifest_key}", flush=True)
+                published.append(f"{lane}_p{shard_index}")
+
+            while True:
+                remaining_ms = getattr(context, "get_remaining_time_in_millis", None)
+                needed = slowest_seconds * BATCH_DEADLINE_MARGIN + BATCH_DEADLINE_RESERVE_SECONDS
+                if published and remaining_ms is not None and remaining_ms() / 1000 < needed:
+                    continuation = f"{base}_s{index}{SPLIT_MANIFEST_SUFFIX}"
+                    break
+                shard_started = time.perf_counter()
+                r1, r2 = [
+                    future.result() for future in
+                    [pool.submit(cutter.next_shard, lines_per_shard) for cutter in cutters]
+                ]
+                if r1 is None and r2 is None:
+                    break
+                if r1 is None or r2 is None or r1[1:] != r2[1:]:
+                    raise ShardPairingError(
+                        f"R1/R2 shards disagree at p{index} of {lane}: "
+                        f"R1={r1[1:] if r1 else None} R2={r2[1:] if r2 else None}"
+                    )
+                offsets = [offset + len(shard[0]) for offset, shard in zip(offsets, (r1, r2))]
+                if index >= options["start"]:
+                    # One shard uploads while the next is cut.
+                    if uploading is not None:
+                        publish(uploading)
+                    uploading = (index, [
+                        pool.submit(upload_split_shard, upload_client, spec["bucket"], key, shard[0])
+                        for spec, key, shard in zip((r1_spec, r2_spec), shard_keys(index), (r1, r2))
+                    ])
+                    slowest_seconds = max(slowest_seconds, time.perf_counter() - shard_started)
+                index += 1
+            if uploading is not None:
+                publish(uploading)
+            if continuation is None:
+                for stream in streams:
+                    stream.finish()
+            else:
+                refresh_processing_claim(claim, only_if_due=True)
+                put_split_manifest_once(
+                    bucket, continuation,
+                    f"# split pairs={pairs} start={index} "
+                    f"r1_offset={offsets[0]} r2_offset={offsets[1]}\n"
+                    f"{r1_spec['uri']}\n{r2_spec['uri']}\n",
+                )
+
+        timings = {
+            "lane": lane,
+            "first_shard": options["start"],
+            "pairs": pairs,
+            "next_shard": index,
+            "shards": len(published),
+            "complete": continuation is None,
+            "input_bytes": sum(stream.bytes_read for stream in streams),
+            "total_seconds": round(time.perf_counter() - started, 6),
+            "slowest_shard_seconds": round(slowest_seconds, 6),
+        }
+        print("SPLIT_TIMING " + json.dumps(timings, sort_keys=True), flush=True)
+        publish_completion(
+            claim, marker_key, dict(timings, folders=published, continued_by=continuation)
+        )
+        return {
+            'statusCode': 200,
+            'body': f'Split published {len(published)} shard(s)',
+            'timings': timings,
+        }
+    except Exception as error:
+        if claim and claim.get("status") == "acquired":
+            try:
+                if not completion_marker_exists(folder, marker_key):
+                    release_failed_claim(claim)
+            except Exception as release_error:
+                print(
+                    f"CLAIM release_warning type={type(release_error).__name__} "
+                    f"error={release_error}",
+                    flush=True,
+                )
+        try:
+            # A live claim elsewhere means another attempt is still splitting.
+            if not isinstance(error, ClaimBusyError) and not completion_marker_exists(folder, marker_key):
+                record_split_failure(folder, input_file_key, context, error)
+        except Exception as record_error:
+            print(
+                f"SPLIT failure_record_warning type={type(record_error).__name__} "
+                f"error={record_error}",
+                flush=True,
+            )
+        print(f"Splitter failed: {type(error).__name__}: {error}", flush=True)
+        raise
+    finally:
+        for stream in streams:
+            stream.close()
+        if upload_client is not None:
+            upload_client.close()
         stop_claim_heartbeat(claim)
 
 
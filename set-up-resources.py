@@ -155,13 +155,17 @@ def create_s3_bucket(bucket_name, aws_region):
 def create_eventbridge_rule(rule_name, s3_bucket_name, aws_region):
     client = boto3.client('events', region_name=aws_region)
 
-    # Event pattern to filter only for files ending with "_input.txt"
+    # Event pattern to filter only for files ending with "_input.txt" (shard
+    # manifests) or "_split.txt" (Lambda splitter manifests)
     event_pattern = {
         "source": ["aws.s3"],
         "detail-type": ["Object Created"],
         "detail": {
             "bucket": {
                 "name": [s3_bucket_name]
+            },
+            "object": {
+                "key": [{"suffix": "_input.txt"}, {"suffix": "_split.txt"}]
             }
         }
     }
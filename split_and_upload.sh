@@ -71,18 +71,127 @@ fi
 DECOMP_THREADS="${DECOMP_THREADS:-8}"
 (( DECOMP_THREADS < 1 )) && DECOMP_THREADS=1
 FASTQ_DECOMPRESSOR="${FASTQ_DECOMPRESSOR:-rapidgzip}"
-[[ "$FASTQ_DECOMPRESSOR" == "gzip" || "$FASTQ_DECOMPRESSOR" == "rapidgzip" ]] || {
-    echo "ERROR: FASTQ_DECOMPRESSOR must be gzip or rapidgzip" >&2
+# Backends of scripts/decompressors.py; the python engine resolves auto and
+# replaces a missing one itself.
+case "$FASTQ_DECOMPRESSOR" in
+    gzip|rapidgzip|rapidgzip-python|igzip|libdeflate|pigz|auto) ;;
+    *)
+        echo "ERROR: FASTQ_DECOMPRESSOR must be gzip, rapidgzip, rapidgzip-python, igzip, libdeflate, pigz, or auto" >&2
+        exit 1
+        ;;
+esac
+# python: cut and upload shard pairs in memory with scripts/fastq_shard_engine.py.
+# split: write split -l shards to NVMe, rename, then upload them in bulk.
+# index: zero-split; index the original gzips and publish byte-range manifests
+# with scripts/gzip_range_index.py instead of uploading any shard.
+SHARD_ENGINE="${SHARD_ENGINE:-python}"
+[[ "$SHARD_ENGINE" == "python" || "$SHARD_ENGINE" == "split" || "$SHARD_ENGINE" == "index" ]] || {
+    echo "ERROR: SHARD_ENGINE must be python, split, or index" >&2
     exit 1
 }
+if [[ "$SHARD_ENGINE" == "index" ]] && ! python3 -c 'import boto3, indexed_gzip' >/dev/null 2>&1; then
+    echo "WARNING: indexed_gzip not available; using SHARD_ENGINE=python" >&2
+    SHARD_ENGINE=python
+fi
+if [[ "$SHARD_ENGINE" == "python" ]] && ! python3 -c 'import boto3' >/dev/null 2>&1; then
+    echo "WARNING: python3 with boto3 not available; using SHARD_ENGINE=split" >&2
+    SHARD_ENGINE=split
+fi
+if [[ "$SHARD_ENGINE" == "split" && -n "${SHARD_SCHEDULE:-}" ]]; then
+    echo "WARNING: SHARD_ENGINE=split ignores SHARD_SCHEDULE=$SHARD_SCHEDULE; cutting $SPLIT_LINES-line shards" >&2
+fi
+
+# Cross-run shard cache (scripts/shard_cache.py). A hit republishes this
+# lane's manifests against the cached shards and skips download and split; a
+# miss hands its key to the engine, which stores the shards it cuts. A caller
+# that has already looked the lane up passes SHARD_CACHE_KEY.
+if [[ -n "${SHARD_CACHE_URI:-}" && -z "${SHARD_CACHE_KEY:-}" && "$SHARD_ENGINE" == "python" ]]; then
+    CACHE_START_NS=$(date +%s%N)
+    CACHE_SOURCES=("$R1_LOCAL_PATH" "$R2_LOCAL_PATH")
+    if [[ "${LOCAL_FASTQ_INPUT:-0}" != "1" ]]; then
+        CACHE_SOURCES=("$R1_S3_FULL_PATH" "$R2_S3_FULL_PATH")
+    fi
+    CACHE_RC=0
+    CACHE_OUTPUT=$(python3 "$(dirname -- "${BASH_SOURCE[0]}")/scripts/shard_cache.py" replay \
+        "${CACHE_SOURCES[@]}" "$BASENAME_WITH_LANE" "$S3_INPUT_TXT_BUCKET_NAME" "$SPLIT_LINES") \
+        || CACHE_RC=$?
+    if (( CACHE_RC == 0 )); then
+        record_split_timing "shard_cache_replay" "$CACHE_START_NS"
+        # The replayed PAIR_COUNT is the last line, as after a split.
+        printf '%s\n' "$CACHE_OUTPUT"
+        exit 0
+    elif (( CACHE_RC == 3 )); then
+        printf '%s\n' "$CACHE_OUTPUT" | sed '$d'
+        export SHARD_CACHE_KEY="${CACHE_OUTPUT##*$'\n'}"
+    else
+        echo "WARNING: shard cache lookup failed; splitting without it" >&2
+        unset SHARD_CACHE_URI
+    fi
+fi
+
+# Bulk uploads go through one pooled uploader process when boto3 is present;
+# otherwise fall back to one `aws s3 cp` process per file.
+S3_UPLOAD_SERVICE="$(dirname -- "${BASH_SOURCE[0]}")/scripts/s3_upload_service.py"
+upload_list() {
+    local list_file="$1"
+    if python3 -c 'import boto3' >/dev/null 2>&1; then
+        python3 "$S3_UPLOAD_SERVICE" < "$list_file" | { ! grep '^ERROR' >&2; }
+        return "${PIPESTATUS[0]}"
+    fi
+    xargs -a "$list_file" -n 2 -P 10 aws s3 cp --only-show-errors
+}
 
 # Download the gzip to NVMe first, then decompress the local file.
 # Piping `aws s3 cp -` into rapidgzip blocks multipart download and
 # rapidgzip seek parallelism (Hong, Aug 2026).
+# With S3_PREFETCH=1 (default when boto3 is available) the download instead
+# runs as parallel ranged GETs into a sparse file, so the download stays
+# parallel. A stream whose file is already complete when it starts still reads
+# the local file and keeps rapidgzip's seek parallelism. Otherwise the
+# decompressor reads the finished prefix through scripts/s3_range_prefetcher.py
+# follow while the tail is still arriving. That pipe gives up rapidgzip's seek
+# parallelism to start before the download ends. The trade-off has not been
+# measured; S3_PREFETCH=0 keeps download-then-decompress.
+S3_PREFETCHER="$(dirname -- "${BASH_SOURCE[0]}")/scripts/s3_range_prefetcher.py"
+PREFETCH_ACTIVE=0
+if [[ "${LOCAL_FASTQ_INPUT:-0}" != "1" && "${S3_PREFETCH:-1}" == "1" ]] && \
+   python3 -c 'import boto3' >/dev/null 2>&1; then
+    PREFETCH_ACTIVE=1
+fi
+
+remove_local_gzips() {
+    rm -f "$R1_LOCAL_PATH" "$R2_LOCAL_PATH" "$R1_LOCAL_PATH.watermark" "$R2_LOCAL_PATH.watermark"
+}
+
+# Wait for both prefetchers; a decompressor failure has usually stopped them
+# already, so this only reports the first error.
+wait_prefetch() {
+    (( PREFETCH_ACTIVE == 1 )) || return 0
+    local rc=0
+    wait "$R1_DL_PID" || { echo "ERROR: R1 prefetch failed for $R1_FILE" >&2; rc=1; }
+    wait "$R2_DL_PID" || { echo "ERROR: R2 prefetch failed for $R2_FILE" >&2; rc=1; }
+    return "$rc"
+}
+
+stop_prefetch() {
+    (( PREFETCH_ACTIVE == 1 )) || return 0
+    kill "$R1_DL_PID" "$R2_DL_PID" 2>/dev/null || true
+    wait "$R1_DL_PID" "$R2_DL_PID" 2>/dev/null || true
+}
+
 DOWNLOAD_START_NS=$(date +%s%N)
 if [[ "${LOCAL_FASTQ_INPUT:-0}" == "1" ]]; then
     echo "Reading compressed FASTQ files directly from NVMe..."
     record_split_timing "locate_nvme_fastq" "$DOWNLOAD_START_NS"
+elif (( PREFETCH_ACTIVE == 1 )); then
+    echo "Prefetching compressed FASTQ files from S3 with parallel ranged GETs..."
+    rm -f "$R1_LOCAL_PATH.watermark" "$R2_LOCAL_PATH.watermark"
+    python3 "$S3_PREFETCHER" fetch "$R1_S3_FULL_PATH" "$R1_LOCAL_PATH" \
+        --timing-stage prefetch_r1_compressed_fastq &
+    R1_DL_PID=$!
+    python3 "$S3_PREFETCHER" fetch "$R2_S3_FULL_PATH" "$R2_LOCAL_PATH" \
+        --timing-stage prefetch_r2_compressed_fastq &
+    R2_DL_PID=$!
 else
     echo "Downloading compressed FASTQ files from S3..."
     aws s3 cp "$R1_S3_FULL_PATH" "$R1_LOCAL_PATH" --only-show-errors &
@@ -94,36 +203,90 @@ else
     record_split_timing "download_compressed_fastq" "$DOWNLOAD_START_NS"
 fi
 
-# The driver chooses gzip for one CPU per file and rapidgzip when multiple CPUs
-# are apportioned to each active compressed input.
+if [[ "$SHARD_ENGINE" == "index" ]]; then
+    # indexed_gzip opens the file itself, so it needs the complete download.
+    wait_prefetch || { remove_local_gzips; exit 1; }
+    ENGINE_RC=0
+    SOURCE_ARGS=()
+    if [[ "${LOCAL_FASTQ_INPUT:-0}" != "1" ]]; then
+        # The originals are already in S3; Lambdas read ranges of them there.
+        SOURCE_ARGS=(--r1-uri "$R1_S3_FULL_PATH" --r2-uri "$R2_S3_FULL_PATH")
+    fi
+    python3 "$(dirname -- "${BASH_SOURCE[0]}")/scripts/gzip_range_index.py" \
+        "$BUCKET_NAME" "$R1_LOCAL_PATH" "$R2_LOCAL_PATH" "$BASENAME_WITH_LANE" \
+        "$S3_INPUT_TXT_BUCKET_NAME" "$SPLIT_LINES" "${SOURCE_ARGS[@]}" || ENGINE_RC=$?
+    if [[ "${LOCAL_FASTQ_INPUT:-0}" != "1" ]]; then
+        remove_local_gzips
+    fi
+    exit "$ENGINE_RC"
+fi
+
+if [[ "$SHARD_ENGINE" == "python" ]]; then
+    ENGINE_RC=0
+    FOLLOW_ARGS=()
+    (( PREFETCH_ACTIVE == 1 )) && FOLLOW_ARGS=(--follow-prefetch)
+    python3 "$(dirname -- "${BASH_SOURCE[0]}")/scripts/fastq_shard_engine.py" \
+        "$BUCKET_NAME" "$R1_LOCAL_PATH" "$R2_LOCAL_PATH" "$BASENAME_WITH_LANE" \
+        "$S3_INPUT_TXT_BUCKET_NAME" "$SPLIT_LINES" \
+        --decompressor "$FASTQ_DECOMPRESSOR" --threads "$DECOMP_THREADS" \
+        "${FOLLOW_ARGS[@]}" || ENGINE_RC=$?
+    if (( ENGINE_RC != 0 )); then
+        stop_prefetch
+    else
+        wait_prefetch || ENGINE_RC=1
+    fi
+    if [[ "${LOCAL_FASTQ_INPUT:-0}" != "1" ]]; then
+        remove_local_gzips
+    fi
+    # The engine prints PAIR_COUNT as its last line for Python to capture.
+    exit "$ENGINE_RC"
+fi
+
+# The coreutils path uses one backend for both files. The Python engine
+# honours the scheduler's per-stream SPLIT_R*_DECOMPRESSOR.
+# decompressors.resolve_backend maps it as it does for the engine: auto picks
+# the fastest usable backend, and one that is missing or cannot read a
+# prefetching stream (libdeflate, rapidgzip-python) is replaced with a warning.
 DECOMPRESS_START_NS=$(date +%s%N)
-if [[ "$FASTQ_DECOMPRESSOR" == "gzip" ]]; then
-    echo "Decompressing local files with single-threaded gzip"
-    echo "Splitting local FASTQ files (split every $SPLIT_LINES lines)..."
-    gzip -dc -- "$R1_LOCAL_PATH" | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "/mnt/nvme/${R1_BASE}_p" &
-    R1_PID=$!
-    gzip -dc -- "$R2_LOCAL_PATH" | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "/mnt/nvme/${R2_BASE}_p" &
-    R2_PID=$!
-elif command -v rapidgzip >/dev/null 2>&1; then
-    echo "Decompressing local files with rapidgzip (-P $DECOMP_THREADS)"
-    echo "Splitting local FASTQ files (split every $SPLIT_LINES lines)..."
-    rapidgzip -d -c -P "$DECOMP_THREADS" "$R1_LOCAL_PATH" | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "/mnt/nvme/${R1_BASE}_p" &
-    R1_PID=$!
-    rapidgzip -d -c -P "$DECOMP_THREADS" "$R2_LOCAL_PATH" | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "/mnt/nvme/${R2_BASE}_p" &
-    R2_PID=$!
+DECOMPRESSORS_PY="$(dirname -- "${BASH_SOURCE[0]}")/scripts/decompressors.py"
+STREAMING_ARGS=()
+(( PREFETCH_ACTIVE == 1 )) && STREAMING_ARGS=(--streaming)
+if RESOLVED_BACKEND=$(python3 "$DECOMPRESSORS_PY" resolve "$FASTQ_DECOMPRESSOR" \
+        --threads "$DECOMP_THREADS" "${STREAMING_ARGS[@]}"); then
+    read -r FASTQ_DECOMPRESSOR DECOMP_THREADS <<< "$RESOLVED_BACKEND"
+    DECOMPRESS_CMD=(python3 "$DECOMPRESSORS_PY" inflate "$FASTQ_DECOMPRESSOR" --threads "$DECOMP_THREADS")
 else
-    echo "WARNING: rapidgzip not on PATH, falling back to zcat" >&2
-    echo "Splitting local FASTQ files (split every $SPLIT_LINES lines)..."
-    gzip -dc -- "$R1_LOCAL_PATH" | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "/mnt/nvme/${R1_BASE}_p" &
-    R1_PID=$!
-    gzip -dc -- "$R2_LOCAL_PATH" | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "/mnt/nvme/${R2_BASE}_p" &
-    R2_PID=$!
+    echo "WARNING: cannot resolve $FASTQ_DECOMPRESSOR with $DECOMPRESSORS_PY, falling back to zcat" >&2
+    FASTQ_DECOMPRESSOR=gzip
+    DECOMPRESS_CMD=(gzip -dc --)
 fi
-wait "$R1_PID" || { echo "ERROR: R1 split failed for $R1_BASE" >&2; rm -f "$R1_LOCAL_PATH" "$R2_LOCAL_PATH"; exit 1; }
-wait "$R2_PID" || { echo "ERROR: R2 split failed for $R2_BASE" >&2; rm -f "$R1_LOCAL_PATH" "$R2_LOCAL_PATH"; exit 1; }
+echo "Decompressing local files with $FASTQ_DECOMPRESSOR ($DECOMP_THREADS thread(s))"
+
+# Decompress one gzip to stdout, following the prefetcher's watermark if the
+# file is still downloading.
+decompress_fastq() {
+    local state=""
+    if (( PREFETCH_ACTIVE == 1 )) && [[ -f "$1.watermark" ]]; then
+        read -r _ _ state < "$1.watermark" || state=""
+    fi
+    if (( PREFETCH_ACTIVE == 1 )) && [[ "$state" != "done" ]]; then
+        python3 "$S3_PREFETCHER" follow "$1" | "${DECOMPRESS_CMD[@]}"
+    else
+        "${DECOMPRESS_CMD[@]}" "$1"
+    fi
+}
+
+echo "Splitting local FASTQ files (split every $SPLIT_LINES lines)..."
+decompress_fastq "$R1_LOCAL_PATH" | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "/mnt/nvme/${R1_BASE}_p" &
+R1_PID=$!
+decompress_fastq "$R2_LOCAL_PATH" | split -l "$SPLIT_LINES" -d -a 4 --additional-suffix=.fastq - "/mnt/nvme/${R2_BASE}_p" &
+R2_PID=$!
+wait "$R1_PID" || { echo "ERROR: R1 split failed for $R1_BASE" >&2; stop_prefetch; remove_local_gzips; exit 1; }
+wait "$R2_PID" || { echo "ERROR: R2 split failed for $R2_BASE" >&2; stop_prefetch; remove_local_gzips; exit 1; }
 record_split_timing "decompress_and_split_fastq" "$DECOMPRESS_START_NS"
+wait_prefetch || { remove_local_gzips; exit 1; }
 if [[ "${LOCAL_FASTQ_INPUT:-0}" != "1" ]]; then
-    rm -f "$R1_LOCAL_PATH" "$R2_LOCAL_PATH"
+    remove_local_gzips
 fi
 
 # Rename files to remove zero padding (_p00 -> _p0, _p01 -> _p1, etc.)
@@ -168,7 +331,7 @@ find /mnt/nvme/ -maxdepth 1 -type f -name "${R1_BASE}_p*.fastq" | while read -r
 done
 
 if [[ -s "$UPLOAD_LIST_R1R2" ]]; then
-    if ! xargs -a "$UPLOAD_LIST_R1R2" -n 2 -P 10 aws s3 cp --only-show-errors; then
+    if ! upload_list "$UPLOAD_LIST_R1R2"; then
         echo "ERROR: one or more FASTQ shard uploads failed; input manifests will not be published" >&2
         exit 1
     fi
@@ -202,7 +365,7 @@ find /mnt/nvme/ -maxdepth 1 -type f -name "${R1_BASE}_p*.fastq" | while read -r
 done
 
 if [[ -s "$UPLOAD_LIST_INPUT" ]]; then
-    if ! xargs -a "$UPLOAD_LIST_INPUT" -n 2 -P 10 aws s3 cp --only-show-errors; then
+    if ! upload_list "$UPLOAD_LIST_INPUT"; then
         echo "ERROR: one or more Lambda input-manifest uploads failed" >&2
         exit 1
     fi
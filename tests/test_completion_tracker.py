@@ -0,0 +1,134 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from completion_tracker import (  # noqa: E402
+    CompletionTracker,
+    FileChannel,
+    ListingFallback,
+    completion_folders,
+    write_inventory,
+)
+
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeListing:
+    """list_objects_v2 over sorted keys, two per page, recording each request."""
+
+    def __init__(self, keys, modified=T0):
+        self.keys = sorted(keys)
+        self.modified = modified
+        self.calls = []
+
+    def list_objects_v2(self, Bucket, Prefix, StartAfter="", ContinuationToken=None):
+        self.calls.append({"StartAfter": StartAfter, "ContinuationToken": ContinuationToken})
+        keys = [key for key in self.keys if key.startswith(Prefix) and key > StartAfter]
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + 2]
+        response = {"Contents": [{"Key": key, "LastModified": self.modified} for key in page]}
+        if start + 2 < len(keys):
+            response.update(IsTruncated=True, NextContinuationToken=str(start + 2))
+        return response
+
+
+def shard_keys(*folders):
+    return [f"piscem_output/{folder}/{name}" for folder in folders for name in ("map.rad", "output.txt")]
+
+
+class CompletionChannelTests(unittest.TestCase):
+    def test_file_channel_delivers_whole_lines_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "events.jsonl")
+            writer, reader = FileChannel(path), FileChannel(path)
+            self.assertEqual([], reader.poll(0))
+            writer.publish({"type": "shard_complete", "folder": "lane_p0"})
+            with open(path, "a") as stream:
+                stream.write('{"type": "shard_complete", "fol')
+            self.assertEqual(["lane_p0"], reader.poll(0))
+            with open(path, "a") as stream:
+                stream.write('der": "lane_p1"}\nnot json\n')
+            self.assertEqual(["lane_p1"], reader.poll(0))
+            self.assertEqual(3, reader.received)
+
+    def test_destination_records_report_the_handler_folders(self):
+        record = {"requestContext": {"condition": "Success"}, "responsePayload": {"folders": ["a", "b"]}}
+        self.assertEqual(["a", "b"], completion_folders(json.dumps(record)))
+        self.assertEqual([], completion_folders(json.dumps({"responsePayload": None})))
+        self.assertEqual([], completion_folders(json.dumps({"type": "other", "folder": "a"})))
+
+
+class ListingFallbackTests(unittest.TestCase):
+    def test_sweep_lists_only_the_pending_span(self):
+        client = FakeListing(shard_keys("a", "b", "c", "d", "e", "f") + ["piscem_output/g/map.rad"])
+        fallback = ListingFallback(client, "maps")
+        self.assertEqual({"c": T0, "d": T0}, fallback.sweep({"c", "d"}))
+        self.assertEqual("piscem_output/c", client.calls[0]["StartAfter"])
+        # Pages hold two keys: c's pair, d's pair, then e's map.rad ends the sweep.
+        self.assertEqual(3, fallback.requests)
+        self.assertEqual({}, fallback.sweep(set()))
+        self.assertEqual(3, fallback.requests)
+
+    def test_sweep_orders_folders_as_s3_orders_their_keys(self):
+        # "-" sorts before "/", so S1-1/ and S1-2/ are listed before S1/.
+        client = FakeListing(shard_keys("S1", "S1-1", "S1-2", "S2"))
+        fallback = ListingFallback(client, "maps")
+        self.assertEqual({"S1": T0, "S1-1": T0}, fallback.sweep({"S1", "S1-1"}))
+
+    def test_sweep_ignores_markers_older_than_the_run(self):
+        client = FakeListing(shard_keys("a"), modified=T0)
+        fallback = ListingFallback(client, "maps", not_before=T0 + timedelta(seconds=1))
+        self.assertEqual({}, fallback.sweep({"a"}))
+
+
+class CompletionTrackerTests(unittest.TestCase):
+    def test_pushed_and_listed_completions_are_counted_once(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            channel = FileChannel(os.path.join(tmp, "events.jsonl"))
+            client = FakeListing(shard_keys("lane_p0"))
+            tracker = CompletionTracker(
+                {"lane_p0", "lane_p1", "lane_p2"},
+                channel=channel,
+                fallback=ListingFallback(client, "maps"),
+                fallback_seconds=60,
+            )
+            self.assertEqual(["lane_p0"], tracker.step(timeout=0))
+
+            for folder in ("lane_p0", "lane_p1", "lane_p2", "unexpected"):
+                channel.publish({"type": "shard_complete", "folder": folder})
+            ready = []
+            self.assertTrue(tracker.wait(5, on_ready=ready.extend))
+        self.assertEqual(["lane_p1", "lane_p2"], sorted(ready))
+        self.assertEqual(
+            {"expected": 3, "ready": 3, "pushed": 2, "listed": 1, "list_calls": 1, "channel_requests": 0},
+            tracker.stats(),
+        )
+
+    def test_inventory_has_a_rad_and_a_marker_line_per_ready_folder(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, "inventory.tsv")
+            write_inventory(path, "piscem_output", {"b": T0, "a": T0})
+            lines = path.read_text().splitlines()
+            self.assertEqual(["inventory.tsv"], os.listdir(tmp))
+        self.assertEqual(
+            [
+                "piscem_output/a/map.rad\t2026-01-01T00:00:00+00:00",
+                "piscem_output/a/output.txt\t2026-01-01T00:00:00+00:00",
+                "piscem_output/b/map.rad\t2026-01-01T00:00:00+00:00",
+                "piscem_output/b/output.txt\t2026-01-01T00:00:00+00:00",
+            ],
+            lines,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import gzip
+import io
+import pathlib
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+
+SCRIPTS_DIR = pathlib.Path(__file__).parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import decompressors  # noqa: E402
+
+
+class DecompressorBackendTests(unittest.TestCase):
+    def test_uncalibrated_choice_prefers_parallel_then_fast_single_thread(self):
+        with mock.patch.object(decompressors.Backend, "available", return_value=True):
+            self.assertEqual(("rapidgzip", 4), decompressors.choose_backend(4))
+            self.assertEqual(("igzip", 1), decompressors.choose_backend(1))
+            self.assertEqual(("pigz", 1), decompressors.choose_backend(1, candidates=["pigz", "gzip"]))
+            # libdeflate buffers its whole input, so it cannot follow a prefetch.
+            self.assertEqual(
+                ("gzip", 1),
+                decompressors.choose_backend(1, candidates=["libdeflate", "gzip"], streaming=True),
+            )
+
+    def test_calibration_picks_the_fastest_measured_backend_within_the_cores(self):
+        calibration = [
+            {"backend": "pigz", "threads": 1, "mb_per_second": 180.0},
+            {"backend": "libdeflate", "threads": 1, "mb_per_second": 700.0},
+            {"backend": "rapidgzip", "threads": 8, "mb_per_second": 2400.0},
+        ]
+        with mock.patch.object(decompressors.Backend, "available", return_value=True):
+            self.assertEqual(("libdeflate", 1), decompressors.choose_backend(4, calibration))
+            self.assertEqual(("rapidgzip", 8), decompressors.choose_backend(8, calibration))
+            self.assertEqual(("pigz", 1), decompressors.choose_backend(8, calibration, streaming=True, candidates=["pigz", "libdeflate"]))
+
+    def test_streaming_substitution_is_resolved_and_logged(self):
+        with mock.patch.object(decompressors.Backend, "available", return_value=True), \
+                mock.patch.object(decompressors, "load_calibration", return_value=None), \
+                mock.patch("sys.stderr", new_callable=io.StringIO) as stderr, \
+                mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            self.assertEqual(0, decompressors.main(["resolve", "libdeflate", "--threads", "4", "--streaming"]))
+            self.assertEqual(0, decompressors.main(["resolve", "libdeflate", "--threads", "1"]))
+        self.assertEqual(["rapidgzip 4", "libdeflate 1"], stdout.getvalue().splitlines())
+        self.assertIn("libdeflate cannot read a stream; using rapidgzip", stderr.getvalue())
+
+    def test_calibrate_times_gzip_on_a_real_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = pathlib.Path(temp_dir) / "sample_R2_001.fastq.gz"
+            path.write_bytes(gzip.compress(b"@read\nACGT\n+\nFFFF\n" * 20000))
+            results = decompressors.calibrate(str(path), (1,), 2.0, ["gzip"])
+        self.assertEqual(["gzip"], [row["backend"] for row in results])
+        self.assertGreater(results[0]["mb_per_second"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,274 @@
+import gzip
+import io
+import json
+import pathlib
+import queue
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import Future
+
+
+SCRIPTS_DIR = pathlib.Path(__file__).parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import fastq_shard_engine as engine  # noqa: E402
+
+
+def fastq(read, count, start=0, rename=None):
+    records = []
+    for index in range(start, start + count):
+        name = rename(index) if rename else f"read{index}"
+        sequence = "ACGT" * (3 if read == 1 else 10)
+        records.append(f"@{name} {read}:N:0\n{sequence}\n+\n{'F' * len(sequence)}\n")
+    return "".join(records).encode()
+
+
+class RecordingUploader:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def upload_bytes(self, payload, bucket, key):
+        with self.lock:
+            self.calls.append(("fastq", bucket, key, payload))
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def put_bytes(self, payload, bucket, key):
+        with self.lock:
+            self.calls.append(("manifest", bucket, key, payload))
+
+
+class ShardEngineTests(unittest.TestCase):
+    def test_streams_are_cut_in_lockstep_on_record_boundaries(self):
+        engine.READ_BLOCK_BYTES, original = 37, engine.READ_BLOCK_BYTES
+        try:
+            pairs = list(
+                engine.iter_shard_pairs(
+                    io.BytesIO(fastq(1, 10)), io.BytesIO(fastq(2, 10)), 16
+                )
+            )
+        finally:
+            engine.READ_BLOCK_BYTES = original
+        self.assertEqual([4, 4, 2], [pair.records for pair in pairs])
+        self.assertEqual(b"".join(pair.r1.payload for pair in pairs), fastq(1, 10))
+        self.assertEqual(b"read8", pairs[2].r2.first_name)
+        self.assertEqual(b"read9", pairs[2].r2.last_name)
+
+    def test_shard_schedule_sizes_pairs_by_index(self):
+        schedule = engine.parse_shard_schedule("3*2,2,1")
+        self.assertEqual([3, 3, 2, 1], schedule)
+        self.assertEqual("3*2,2,1", engine.format_shard_schedule(schedule))
+        pairs = list(
+            engine.iter_shard_pairs(
+                io.BytesIO(fastq(1, 11)), io.BytesIO(fastq(2, 11)), 400, schedule
+            )
+        )
+        # Past the schedule its last size repeats.
+        self.assertEqual([3, 3, 2, 1, 1, 1], [pair.records for pair in pairs])
+        with self.assertRaises(ValueError):
+            engine.parse_shard_schedule("4000000*0")
+
+    def test_mate_mismatch_is_rejected(self):
+        r2 = fastq(2, 4, rename=lambda index: f"other{index}")
+        with self.assertRaises(engine.ShardPairingError):
+            list(engine.iter_shard_pairs(io.BytesIO(fastq(1, 4)), io.BytesIO(r2), 8))
+
+    def test_record_count_mismatch_is_rejected(self):
+        with self.assertRaises(engine.ShardPairingError):
+            list(
+                engine.iter_shard_pairs(
+                    io.BytesIO(fastq(1, 5)), io.BytesIO(fastq(2, 4)), 8
+                )
+            )
+
+    def test_truncated_record_is_rejected(self):
+        truncated = b"\n".join(fastq(1, 3).split(b"\n")[:10]) + b"\n"
+        reader = engine.FastqShardReader(io.BytesIO(truncated), 400, "R1")
+        with self.assertRaises(ValueError):
+            reader.next_shard()
+
+    def test_decompressor_stream_feeds_the_reader(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = pathlib.Path(temp_dir) / "sample_R1_001.fastq.gz"
+            path.write_bytes(gzip.compress(fastq(1, 6)))
+            stream = engine.Decompressor(str(path), "gzip", 1, "")
+            try:
+                reader = engine.FastqShardReader(stream, 16, "R1")
+                shards = [reader.next_shard(), reader.next_shard(), reader.next_shard()]
+            finally:
+                stream.close()
+        self.assertEqual([4, 2], [shard.records for shard in shards[:2]])
+        self.assertIsNone(shards[2])
+        self.assertIsNotNone(stream.finished_ns)
+
+    def test_decompressor_follows_a_prefetching_gzip(self):
+        import s3_range_prefetcher
+
+        payload = gzip.compress(fastq(2, 6))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = str(pathlib.Path(temp_dir) / "sample_R2_001.fastq.gz")
+            pathlib.Path(path).write_bytes(payload[:40] + bytes(len(payload) - 40))
+            s3_range_prefetcher.write_watermark(path, 40, len(payload), "fetching")
+            stream = engine.Decompressor(path, "gzip", 1, "", follow_prefetch=True)
+            try:
+                with open(path, "r+b") as handle:
+                    handle.write(payload)
+                s3_range_prefetcher.write_watermark(path, len(payload), len(payload), "done")
+                shard = engine.FastqShardReader(stream, 400, "R2").next_shard()
+            finally:
+                stream.close()
+        self.assertEqual(fastq(2, 6), shard.payload)
+
+    def test_manifest_is_published_after_its_fastq_pair(self):
+        fake = RecordingUploader()
+        publisher = engine.ShardPublisher(
+            fake, "fastqs", "ko/lane_L001", "manifests", engine.TimingLog(None)
+        )
+        pair = next(
+            engine.iter_shard_pairs(io.BytesIO(fastq(1, 2)), io.BytesIO(fastq(2, 2)), 8)
+        )
+        publisher.publish(pair)
+        self.assertEqual(["fastq", "fastq", "manifest"], [call[0] for call in fake.calls])
+        manifest = fake.calls[-1]
+        self.assertEqual("ko/lane_L001_p0_input.txt", manifest[2])
+        self.assertEqual(
+            b"s3://fastqs/ko/lane_L001_R1_001_p0.fastq\n"
+            b"s3://fastqs/ko/lane_L001_R2_001_p0.fastq\n",
+            manifest[3],
+        )
+
+    def test_queue_then_window_shrink_to_the_memory_budget(self):
+        self.assertEqual((2, 4), engine.fit_memory(0, 100, 2, 4))
+        self.assertEqual((2, 4), engine.fit_memory(800, 100, 2, 4))
+        self.assertEqual((1, 4), engine.fit_memory(799, 100, 2, 4))
+        self.assertEqual((1, 2), engine.fit_memory(500, 100, 2, 4))
+        # Below one queued and one uploading pair the lane still runs.
+        self.assertEqual((1, 1), engine.fit_memory(100, 100, 2, 4))
+        self.assertEqual(800, engine.lane_memory_bytes(100, 2, 4))
+
+    def test_directly_invoked_manifest_is_stored_as_an_audit_copy(self):
+        fake = RecordingUploader()
+        with tempfile.TemporaryDirectory() as spool:
+            publisher = engine.ShardPublisher(
+                fake, "fastqs", "ko/lane_L001", "manifests", engine.TimingLog(None), dispatch_spool=spool
+            )
+            publisher.publish(
+                next(engine.iter_shard_pairs(io.BytesIO(fastq(1, 2)), io.BytesIO(fastq(2, 2)), 8))
+            )
+            spooled = json.loads(pathlib.Path(spool, "lane_L001_p0.event.json").read_text())
+        # The rule only matches *_input.txt, so the copy cannot invoke the mapper again.
+        self.assertEqual("ko/lane_L001_p0_input.txt.audit", fake.calls[-1][2])
+        self.assertEqual("ko/lane_L001_p0_input.txt", spooled["event"]["detail"]["object"]["key"])
+
+    def test_window_overlaps_pairs_but_orders_each_manifest(self):
+        fake = RecordingUploader()
+        second_started = threading.Event()
+        original_upload = fake.upload_bytes
+
+        def upload_bytes(payload, bucket, key):
+            if "_p1." in key:
+                second_started.set()
+            elif not second_started.wait(timeout=5):
+                raise AssertionError("second shard pair did not upload concurrently")
+            return original_upload(payload, bucket, key)
+
+        fake.upload_bytes = upload_bytes
+        publisher = engine.ShardPublisher(
+            fake,
+            "fastqs",
+            "ko/lane_L001",
+            "manifests",
+            engine.TimingLog(None),
+            window=engine.UploadWindow(lane_gbps=0, maximum=2, initial=2),
+        )
+        pairs = queue.Queue()
+        for pair in engine.iter_shard_pairs(
+            io.BytesIO(fastq(1, 4)), io.BytesIO(fastq(2, 4)), 8
+        ):
+            pairs.put(pair)
+        pairs.put(None)
+        publisher.run(pairs, threading.Event())
+
+        self.assertIsNone(publisher.error)
+        self.assertEqual(2, publisher.published)
+        keys = [call[2] for call in fake.calls]
+        for index in (0, 1):
+            manifest = keys.index(f"ko/lane_L001_p{index}_input.txt")
+            self.assertLess(keys.index(f"ko/lane_L001_R1_001_p{index}.fastq"), manifest)
+            self.assertLess(keys.index(f"ko/lane_L001_R2_001_p{index}.fastq"), manifest)
+
+    def test_batched_pairs_share_one_manifest_per_invocation(self):
+        fake = RecordingUploader()
+        publisher = engine.ShardPublisher(
+            fake, "fastqs", "ko/lane_L001", "manifests", engine.TimingLog(None), batch_shards=2
+        )
+        pairs = queue.Queue()
+        for pair in engine.iter_shard_pairs(io.BytesIO(fastq(1, 5)), io.BytesIO(fastq(2, 5)), 8):
+            pairs.put(pair)
+        pairs.put(None)
+        publisher.run(pairs, threading.Event())
+
+        self.assertIsNone(publisher.error)
+        self.assertEqual(3, publisher.published)
+        manifests = {call[2]: call[3] for call in fake.calls if call[0] == "manifest"}
+        self.assertEqual({"ko/lane_L001_b0_input.txt", "ko/lane_L001_p2_input.txt"}, set(manifests))
+        self.assertEqual(
+            b"# shard lane_L001_p0\n"
+            b"s3://fastqs/ko/lane_L001_R1_001_p0.fastq\n"
+            b"s3://fastqs/ko/lane_L001_R2_001_p0.fastq\n"
+            b"# shard lane_L001_p1\n"
+            b"s3://fastqs/ko/lane_L001_R1_001_p1.fastq\n"
+            b"s3://fastqs/ko/lane_L001_R2_001_p1.fastq\n",
+            manifests["ko/lane_L001_b0_input.txt"],
+        )
+        # The lane's last pair is flushed alone, as a plain manifest.
+        self.assertTrue(manifests["ko/lane_L001_p2_input.txt"].startswith(b"s3://"))
+
+    def test_gzip_codec_publishes_member_compressed_shards(self):
+        fake = RecordingUploader()
+        with engine.ThreadPoolExecutor(max_workers=2) as pool:
+            publisher = engine.ShardPublisher(
+                fake,
+                "fastqs",
+                "ko/lane_L001",
+                "manifests",
+                engine.TimingLog(None),
+                codec="gzip",
+                compress_pool=pool,
+            )
+            pair = next(
+                engine.iter_shard_pairs(io.BytesIO(fastq(1, 40)), io.BytesIO(fastq(2, 40)), 160)
+            )
+            engine.GZIP_MEMBER_BYTES, original = 256, engine.GZIP_MEMBER_BYTES
+            try:
+                publisher.publish(pair)
+            finally:
+                engine.GZIP_MEMBER_BYTES = original
+        r1_call = fake.calls[0]
+        self.assertEqual("ko/lane_L001_R1_001_p0.fastq.gz", r1_call[2])
+        self.assertEqual(fastq(1, 40), gzip.decompress(r1_call[3]))
+        self.assertIn(b"lane_L001_R2_001_p0.fastq.gz\n", fake.calls[-1][3])
+
+    def test_codec_choice_weighs_compression_against_the_lane_uplink(self):
+        # 4:1 FASTQ at 100 MB/s per core: 8 cores beat a 1 Gbit/s lane ...
+        self.assertEqual("gzip", engine.choose_shard_codec(0.25, 100e6, 8, 1.0))
+        # ... but one core cannot keep a 10 Gbit/s lane busy.
+        self.assertEqual("none", engine.choose_shard_codec(0.25, 100e6, 1, 10.0))
+        self.assertEqual("none", engine.choose_shard_codec(0.25, 100e6, 8, 0))
+
+    def test_window_settles_at_lane_bandwidth(self):
+        window = engine.UploadWindow(lane_gbps=10, maximum=6, initial=1)
+        window.acquire()
+        window.release(payload_bytes=2_500_000_000 // 8, seconds=1.0)
+        self.assertEqual(4, window.limit)
+        window.acquire()
+        window.release(payload_bytes=20_000_000_000 // 8, seconds=1.0)
+        self.assertEqual(1, window.limit)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import gzip
+import importlib.util
+import io
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import unittest
+
+
+os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+SCRIPTS_DIR = pathlib.Path(__file__).parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import gzip_range_index as range_index  # noqa: E402
+
+MODULE_PATH = pathlib.Path(__file__).parents[1] / "scrna-pipeline" / "map.py"
+SPEC = importlib.util.spec_from_file_location("lambda_map_ranges", MODULE_PATH)
+lambda_map = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(lambda_map)
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+
+def fastq(read, count):
+    rng = random.Random(read)
+    records = []
+    for index in range(count):
+        sequence = "".join(rng.choice("ACGT") for _ in range(28 if read == 1 else 90))
+        records.append(f"@read{index} {read}:N:0\n{sequence}\n+\n{'F' * len(sequence)}\n")
+    return "".join(records).encode()
+
+
+class RangeS3:
+    def __init__(self, objects):
+        self.objects = objects
+        self.ranges = []
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, Range=None):
+        body = self.objects[Key]
+        if Range:
+            first, _, last = Range[len("bytes="):].partition("-")
+            self.ranges.append((Key, int(first), int(last) if last else None))
+            body = body[int(first):int(last) + 1 if last else None]
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+
+class RangeScannerTests(unittest.TestCase):
+    def test_ranges_follow_record_boundaries_across_small_blocks(self):
+        range_index.READ_BLOCK_BYTES, original = 41, range_index.READ_BLOCK_BYTES
+        try:
+            pairs = list(
+                range_index.iter_range_pairs(io.BytesIO(fastq(1, 10)), io.BytesIO(fastq(2, 10)), 16)
+            )
+        finally:
+            range_index.READ_BLOCK_BYTES = original
+        r1_ranges = [pair[1] for pair in pairs]
+        self.assertEqual([4, 4, 2], [shard.records for shard in r1_ranges])
+        self.assertEqual([0, 4, 8], [shard.first_read for shard in r1_ranges])
+        self.assertEqual(len(fastq(1, 10)), sum(shard.length for shard in r1_ranges))
+        self.assertEqual(b"read9", pairs[-1][2].last_name)
+
+    def test_compressed_span_starts_a_byte_before_the_seek_point(self):
+        points = [(0, 10), (1000, 400), (2000, 800), (3000, 1200)]
+        self.assertEqual((1, 399, 1200), range_index.compressed_span(points, 1500, 1500, 2000))
+        self.assertEqual((3, 1199, 1999), range_index.compressed_span(points, 3100, 10, 2000))
+
+
+@unittest.skipIf(indexed_gzip is None, "indexed_gzip is not installed")
+class ZeroSplitRoundTripTests(unittest.TestCase):
+    def test_lambda_inflates_exactly_its_range_from_the_seek_point(self):
+        payload = fastq(2, 4000)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = pathlib.Path(temp_dir) / "lane_R2_001.fastq.gz"
+            index_path = pathlib.Path(temp_dir) / "lane_R2_001.fastq.gz.gzidx"
+            path.write_bytes(gzip.compress(payload))
+            stream = indexed_gzip.IndexedGzipFile(str(path), spacing=64 * 1024)
+            try:
+                scanner = range_index.RecordRangeScanner(stream, 4000, "R2")
+                shards = []
+                while (shard := scanner.next_range()) is not None:
+                    shards.append(shard)
+                stream.build_full_index()
+                points = list(stream.seek_points())
+                stream.export_index(str(index_path))
+            finally:
+                stream.close()
+            objects = {
+                "ko/lane_R2_001.fastq.gz": path.read_bytes(),
+                "ko/lane_R2_001.fastq.gz.gzidx": index_path.read_bytes(),
+            }
+
+            shard = shards[2]
+            seek, first, last = range_index.compressed_span(
+                points, shard.offset, shard.length, len(objects["ko/lane_R2_001.fastq.gz"])
+            )
+            uri = range_index.range_uri(
+                "s3://fastqs/ko/lane_R2_001.fastq.gz",
+                "s3://fastqs/ko/lane_R2_001.fastq.gz.gzidx",
+                shard, seek, first, last,
+            )
+            spec = lambda_map.parse_fastq_uri(uri)
+            self.assertEqual("2000-2999", spec["range"]["reads"])
+            spec["fifo_path"] = str(pathlib.Path(temp_dir) / "r2_0000.fastq")
+
+            fake = RangeS3(objects)
+            original_client = lambda_map.s3_client
+            lambda_map.s3_client = fake
+            try:
+                result = lambda_map.write_s3_object_to_fifo(spec)
+            finally:
+                lambda_map.s3_client = original_client
+            written = pathlib.Path(spec["fifo_path"]).read_bytes()
+
+        self.assertEqual(payload[shard.offset:shard.offset + shard.length], written)
+        self.assertEqual(shard.length, result["fifo_bytes"])
+        fastq_ranges = [item for item in fake.ranges if item[0] == "ko/lane_R2_001.fastq.gz"]
+        # One GET covers the manifest's compressed span; nothing before it is fetched.
+        self.assertEqual(("ko/lane_R2_001.fastq.gz", first, last), fastq_ranges[0])
+        self.assertTrue(all(start > last and end is not None for _, start, end in fastq_ranges[1:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
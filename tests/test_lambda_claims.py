@@ -3,6 +3,7 @@ import io
 import json
 import os
 import pathlib
+import tempfile
 import unittest
 from datetime import datetime, timezone
 
@@ -39,18 +40,21 @@ class FakeS3:
         self.objects = {}
         self.etag_counter = 0
         self.deleted = []
+        self.requests = []
 
     def _etag(self):
         self.etag_counter += 1
         return f'"etag-{self.etag_counter}"'
 
     def head_object(self, Bucket, Key, **_kwargs):
+        self.requests.append(("HeadObject", Key))
         if Key not in self.objects:
             raise client_error("404", "HeadObject", 404)
         item = self.objects[Key]
         return {"ETag": item["ETag"], "LastModified": item["LastModified"]}
 
     def get_object(self, Bucket, Key):
+        self.requests.append(("GetObject", Key))
         if Key not in self.objects:
             raise client_error("NoSuchKey", "GetObject", 404)
         item = self.objects[Key]
@@ -62,6 +66,7 @@ class FakeS3:
         }
 
     def put_object(self, Bucket, Key, Body, IfNoneMatch=None, IfMatch=None, **_kwargs):
+        self.requests.append(("PutObject", Key))
         current = self.objects.get(Key)
         if IfNoneMatch == "*" and current is not None:
             raise client_error("PreconditionFailed", "PutObject")
@@ -76,6 +81,7 @@ class FakeS3:
         return {"ETag": etag}
 
     def delete_object(self, Bucket, Key, IfMatch=None):
+        self.requests.append(("DeleteObject", Key))
         current = self.objects.get(Key)
         if current is None:
             raise client_error("NoSuchKey", "DeleteObject", 404)
@@ -123,6 +129,8 @@ class ClaimTests(unittest.TestCase):
         self.fake.put_object(Bucket="output", Key=marker, Body=b"")
         claim = self.acquire("duplicate")
         self.assertEqual("already_complete", claim["status"])
+        # The claim won alongside the marker check is given back.
+        self.assertNotIn(lambda_map.claim_object_key("lane_p0"), self.fake.objects)
 
     def test_live_claim_rejects_duplicate_owner(self):
         self.acquire("request-1")
@@ -146,6 +154,101 @@ class ClaimTests(unittest.TestCase):
         self.assertNotIn(claim["key"], self.fake.objects)
         self.assertEqual([(claim["key"], claim["etag"])], self.fake.deleted)
 
+    def test_fresh_shard_needs_one_claim_put_and_one_conditional_completion(self):
+        claim = self.acquire()
+        self.assertFalse(lambda_map.refresh_processing_claim(claim, only_if_due=True))
+        marker = lambda_map.completion_marker_key("lane_p0")
+        self.assertTrue(lambda_map.publish_completion(claim, marker, {"timings": {"total_seconds": 1}}))
+        self.assertEqual(
+            [("HeadObject", marker), ("PutObject", claim["key"]), ("PutObject", marker)],
+            sorted(self.fake.requests),
+        )
+        record = json.loads(self.fake.objects[marker]["Body"])
+        self.assertEqual("request-1", record["owner"])
+        self.assertEqual(claim["etag"], record["claim_etag"])
+
+        # A second publisher, e.g. a stale owner, cannot overwrite the marker.
+        self.assertFalse(lambda_map.publish_completion(claim, marker, {}))
+        self.assertEqual("request-1", json.loads(self.fake.objects[marker]["Body"])["owner"])
+        self.assertEqual("already_complete", self.acquire("request-2")["status"])
+
+    def test_lease_renews_only_when_due_and_covers_the_expected_shard(self):
+        claim = self.acquire()
+        claim["document"]["lease_expires_epoch"] = int(lambda_map.time.time()) + 5
+        self.assertTrue(lambda_map.refresh_processing_claim(claim, only_if_due=True))
+        stored = json.loads(self.fake.objects[claim["key"]]["Body"])
+        self.assertEqual(claim["etag"], self.fake.objects[claim["key"]]["ETag"])
+        self.assertGreater(stored["lease_expires_epoch"], int(lambda_map.time.time()) + 100)
+
+        class Remaining(Context):
+            def get_remaining_time_in_millis(self):
+                return 600_000
+
+        self.assertEqual(180, lambda_map.claim_lease_seconds(Remaining("r"), None))
+        self.assertEqual(180, lambda_map.claim_lease_seconds(Remaining("r"), 60))
+        self.assertEqual(450, lambda_map.claim_lease_seconds(Remaining("r"), 300))
+        self.assertEqual(630, lambda_map.claim_lease_seconds(Remaining("r"), 600))
+
+    def test_inline_manifest_is_mapped_without_reading_the_object(self):
+        calls = []
+        cleaned = []
+        original_process_shard = lambda_map.process_shard
+        original_input_bucket = lambda_map.EXPECTED_INPUT_FILES_BUCKET
+        original_clean_scratch = lambda_map.clean_scratch
+        lambda_map.process_shard = lambda folder, key, uris, *_args: calls.append((folder, key, uris))
+        # The handler empties /tmp on a real Lambda; it must not on the test host.
+        lambda_map.clean_scratch = lambda: cleaned.append(True)
+        lambda_map.EXPECTED_INPUT_FILES_BUCKET = "inputs"
+        try:
+            event = {
+                "detail": {
+                    "bucket": {"name": "inputs"},
+                    "object": {"key": "dataset/lane_p0_input.txt"},
+                    "manifest": ["s3://fastq/lane_R1.fastq.gz", " s3://fastq/lane_R2.fastq.gz ", ""],
+                }
+            }
+            lambda_map.handler(event, Context("request-1"))
+            with self.assertRaises(ValueError):
+                lambda_map.handler(dict(event, detail=dict(event["detail"], manifest=[" "])), Context("r"))
+        finally:
+            lambda_map.process_shard = original_process_shard
+            lambda_map.EXPECTED_INPUT_FILES_BUCKET = original_input_bucket
+            lambda_map.clean_scratch = original_clean_scratch
+        self.assertEqual([True, True], cleaned)
+        self.assertEqual([], self.fake.requests)
+        self.assertEqual(
+            [("lane_p0", "dataset/lane_p0_input.txt",
+              ["s3://fastq/lane_R1.fastq.gz", "s3://fastq/lane_R2.fastq.gz"])],
+            calls,
+        )
+
+    def test_completion_is_pushed_to_a_file_channel(self):
+        original_channel = lambda_map.COMPLETION_CHANNEL
+        with tempfile.TemporaryDirectory() as tmp:
+            events = pathlib.Path(tmp, "events.jsonl")
+            lambda_map.COMPLETION_CHANNEL = f"file://{events}"
+            try:
+                lambda_map.notify_completion("lane_p0")
+                lambda_map.notify_completion("lane_p1")
+            finally:
+                lambda_map.COMPLETION_CHANNEL = original_channel
+            messages = [json.loads(line) for line in events.read_text().splitlines()]
+        self.assertEqual(["lane_p0", "lane_p1"], [message["folder"] for message in messages])
+        self.assertEqual({"shard_complete"}, {message["type"] for message in messages})
+        self.assertEqual("piscem_output/lane_p0/output.txt", messages[0]["marker_key"])
+
+    def test_clean_scratch_empties_only_the_given_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            scratch = pathlib.Path(tmp, "scratch")
+            (scratch / "output").mkdir(parents=True)
+            (scratch / "output" / "map.rad").write_bytes(b"rad")
+            (scratch / "stale.fastq").write_bytes(b"@r")
+            keep = pathlib.Path(tmp, "keep.txt")
+            keep.write_text("x")
+            lambda_map.clean_scratch(str(scratch))
+            self.assertEqual([], os.listdir(scratch))
+            self.assertTrue(keep.exists())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,225 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from completion_tracker import FileChannel  # noqa: E402
+from lambda_dispatch import (  # noqa: E402
+    LambdaDispatcher,
+    PacedDispatcher,
+    effective_concurrency,
+    inline_manifest_event,
+    invoke_async,
+    spool_invocation,
+)
+
+
+class FakeLambda:
+    def __init__(self, status=202, delay=0.0):
+        self.status = status
+        self.delay = delay
+        self.payloads = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.payloads.append((FunctionName, InvocationType, json.loads(Payload)))
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        return {"StatusCode": self.status}
+
+    def get_function_concurrency(self, FunctionName):
+        return {}
+
+    def get_account_settings(self):
+        return {"AccountLimit": {"UnreservedConcurrentExecutions": 25}}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+class LambdaDispatchTests(unittest.TestCase):
+    def test_event_keeps_the_eventbridge_shape_and_carries_the_manifest(self):
+        event = inline_manifest_event("inputs", "dataset/lane_p0_input.txt", ["s3://a/R1", "", "s3://a/R2"])
+        self.assertEqual("inputs", event["detail"]["bucket"]["name"])
+        self.assertEqual("dataset/lane_p0_input.txt", event["detail"]["object"]["key"])
+        self.assertEqual(["s3://a/R1", "s3://a/R2"], event["detail"]["manifest"])
+
+        with self.assertRaises(RuntimeError):
+            invoke_async(FakeLambda(status=500), "mapper", event)
+
+    def test_dispatcher_bounds_in_flight_invocations_and_logs_each(self):
+        client = FakeLambda(delay=0.02)
+        with tempfile.TemporaryDirectory() as tmp:
+            with LambdaDispatcher("mapper", max_in_flight=3, invoke_log_dir=tmp, client=client) as dispatcher:
+                for index in range(12):
+                    dispatcher.submit("inputs", f"lane_p{index}_input.txt", [f"s3://a/{index}"], f"lane_p{index}")
+            self.assertEqual(12, len(os.listdir(tmp)))
+            self.assertEqual({"StatusCode": 202}, json.loads(Path(tmp, "lane_p0.json").read_text()))
+
+        self.assertEqual(12, len(client.payloads))
+        self.assertLessEqual(client.max_in_flight, 3)
+        self.assertEqual({"Event"}, {invocation_type for _, invocation_type, _ in client.payloads})
+
+    def test_close_raises_the_first_rejected_invocation(self):
+        dispatcher = LambdaDispatcher("mapper", max_in_flight=2, client=FakeLambda(status=429))
+        dispatcher.submit("inputs", "lane_p0_input.txt", ["s3://a/R1"], "lane_p0")
+        with self.assertRaises(RuntimeError):
+            dispatcher.close()
+
+
+class PacedDispatcherTests(unittest.TestCase):
+    def invoked(self, client):
+        return [event["detail"]["object"]["key"] for _, _, event in client.payloads]
+
+    def test_effective_concurrency_prefers_the_reservation(self):
+        client = FakeLambda()
+        self.assertEqual(25, effective_concurrency(client, "mapper"))
+        client.get_function_concurrency = lambda FunctionName: {"ReservedConcurrentExecutions": 10}
+        self.assertEqual(10, effective_concurrency(client, "mapper"))
+
+    def test_releases_longest_shards_first_and_one_per_completion(self):
+        client = FakeLambda()
+        done = set()
+        pacer = PacedDispatcher(
+            LambdaDispatcher("mapper", client=client),
+            limit=2,
+            is_complete=done.__contains__,
+            expected_seconds=lambda read_pairs: sum(read_pairs) / 1e9,
+            poll_seconds=0.01,
+        )
+        with pacer.wakeup:
+            for name, pairs in [("a", 1), ("b", 4), ("c", 2), ("d", 3)]:
+                pacer.queue(inline_manifest_event("inputs", name, ["s3://x"]), name, [name], [pairs])
+        wait_for(lambda: len(client.payloads) == 2)
+        time.sleep(0.05)
+        self.assertEqual(["b", "d"], self.invoked(client))
+
+        done.add("d")
+        wait_for(lambda: len(client.payloads) == 3)
+        time.sleep(0.05)
+        self.assertEqual(["b", "d", "c"], self.invoked(client))
+
+        done.update({"b", "c"})
+        stats = pacer.close()
+        self.assertEqual(["b", "d", "c", "a"], self.invoked(client))
+        self.assertEqual(4, stats["dispatched"])
+        self.assertEqual(2, stats["max_running"])
+
+    def test_spooled_batches_wait_for_every_shard_marker(self):
+        client = FakeLambda()
+        done = set()
+        with tempfile.TemporaryDirectory() as spool:
+            pacer = PacedDispatcher(
+                LambdaDispatcher("mapper", client=client),
+                limit=1,
+                is_complete=done.__contains__,
+                expected_seconds=lambda read_pairs: 0.0,
+                spool_dir=spool,
+                poll_seconds=0.01,
+            )
+            event = inline_manifest_event("inputs", "lane_b0_input.txt", ["s3://x"])
+            spool_invocation(spool, event, "lane_b0", ["lane_p0", "lane_p1"], [5, 5])
+            spool_invocation(spool, inline_manifest_event("inputs", "lane_p2_input.txt", []), "lane_p2",
+                             ["lane_p2"], [5])
+            wait_for(lambda: len(client.payloads) == 1)
+            self.assertEqual([], os.listdir(spool))
+
+            done.add("lane_p0")
+            time.sleep(0.05)
+            self.assertEqual(1, len(client.payloads))
+            done.add("lane_p1")
+            pacer.close()
+        self.assertEqual(["lane_b0_input.txt", "lane_p2_input.txt"], self.invoked(client))
+
+    def test_stale_shards_give_their_slot_back(self):
+        client = FakeLambda()
+        pacer = PacedDispatcher(
+            LambdaDispatcher("mapper", client=client),
+            limit=1,
+            is_complete=lambda folder: False,
+            expected_seconds=lambda read_pairs: 0.0,
+            poll_seconds=0.01,
+            slot_timeout_seconds=0.02,
+        )
+        for name in ("a", "b"):
+            pacer.queue(inline_manifest_event("inputs", name, ["s3://x"]), name, [name], [1])
+        stats = pacer.close()
+        self.assertEqual(2, stats["dispatched"])
+        self.assertGreaterEqual(stats["reclaimed"], 1)
+
+    def test_channel_events_release_slots_without_marker_checks(self):
+        client = FakeLambda()
+        checked = []
+        with tempfile.TemporaryDirectory() as tmp:
+            events = os.path.join(tmp, "events.jsonl")
+            pacer = PacedDispatcher(
+                LambdaDispatcher("mapper", client=client),
+                limit=1,
+                is_complete=lambda folder: checked.append(folder) or False,
+                expected_seconds=lambda read_pairs: 3600.0,
+                poll_seconds=0.01,
+                channel=FileChannel(events),
+            )
+            for name in ("a", "b"):
+                pacer.queue(inline_manifest_event("inputs", name, ["s3://x"]), name, [name], [1])
+            wait_for(lambda: len(client.payloads) == 1)
+            FileChannel(events).publish({"type": "shard_complete", "folder": "a"})
+            stats = pacer.close()
+        self.assertEqual(["a", "b"], self.invoked(client))
+        self.assertEqual((2, 1), (stats["dispatched"], stats["completed"]))
+        self.assertEqual({"a"}, pacer.completed_folders)
+        self.assertEqual([], checked)
+
+    def test_marker_checks_run_outside_the_queue_lock_and_survive_errors(self):
+        client = FakeLambda()
+        checking, resume = threading.Event(), threading.Event()
+        calls = []
+
+        def is_complete(folder):
+            calls.append(folder)
+            if len(calls) == 1:
+                raise RuntimeError("SlowDown")
+            checking.set()
+            resume.wait(5)
+            return True
+
+        pacer = PacedDispatcher(
+            LambdaDispatcher("mapper", client=client),
+            limit=1,
+            is_complete=is_complete,
+            expected_seconds=lambda read_pairs: 0.0,
+            poll_seconds=0.01,
+        )
+        pacer.queue(inline_manifest_event("inputs", "a", ["s3://x"]), "a", ["a"], [1])
+        self.assertTrue(checking.wait(5))
+        # A check in progress does not hold up publication.
+        started = time.monotonic()
+        pacer.queue(inline_manifest_event("inputs", "b", ["s3://x"]), "b", ["b"], [1])
+        self.assertLess(time.monotonic() - started, 1.0)
+        resume.set()
+        stats = pacer.close()
+        self.assertEqual(["a", "b"], self.invoked(client))
+        self.assertEqual(2, stats["dispatched"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+import gzip
+import importlib.util
+import io
+import json
+import os
+import pathlib
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+
+os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+MODULE_PATH = pathlib.Path(__file__).parents[1] / "scrna-pipeline" / "map.py"
+SPEC = importlib.util.spec_from_file_location("lambda_map_splitter", MODULE_PATH)
+lambda_map = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(lambda_map)
+
+
+def client_error(code, operation, status):
+    return ClientError(
+        {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, operation
+    )
+
+
+class SplitS3:
+    """Objects by (bucket, key), with the calls the splitter and its claim make."""
+
+    def __init__(self):
+        self.objects = {}
+        self.puts = []
+        self.gets = []
+        self.etags = 0
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise client_error("404", "HeadObject", 404)
+        body, etag = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(body), "ETag": etag, "LastModified": datetime.now(timezone.utc)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.gets.append((Key, Range))
+        if (Bucket, Key) not in self.objects:
+            raise client_error("NoSuchKey", "GetObject", 404)
+        body, etag = self.objects[(Bucket, Key)]
+        response = {"ETag": etag, "LastModified": datetime.now(timezone.utc)}
+        if Range is not None:
+            first, last = (int(value) for value in Range[len("bytes="):].split("-"))
+            if first >= len(body):
+                raise client_error("InvalidRange", "GetObject", 416)
+            response["ContentRange"] = f"bytes {first}-{min(last, len(body) - 1)}/{len(body)}"
+            body = body[first:last + 1]
+        response.update(Body=io.BytesIO(body), ContentLength=len(body))
+        return response
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, IfMatch=None, **_kwargs):
+        current = self.objects.get((Bucket, Key))
+        if (IfNoneMatch == "*" and current) or (IfMatch and (not current or current[1] != IfMatch)):
+            raise client_error("PreconditionFailed", "PutObject", 412)
+        self.etags += 1
+        self.objects[(Bucket, Key)] = (bytes(Body), f'"{self.etags}"')
+        self.puts.append(Key)
+        return {"ETag": f'"{self.etags}"'}
+
+    def delete_object(self, Bucket, Key, IfMatch=None):
+        del self.objects[(Bucket, Key)]
+
+    def upload_fileobj(self, Fileobj, Bucket, Key):
+        self.put_object(Bucket, Key, Fileobj.read())
+
+    def close(self):
+        pass
+
+
+class Context:
+    aws_request_id = "split-1"
+
+    def __init__(self, remaining_ms=None):
+        if remaining_ms is not None:
+            self.get_remaining_time_in_millis = lambda: remaining_ms
+
+
+def fastq(read, count):
+    return "".join(
+        f"@read{index} {read}:N:0\n{'ACGT' * 4}\n+\n{'F' * 16}\n" for index in range(count)
+    ).encode()
+
+
+class SplitterTests(unittest.TestCase):
+    def setUp(self):
+        self.s3 = SplitS3()
+        self.r1, self.r2 = fastq(1, 10), fastq(2, 10)
+        self.s3.objects[("fastqs", "ko/lane_L001_R1_001.fastq.gz")] = (gzip.compress(self.r1), '"a"')
+        self.s3.objects[("fastqs", "ko/lane_L001_R2_001.fastq.gz")] = (gzip.compress(self.r2), '"b"')
+        self.s3.put_object(
+            "manifests", "ko/lane_L001_split.txt",
+            b"# split pairs=3\n"
+            b"s3://fastqs/ko/lane_L001_R1_001.fastq.gz\n"
+            b"s3://fastqs/ko/lane_L001_R2_001.fastq.gz\n",
+        )
+        patches = [
+            mock.patch.object(lambda_map, "s3_client", self.s3),
+            mock.patch.object(lambda_map, "S3_OUTPUT_BUCKET_NAME", "output"),
+            mock.patch.object(lambda_map, "FIFO_RANGE_BYTES", 40),
+            mock.patch.object(lambda_map.boto3, "client", return_value=self.s3),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def split(self, key, context):
+        return lambda_map.process_split("manifests", key, context)
+
+    def done(self, folder):
+        return json.loads(self.s3.objects[("output", lambda_map.split_marker_key(folder))][0])
+
+    def shards(self, read):
+        return b"".join(
+            self.s3.objects[("fastqs", f"ko/lane_L001_{read}_001_p{index}.fastq")][0] for index in range(4)
+        )
+
+    def test_splitter_publishes_driver_named_shards_and_manifests(self):
+        result = self.split("ko/lane_L001_split.txt", Context())
+        self.assertEqual(4, result["timings"]["shards"])
+        self.assertEqual((self.r1, self.r2), (self.shards("R1"), self.shards("R2")))
+        self.assertEqual(
+            b"s3://fastqs/ko/lane_L001_R1_001_p3.fastq\ns3://fastqs/ko/lane_L001_R2_001_p3.fastq\n",
+            self.s3.objects[("manifests", "ko/lane_L001_p3_input.txt")][0],
+        )
+        done = self.done("lane_L001_split")
+        self.assertEqual([f"lane_L001_p{index}" for index in range(4)], done["folders"])
+        self.assertTrue(done["complete"])
+        # Mappers' output.txt markers are the only completion files under S3_PREFIX.
+        self.assertFalse(any(key.startswith(lambda_map.S3_PREFIX) for key in self.s3.puts))
+
+        puts = len(self.s3.puts)
+        self.assertTrue(self.split("ko/lane_L001_split.txt", Context())["idempotent"])
+        self.assertEqual(puts, len(self.s3.puts))
+
+    def test_splitter_hands_the_rest_of_a_lane_to_a_continuation(self):
+        first = self.split("ko/lane_L001_split.txt", Context(remaining_ms=1000))
+        self.assertFalse(first["timings"]["complete"])
+        continuation = self.done("lane_L001_split")["continued_by"]
+        self.assertEqual("ko/lane_L001_s2_split.txt", continuation)
+        self.assertIn(b"start=2", self.s3.objects[("manifests", continuation)][0])
+
+        self.split(continuation, Context())
+        folders = self.done("lane_L001_split")["folders"] + self.done("lane_L001_s2_split")["folders"]
+        self.assertEqual([f"lane_L001_p{index}" for index in range(4)], folders)
+        self.assertEqual((self.r1, self.r2), (self.shards("R1"), self.shards("R2")))
+
+    def test_continuation_seeks_through_a_gzip_index(self):
+        import indexed_gzip
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for read in ("R1", "R2"):
+                key = f"ko/lane_L001_{read}_001.fastq.gz"
+                path = os.path.join(tmp, f"{read}.gz")
+                pathlib.Path(path).write_bytes(self.s3.objects[("fastqs", key)][0])
+                with indexed_gzip.IndexedGzipFile(path) as stream:
+                    stream.build_full_index()
+                    stream.export_index(path + ".gzidx")
+                self.s3.objects[("fastqs", key + ".gzidx")] = (pathlib.Path(path + ".gzidx").read_bytes(), '"i"')
+
+        self.split("ko/lane_L001_split.txt", Context(remaining_ms=1000))
+        continuation = self.done("lane_L001_split")["continued_by"]
+        # Shards p0 and p1 hold six records, 24 lines, of each read.
+        offset = len(b"".join(self.r1.splitlines(True)[:24]))
+        self.assertIn(
+            f"start=2 r1_offset={offset} r2_offset={offset}".encode(),
+            self.s3.objects[("manifests", continuation)][0],
+        )
+        self.s3.gets.clear()
+        result = self.split(continuation, Context())
+        self.assertEqual(2, result["timings"]["shards"])
+        self.assertIn(("ko/lane_L001_R2_001.fastq.gz.gzidx", None), self.s3.gets)
+        self.assertEqual((self.r1, self.r2), (self.shards("R1"), self.shards("R2")))
+
+    def test_shards_are_capped_to_the_functions_memory(self):
+        with mock.patch.dict(os.environ, {"AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "1"}), \
+                mock.patch.object(lambda_map, "SPLIT_PAIR_BYTES", 100_000):
+            self.assertEqual(2, lambda_map.split_pair_limit(1))
+            result = self.split("ko/lane_L001_split.txt", Context())
+        self.assertEqual((2, 5), (result["timings"]["pairs"], result["timings"]["shards"]))
+        self.assertEqual(self.r1, b"".join(
+            self.s3.objects[("fastqs", f"ko/lane_L001_R1_001_p{index}.fastq")][0] for index in range(5)
+        ))
+
+    def test_mismatched_mates_fail_without_a_completion_document(self):
+        self.s3.objects[("fastqs", "ko/lane_L001_R2_001.fastq.gz")] = (gzip.compress(fastq(2, 9)), '"c"')
+        with self.assertRaises(lambda_map.ShardPairingError):
+            self.split("ko/lane_L001_split.txt", Context())
+        self.assertNotIn(("output", lambda_map.split_marker_key("lane_L001_split")), self.s3.objects)
+        failure = json.loads(self.s3.objects[("output", lambda_map.split_failure_key("lane_L001_split"))][0])
+        self.assertFalse(failure["retryable"])
+        self.assertIn("ShardPairingError", failure["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,573 @@
+import contextlib
+import gzip
+import importlib.util
+import io
+import os
+import pathlib
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+MODULE_PATH = pathlib.Path(__file__).parents[1] / "scrna-pipeline" / "map.py"
+SPEC = importlib.util.spec_from_file_location("lambda_map_streaming", MODULE_PATH)
+lambda_map = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(lambda_map)
+BENCHMARK_PATH = pathlib.Path(__file__).parents[1] / "scripts" / "benchmark_fifo_producer.py"
+
+
+FASTQ = b"".join(
+    f"@read{index} 1:N:0\nACGTACGTACGT\n+\nFFFFFFFFFFFF\n".encode() for index in range(500)
+)
+
+
+class RangeS3:
+    """Answers ranged GETs with random delays so they complete out of order."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.ranges = []
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Range is None:
+            return {"ContentLength": len(self.payload), "Body": io.BytesIO(self.payload)}
+        first, last = (int(value) for value in Range[len("bytes="):].split("-"))
+        if first >= len(self.payload):
+            raise lambda_map.ClientError({"Error": {"Code": "InvalidRange"}}, "GetObject")
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.ranges.append(first)
+        time.sleep(random.uniform(0, 0.01))
+        with self.lock:
+            self.in_flight -= 1
+        body = self.payload[first:last + 1]
+        return {
+            "ContentLength": len(body),
+            "ContentRange": f"bytes {first}-{first + len(body) - 1}/{len(self.payload)}",
+            "Body": io.BytesIO(body),
+        }
+
+
+class RangeFetchTests(unittest.TestCase):
+    def setUp(self):
+        self.original_client = lambda_map.s3_client
+
+    def tearDown(self):
+        lambda_map.s3_client = self.original_client
+
+    def stream(self, payload, concurrency, inflate=False, **extra):
+        lambda_map.s3_client = fake = RangeS3(payload)
+        original = lambda_map.FIFO_RANGE_BYTES, lambda_map.FIFO_RANGE_CONCURRENCY
+        lambda_map.FIFO_RANGE_BYTES, lambda_map.FIFO_RANGE_CONCURRENCY = 1000, concurrency
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                spec = {
+                    "uri": "s3://fastqs/ko/lane_R1_001_p0.fastq",
+                    "bucket": "fastqs",
+                    "key": "ko/lane_R1_001_p0.fastq",
+                    "read": "R1",
+                    "compression": "gzip" if inflate else "none",
+                    "inflate": inflate,
+                    # A regular file stands in for the FIFO.
+                    "fifo_path": os.path.join(temp_dir, "r1_0000.fastq"),
+                    **extra,
+                }
+                result = lambda_map.write_s3_object_to_fifo(spec)
+                written = pathlib.Path(spec["fifo_path"]).read_bytes()
+        finally:
+            lambda_map.FIFO_RANGE_BYTES, lambda_map.FIFO_RANGE_CONCURRENCY = original
+        return result, written, fake
+
+    def test_parallel_ranges_reach_the_fifo_in_order(self):
+        result, written, fake = self.stream(FASTQ, concurrency=4)
+        self.assertEqual(FASTQ, written)
+        self.assertEqual(-(-len(FASTQ) // 1000), result["get_requests"])
+        self.assertLessEqual(fake.peak_in_flight, 4)
+        self.assertGreater(fake.peak_in_flight, 1)
+        self.assertIn(result["limit"], ("s3", "piscem"))
+        self.assertGreaterEqual(result["starved_seconds"], 0.0)
+
+    def test_parallel_ranges_feed_writer_inflation_and_empty_objects(self):
+        result, written, _ = self.stream(gzip.compress(FASTQ), concurrency=3, inflate=True)
+        self.assertEqual(FASTQ, written)
+        result, written, _ = self.stream(b"", concurrency=3)
+        self.assertEqual((b"", 0), (written, result["bytes"]))
+
+    def test_parallel_inflation_runs_rapidgzip_into_the_fifo(self):
+        with tempfile.TemporaryDirectory() as bin_dir:
+            # Stands in for the rapidgzip CLI: inflate stdin, record -P.
+            rapidgzip = pathlib.Path(bin_dir) / "rapidgzip"
+            rapidgzip.write_text(
+                f"#!{sys.executable}\n"
+                "import gzip, pathlib, sys\n"
+                f"pathlib.Path({bin_dir!r}, 'args').write_text(' '.join(sys.argv[1:]))\n"
+                "sys.stdout.buffer.write(gzip.decompress(sys.stdin.buffer.read()))\n"
+            )
+            rapidgzip.chmod(0o755)
+            original = lambda_map.RAPIDGZIP
+            lambda_map.RAPIDGZIP = str(rapidgzip)
+            try:
+                payload = gzip.compress(FASTQ)
+                result, written, _ = self.stream(payload, 3, inflate="parallel", inflate_threads=2)
+                self.assertEqual(FASTQ, written)
+                self.assertEqual(("parallel", 2, len(payload)), (
+                    result["inflate"], result["inflate_threads"], result["fifo_bytes"]
+                ))
+                self.assertEqual("-d -c -P 2", (pathlib.Path(bin_dir) / "args").read_text())
+                with self.assertRaisesRegex(IOError, "rapidgzip exited"):
+                    self.stream(payload[:-12], 3, inflate="parallel", inflate_threads=2)
+            finally:
+                lambda_map.RAPIDGZIP = original
+
+    def test_inflate_threads_come_out_of_piscems_share(self):
+        self.assertEqual((4, 1, 2), lambda_map.inflate_thread_budget(6, 6, True))
+        self.assertEqual((6, 0, 0), lambda_map.inflate_thread_budget(6, 6, False))
+        self.assertEqual((2, 0, 0), lambda_map.inflate_thread_budget(2, 2, True))
+        self.assertEqual((6, 2, 4), lambda_map.inflate_thread_budget(12, 6, True))
+
+    def test_ranges_are_read_into_a_bounded_ring_of_buffers(self):
+        lambda_map.s3_client = RangeS3(FASTQ)
+        reader = lambda_map.OrderedRangeReader("fastqs", "ko/lane_R1_001_p0.fastq", 1000, 3)
+        buffers = set()
+        output = bytearray()
+        for view in reader.chunks():
+            buffers.add(id(view.obj))
+            output += view
+        self.assertEqual(FASTQ, bytes(output))
+        self.assertLessEqual(len(buffers), 4)
+
+    def test_botocore_bodies_fill_buffers_through_http_client(self):
+        import boto3
+        from botocore.config import Config
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            payload_path = os.path.join(temp_dir, "payload.fastq")
+            pathlib.Path(payload_path).write_bytes(FASTQ)
+            server = subprocess.Popen(
+                [sys.executable, str(BENCHMARK_PATH), "serve", payload_path],
+                stdout=subprocess.PIPE, text=True,
+            )
+            try:
+                port = int(server.stdout.readline())
+                client = boto3.client(
+                    "s3", endpoint_url=f"http://127.0.0.1:{port}",
+                    config=Config(s3={"addressing_style": "path"}),
+                )
+                body = client.get_object(Bucket="fastqs", Key="payload.fastq", Range="bytes=100-1099")["Body"]
+                # The installed botocore and urllib3 must take the fast path;
+                # a release outside FAST_BODY_VERSIONS fails here, not silently.
+                self.assertTrue(lambda_map.FAST_BODY_READS)
+                self.assertEqual("HTTPResponse", type(lambda_map.body_reader(body)).__name__)
+                self.assertEqual("http.client", type(lambda_map.body_reader(body)).__module__)
+                lambda_map.FAST_BODY_READS = False
+                try:
+                    self.assertIs(body, lambda_map.body_reader(body))
+                finally:
+                    lambda_map.FAST_BODY_READS = True
+                buffer = bytearray(4000)
+                self.assertEqual(1000, lambda_map.fill_buffer(body, memoryview(buffer)))
+                body.close()
+                self.assertEqual(FASTQ[100:1100], bytes(buffer[:1000]))
+            finally:
+                server.terminate()
+                server.wait()
+
+    def test_checksum_validating_bodies_keep_botocores_read(self):
+        from botocore.httpchecksum import StreamingChecksumBody
+
+        raw = io.BytesIO(FASTQ)
+        raw._fp, raw.headers = io.BytesIO(FASTQ), {}
+        body = StreamingChecksumBody(raw, len(FASTQ), None, "unused")
+        self.assertIs(body, lambda_map.body_reader(body))
+
+    def test_single_connection_streams_one_get(self):
+        result, written, fake = self.stream(FASTQ, concurrency=1)
+        self.assertEqual(FASTQ, written)
+        self.assertEqual((1, []), (result["get_requests"], fake.ranges))
+
+
+class BatchContext:
+    aws_request_id = "request-1"
+
+    def __init__(self, remaining_seconds):
+        self.remaining_seconds = remaining_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int(self.remaining_seconds * 1000)
+
+
+class BatchManifestTests(unittest.TestCase):
+    def test_plain_and_batch_manifests_name_their_output_folders(self):
+        self.assertEqual(
+            [("lane_L001_p3", ["s3://a/x_R1_001_p3.fastq", "s3://a/x_R2_001_p3.fastq"])],
+            lambda_map.manifest_shards(
+                "ko/lane_L001_p3_input.txt", ["s3://a/x_R1_001_p3.fastq", "s3://a/x_R2_001_p3.fastq"]
+            ),
+        )
+        shards = lambda_map.manifest_shards(
+            "ko/lane_L001_b0_input.txt",
+            ["# shard lane_L001_p0", "s3://a/p0_R1_001.fastq", "s3://a/p0_R2_001.fastq",
+             "# shard lane_L001_p1", "s3://a/p1_R1_001.fastq", "s3://a/p1_R2_001.fastq"],
+        )
+        self.assertEqual(["lane_L001_p0", "lane_L001_p1"], [folder for folder, _ in shards])
+        with self.assertRaises(ValueError):
+            lambda_map.manifest_shards("b_input.txt", ["# shard a", "s3://a/p0_R1_001.fastq", "# shard a"])
+
+    def test_batch_maps_each_shard_and_hands_the_rest_on_before_the_deadline(self):
+        shards = [(f"lane_L001_p{index}", [f"s3://a/p{index}_R1_001.fastq"]) for index in range(3)]
+        calls = []
+        published = {}
+
+        def process_shard(folder, key, uris, context, manifest_seconds, prefetched, batch_shards):
+            calls.append((folder, sorted(prefetched or {})))
+            context.remaining_seconds -= 100
+            return {"statusCode": 200, "timings": {"folder": folder}}
+
+        def put_once(bucket, key, body):
+            if (bucket, key) in published:
+                return False
+            published[(bucket, key)] = body
+            return True
+
+        original = (
+            lambda_map.process_shard, lambda_map.FIFO_RANGE_CONCURRENCY, lambda_map.put_split_manifest_once
+        )
+        (lambda_map.process_shard, lambda_map.FIFO_RANGE_CONCURRENCY,
+         lambda_map.put_split_manifest_once) = process_shard, 1, put_once
+        try:
+            result = lambda_map.process_batch("in", shards, "ko/lane_L001_b0_input.txt", BatchContext(900), 0.0)
+            self.assertEqual((3, None), (len(result["timings"]), result["continued_by"]))
+            calls.clear()
+            result = lambda_map.process_batch("in", shards, "ko/lane_L001_b0_input.txt", BatchContext(110), 0.0)
+        finally:
+            (lambda_map.process_shard, lambda_map.FIFO_RANGE_CONCURRENCY,
+             lambda_map.put_split_manifest_once) = original
+        # The second shard did not start with too little time left; the rest
+        # of the batch went out as a manifest and the invocation succeeded.
+        self.assertEqual(["lane_L001_p0"], [folder for folder, _ in calls])
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual("ko/lane_L001_b0_r1_input.txt", result["continued_by"])
+        body = published[("in", "ko/lane_L001_b0_r1_input.txt")]
+        self.assertEqual(
+            [(folder, uris) for folder, uris in shards[1:]],
+            lambda_map.manifest_shards(result["continued_by"], body.splitlines()),
+        )
+
+
+class MultipartS3:
+    def __init__(self):
+        self.parts = {}
+        self.objects = {}
+        self.aborted = []
+
+    def create_multipart_upload(self, Bucket, Key):
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts[PartNumber] = bytes(Body)
+        return {"ETag": f'"{PartNumber}-{len(Body)}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        assert numbers == list(range(1, len(numbers) + 1)), numbers
+        self.objects[(Bucket, Key)] = b"".join(self.parts[number] for number in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(Key)
+
+    def close(self):
+        pass
+
+
+def rad_header(chunks):
+    names = b"".join(len(name).to_bytes(2, "little") + name for name in (b"tx1", b"tx22"))
+    return b"\x00" + (2).to_bytes(8, "little") + names + chunks.to_bytes(8, "little")
+
+
+class RadStreamUploadTests(unittest.TestCase):
+    def setUp(self):
+        self.original_poll = lambda_map.RAD_TAIL_POLL_SECONDS
+        lambda_map.RAD_TAIL_POLL_SECONDS = 0.005
+
+    def tearDown(self):
+        lambda_map.RAD_TAIL_POLL_SECONDS = self.original_poll
+
+    def stream(self, edit=None):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "map.rad")
+            uploader = lambda_map.RadStreamUploader(path, "out", "ko/folder/map.rad", part_bytes=1000)
+            uploader.client = fake = MultipartS3()
+            uploader.start()
+            with open(path, "wb") as rad:
+                rad.write(rad_header(0))
+                for chunk in range(12):
+                    rad.write(bytes([chunk]) * 500)
+                    rad.flush()
+                    time.sleep(0.01)
+            deadline = time.monotonic() + 5
+            while uploader.streamed_bytes < 3000 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            uploader.stop()
+            with open(path, "r+b") as rad:
+                # Piscem's only in-place write: the final chunk count.
+                rad.write(rad_header(12))
+                if edit is not None:
+                    rad.seek(edit)
+                    rad.write(b"\xff")
+            self.assertTrue(uploader.complete())
+            with open(path, "rb") as rad:
+                expected = rad.read()
+        return fake, uploader, expected
+
+    def test_parts_stream_during_mapping_and_the_header_is_sent_last(self):
+        self.assertEqual(len(rad_header(0)), lambda_map.rad_chunk_count_end(rad_header(0)))
+        self.assertIsNone(lambda_map.rad_chunk_count_end(rad_header(0)[:-1]))
+        fake, uploader, expected = self.stream()
+        self.assertEqual(expected, fake.objects[("out", "ko/folder/map.rad")])
+        self.assertGreaterEqual(uploader.streamed_bytes, 3000)
+        self.assertEqual(rad_header(12), fake.parts[1][:len(rad_header(12))])
+
+    def test_streamed_part_rewritten_after_upload_is_sent_again(self):
+        fake, _, expected = self.stream(edit=1500)
+        self.assertEqual(expected, fake.objects[("out", "ko/folder/map.rad")])
+
+    def test_small_map_rad_falls_back_to_a_whole_upload(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "map.rad")
+            pathlib.Path(path).write_bytes(rad_header(1) + b"x" * 100)
+            uploader = lambda_map.RadStreamUploader(path, "out", "ko/folder/map.rad", part_bytes=1000)
+            uploader.start()
+            uploader.stop()
+            self.assertFalse(uploader.complete())
+
+
+def rad_with_tags(chunk_sizes):
+    """A RAD prelude with file tags (a u32 array and a string) and chunks of the given sizes."""
+    def tag(name, kind, *array_kinds):
+        return len(name).to_bytes(2, "little") + name + bytes([kind, *array_kinds])
+
+    prelude = rad_header(len(chunk_sizes))
+    prelude += (2).to_bytes(2, "little") + tag(b"ref_lengths", 7, 3, 3) + tag(b"producer", 8)
+    prelude += (1).to_bytes(2, "little") + tag(b"barcode", 3)
+    prelude += (1).to_bytes(2, "little") + tag(b"reference", 3)
+    prelude += (2).to_bytes(4, "little") + (100).to_bytes(4, "little") + (200).to_bytes(4, "little")
+    prelude += (11).to_bytes(2, "little") + b"piscem-test"
+    chunks = b"".join(
+        size.to_bytes(4, "little") + (1).to_bytes(4, "little") + bytes([index]) * (size - 8)
+        for index, size in enumerate(chunk_sizes)
+    )
+    return prelude, chunks
+
+
+def decode_rad_frames(framed):
+    assert framed[:4] == lambda_map.RAD_FRAME_MAGIC
+    version, codec, _, prelude_bytes, frame_count = struct.unpack_from("<BBHQQ", framed, 4)
+    offset = 24 + prelude_bytes
+    table = [struct.unpack_from("<QQ", framed, offset + 16 * index) for index in range(frame_count)]
+    offset += 16 * frame_count
+    payload = []
+    for compressed, raw in table:
+        frame = zlib.decompress(framed[offset:offset + compressed])
+        assert len(frame) == raw
+        payload.append(frame)
+        offset += compressed
+    assert offset == len(framed) and (version, codec) == (1, 1)
+    return framed[24:24 + prelude_bytes], payload
+
+
+class RadFrameTests(unittest.TestCase):
+    def test_frames_end_on_chunk_boundaries_and_decode_to_the_original(self):
+        prelude, chunks = rad_with_tags([300, 500, 200, 900, 100])
+        self.assertEqual(len(prelude), lambda_map.rad_payload_offset(prelude + chunks[:10]))
+        self.assertIsNone(lambda_map.rad_payload_offset(prelude[:-3]))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "map.rad")
+            pathlib.Path(path).write_bytes(prelude + chunks + b"tail")
+            sizes = lambda_map.encode_rad_frames(path, "deflate", frame_bytes=700, threads=2)
+            framed = pathlib.Path(path).read_bytes()
+        header, frames = decode_rad_frames(framed)
+        self.assertEqual(prelude, header)
+        # 300+500, 200+900, then the last chunk with the unparsed tail.
+        self.assertEqual([800, 1100, 104], [len(frame) for frame in frames])
+        self.assertEqual(chunks + b"tail", b"".join(frames))
+        self.assertEqual(
+            {"raw_bytes": len(prelude + chunks) + 4, "framed_bytes": len(framed), "frames": 3}, sizes
+        )
+
+
+def piscem_rad(chunks):
+    """A Piscem-style RAD: a cblen file tag, b and u read tags and one alignment tag.
+
+    Each chunk is a list of (barcode, umi, alignment count) records.
+    """
+    def tag(name, kind):
+        return len(name).to_bytes(2, "little") + name + bytes([kind])
+
+    rad = rad_header(len(chunks))
+    rad += (1).to_bytes(2, "little") + tag(b"cblen", 2)
+    rad += (2).to_bytes(2, "little") + tag(b"b", 3) + tag(b"u", 3)
+    rad += (1).to_bytes(2, "little") + tag(b"compressed_ori_refid", 3)
+    rad += (4).to_bytes(2, "little")
+    for records in chunks:
+        body = b"".join(
+            struct.pack("<III", alignments, barcode, umi) + bytes(4 * alignments)
+            for barcode, umi, alignments in records
+        )
+        rad += struct.pack("<II", 8 + len(body), len(records)) + body
+    return rad
+
+
+class BarcodeHistogramTests(unittest.TestCase):
+    def test_reads_are_counted_per_barcode_and_written_sorted(self):
+        rad = piscem_rad([[(0b00011011, 1, 1), (5, 2, 3)], [(0b00011011, 3, 0), (5, 4, 2), (0b00011011, 5, 1)]])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "map.rad")
+            pathlib.Path(path).write_bytes(rad)
+            counts, barcode_length = lambda_map.rad_barcode_histogram(path)
+            self.assertEqual({0b00011011: 3, 5: 2}, dict(counts))
+            self.assertEqual(4, barcode_length)
+
+            sidecar = os.path.join(temp_dir, lambda_map.BARCODE_HISTOGRAM_FILE)
+            size = lambda_map.write_barcode_histogram(sidecar, counts, barcode_length)
+            data = pathlib.Path(sidecar).read_bytes()
+        self.assertEqual(len(data), size)
+        self.assertEqual((b"BCH1", 4, 2), (data[:4], data[4], struct.unpack_from("<Q", data, 8)[0]))
+        self.assertEqual(struct.pack("<4Q", 5, 0b00011011, 2, 3), zlib.decompress(data[16:]))
+
+        # A record that overruns its chunk is a corrupt file, not a short count.
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "map.rad")
+            pathlib.Path(path).write_bytes(rad.replace(struct.pack("<III", 3, 5, 2), struct.pack("<III", 2, 5, 2)))
+            with self.assertRaises(ValueError):
+                lambda_map.rad_barcode_histogram(path)
+
+
+READ_FIFO = (
+    "import sys\n"
+    "data = open(sys.argv[1], 'rb').read()\n"
+    "print('mapped', len(data), flush=True)\n"
+    "sys.stderr.write('progress\\nno newline')\n"
+)
+
+
+class PiscemSupervisorTests(unittest.TestCase):
+    def supervise(self, producer):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fifo_path = os.path.join(temp_dir, "r1_0000.fastq")
+            os.mkfifo(fifo_path)
+            keeper_fds = {fifo_path: os.open(fifo_path, os.O_RDWR | os.O_NONBLOCK)}
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(producer, fifo_path)
+                process = subprocess.Popen(
+                    [sys.executable, "-c", READ_FIFO, fifo_path],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                )
+                supervisor = lambda_map.PiscemSupervisor(
+                    process, {future: {"fifo_path": fifo_path}}, keeper_fds
+                )
+                log = io.StringIO()
+                with contextlib.redirect_stdout(log):
+                    failure = supervisor.run()
+            self.assertEqual({}, keeper_fds)
+        return supervisor, failure, log.getvalue()
+
+    def test_producer_completion_closes_its_fifo_and_logs_stream(self):
+        def producer(fifo_path):
+            with open(fifo_path, "wb") as fifo:
+                fifo.write(FASTQ)
+            return {"bytes": len(FASTQ), "starved_seconds": 0.5, "blocked_seconds": 0.1}
+
+        supervisor, failure, log = self.supervise(producer)
+        self.assertIsNone(failure)
+        self.assertEqual(0, supervisor.process.returncode)
+        self.assertEqual(f"mapped {len(FASTQ)}\nprogress\nno newline\n", log)
+        self.assertEqual(b"progress\nno newline", bytes(supervisor.stderr_tail))
+        self.assertGreaterEqual(supervisor.tail_seconds(), 0.0)
+
+    def test_failed_producer_stops_piscem(self):
+        def producer(fifo_path):
+            raise lambda_map.ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+
+        supervisor, failure, _ = self.supervise(producer)
+        self.assertIsInstance(failure, lambda_map.ClientError)
+        self.assertNotEqual(0, supervisor.process.returncode)
+
+    def test_bottleneck_verdict_weighs_s3_waits_against_fifo_waits(self):
+        network = [{"starved_seconds": 3.0, "blocked_seconds": 0.5}, {"starved_seconds": 1.0}]
+        self.assertEqual("network-bound", lambda_map.bottleneck_verdict(network))
+        mapper = [{"starved_seconds": 0.2, "blocked_seconds": 4.0}]
+        self.assertEqual("mapper-bound", lambda_map.bottleneck_verdict(mapper))
+
+
+class ResourceSamplerTests(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists("/proc/stat"), "needs Linux /proc")
+    def test_sampler_summarises_cpu_memory_and_a_timeseries(self):
+        process = subprocess.Popen(
+            [sys.executable, "-c", "block = bytearray(40 << 20); [sum(range(10000)) for _ in range(2000)]"]
+        )
+        sampler = lambda_map.ResourceSampler(interval=0.02, timeseries=True)
+        sampler.start()
+        sampler.watch(process.pid)
+        process.wait()
+        summary = sampler.stop()
+        self.assertIsNone(sampler.stop())
+        self.assertGreaterEqual(summary["samples"], 3)
+        self.assertEqual(summary["cpu_cores"], len(summary["cpu_core_mean_percent"]))
+        self.assertLessEqual(summary["cpu_mean_percent"], summary["cpu_peak_percent"])
+        self.assertGreater(summary["piscem_rss_peak_bytes"], 40 << 20)
+        self.assertIn("net_rx_bytes", summary)
+        series = summary["timeseries"]
+        self.assertEqual(summary["samples"] - 1, len(series["rows"]))
+        self.assertTrue(all(len(row) == len(series["columns"]) for row in series["rows"]))
+
+
+class GzipInflateTests(unittest.TestCase):
+    def test_concatenated_members_inflate_across_chunk_boundaries(self):
+        members = b"".join(gzip.compress(FASTQ[start:start + 4096]) for start in range(0, len(FASTQ), 4096))
+        inflater = lambda_map.GzipMemberInflater()
+        output = b"".join(inflater.inflate(members[start:start + 333]) for start in range(0, len(members), 333))
+        inflater.finish("s3://fastqs/lane_R1_001_p0.fastq.gz")
+        self.assertEqual(FASTQ, output)
+
+    def test_truncated_member_is_rejected(self):
+        inflater = lambda_map.GzipMemberInflater()
+        inflater.inflate(gzip.compress(FASTQ)[:-12])
+        with self.assertRaises(IOError):
+            inflater.finish("s3://fastqs/lane_R1_001_p0.fastq.gz")
+
+    def test_writer_inflation_gives_piscem_a_plain_fastq_fifo(self):
+        original = lambda_map.FASTQ_GZIP_INFLATE
+        lambda_map.FASTQ_GZIP_INFLATE = "writer"
+        try:
+            with tempfile.TemporaryDirectory() as stream_dir:
+                files_r1, files_r2 = lambda_map.create_fastq_fifos(
+                    [
+                        "s3://fastqs/ko/lane_R1_001_p0.fastq.gz",
+                        "s3://fastqs/ko/lane_R2_001_p0.fastq.gz",
+                    ],
+                    stream_dir,
+                )
+        finally:
+            lambda_map.FASTQ_GZIP_INFLATE = original
+        self.assertTrue(files_r1[0]["fifo_path"].endswith("r1_0000.fastq"))
+        self.assertEqual("writer", files_r2[0]["inflate"])
+
+
+if __name__ == "__main__":
+    unittest.main()
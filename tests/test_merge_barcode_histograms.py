@@ -0,0 +1,66 @@
+import importlib.util
+import io
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from contextlib import redirect_stdout
+
+
+os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+SCRIPTS_DIR = pathlib.Path(__file__).parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import merge_barcode_histograms as merge  # noqa: E402
+
+MODULE_PATH = pathlib.Path(__file__).parents[1] / "scrna-pipeline" / "map.py"
+SPEC = importlib.util.spec_from_file_location("lambda_map_histograms", MODULE_PATH)
+lambda_map = importlib.util.module_from_spec(SPEC)
+with redirect_stdout(io.StringIO()):
+    SPEC.loader.exec_module(lambda_map)
+
+
+class MergeBarcodeHistogramTests(unittest.TestCase):
+    def test_shard_histograms_merge_into_a_ranked_table_and_permit_list(self):
+        # 20 cells of 1,000-2,000 reads over a long tail of 1-3 read barcodes.
+        cells = Counter({barcode: 1_000 + 50 * barcode for barcode in range(20)})
+        noise = Counter({barcode: 1 + barcode % 3 for barcode in range(100, 2_100)})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = pathlib.Path(temp_dir)
+            halves = [Counter(), Counter()]
+            for barcode, count in (cells + noise).items():
+                halves[0][barcode] = count // 2
+                halves[1][barcode] = count - count // 2
+            for index, half in enumerate(halves):
+                (root / f"lane_p{index}").mkdir()
+                lambda_map.write_barcode_histogram(
+                    str(root / f"lane_p{index}" / merge.HISTOGRAM_FILE), +half, 16
+                )
+            expected = root / "expected.txt"
+            expected.write_text("lane_p0\nlane_p1\n")
+            with redirect_stdout(io.StringIO()):
+                self.assertEqual(0, merge.main([str(root), "--expected-folders", str(expected),
+                                                "--output-dir", str(root / "barcodes")]))
+            summary = json.loads((root / "barcodes" / "knee.json").read_text())
+            table = (root / "barcodes" / "barcode_freq.tsv").read_text().splitlines()
+            permit = (root / "barcodes" / "permit_list.txt").read_text().splitlines()
+
+        self.assertEqual(2_020, summary["barcodes"])
+        self.assertEqual(sum((cells + noise).values()), summary["reads"])
+        self.assertEqual(20, summary["knee_barcodes"])
+        self.assertEqual(f"{merge.decode_barcode(19, 16)}\t1950", table[0])
+        self.assertEqual([merge.decode_barcode(barcode, 16) for barcode in range(19, -1, -1)], permit)
+
+    def test_barcodes_decode_most_significant_base_first(self):
+        self.assertEqual("ACGT", merge.decode_barcode(0b00011011, 4))
+        self.assertEqual("27", merge.decode_barcode(27, 0))
+        self.assertEqual(2, merge.knee_rank([5, 4]))
+
+
+if __name__ == "__main__":
+    unittest.main()
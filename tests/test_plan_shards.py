@@ -0,0 +1,98 @@
+import io
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+
+SCRIPTS_DIR = pathlib.Path(__file__).parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import plan_shards  # noqa: E402
+from shard_sizing import parse_shard_schedule  # noqa: E402
+
+
+class ShardPlannerTests(unittest.TestCase):
+    def test_taper_covers_the_lane_and_shrinks_to_the_minimum(self):
+        schedule = plan_shards.taper_schedule(
+            30_000_000, 4_000_000, 500_000, map_rate=561_000, cut_rate=1_000_000
+        )
+        self.assertEqual(30_000_000, sum(schedule))
+        self.assertEqual(500_000, schedule[-1])
+        self.assertTrue(all(size <= 4_000_000 for size in schedule))
+        tail = schedule[schedule.index(4_000_000, 1):]
+        self.assertEqual(sorted(tail, reverse=True), list(tail))
+
+    def test_tapering_shortens_the_lane_tail(self):
+        cut_rate, map_rate = 1_000_000, 561_000
+
+        def lane_finish(schedule):
+            clock = finish = 0.0
+            for size in schedule:
+                clock += size / cut_rate
+                finish = max(finish, clock + size / map_rate)
+            return finish
+
+        uniform = plan_shards.uniform_schedule(12_000_000, 4_000_000)
+        tapered = plan_shards.taper_schedule(12_000_000, 4_000_000, 500_000, map_rate, cut_rate)
+        self.assertEqual((4_000_000,) * 3, uniform)
+        self.assertLess(lane_finish(tapered) + 3.0, lane_finish(uniform))
+
+    def test_capped_concurrency_queues_invocations(self):
+        jobs = [(0.0, 10.0), (0.0, 10.0), (1.0, 5.0)]
+        self.assertEqual([10.0, 10.0, 6.0], plan_shards.finish_times(jobs, 0))
+        self.assertEqual([10.0, 20.0, 25.0], plan_shards.finish_times(jobs, 1))
+
+    def test_batches_fill_the_timeout_margin_and_cut_invocations(self):
+        params = plan_shards.PlanParameters(batch_shards=8)
+        batches = plan_shards.pack_batches([4_000_000] * 10 + [1_000_000] * 3, params)
+        self.assertEqual(13, sum(len(batch) for batch in batches))
+        limit = params.lambda_timeout_seconds * plan_shards.DIRECT_TIMEOUT_FRACTION
+        self.assertTrue(all(plan_shards.batch_seconds(batch, params) <= limit for batch in batches))
+        self.assertLessEqual(max(len(batch) for batch in batches), 8)
+        self.assertEqual([(4_000_000,)] * 2, plan_shards.pack_batches([4_000_000] * 2, plan_shards.PlanParameters()))
+
+        lanes = [plan_shards.Lane("ko/L001", 10 * 1024**3)]
+        single = plan_shards.build_plan(lanes, set(), 4_000_000, plan_shards.PlanParameters(cores=8))
+        batched = plan_shards.build_plan(lanes, set(), 4_000_000, params.__class__(cores=8, batch_shards=4))
+        self.assertLess(batched.invocations * 3, single.invocations)
+
+    def test_small_lane_goes_direct_when_the_driver_is_busy(self):
+        params = plan_shards.PlanParameters(cores=2)
+        lanes = [
+            plan_shards.Lane("ko/big_L001", 20 * 1024**3),
+            plan_shards.Lane("ko/small_L001", 100 * 1024**2),
+        ]
+        plan = plan_shards.plan_lanes(lanes, params)
+        modes = {lane.lane.name: lane.mode for lane in plan.lanes}
+        self.assertEqual({"ko/big_L001": "split", "ko/small_L001": "direct"}, modes)
+
+        forced = plan_shards.plan_lanes(lanes, plan_shards.PlanParameters(cores=2, allow_direct=False))
+        self.assertEqual({"split"}, {lane.mode for lane in forced.lanes})
+
+    def test_plan_file_lists_every_lane_with_its_schedule(self):
+        params = plan_shards.PlanParameters(cores=8, allow_direct=False)
+        plan = plan_shards.plan_lanes([plan_shards.Lane("pbmc/L001", 2 * 1024**3)], params)
+        output = io.StringIO()
+        plan_shards.write_plan(plan, params, output)
+        lines = output.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("# predicted_makespan_seconds="))
+        header = [line for line in lines if not line.startswith("#")][0].split("\t")
+        self.assertEqual(list(plan_shards.PLAN_FIELDS), header)
+        row = dict(zip(header, lines[-1].split("\t")))
+        self.assertEqual("split", row["mode"])
+        schedule = parse_shard_schedule(row["shard_schedule"])
+        self.assertEqual(int(row["est_read_pairs"]), sum(schedule))
+
+    def test_split_engine_plans_fixed_size_shards(self):
+        with mock.patch.dict("os.environ", {"SHARD_ENGINE": "split"}):
+            params = plan_shards.parameters_from_env()
+        self.assertTrue(params.fixed_shard_size)
+        params = plan_shards.PlanParameters(cores=8, allow_direct=False, fixed_shard_size=True, max_read_pairs=1_000_000)
+        schedule = plan_shards.plan_lanes([plan_shards.Lane("pbmc/L001", 2 * 1024**3)], params).lanes[0].schedule
+        self.assertEqual({1_000_000}, set(schedule[:-1]))
+        self.assertLessEqual(schedule[-1], 1_000_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
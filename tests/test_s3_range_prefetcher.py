@@ -0,0 +1,77 @@
+import io
+import pathlib
+import sys
+import tempfile
+import threading
+import unittest
+
+
+SCRIPTS_DIR = pathlib.Path(__file__).parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import s3_range_prefetcher as prefetcher  # noqa: E402
+
+
+class RangeS3:
+    def __init__(self, payload, fail_from=None):
+        self.payload = payload
+        self.fail_from = fail_from
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.payload)}
+
+    def get_object(self, Bucket, Key, Range):
+        first, last = (int(value) for value in Range[len("bytes="):].split("-"))
+        with self.lock:
+            self.ranges.append((first, last))
+        if self.fail_from is not None and first >= self.fail_from:
+            raise ConnectionError("reset by peer")
+        return {"Body": io.BytesIO(self.payload[first:last + 1])}
+
+
+class PrefetcherTests(unittest.TestCase):
+    def setUp(self):
+        self.original_piece = prefetcher.PIECE_BYTES
+        prefetcher.PIECE_BYTES = 7
+
+    def tearDown(self):
+        prefetcher.PIECE_BYTES = self.original_piece
+
+    def test_follower_streams_the_prefix_while_chunks_download_in_parallel(self):
+        payload = bytes(range(256)) * 13
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = str(pathlib.Path(temp_dir) / "lane_R1_001.fastq.gz")
+            fake = RangeS3(payload)
+            fetch = prefetcher.RangePrefetcher(fake, "fastqs", "lane_R1_001.fastq.gz", path, 100, 4)
+            followed = io.BytesIO()
+            follower = threading.Thread(target=prefetcher.follow, args=(path, followed))
+            follower.start()
+            fetch.run()
+            follower.join(timeout=10)
+            self.assertEqual(payload, pathlib.Path(path).read_bytes())
+            self.assertEqual((len(payload), len(payload), "done"), prefetcher.read_watermark(path))
+        self.assertEqual(payload, followed.getvalue())
+        self.assertEqual(34, len(fake.ranges))
+        self.assertEqual((3300, 3327), max(fake.ranges))
+
+    def test_failed_chunk_stops_the_follower(self):
+        payload = b"x" * 1000
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = str(pathlib.Path(temp_dir) / "lane_R2_001.fastq.gz")
+            fetch = prefetcher.RangePrefetcher(
+                RangeS3(payload, fail_from=500), "fastqs", "lane_R2_001.fastq.gz", path, 100, 2
+            )
+            with self.assertRaises(prefetcher.PrefetchError):
+                fetch.run()
+            watermark, _size, state = prefetcher.read_watermark(path)
+            self.assertEqual(("failed", 500), (state, watermark))
+            followed = io.BytesIO()
+            with self.assertRaises(prefetcher.PrefetchError):
+                prefetcher.follow(path, followed)
+        self.assertEqual(b"", followed.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import io
+import pathlib
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+
+
+SCRIPTS_DIR = pathlib.Path(__file__).parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import s3_upload_service  # noqa: E402
+
+
+class ImmediateService:
+    def __init__(self, failing_keys=()):
+        self.uploads = []
+        self.failing_keys = set(failing_keys)
+
+    def upload_file(self, path, bucket, key, on_done=None):
+        future = Future()
+        error = RuntimeError("network\nreset") if key in self.failing_keys else None
+        if error is None:
+            self.uploads.append((path, bucket, key))
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+        on_done(error)
+        return future
+
+
+class UploadServiceTests(unittest.TestCase):
+    def test_every_job_line_gets_exactly_one_acknowledgement(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            shard = pathlib.Path(temp_dir) / "r1 p0.fastq"
+            shard.write_text("@r\nA\n+\nF\n")
+            jobs = io.StringIO(
+                f"{shard}\ts3://fastqs/ko/lane_R1_001_p0.fastq\n"
+                "\n"
+                f"{shard}\ts3://fastqs/ko/broken.fastq\n"
+                f"{temp_dir}/missing.fastq\ts3://fastqs/ko/missing.fastq\n"
+                "not-a-job\n"
+            )
+            acks = io.StringIO()
+            service = ImmediateService(failing_keys={"ko/broken.fastq"})
+            status = s3_upload_service.serve(service, jobs, acks)
+
+        lines = acks.getvalue().splitlines()
+        self.assertEqual(1, status)
+        self.assertEqual(4, len(lines))
+        self.assertEqual("OK\ts3://fastqs/ko/lane_R1_001_p0.fastq", lines[0])
+        self.assertTrue(lines[1].startswith("ERROR\ts3://fastqs/ko/broken.fastq\tRuntimeError: network reset"))
+        self.assertTrue(lines[2].startswith("ERROR\ts3://fastqs/ko/missing.fastq\t"))
+        self.assertEqual([(str(shard), "fastqs", "ko/lane_R1_001_p0.fastq")], service.uploads)
+
+    def test_s3_uri_requires_bucket_and_key(self):
+        self.assertEqual(("bucket", "a/b.txt"), s3_upload_service.parse_s3_uri("s3://bucket/a/b.txt"))
+        with self.assertRaises(ValueError):
+            s3_upload_service.parse_s3_uri("s3://bucket")
+
+
+if __name__ == "__main__":
+    unittest.main()
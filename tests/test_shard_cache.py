@@ -0,0 +1,136 @@
+import importlib.util
+import io
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+
+from botocore.exceptions import ClientError
+
+
+os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+SCRIPTS_DIR = pathlib.Path(__file__).parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import fastq_shard_engine as engine  # noqa: E402
+import shard_cache  # noqa: E402
+
+MAP_PATH = pathlib.Path(__file__).parents[1] / "scrna-pipeline" / "map.py"
+MAP_SPEC = importlib.util.spec_from_file_location("lambda_map", MAP_PATH)
+lambda_map = importlib.util.module_from_spec(MAP_SPEC)
+MAP_SPEC.loader.exec_module(lambda_map)
+
+
+class CacheS3:
+    def __init__(self):
+        self.objects = {}
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        body = self.objects[(Bucket, Key)]
+        if Range:
+            first, _, last = Range[len("bytes="):].partition("-")
+            body = body[int(first):int(last) + 1]
+        return {"Body": io.BytesIO(body)}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_paginator(self, name):
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                keys = [key for bucket, key in objects if bucket == Bucket and key.startswith(Prefix)]
+                yield {"Contents": [{"Key": key} for key in sorted(keys)]}
+
+        return Paginator()
+
+    # UploadService surface used by ShardPublisher.
+    def upload_bytes(self, payload, bucket, key):
+        self.put_object(bucket, key, payload)
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def put_bytes(self, payload, bucket, key):
+        self.put_object(bucket, key, payload)
+
+
+def fastq(read, count):
+    return "".join(
+        f"@read{index} {read}:N:0\n{'ACGT' * 5}\n+\n{'F' * 20}\n" for index in range(count)
+    ).encode()
+
+
+class ShardCacheTests(unittest.TestCase):
+    def test_local_copy_and_s3_object_share_a_fingerprint(self):
+        shard_cache.FINGERPRINT_BYTES, original = 16, shard_cache.FINGERPRINT_BYTES
+        try:
+            payload = bytes(range(200))
+            s3 = CacheS3()
+            s3.put_object("fastqs", "ko/lane_R1_001.fastq.gz", payload)
+            with tempfile.TemporaryDirectory() as temp_dir:
+                path = pathlib.Path(temp_dir) / "lane_R1_001.fastq.gz"
+                path.write_bytes(payload)
+                local = shard_cache.source_fingerprint(str(path))
+                path.write_bytes(payload[:100] + b"x" + payload[101:])
+                # Only the head and tail are sampled.
+                self.assertEqual(local, shard_cache.source_fingerprint(str(path)))
+                path.write_bytes(payload[:5])
+                tiny = shard_cache.source_fingerprint(str(path))
+            remote = shard_cache.source_fingerprint("s3://fastqs/ko/lane_R1_001.fastq.gz", s3)
+            s3.put_object("fastqs", "tiny.gz", payload[:5])
+            self.assertEqual(tiny, shard_cache.source_fingerprint("s3://fastqs/tiny.gz", s3))
+        finally:
+            shard_cache.FINGERPRINT_BYTES = original
+        self.assertEqual(local, remote)
+        key = shard_cache.cache_key(local, remote, 16_000_000, "", "none")
+        self.assertNotEqual(key, shard_cache.cache_key(local, remote, 8_000_000, "", "none"))
+        self.assertNotEqual(key, shard_cache.cache_key(local, remote, 16_000_000, "", "gzip"))
+        self.assertEqual(
+            shard_cache.cache_key(local, remote, 4, "3*2", "none"),
+            shard_cache.cache_key(local, remote, 8, "3*2", "none"),
+        )
+
+    def test_cut_shards_are_cached_and_replayed_as_manifests(self):
+        s3 = CacheS3()
+        cache = shard_cache.ShardCache(s3, "s3://cache/shard-cache")
+        publisher = engine.ShardPublisher(
+            s3, "fastqs", "ko/lane_L001", "manifests", engine.TimingLog(None),
+            shard_bucket=cache.bucket, shard_prefix=cache.shard_prefix("abc"),
+        )
+        for pair in engine.iter_shard_pairs(io.BytesIO(fastq(1, 3)), io.BytesIO(fastq(2, 3)), 8):
+            publisher.publish(pair)
+        self.assertIn(("cache", "shard-cache/abc/lane_L001_R1_001_p1.fastq"), s3.objects)
+        self.assertIsNone(cache.load("abc"))
+        cache.store("abc", publisher.shards)
+
+        pairs = cache.load("abc")
+        self.assertEqual([2, 1], [pair.read_pairs for pair in pairs])
+        rerun = engine.ShardPublisher(s3, "fastqs", "ko2/lane_L001", "manifests", engine.TimingLog(None))
+        self.assertEqual(2, shard_cache.replay(pairs, rerun))
+        self.assertEqual(
+            b"s3://cache/shard-cache/abc/lane_L001_R1_001_p1.fastq\n"
+            b"s3://cache/shard-cache/abc/lane_L001_R2_001_p1.fastq\n",
+            s3.objects[("manifests", "ko2/lane_L001_p1_input.txt")],
+        )
+        manifest = s3.objects[("manifests", "ko2/lane_L001_p1_input.txt")].decode().split()
+        self.assertEqual(["R1", "R2"], [lambda_map.parse_fastq_uri(uri)["read"] for uri in manifest])
+
+        del s3.objects[("cache", "shard-cache/abc/lane_L001_R2_001_p0.fastq")]
+        self.assertIsNone(cache.load("abc"))
+
+
+if __name__ == "__main__":
+    unittest.main()
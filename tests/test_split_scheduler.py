@@ -0,0 +1,141 @@
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+
+SCRIPTS_DIR = pathlib.Path(__file__).parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import decompressors  # noqa: E402
+import split_scheduler as scheduler_module  # noqa: E402
+from plan_shards import PlanParameters  # noqa: E402
+
+
+def job(lane, r1_bytes=1_000, r2_bytes=3_000):
+    return scheduler_module.SplitJob(lane, f"ko/{lane}", f"{lane}_R1.gz", f"{lane}_R2.gz", r1_bytes, r2_bytes)
+
+
+def scheduler(cpus=8, nvme_bytes=10_000, uplink_gbps=100.0, lane_cores=4, **kwargs):
+    calls = []
+    instance = scheduler_module.SplitScheduler(
+        scheduler_module.Budgets(set(range(cpus)), nvme_bytes, uplink_gbps),
+        lane_cores,
+        PlanParameters(cores=cpus),
+        set_affinity=lambda pid, cores: calls.append((pid, list(cores))),
+        **kwargs,
+    )
+    return instance, calls
+
+
+class SplitSchedulerTests(unittest.TestCase):
+    def test_streams_get_cores_in_proportion_to_their_bytes(self):
+        self.assertEqual((4, 12), scheduler_module.stream_threads(16, 1_000, 3_000))
+        self.assertEqual((1, 1), scheduler_module.stream_threads(2, 1, 1_000_000))
+        self.assertEqual((1, 15), scheduler_module.stream_threads(16, 1, 1_000_000))
+        self.assertEqual([0, 1, 2, 3, 8], scheduler_module.parse_cpu_list("0-3,8"))
+        self.assertEqual("0-3,8", scheduler_module.format_cpu_list([8, 0, 1, 2, 3]))
+
+    def test_lanes_wait_for_cores_and_nvme_but_the_first_always_runs(self):
+        instance, _ = scheduler(cpus=8, nvme_bytes=6_000, staged_input=True)
+        first = instance.admit(job("L001"))
+        self.assertEqual({"R1": [0], "R2": [1, 2, 3]}, first.cpus)
+        self.assertTrue(instance.admissible(job("L002", 1_000, 1_000)))
+        # 4,000 staged bytes would leave too little NVMe for a second big lane.
+        self.assertFalse(instance.admissible(job("L002")))
+        instance.admit(job("L002", 1_000, 1_000))
+        self.assertFalse(instance.admissible(job("L003", 1, 1)))
+
+        oversized, _ = scheduler(nvme_bytes=10)
+        self.assertTrue(oversized.admissible(job("L001", 10**12, 10**12)))
+
+    def test_uplink_share_limits_admission(self):
+        params = PlanParameters()
+        lane_gbps = scheduler_module.uplink_demand_gbps(4, params)
+        instance, _ = scheduler(cpus=16, uplink_gbps=lane_gbps * 1.5)
+        lane = instance.admit(job("L001"))
+        self.assertAlmostEqual(lane_gbps, lane.uplink_gbps)
+        self.assertFalse(instance.admissible(job("L002")))
+        instance.lane_finished("L001")
+        self.assertTrue(instance.admissible(job("L002")))
+        self.assertEqual(set(range(16)), instance.budgets.cpus)
+
+    def test_memory_admits_a_lane_that_fits_one_queued_and_one_uploading_pair(self):
+        instance, _ = scheduler(cpus=16, split_lines=400)
+        pair_bytes = scheduler_module.shard_pair_bytes(400, [])
+        minimum, full = instance.memory_cost(job("L001"))
+        self.assertEqual((4 * pair_bytes, 8 * pair_bytes), (minimum, full))
+        instance.budgets.memory_bytes = full + minimum + pair_bytes
+
+        self.assertEqual(full, instance.admit(job("L001")).memory_bytes)
+        self.assertTrue(instance.admissible(job("L002")))
+        # The second lane gets what is left, for the engine to shrink into.
+        self.assertEqual(minimum + pair_bytes, instance.admit(job("L002")).memory_bytes)
+        self.assertFalse(instance.admissible(job("L003")))
+        instance.lane_finished("L001")
+        self.assertEqual(full, instance.budgets.memory_bytes)
+        self.assertEqual((0, 0), scheduler(engine="split")[0].memory_cost(job("L001")))
+
+    def test_streams_get_the_fastest_backend_for_their_cores(self):
+        calibration = [
+            {"backend": "rapidgzip", "threads": 1, "mb_per_second": 150.0},
+            {"backend": "rapidgzip", "threads": 2, "mb_per_second": 650.0},
+            {"backend": "igzip", "threads": 1, "mb_per_second": 600.0},
+            {"backend": "rapidgzip", "threads": 4, "mb_per_second": 900.0},
+        ]
+        with mock.patch.object(decompressors.Backend, "available", return_value=True):
+            instance, _ = scheduler(cpus=8, calibration=calibration)
+            lane = instance.admit(job("L001"))
+        self.assertEqual({"R1": "igzip", "R2": "rapidgzip"}, lane.backends)
+        self.assertEqual({"R1": 1, "R2": 4}, lane.threads)
+
+    @mock.patch.object(decompressors.Backend, "available", return_value=True)
+    def test_drained_stream_widens_its_sibling(self, _available):
+        instance, calls = scheduler(cpus=8)
+        instance.admit(job("L001"))
+        instance.handle_event('{"event": "start", "lane": "L001", "stream": "R1", "pid": 11}')
+        instance.handle_event('{"event": "start", "lane": "L001", "stream": "R2", "pid": 12}')
+        self.assertEqual([(11, [0]), (12, [1, 2, 3])], calls)
+
+        released = instance.stream_finished("L001", "R1")
+        self.assertEqual([], released)
+        self.assertEqual((12, [0, 1, 2, 3]), calls[-1])
+        self.assertEqual({4, 5, 6, 7}, instance.budgets.cpus)
+        # With no sibling left the cores return to the pool.
+        self.assertEqual([0, 1, 2, 3], instance.stream_finished("L001", "R2"))
+        self.assertEqual(set(range(8)), instance.budgets.cpus)
+
+    def test_run_launches_workers_and_records_their_part_counts(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            parts_dir = pathlib.Path(temp_dir)
+            fifo = str(parts_dir / "scheduler.fifo")
+            os.mkfifo(fifo)
+            instance, _ = scheduler(cpus=4, lane_cores=2)
+            template = [sys.executable, "-c", "import sys; print('cutting', sys.argv[1]); print(3)", "{lane}"]
+            status = scheduler_module.run(
+                [job("L001"), job("L002"), job("L003")], instance, template, parts_dir, fifo
+            )
+            self.assertEqual(0, status)
+            self.assertEqual("3\n", (parts_dir / "L003.parts").read_text())
+            self.assertIn("cutting L002", (parts_dir / "L002.log").read_text())
+        self.assertEqual({}, instance.running)
+        self.assertEqual(set(range(4)), instance.budgets.cpus)
+
+    def test_scheduler_and_planner_import_without_boto3(self):
+        # Drivers without boto3 still schedule lanes; their workers fall back
+        # to SHARD_ENGINE=split.
+        code = (
+            "import sys; sys.modules['boto3'] = sys.modules['botocore'] = None; "
+            f"sys.path.insert(0, {str(SCRIPTS_DIR)!r}); "
+            "import split_scheduler, plan_shards; print(split_scheduler.DEFAULT_SPLIT_LINES)"
+        )
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        self.assertEqual(0, result.returncode, result.stderr)
+        self.assertEqual("16000000", result.stdout.strip())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+#pragma once
+
+#include <cstddef>
+#include <cstdint>
+#include <vector>
+
+namespace scrna::rad {
+
+// map.py can upload map.rad as independently compressed frames (RAD_FRAME_CODEC):
+// "RADZ", version u8, codec u8, reserved u16, prelude size u64, frame count u64,
+// the uncompressed RAD prelude, one (compressed, raw) u64 size pair per frame,
+// and then the frames. Frames end on RAD chunk boundaries.
+constexpr std::uint8_t kDeflateFrames = 1;
+constexpr std::uint8_t kZstdFrames = 2;
+
+struct Frame {
+    std::uint64_t compressed_offset{};
+    std::uint64_t compressed_size{};
+    std::uint64_t raw_offset{};
+    std::uint64_t raw_size{};
+};
+
+struct FrameIndex {
+    std::uint8_t codec{};
+    std::size_t prelude_offset{};
+    std::size_t prelude_size{};
+    std::uint64_t raw_payload_size{};
+    std::vector<Frame> frames;
+};
+
+// True when the object prefix starts with the frame magic.
+bool is_framed(const std::vector<std::uint8_t>& bytes);
+
+// Parse the frame header, prelude extent and frame table. Offsets are object
+// offsets; raw offsets are relative to the start of the RAD payload.
+// NeedMoreData means the prefix should be extended.
+FrameIndex parse_frame_index(const std::vector<std::uint8_t>& bytes, std::uint64_t object_size);
+
+// Decompress one frame and check it yields exactly raw_size bytes.
+std::vector<std::uint8_t> decompress_frame(
+    std::uint8_t codec,
+    const std::vector<std::uint8_t>& compressed,
+    std::uint64_t raw_size);
+
+}  // namespace scrna::rad
@@ -0,0 +1,127 @@
+#include "rad_frames.hpp"
+
+#include "rad_prelude.hpp"
+
+#include <algorithm>
+#include <iterator>
+#include <limits>
+#include <string>
+#include <zlib.h>
+#include <zstd.h>
+
+namespace scrna::rad {
+namespace {
+
+constexpr std::uint8_t kMagic[] = {'R', 'A', 'D', 'Z'};
+constexpr std::size_t kFixedHeader = 24;
+constexpr std::size_t kFrameEntry = 16;
+constexpr std::uint64_t kMaxFrames = 16'777'216;
+
+std::uint64_t read_le(const std::vector<std::uint8_t>& bytes, std::size_t offset, std::size_t width) {
+    std::uint64_t value = 0;
+    for (std::size_t i = 0; i < width; ++i) {
+        value |= static_cast<std::uint64_t>(bytes[offset + i]) << (8U * i);
+    }
+    return value;
+}
+
+std::uint64_t add(std::uint64_t lhs, std::uint64_t rhs) {
+    if (rhs > std::numeric_limits<std::uint64_t>::max() - lhs) {
+        throw InvalidRad("RAD frame sizes overflow");
+    }
+    return lhs + rhs;
+}
+
+}  // namespace
+
+bool is_framed(const std::vector<std::uint8_t>& bytes) {
+    return bytes.size() >= sizeof(kMagic) &&
+        std::equal(std::begin(kMagic), std::end(kMagic), bytes.begin());
+}
+
+FrameIndex parse_frame_index(const std::vector<std::uint8_t>& bytes, std::uint64_t object_size) {
+    if (bytes.size() < kFixedHeader) {
+        throw NeedMoreData();
+    }
+    if (!is_framed(bytes)) {
+        throw InvalidRad("missing RAD frame magic");
+    }
+    if (bytes[4] != 1) {
+        throw InvalidRad("unsupported RAD frame version " + std::to_string(bytes[4]));
+    }
+
+    FrameIndex index;
+    index.codec = bytes[5];
+    if (index.codec != kDeflateFrames && index.codec != kZstdFrames) {
+        throw InvalidRad("unsupported RAD frame codec " + std::to_string(index.codec));
+    }
+    const auto prelude_size = read_le(bytes, 8, 8);
+    const auto frame_count = read_le(bytes, 16, 8);
+    if (frame_count > kMaxFrames || prelude_size > object_size) {
+        throw InvalidRad("RAD frame header exceeds safety limits");
+    }
+    const auto table_offset = add(kFixedHeader, prelude_size);
+    const auto frames_offset = add(table_offset, frame_count * kFrameEntry);
+    if (frames_offset > object_size) {
+        throw InvalidRad("RAD frame table is truncated");
+    }
+    if (frames_offset > bytes.size()) {
+        throw NeedMoreData();
+    }
+
+    index.prelude_offset = kFixedHeader;
+    index.prelude_size = static_cast<std::size_t>(prelude_size);
+    index.frames.reserve(static_cast<std::size_t>(frame_count));
+    std::uint64_t compressed_offset = frames_offset;
+    for (std::uint64_t i = 0; i < frame_count; ++i) {
+        const auto entry = static_cast<std::size_t>(table_offset + i * kFrameEntry);
+        Frame frame;
+        frame.compressed_offset = compressed_offset;
+        frame.compressed_size = read_le(bytes, entry, 8);
+        frame.raw_size = read_le(bytes, entry + 8, 8);
+        frame.raw_offset = index.raw_payload_size;
+        if (frame.compressed_size == 0 || frame.raw_size == 0) {
+            throw InvalidRad("empty RAD frame");
+        }
+        compressed_offset = add(compressed_offset, frame.compressed_size);
+        index.raw_payload_size = add(index.raw_payload_size, frame.raw_size);
+        index.frames.push_back(frame);
+    }
+    if (compressed_offset != object_size) {
+        throw InvalidRad("RAD frame sizes do not match the object size");
+    }
+    return index;
+}
+
+std::vector<std::uint8_t> decompress_frame(
+    std::uint8_t codec,
+    const std::vector<std::uint8_t>& compressed,
+    std::uint64_t raw_size) {
+    if (raw_size > std::numeric_limits<std::size_t>::max() ||
+        raw_size > std::numeric_limits<uLongf>::max()) {
+        throw InvalidRad("RAD frame is too large for this platform");
+    }
+    std::vector<std::uint8_t> raw(static_cast<std::size_t>(raw_size));
+    if (codec == kZstdFrames) {
+        const auto produced = ZSTD_decompress(raw.data(), raw.size(), compressed.data(), compressed.size());
+        if (ZSTD_isError(produced)) {
+            throw InvalidRad(std::string("zstd frame: ") + ZSTD_getErrorName(produced));
+        }
+        if (produced != raw.size()) {
+            throw InvalidRad("zstd frame decompressed to the wrong size");
+        }
+        return raw;
+    }
+    if (codec != kDeflateFrames) {
+        throw InvalidRad("unsupported RAD frame codec " + std::to_string(codec));
+    }
+    auto produced = static_cast<uLongf>(raw.size());
+    const auto status = ::uncompress(
+        raw.data(), &produced, compressed.data(), static_cast<uLong>(compressed.size()));
+    if (status != Z_OK || produced != raw.size()) {
+        throw InvalidRad("deflate frame failed to decompress to " + std::to_string(raw_size) + " bytes");
+    }
+    return raw;
+}
+
+}  // namespace scrna::rad
@@ -1,5 +1,6 @@
 #include "s3_materializer.hpp"
 
+#include "rad_frames.hpp"
 #include "rad_prelude.hpp"
 
 #include <aws/core/auth/AWSCredentialsProviderChain.h>
@@ -49,8 +50,18 @@ struct Shard {
     rad::PreludeInfo prelude;
     std::uint64_t payload_size{};
     std::uint64_t destination_offset{};
+    bool framed{false};
+    rad::FrameIndex frames;
 };
 
+// One unit of transfer work: a whole raw payload, or one compressed frame.
+struct Task {
+    std::size_t shard{};
+    std::size_t frame{};
+};
+
+constexpr std::size_t kWholePayload = std::numeric_limits<std::size_t>::max();
+
 class FileDescriptor {
 public:
     explicit FileDescriptor(int fd) : fd_(fd) {}
@@ -233,6 +244,23 @@ std::vector<std::uint8_t> get_range(
     return bytes;
 }
 
+void inspect_frames(Shard& shard) {
+    shard.frames = rad::parse_frame_index(shard.header, shard.object_size);
+    const auto begin = shard.header.begin() + static_cast<std::ptrdiff_t>(shard.frames.prelude_offset);
+    std::vector<std::uint8_t> prelude(begin, begin + static_cast<std::ptrdiff_t>(shard.frames.prelude_size));
+    try {
+        shard.prelude = rad::parse_prelude(prelude);
+    } catch (const rad::NeedMoreData&) {
+        throw rad::InvalidRad("framed RAD prelude is truncated");
+    }
+    if (shard.prelude.payload_offset != prelude.size()) {
+        throw rad::InvalidRad("framed RAD prelude has trailing bytes");
+    }
+    shard.header = std::move(prelude);
+    shard.framed = true;
+    shard.payload_size = shard.frames.raw_payload_size;
+}
+
 void inspect_shard(Aws::S3::S3Client& client, Shard& shard, const Options& options) {
     head_shard(client, shard);
 
@@ -246,12 +274,18 @@ void inspect_shard(Aws::S3::S3Client& client, Shard& shard, const Options& optio
         fetched += amount;
 
         try {
-            shard.prelude = rad::parse_prelude(shard.header);
-            shard.header.resize(shard.prelude.payload_offset);
-            if (shard.prelude.payload_offset >= shard.object_size) {
+            if (rad::is_framed(shard.header)) {
+                inspect_frames(shard);
+            } else {
+                shard.prelude = rad::parse_prelude(shard.header);
+                shard.header.resize(shard.prelude.payload_offset);
+                if (shard.prelude.payload_offset < shard.object_size) {
+                    shard.payload_size = shard.object_size - shard.prelude.payload_offset;
+                }
+            }
+            if (shard.payload_size == 0) {
                 throw std::runtime_error("RAD object has no record payload: " + describe(shard));
             }
-            shard.payload_size = shard.object_size - shard.prelude.payload_offset;
             return;
         } catch (const rad::NeedMoreData&) {
             if (fetched == shard.object_size || fetched == options.maximum_header_size) {
@@ -395,6 +429,39 @@ void copy_payload(
     }
 }
 
+void copy_frame(
+    Aws::S3::S3Client& client,
+    const Shard& shard,
+    const rad::Frame& frame,
+    int output_fd,
+    const Options& options) {
+    std::vector<std::uint8_t> compressed;
+    unsigned int attempts = 0;
+    while (true) {
+        try {
+            compressed = get_range(
+                client, shard, frame.compressed_offset, frame.compressed_offset + frame.compressed_size - 1);
+            break;
+        } catch (const std::runtime_error&) {
+            if (++attempts > options.retries) {
+                throw;
+            }
+            std::this_thread::sleep_for(std::chrono::milliseconds(200U * attempts));
+        }
+    }
+    std::vector<std::uint8_t> raw;
+    try {
+        raw = rad::decompress_frame(shard.frames.codec, compressed, frame.raw_size);
+    } catch (const rad::InvalidRad& error) {
+        throw std::runtime_error("invalid RAD frame in " + describe(shard) + ": " + error.what());
+    }
+    pwrite_all(
+        output_fd,
+        reinterpret_cast<const char*>(raw.data()),
+        raw.size(),
+        shard.destination_offset + frame.raw_offset);
+}
+
 double seconds_since(const Clock::time_point& start) {
     return std::chrono::duration<double>(Clock::now() - start).count();
 }
@@ -419,6 +486,9 @@ int run(const Options& options) {
     const auto& canonical = shards.front();
     std::uint64_t total_chunks = 0;
     std::uint64_t final_size = canonical.prelude.payload_offset;
+    std::uint64_t download_bytes = 0;
+    std::size_t framed_shards = 0;
+    std::vector<Task> tasks;
     for (std::size_t i = 0; i < shards.size(); ++i) {
         auto& shard = shards[i];
         if (!rad::compatible_preludes(
@@ -428,6 +498,17 @@ int run(const Options& options) {
         total_chunks = checked_add(total_chunks, shard.prelude.num_chunks, "RAD chunk count");
         shard.destination_offset = final_size;
         final_size = checked_add(final_size, shard.payload_size, "combined RAD");
+        if (shard.framed) {
+            // Frames decompress independently, so each is its own task.
+            ++framed_shards;
+            for (std::size_t frame = 0; frame < shard.frames.frames.size(); ++frame) {
+                tasks.push_back({i, frame});
+                download_bytes += shard.frames.frames[frame].compressed_size;
+            }
+        } else {
+            tasks.push_back({i, kWholePayload});
+            download_bytes += shard.payload_size;
+        }
     }
     if (final_size > static_cast<std::uint64_t>(std::numeric_limits<off_t>::max())) {
         throw std::overflow_error("combined RAD exceeds off_t");
@@ -470,10 +551,21 @@ int run(const Options& options) {
 
         const auto payload_bytes = final_size - combined_header.size();
         const auto prepare_seconds = seconds_since(prepare_start);
-        std::cerr << "Writing " << payload_bytes << " payload bytes directly from S3\n";
+        std::cerr << "Writing " << payload_bytes << " payload bytes directly from S3";
+        if (framed_shards > 0) {
+            std::cerr << " (" << framed_shards << " framed shard(s), " << download_bytes
+                      << " bytes to download)";
+        }
+        std::cerr << '\n';
         const auto transfer_start = Clock::now();
-        parallel_for(shards.size(), options.threads, [&](std::size_t index) {
-            copy_payload(*client, shards[index], output.get(), options);
+        parallel_for(tasks.size(), options.threads, [&](std::size_t index) {
+            const auto& task = tasks[index];
+            const auto& shard = shards[task.shard];
+            if (task.frame == kWholePayload) {
+                copy_payload(*client, shard, output.get(), options);
+            } else {
+                copy_frame(*client, shard, shard.frames.frames[task.frame], output.get(), options);
+            }
         });
         const auto transfer_seconds = seconds_since(transfer_start);
         const auto finalize_start = Clock::now();
@@ -493,6 +585,8 @@ int run(const Options& options) {
                   << "chunks=" << total_chunks << '\n'
                   << "header_bytes=" << combined_header.size() << '\n'
                   << "payload_bytes=" << payload_bytes << '\n'
+                  << "framed_shards=" << framed_shards << '\n'
+                  << "download_bytes=" << download_bytes << '\n'
                   << "output_bytes=" << final_size << '\n'
                   << "setup_seconds=" << setup_seconds << '\n'
                   << "inspect_seconds=" << inspect_seconds << '\n'
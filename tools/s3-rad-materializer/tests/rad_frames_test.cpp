@@ -0,0 +1,125 @@
+#include "rad_frames.hpp"
+#include "rad_prelude.hpp"
+
+#include <cstdint>
+#include <exception>
+#include <iostream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#include <zlib.h>
+#include <zstd.h>
+
+namespace {
+
+void append_u64(std::vector<std::uint8_t>& out, std::uint64_t value) {
+    for (unsigned int i = 0; i < 8; ++i) {
+        out.push_back(static_cast<std::uint8_t>(value >> (8U * i)));
+    }
+}
+
+std::vector<std::uint8_t> deflate(const std::vector<std::uint8_t>& raw) {
+    auto size = compressBound(static_cast<uLong>(raw.size()));
+    std::vector<std::uint8_t> out(size);
+    if (compress(out.data(), &size, raw.data(), static_cast<uLong>(raw.size())) != Z_OK) {
+        throw std::runtime_error("zlib compress failed");
+    }
+    out.resize(size);
+    return out;
+}
+
+std::vector<std::uint8_t> zstd(const std::vector<std::uint8_t>& raw) {
+    std::vector<std::uint8_t> out(ZSTD_compressBound(raw.size()));
+    const auto size = ZSTD_compress(out.data(), out.size(), raw.data(), raw.size(), 3);
+    if (ZSTD_isError(size)) {
+        throw std::runtime_error("zstd compress failed");
+    }
+    out.resize(size);
+    return out;
+}
+
+// A framed object whose "prelude" is opaque bytes; only the framing is tested.
+std::vector<std::uint8_t> make_framed(
+    std::uint8_t codec,
+    const std::vector<std::uint8_t>& prelude,
+    const std::vector<std::vector<std::uint8_t>>& raw_frames) {
+    std::vector<std::uint8_t> out = {'R', 'A', 'D', 'Z', 1, codec, 0, 0};
+    append_u64(out, prelude.size());
+    append_u64(out, raw_frames.size());
+    out.insert(out.end(), prelude.begin(), prelude.end());
+    std::vector<std::vector<std::uint8_t>> compressed;
+    for (const auto& raw : raw_frames) {
+        compressed.push_back(codec == scrna::rad::kZstdFrames ? zstd(raw) : deflate(raw));
+        append_u64(out, compressed.back().size());
+        append_u64(out, raw.size());
+    }
+    for (const auto& frame : compressed) {
+        out.insert(out.end(), frame.begin(), frame.end());
+    }
+    return out;
+}
+
+void require(bool condition, const std::string& message) {
+    if (!condition) {
+        throw std::runtime_error(message);
+    }
+}
+
+void test_round_trip(std::uint8_t codec) {
+    const std::vector<std::uint8_t> prelude(40, 0x11);
+    const std::vector<std::vector<std::uint8_t>> raw = {
+        std::vector<std::uint8_t>(5000, 0x22), std::vector<std::uint8_t>(123, 0x33)};
+    const auto framed = make_framed(codec, prelude, raw);
+    require(scrna::rad::is_framed(framed), "framed object was not detected");
+
+    const auto index = scrna::rad::parse_frame_index(framed, framed.size());
+    require(index.codec == codec, "codec was not parsed");
+    require(index.prelude_offset == 24 && index.prelude_size == prelude.size(), "prelude extent is wrong");
+    require(index.frames.size() == 2 && index.raw_payload_size == 5123, "frame table is wrong");
+    require(index.frames[1].raw_offset == 5000, "raw offsets are not cumulative");
+
+    for (std::size_t i = 0; i < raw.size(); ++i) {
+        const auto& frame = index.frames[i];
+        const std::vector<std::uint8_t> compressed(
+            framed.begin() + static_cast<std::ptrdiff_t>(frame.compressed_offset),
+            framed.begin() + static_cast<std::ptrdiff_t>(frame.compressed_offset + frame.compressed_size));
+        require(
+            scrna::rad::decompress_frame(codec, compressed, frame.raw_size) == raw[i],
+            "frame did not decompress to its raw bytes");
+    }
+}
+
+void test_truncated_and_invalid() {
+    const auto framed = make_framed(scrna::rad::kDeflateFrames, std::vector<std::uint8_t>(40, 1),
+        {std::vector<std::uint8_t>(100, 2)});
+    std::vector<std::uint8_t> prefix(framed.begin(), framed.begin() + 70);
+    try {
+        (void)scrna::rad::parse_frame_index(prefix, framed.size());
+        throw std::runtime_error("truncated frame table did not request more data");
+    } catch (const scrna::rad::NeedMoreData&) {
+    }
+
+    try {
+        (void)scrna::rad::parse_frame_index(framed, framed.size() + 1);
+        throw std::runtime_error("a size mismatch was accepted");
+    } catch (const scrna::rad::InvalidRad&) {
+    }
+
+    const std::vector<std::uint8_t> rad = {1, 0, 0, 0, 0, 0, 0, 0, 0};
+    require(!scrna::rad::is_framed(rad), "a plain RAD prefix was detected as framed");
+}
+
+}  // namespace
+
+int main() {
+    try {
+        test_round_trip(scrna::rad::kDeflateFrames);
+        test_round_trip(scrna::rad::kZstdFrames);
+        test_truncated_and_invalid();
+        std::cout << "rad frame tests passed\n";
+        return 0;
+    } catch (const std::exception& error) {
+        std::cerr << "test failure: " << error.what() << '\n';
+        return 1;
+    }
+}